@@ -144,6 +144,30 @@ class BaseClient(object):
 
         raise Exception, "Call to method %s on %s failed: %s.\nParams = %s" % (method, application['manager'], res[1], data)
 
+    def callmanager_batch(self, app_id, calls):
+        """Call several manager API methods in a single request.
+
+        'calls': sequence of (service_id, method, data) tuples.
+
+        callmanager_batch returns the list of results, in the order of the
+        calls. The result of a failed call is a dictionary holding its 'error'.
+        """
+        application = self.application_dict(app_id)
+        if application is None:
+            print "E: Application %s not found" % app_id
+            sys.exit(1)
+        elif application['manager'] is None:
+            print 'E: Application %s has not started. Try to start it first.' % app_id
+            sys.exit(1)
+
+        res = client.jsonrpc_batch(application['manager'], 443, '/',
+                [ (method, data, service_id) for service_id, method, data in calls ])
+
+        if res[0] == 200:
+            return client.check_batch_response(res)
+
+        raise Exception, "Batch call on %s failed: %s.\nCalls = %s" % (application['manager'], res[1], calls)
+
     # def callmanager(self, service_id, method, post, data, files=[]):
     #     """Call the manager API.
 
@@ -294,22 +318,25 @@ class BaseClient(object):
             print "E: Cannot get list of nodes: %s" % nodes['error']
             sys.exit(1)
 
-        for role, role_nodes in nodes.items():
-            for node in role_nodes:
-                params = {'serviceNodeId': node}
-                details = self.callmanager(app_id, service_id, "get_node_info",
-                         False, params)
-                if 'error' in details:
-                    print "Warning: got node identifier from list_nodes but " \
-                            "failed on get_node_info: %s" % details['error']
+        # get the info of all the nodes in a single request
+        roles = [ (role, node) for role, role_nodes in nodes.items()
+                               for node in role_nodes ]
+        calls = [ (service_id, "get_node_info", {'serviceNodeId': node})
+                  for _, node in roles ]
+        all_details = self.callmanager_batch(app_id, calls) if calls else []
+
+        for (role, _), details in zip(roles, all_details):
+            if 'error' in details:
+                print "Warning: got node identifier from list_nodes but " \
+                        "failed on get_node_info: %s" % details['error']
+            else:
+                node = details['serviceNode']
+                if 'vmid' in node and 'cloud' in node:
+                    print "%s: node %s from cloud %s with IP address %s" \
+                          % (role, node['vmid'], node['cloud'], node['ip'])
                 else:
-                    node = details['serviceNode']
-                    if 'vmid' in node and 'cloud' in node:
-                        print "%s: node %s from cloud %s with IP address %s" \
-                              % (role, node['vmid'], node['cloud'], node['ip'])
-                    else:
-                        print "%s: node %s with IP address %s" \
-                              % (role, node['id'], node['ip'])
+                    print "%s: node %s with IP address %s" \
+                          % (role, node['id'], node['ip'])
 
     def logs(self, app_id, service_id):
         res = self.callmanager(app_id, service_id, "getLog", False, {})
@@ -19,12 +19,22 @@ from cpsdirector.x509cert import generate_certificate
 from cpsdirector.iaas import iaas
 
 from conpaas.core import https
+from conpaas.core import fanout
 from ConfigParser import ConfigParser
 from cpsdirector.common import config_parser as default_config_parser
 
 
 class Controller(object):
 
+    # Seconds to wait for the agents of new nodes to start
+    BOOT_TIMEOUT = 300
+    # Maximum interval between two probes of a booting node
+    BOOT_POLL_MAX_INTERVAL = 30
+    # Maximum number of nodes probed in parallel and maximum duration
+    # of a probe
+    BOOT_POLL_WORKERS = 32
+    BOOT_PROBE_TIMEOUT = 30
+
     def __init__(self):
 
         https.client.conpaas_init_ssl_ctx('/etc/cpsdirector/certs', 'director')
@@ -124,21 +134,45 @@ class Controller(object):
             raise Exception("Unknown cloud: %s. Available clouds: %s" % (cloud_name, self._available_clouds))
 
     def create_nodes(self, nodes_info, clouds):
+        """Create the requested nodes on all the given clouds concurrently
+        and wait for their agents to start.
+
+        If the nodes cannot be requested from one of the clouds, the
+        nodes already created on the other clouds are deleted and the
+        error is raised."""
         self._logger.debug('[create_nodes]: %s' % nodes_info)
 
         try:
             self._force_terminate_lock.acquire()
 
             self._partially_created_nodes = []
+            target_clouds = []
+            cloud_nodes_info = {}
             for cloud_name in clouds:
                 cloud = self.get_cloud_by_name(cloud_name)
+                if cloud in cloud_nodes_info:
+                    continue
                 ninfo = filter(lambda ni : ni['cloud'] == cloud_name, nodes_info)
 
                 msg = '[create_nodes] creating %d nodes on cloud %s' % (len(ninfo), cloud_name)
                 self._logger.debug(msg)
-
-                self._partially_created_nodes += self._create_nodes(ninfo, cloud)
-                self._logger.debug('[create_nodes] _partially_created_nodes: %s' % self._partially_created_nodes)
+                target_clouds.append(cloud)
+                cloud_nodes_info[cloud] = ninfo
+
+            outcome = fanout.call_nodes(
+                lambda cloud: self._create_nodes(cloud_nodes_info[cloud], cloud),
+                target_clouds)
+            for cloud in outcome.succeeded_nodes():
+                self._partially_created_nodes += outcome.results[cloud]
+            self._logger.debug('[create_nodes] _partially_created_nodes: %s' % self._partially_created_nodes)
+
+            failed_clouds = outcome.failed_nodes()
+            for cloud in failed_clouds:
+                self._logger.error('[create_nodes]: Failed to request new nodes from cloud %s: %s'
+                                   % (cloud.get_cloud_name(), outcome.tracebacks[cloud]))
+            if failed_clouds:
+                self.delete_nodes(self._partially_created_nodes)
+                outcome.check()
         except Exception as e:
             self._logger.exception('[create_nodes]: Failed to request new nodes')
             self._partially_created_nodes = []
@@ -295,47 +329,89 @@ class Controller(object):
     #     return ready
 
     def _wait_for_nodes(self, nodes, poll_interval=5):
-        self._logger.debug('[_wait_for_nodes]: going to start polling for %d nodes' % len(nodes))
+        """Wait for the agents of the given nodes to start.
 
-        done = []
-        poll_cycles = 0
-
-        while len(nodes) > 0:
-            poll_cycles += 1
+        All the pending nodes are probed in parallel. A node is probed
+        again after poll_interval seconds at first, then after
+        exponentially longer intervals (up to BOOT_POLL_MAX_INTERVAL),
+        so that slow booting VMs are not polled needlessly. The IP
+        addresses of the nodes which do not have one yet are refreshed
+        with a single list_vms call per cloud and per cycle.
 
-            # Add to 'done' the nodes on which an agent has been started
-            # properly.
-            done.extend([ node for node in nodes if self._check_node(node) ])
-
-            # Put in 'nodes' only those who have not started yet.
-            nodes = [ node for node in nodes if node not in done ]
+        Returns the tuple (ready nodes, nodes which did not start within
+        BOOT_TIMEOUT seconds)."""
+        self._logger.debug('[_wait_for_nodes]: going to start polling for %d nodes' % len(nodes))
 
-            if len(nodes) == 0:
-                # All the nodes are ready.
+        start = time.time()
+        deadline = start + self.BOOT_TIMEOUT
+        done = []
+        pending = list(nodes)
+        interval = dict([ (node.id, poll_interval) for node in pending ])
+        next_probe = dict([ (node.id, start) for node in pending ])
+
+        while pending:
+            now = time.time()
+            due = [ node for node in pending if next_probe[node.id] <= now ]
+
+            self._refresh_node_ips([ node for node in due
+                                     if node.ip == '' or node.private_ip == '' ])
+
+            outcome = fanout.call_nodes(self._check_node, due,
+                                        self.BOOT_POLL_WORKERS,
+                                        self.BOOT_PROBE_TIMEOUT)
+            now = time.time()
+            for node in due:
+                if outcome.results.get(node):
+                    self._logger.debug('[_wait_for_nodes]: node %s ready after %.1f secs'
+                                       % (node.id, now - start))
+                    done.append(node)
+                    pending.remove(node)
+                else:
+                    next_probe[node.id] = now + interval[node.id]
+                    interval[node.id] = min(interval[node.id] * 2,
+                                            self.BOOT_POLL_MAX_INTERVAL)
+
+            if not pending:
                 break
-            elif poll_cycles * poll_interval > 300:
-                # We have waited for more than 5 mins of sleeping + poll time.
+            if now >= deadline:
                 # Let's return whatever we have.
-                return (done, nodes)
-
-            self._logger.debug('[_wait_for_nodes]: waiting %d secs for %d nodes' % (poll_interval, len(nodes)))
-            time.sleep(poll_interval)
-
-            # Check if some nodes still do not have an IP address.
-            no_ip_nodes = [ node for node in nodes if node.ip == '' or node.private_ip == '' ]
-            if no_ip_nodes:
-                self._logger.debug('[_wait_for_nodes]: refreshing %d nodes' % len(no_ip_nodes))
+                self._logger.debug('[_wait_for_nodes]: %d nodes not ready after %d secs'
+                                   % (len(pending), now - start))
+                return (done, pending)
+
+            wait = min(min([ next_probe[node.id] for node in pending ]),
+                       deadline) - now
+            if wait > 0:
+                self._logger.debug('[_wait_for_nodes]: waiting %.1f secs for %d nodes' % (wait, len(pending)))
+                time.sleep(wait)
+
+        self._logger.debug('[_wait_for_nodes]: All nodes are ready after %.1f secs: %s'
+                           % (time.time() - start, str(done)))
+        return (done, [])
 
-                for node in no_ip_nodes:
-                    refreshed_list = self.list_vms(self.get_cloud_by_name(node.cloud_name))
+    def _refresh_node_ips(self, nodes):
+        """Update the IP addresses of the given nodes, listing the VMs of
+        every cloud involved once."""
+        if not nodes:
+            return
+        self._logger.debug('[_wait_for_nodes]: refreshing %d nodes' % len(nodes))
 
-                    for refreshed_node in refreshed_list:
-                        if refreshed_node.id == node.id:
-                            node.ip = refreshed_node.ip
-                            node.private_ip = refreshed_node.private_ip
+        cloud_names = []
+        for node in nodes:
+            if node.cloud_name not in cloud_names:
+                cloud_names.append(node.cloud_name)
+        outcome = fanout.call_nodes(
+            lambda cloud_name: self.list_vms(self.get_cloud_by_name(cloud_name)),
+            cloud_names, self.BOOT_POLL_WORKERS, self.BOOT_PROBE_TIMEOUT)
+        for cloud_name in outcome.failed_nodes():
+            self._logger.debug('[_wait_for_nodes]: failed to list the VMs of cloud %s: %s'
+                               % (cloud_name, outcome.errors[cloud_name]))
 
-        self._logger.debug('[_wait_for_nodes]: All nodes are ready %s'% str(done))
-        return (done, [])
+        for node in nodes:
+            for refreshed_node in outcome.results.get(node.cloud_name, []):
+                if refreshed_node.id == node.id:
+                    node.ip = refreshed_node.ip
+                    node.private_ip = refreshed_node.private_ip
 
     def _check_node(self, node):
         """Return True if the given node has properly started an agent on the
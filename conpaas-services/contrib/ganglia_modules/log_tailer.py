@@ -0,0 +1,86 @@
+# Helpers shared by the Ganglia modules parsing access logs: an in-process
+# log tailer. The response times are counted in the histograms of the
+# latency module (conpaas.core.latency).
+# Installed next to the modules by conpaas.core.ganglia.
+import os, re;
+
+# Bytes read from the log at a time
+read_size = 256 * 1024
+
+# Matches the lines of the timed access logs, which end with the time of the
+# request (seconds since the epoch) and its response time. The first group
+# is the rest of the line.
+TIMED_LINE = re.compile(r'^(.*)[ \t]([0-9.]+)[ \t]+([0-9.]+)[ \t]*\r?$', re.M)
+
+# Follows a log file across calls of read_blocks(), which yields what has
+# been written to the log since the previous call, in blocks of complete
+# lines. The file is followed by inode and offset: when the log is rotated,
+# the rest of the old file is read before the new one, and a truncated log
+# is read again from its start. The first time, the log is read from its end.
+class LogTailer(object):
+	def __init__(self, log_file, from_start=False):
+		self.log_file = log_file
+		self.from_start = from_start
+		self.file = None
+		self.inode = None
+		# incomplete last line read so far
+		self.partial = ''
+
+	def _open(self):
+		try:
+			f = open(self.log_file, 'rb')
+		except IOError:
+			return False
+		st = os.fstat(f.fileno())
+		if not self.from_start:
+			f.seek(0, os.SEEK_END)
+			# once rotated, logs are read from their start
+			self.from_start = True
+		self.file = f
+		self.inode = (st.st_dev, st.st_ino)
+		self.partial = ''
+		return True
+
+	def _check(self):
+		try:
+			st = os.stat(self.log_file)
+		except OSError:
+			# rotated, and the new log does not exist yet
+			return 'same'
+		if (st.st_dev, st.st_ino) != self.inode:
+			return 'rotated'
+		if st.st_size < self.file.tell():
+			return 'truncated'
+		return 'same'
+
+	def read_blocks(self):
+		if self.file is None and not self._open():
+			return
+		while True:
+			while True:
+				data = self.file.read(read_size)
+				if not data:
+					break
+				data = self.partial + data
+				end = data.rfind('\n') + 1
+				self.partial = data[end:]
+				if end:
+					yield data[:end]
+
+			state = self._check()
+			if state == 'rotated':
+				# an incomplete last line of the old log is dropped
+				self.file.close()
+				self.file = None
+				if not self._open():
+					return
+			elif state == 'truncated':
+				self.file.seek(0)
+				self.partial = ''
+			else:
+				return
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
@@ -1,10 +1,14 @@
 # Ganglia module for parsing the nginx access log.
-# Computes average request rate and response time.
-# Uses the logtail tool to access the log.
-import subprocess, threading;
+# Computes average request rate and response time, and percentiles of the
+# response time.
+# Follows the log in process with log_tailer.
+import threading;
 import time, os;
 import logging;
 
+import log_tailer;
+import latency;
+
 web_static_log = '/var/cache/cpsagent/nginx-static-timed.log'
 dbg_log = '/tmp/nginx_dbg.log'
 logtail_interval = 15
@@ -16,6 +20,12 @@ logger = logging.getLogger('Ganglia Web')
 web_response_time = 0
 web_request_rate = 0
 
+# Percentiles of the response times in ms, by metric name
+percentiles = [50, 95, 99]
+percentile_values = {}
+for p in percentiles:
+	percentile_values['web_response_time_p%d' % p] = 0
+
 # Can be used to stop the parsing thread.
 stop_parsing = False
 
@@ -35,8 +45,7 @@ class NginxLogParser(threading.Thread):
 
 		logger.debug("Initializing NginxLogParser with parse interval: " + \
 			str(self.parse_interval) + ", static log: " + self.static_log_file)
-		self.tmp_static_file = '/tmp/nginx_static_temp.log'		
-		self.tmp_proxy_file = '/tmp/nginx_proxy_temp.log'
+		self.tailer = log_tailer.LogTailer(self.static_log_file)
 
 		# last timestamp seen in the log
 		self.last_access_time = 0
@@ -50,26 +59,19 @@ class NginxLogParser(threading.Thread):
 		#logger.debug("Processing static log...")
 
 		try:
-			# get what has been added to the log since last time we checked
-			f_tmp_w = open(self.tmp_static_file, 'w')
-			subprocess.call(['/usr/sbin/logtail', '-f', self.static_log_file], stdout=f_tmp_w)
-			f_tmp_w.close()
-
 			start_time = 0
 			crt_time = self.last_access_time
-			n_requests = 0
-			total_resp_time = 0
-		
-			f_tmp_r = open(self.tmp_static_file, 'r')
-			for line in f_tmp_r:
-				logger.debug(line + '\n')
-				tokens = line.split()
-				nt = len(tokens)
-				crt_time = float(tokens[nt - 2])
-				if (start_time == 0):
-					start_time = crt_time
-				total_resp_time += float(tokens[nt - 1])	
-				n_requests += 1
+			times = latency.LatencyHistogram()
+
+			# what has been added to the log since last time we checked
+			for block in self.tailer.read_blocks():
+				for rest, req_time, resp_time in log_tailer.TIMED_LINE.findall(block):
+					crt_time = float(req_time)
+					if (start_time == 0):
+						start_time = crt_time
+					# response time in ms
+					times.add(float(resp_time) * 1000)
+			n_requests = times.count
 
 			# not the first time we read from the log
 			if (self.last_access_time != 0):
@@ -85,17 +87,17 @@ class NginxLogParser(threading.Thread):
 				web_request_rate = 0
 
 			logger.debug("Start time: " + str(start_time) + ", end time: " + str(end_time) + "\n")
-			# response time in ms
-			if ((n_requests != 0) and (start_time != end_time)):
-				web_response_time = (total_resp_time * 1000) / n_requests			
+			if (start_time != end_time):
+				web_response_time = times.mean()
 			else:
 				web_response_time = 0
+				times = latency.LatencyHistogram()
+			for p in percentiles:
+				percentile_values['web_response_time_p%d' % p] = times.percentile(p)
 
 			logger.debug("Req rate: " + str(web_request_rate) + ", response time: " + str(web_response_time) + 
 "n. requests: " + str(n_requests) + "\n")
 
-			f_tmp_r.close()
-
 		except Exception, ex:
 			logger.exception(ex)
 			return 1 		
@@ -124,6 +126,10 @@ def response_time_static_handler(name):
 	global web_response_time
 	return web_response_time
 
+def percentile_handler(name):
+	global percentile_values
+	return percentile_values[name]
+
 
 def metric_init(params):
 	global descriptors, web_static_log, logtail_interval
@@ -164,6 +170,17 @@ def metric_init(params):
 	
 	descriptors = [d1, d2]
 
+	for p in percentiles:
+		descriptors.append({'name': 'web_response_time_p%d' % p,
+			'call_back': percentile_handler,
+			'time_max': 90,
+			'value_type': 'float',
+			'units': 'ms',
+			'slope': 'both',
+			'format': '%f',
+			'description': 'Web Response Time (%dth percentile)' % p,
+			'groups': 'web'})
+
 	parser_thread =  NginxLogParser(web_static_log, web_static_log, logtail_interval)	
 	parser_thread.start()
 	return descriptors
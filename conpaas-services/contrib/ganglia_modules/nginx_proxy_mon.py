@@ -1,12 +1,21 @@
 # Ganglia module for parsing the nginx proxy access log.
-# Computes average request rate and response time for static and php requests.
-# Uses the logtail tool to access the log.
-import subprocess, threading;
+# Computes average request rate and response time, and percentiles of the
+# response time, for static and php requests.
+# Follows the log in process with log_tailer.
+# The histograms of all the response times since the module started are
+# also written to histogram_file, from which the agent serves them to the
+# manager (see getResponseTimeHistograms).
+import threading;
 import time, os;
+import json;
 import logging;
 
+import log_tailer;
+import latency;
+
 web_proxy_log = '/var/cache/cpsagent/nginx-proxy-timed.log'
 dbg_log = '/tmp/nginx_proxy_dbg.log'
+histogram_file = '/var/cache/cpsagent/nginx-proxy-histograms.json'
 logtail_interval = 15
 descriptors = []
 
@@ -19,6 +28,13 @@ web_request_rate_lb = 0
 php_response_time_lb = 0
 php_request_rate_lb = 0
 
+# Percentiles of the response times in ms, by metric name
+percentiles = [50, 95, 99]
+percentile_values = {}
+for p in percentiles:
+	percentile_values['web_response_time_lb_p%d' % p] = 0
+	percentile_values['php_response_time_lb_p%d' % p] = 0
+
 # Can be used to stop the parsing thread.
 stop_parsing = False
 
@@ -27,21 +43,42 @@ stop_parsing = False
 # and request rate for the last time interval and stores them
 # in the global variables.
 class NginxLogParser(threading.Thread):
-	def __init__(self, proxy_log_file, parse_interval):
+	def __init__(self, proxy_log_file, parse_interval, histogram_file):
 		global logger
 
 		threading.Thread.__init__(self)
 
 		self.proxy_log_file = proxy_log_file
 		self.parse_interval = parse_interval
+		self.histogram_file = histogram_file
 
 		logger.debug("Initializing NginxLogParser with parse interval: " + \
 			str(self.parse_interval) + ", proxy log: " + self.proxy_log_file)	
-		self.tmp_proxy_file = '/tmp/nginx_proxy_temp.log'
+		self.tailer = log_tailer.LogTailer(self.proxy_log_file)
 
 		# last timestamp seen in the log
 		self.last_access_time = 0
 
+		# response times since the module started
+		self.started = time.time()
+		self.web_histogram = latency.LatencyHistogram()
+		self.php_histogram = latency.LatencyHistogram()
+
+	# Writes the histograms of the response times to the histogram file.
+	# The file is replaced at once, so that it is never read half written.
+	def export_histograms(self, end_time):
+		data = {'started': self.started,
+			'time': end_time,
+			'web_response_time_lb': self.web_histogram.to_dict(),
+			'php_response_time_lb': self.php_histogram.to_dict()}
+		tmp_file = self.histogram_file + '.tmp'
+		f = open(tmp_file, 'w')
+		try:
+			json.dump(data, f)
+		finally:
+			f.close()
+		os.rename(tmp_file, self.histogram_file)
+
 	# Reads the lines that have been written in the log since the last access.
 	# Computes the average request rate and response time and writes them
 	# in global variables.
@@ -51,33 +88,27 @@ class NginxLogParser(threading.Thread):
 		logger.debug("Processing proxy log...")
 
 		try:
-			# get what has been added to the log since last time we checked
-			f_tmp_w = open(self.tmp_proxy_file, 'w')
-			subprocess.call(['/usr/sbin/logtail', '-f', self.proxy_log_file], stdout=f_tmp_w)
-			f_tmp_w.close()
-
 			start_time = 0
 			crt_time = self.last_access_time
-			n_web_requests = 0
-			n_php_requests = 0
-			total_web_resp_time = 0
-			total_php_resp_time = 0
-		
-			f_tmp_r = open(self.tmp_proxy_file, 'r')
-			for line in f_tmp_r:
-				logger.debug(line + '\n')
-				tokens = line.split()
-				nt = len(tokens)
-				crt_time = float(tokens[nt - 2])
-				if (start_time == 0):
-					start_time = crt_time
-				
-				if (line.find('php') >= 0):
-					total_php_resp_time += float(tokens[nt - 1])	
-					n_php_requests += 1
-				else:
-					total_web_resp_time += float(tokens[nt - 1])	
-					n_web_requests += 1
+			web_times = latency.LatencyHistogram()
+			php_times = latency.LatencyHistogram()
+
+			# what has been added to the log since last time we checked
+			for block in self.tailer.read_blocks():
+				for rest, req_time, resp_time in log_tailer.TIMED_LINE.findall(block):
+					crt_time = float(req_time)
+					if (start_time == 0):
+						start_time = crt_time
+
+					# response time in ms
+					if (rest.find('php') >= 0):
+						php_times.add(float(resp_time) * 1000)
+					else:
+						web_times.add(float(resp_time) * 1000)
+			n_web_requests = web_times.count
+			n_php_requests = php_times.count
+			self.web_histogram.merge(web_times)
+			self.php_histogram.merge(php_times)
 
 			# not the first time we read from the log
 			if (self.last_access_time != 0):
@@ -95,23 +126,23 @@ class NginxLogParser(threading.Thread):
 				php_request_rate_lb = 0
 
 			logger.debug("Start time: " + str(start_time) + ", end time: " + str(end_time) + "\n")
-			# response time in ms
-			if ((n_web_requests != 0) and (start_time != end_time)):
-				web_response_time_lb = (total_web_resp_time * 1000) / n_web_requests			
+			if (start_time != end_time):
+				web_response_time_lb = web_times.mean()
+				php_response_time_lb = php_times.mean()
 			else:
 				web_response_time_lb = 0
-			
-			if ((n_php_requests != 0) and (start_time != end_time)):
-				php_response_time_lb = (total_php_resp_time * 1000) / n_php_requests			
-			else:
 				php_response_time_lb = 0
+				web_times = latency.LatencyHistogram()
+				php_times = latency.LatencyHistogram()
+			for p in percentiles:
+				percentile_values['web_response_time_lb_p%d' % p] = web_times.percentile(p)
+				percentile_values['php_response_time_lb_p%d' % p] = php_times.percentile(p)
+			self.export_histograms(end_time)
 
 			logger.debug("Web req rate: " + str(web_request_rate_lb) + ", web response time: " + \
 									str(web_response_time_lb) + "n. web requests: " + str(n_web_requests) + "\n")
 			logger.debug("PHP req rate: " + str(php_request_rate_lb) + ", php response time: " + \
 									str(php_response_time_lb) + "n. php requests: " + str(n_php_requests) + "\n")
-			
-			f_tmp_r.close()
 
 		except Exception, ex:
 			logger.exception(ex)
@@ -148,8 +179,12 @@ def php_response_time_lb_handler(name):
 	global php_response_time_lb
 	return php_response_time_lb
 
+def percentile_handler(name):
+	global percentile_values
+	return percentile_values[name]
+
 def metric_init(params):
-	global descriptors, web_proxy_log, logtail_interval
+	global descriptors, web_proxy_log, logtail_interval, histogram_file
 	global logger
 
 	logging.basicConfig(
@@ -163,6 +198,8 @@ def metric_init(params):
 		web_proxy_log = params['proxy_log']
 	if 'monitor_interval' in params:
 		logtail_interval = int(params['monitor_interval'])
+	if 'histogram_file' in params:
+		histogram_file = params['histogram_file']
 
 	d1 = {'name': 'web_request_rate_lb',
       	'call_back': web_request_rate_lb_handler,
@@ -207,7 +244,19 @@ def metric_init(params):
 	
 	descriptors = [d1, d2, d3, d4]
 
-	parser_thread =  NginxLogParser(web_proxy_log, logtail_interval)	
+	for kind, title in [('web', 'Web'), ('php', 'PHP')]:
+		for p in percentiles:
+			descriptors.append({'name': '%s_response_time_lb_p%d' % (kind, p),
+				'call_back': percentile_handler,
+				'time_max': 90,
+				'value_type': 'float',
+				'units': 'ms',
+				'slope': 'both',
+				'format': '%f',
+				'description': 'Load Balancer %s Response Time (%dth percentile)' % (title, p),
+				'groups': 'web'})
+
+	parser_thread =  NginxLogParser(web_proxy_log, logtail_interval, histogram_file)	
 	parser_thread.start()
 	return descriptors
 
@@ -1,10 +1,14 @@
 # Ganglia module for parsing the PHP-FPM access log.
-# Computes average request rate and response time.
-# Uses the logtail tool to access the log.
-import subprocess, threading;
+# Computes average request rate and response time, and percentiles of the
+# response time.
+# Follows the log in process with log_tailer.
+import threading;
 import time, os;
 import logging;
 
+import log_tailer;
+import latency;
+
 php_fpm_log = '/var/cache/cpsagent/fpm-access.log'
 dbg_log = '/tmp/php_mon_dbg.log'
 logtail_interval = 15
@@ -16,6 +20,12 @@ logger = logging.getLogger('Ganglia PHP')
 php_response_time = 0
 php_request_rate = 0
 
+# Percentiles of the response times in ms, by metric name
+percentiles = [50, 95, 99]
+percentile_values = {}
+for p in percentiles:
+	percentile_values['php_response_time_p%d' % p] = 0
+
 # Can be used to stop the parsing thread
 stop_parsing = False
 
@@ -33,7 +43,7 @@ class PHPLogParser(threading.Thread):
 		self.parse_interval = parse_interval
 		logger.debug("Initializing PHPLogParser with parse interval: " + \
 			str(self.parse_interval) + ", log file: " + self.log_file)
-		self.tmp_log_file = '/tmp/php_mon_temp.log'		
+		self.tailer = log_tailer.LogTailer(self.log_file)
 
 		# last timestamp seen in the log
 		self.last_access_time = 0
@@ -47,26 +57,19 @@ class PHPLogParser(threading.Thread):
 		logger.debug("Processing PHP log...")
 
 		try:
-			# get what has been written in the log since the last time we checked
-			f_tmp_w = open(self.tmp_log_file, 'w')
-			subprocess.call(['/usr/sbin/logtail', '-f', self.log_file], stdout=f_tmp_w)
-			f_tmp_w.close()
-
 			start_time = 0
 			crt_time = self.last_access_time
-			n_requests = 0
-			total_resp_time = 0
-		
-			f_tmp_r = open(self.tmp_log_file, 'r')
-			for line in f_tmp_r:
-				logger.debug(line + '\n')
-				tokens = line.split()
-				nt = len(tokens)
-				crt_time = float(tokens[nt - 2])
-				if (start_time == 0):
-					start_time = crt_time
-				total_resp_time += float(tokens[nt - 1])	
-				n_requests += 1
+			times = latency.LatencyHistogram()
+
+			# what has been written in the log since the last time we checked
+			for block in self.tailer.read_blocks():
+				for rest, req_time, resp_time in log_tailer.TIMED_LINE.findall(block):
+					crt_time = float(req_time)
+					if (start_time == 0):
+						start_time = crt_time
+					# the response time is logged in ms
+					times.add(float(resp_time))
+			n_requests = times.count
 
 			# not the first time we read from the log
 			if (self.last_access_time != 0):
@@ -84,16 +87,13 @@ class PHPLogParser(threading.Thread):
 				php_request_rate = 0
 
 			# response time in ms
-			if (n_requests != 0):
-				php_response_time = (total_resp_time) / n_requests			
-			else:
-				php_response_time = 0
+			php_response_time = times.mean()
+			for p in percentiles:
+				percentile_values['php_response_time_p%d' % p] = times.percentile(p)
 
 			logger.debug("Req rate: " + str(php_request_rate) + ", response time: " + str(php_response_time) + 
 "n. requests: " + str(n_requests) + "\n")
 
-			f_tmp_r.close()
-
 		except Exception, ex:
 			logger.exception(ex)
 			return 1 		
@@ -121,6 +121,10 @@ def response_time_handler(name):
 	global php_response_time
 	return php_response_time
 
+def percentile_handler(name):
+	global percentile_values
+	return percentile_values[name]
+
 def metric_init(params):
 	global descriptors, php_fpm_log, logtail_interval
 	global logger
@@ -159,6 +163,17 @@ def metric_init(params):
 
 	descriptors = [d1, d2]
 
+	for p in percentiles:
+		descriptors.append({'name': 'php_response_time_p%d' % p,
+			'call_back': percentile_handler,
+			'time_max': 90,
+			'value_type': 'float',
+			'units': 'ms',
+			'slope': 'both',
+			'format': '%f',
+			'description': 'PHP Response Time (%dth percentile)' % p,
+			'groups': 'web'})
+
 	parser_thread =  PHPLogParser(php_fpm_log, logtail_interval)	
 	parser_thread.start()
 	return descriptors
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.coderelay
+    ======================
+
+    ConPaaS core: rolling a code version out to many agents.
+
+    Instead of uploading the code to every agent itself, the manager
+    uploads it to a few seed agents only. Every agent that has the code
+    then relays it to another agent, so the number of agents having the
+    code doubles with every round of uploads and a rollout takes a
+    logarithmic number of rounds. The receiving agents verify every blob
+    against its digest (see conpaas.core.codestore).
+
+    CodeRelay.update(node) is called for all the nodes in parallel, e.g.
+    through BaseManager._call_agents. It waits for a free source, either
+    one of the seed slots of the manager or an agent that already has
+    the code, and has the code sent from there:
+
+        push_func(node)          - the manager sends the code to node
+        relay_func(source, node) - the agent source sends it to node
+
+    A node whose relay failed gets the code from the manager instead,
+    through a seed slot as well, and the source of the failed relay is
+    not used anymore.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import threading
+
+from conpaas.core.log import create_logger
+
+DEFAULT_SEEDS = 2
+
+
+class CodeRelay(object):
+
+    def __init__(self, push_func, relay_func, seeds=DEFAULT_SEEDS,
+                 logger=None):
+        if seeds < 1:
+            raise ValueError('At least one seed is needed, got %s' % seeds)
+        self.push_func = push_func
+        self.relay_func = relay_func
+        self.free_seeds = seeds
+        # agents having the code and not sending it at the moment
+        self.free_sources = []
+        self.cond = threading.Condition()
+        self.logger = logger or create_logger(__name__)
+
+    def _acquire_source(self):
+        """Wait for a free source, preferring the agents to the manager.
+        None stands for the manager."""
+        self.cond.acquire()
+        try:
+            while True:
+                if self.free_sources:
+                    return self.free_sources.pop(0)
+                if self.free_seeds > 0:
+                    self.free_seeds -= 1
+                    return None
+                # a timeout keeps the wait interruptible
+                self.cond.wait(365 * 24 * 3600)
+        finally:
+            self.cond.release()
+
+    def _acquire_seed(self):
+        """Wait for a free seed slot of the manager."""
+        self.cond.acquire()
+        try:
+            while self.free_seeds == 0:
+                self.cond.wait(365 * 24 * 3600)
+            self.free_seeds -= 1
+        finally:
+            self.cond.release()
+
+    def _release_sources(self, sources):
+        self.cond.acquire()
+        try:
+            for source in sources:
+                if source is None:
+                    self.free_seeds += 1
+                else:
+                    self.free_sources.append(source)
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def update(self, node):
+        """Send the code to node and make node a source afterwards."""
+        source = self._acquire_source()
+        released = [ source ]
+        try:
+            if source is None:
+                self.push_func(node)
+            else:
+                try:
+                    self.relay_func(source, node)
+                except Exception as ex:
+                    self.logger.warning('Failed to relay the code from %s '
+                                        'to %s (%s), sending it directly'
+                                        % (source, node, ex))
+                    # the source is not used anymore
+                    released.remove(source)
+                    self._acquire_seed()
+                    released.append(None)
+                    self.push_func(node)
+            released.append(node)
+        finally:
+            self._release_sources(released)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.codestore
+    ======================
+
+    ConPaaS core: content-addressed code versions.
+
+    A code archive (zip or tar) is split into blobs, the contents of its
+    files, stored under their SHA-1 digest in a BlobStore, and a
+    manifest describing the tree:
+
+        {'files': {path: [digest, mode]}, 'dirs': [path], 'links': {path: target}}
+
+    The manager keeps a BlobStore next to the code repository and the
+    agents keep one as a local cache. To update the code of an agent,
+    the manager asks which blobs of the manifest the agent is missing
+    and uploads a bundle holding the manifest and only those blobs. The
+    agent then checks the manifest out into a new directory and switches
+    it in by atomically replacing a symlink, so a redeployment with a
+    small diff moves only the changed files.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+
+from StringIO import StringIO
+
+BUNDLE_MANIFEST = 'manifest.json'
+BUNDLE_BLOBS = 'blobs/'
+
+DEFAULT_FILE_MODE = 0644
+
+CHUNK_SIZE = 64 * 1024
+
+_DIGEST_RE = re.compile('^[0-9a-f]{40}$')
+
+
+class CodeStoreError(Exception):
+    pass
+
+
+class BlobStore(object):
+    """Files stored under the SHA-1 digest of their content."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, digest):
+        if not _DIGEST_RE.match(digest):
+            raise CodeStoreError('Invalid blob digest %r' % digest)
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def missing(self, digests):
+        """Return the digests whose blob is not in the store, without
+        duplicates and in the given order."""
+        seen = set()
+        missing = []
+        for digest in digests:
+            if digest not in seen and not self.has(digest):
+                missing.append(digest)
+            seen.add(digest)
+        return missing
+
+    def add_file(self, fileobj, digest=None):
+        """Copy the content of fileobj into the store and return its
+        digest. If digest is given, the content must match it."""
+        fd, tmp_path = tempfile.mkstemp(prefix='.blob-', dir=self.directory)
+        try:
+            sha1 = hashlib.sha1()
+            out = os.fdopen(fd, 'wb')
+            try:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha1.update(chunk)
+                    out.write(chunk)
+            finally:
+                out.close()
+
+            actual = sha1.hexdigest()
+            if digest is not None and digest != actual:
+                raise CodeStoreError('Corrupted blob %s (content hashes to %s)'
+                                     % (digest, actual))
+            blob_path = self.path(actual)
+            if os.path.exists(blob_path):
+                os.remove(tmp_path)
+            else:
+                if not os.path.isdir(os.path.dirname(blob_path)):
+                    try:
+                        os.makedirs(os.path.dirname(blob_path))
+                    except OSError:
+                        # created meanwhile by a concurrent add_file
+                        pass
+                os.rename(tmp_path, blob_path)
+            return actual
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def prune(self, keep):
+        """Remove the blobs whose digest is not in keep."""
+        keep = set(keep)
+        for subdir in os.listdir(self.directory):
+            subdir_path = os.path.join(self.directory, subdir)
+            if len(subdir) != 2 or not os.path.isdir(subdir_path):
+                continue
+            for digest in os.listdir(subdir_path):
+                if digest not in keep:
+                    os.remove(os.path.join(subdir_path, digest))
+
+
+def _check_path(path):
+    path = os.path.normpath(path)
+    if os.path.isabs(path) or path == '..' or path.startswith('../'):
+        raise CodeStoreError("Invalid path '%s' in the code archive" % path)
+    return path
+
+
+def import_archive(store, archive_path):
+    """Store the files of a zip or tar archive as blobs and return the
+    manifest of the archive."""
+    manifest = {'files': {}, 'dirs': [], 'links': {}}
+
+    if tarfile.is_tarfile(archive_path):
+        arch = tarfile.open(archive_path)
+        try:
+            for member in arch.getmembers():
+                path = _check_path(member.name)
+                if path == '.':
+                    continue
+                if member.isdir():
+                    manifest['dirs'].append(path)
+                elif member.issym():
+                    manifest['links'][path] = member.linkname
+                elif member.isfile() or member.islnk():
+                    content = arch.extractfile(member)
+                    manifest['files'][path] = [store.add_file(content),
+                                               member.mode & 0777]
+        finally:
+            arch.close()
+    elif zipfile.is_zipfile(archive_path):
+        arch = zipfile.ZipFile(archive_path)
+        try:
+            for name in arch.namelist():
+                path = _check_path(name)
+                if name.endswith('/'):
+                    manifest['dirs'].append(path)
+                else:
+                    # extracting a zip archive does not keep the modes
+                    content = arch.open(name)
+                    manifest['files'][path] = [store.add_file(content), None]
+        finally:
+            arch.close()
+    else:
+        raise CodeStoreError("'%s' is not a zip or tar archive" % archive_path)
+
+    return manifest
+
+
+def _manifest_cache_path(store, archive_path):
+    # the name of an archive may be reused by an archive elsewhere or by
+    # a new upload, hence the full path, mtime and size in the key
+    info = os.stat(archive_path)
+    key = '%s:%r:%d' % (os.path.abspath(archive_path), info.st_mtime,
+                        info.st_size)
+    return os.path.join(store.directory, 'manifests',
+                        hashlib.sha1(key).hexdigest() + '.json')
+
+
+def archive_manifest(store, archive_path):
+    """Return the manifest of an archive, importing the archive in the
+    store the first time. Code archives are never modified, so manifests
+    are cached by the path, mtime and size of the archive."""
+    cache_path = _manifest_cache_path(store, archive_path)
+    manifests_dir = os.path.dirname(cache_path)
+    if os.path.exists(cache_path):
+        manifest = json.load(open(cache_path))
+        if not store.missing(manifest_hashes(manifest)):
+            return manifest
+
+    manifest = import_archive(store, archive_path)
+
+    if not os.path.isdir(manifests_dir):
+        os.makedirs(manifests_dir)
+    fd, tmp_path = tempfile.mkstemp(prefix='.manifest-', dir=manifests_dir)
+    out = os.fdopen(fd, 'w')
+    try:
+        json.dump(manifest, out)
+    finally:
+        out.close()
+    os.rename(tmp_path, cache_path)
+    return manifest
+
+
+def prune_archives(store, archive_paths):
+    """Remove the blobs and the cached manifests not needed by the given
+    archives, e.g. the code versions left after deleting one."""
+    keep = set()
+    cached = set()
+    for archive_path in archive_paths:
+        keep.update(manifest_hashes(archive_manifest(store, archive_path)))
+        cached.add(os.path.basename(_manifest_cache_path(store, archive_path)))
+    store.prune(keep)
+
+    manifests_dir = os.path.join(store.directory, 'manifests')
+    if os.path.isdir(manifests_dir):
+        for name in os.listdir(manifests_dir):
+            # the names starting with a dot are being written
+            if not name.startswith('.') and name not in cached:
+                os.remove(os.path.join(manifests_dir, name))
+
+
+def manifest_hashes(manifest):
+    """Return the digests of the blobs needed by a manifest."""
+    return sorted(set(digest for digest, _ in manifest['files'].values()))
+
+
+def write_bundle(store, manifest, digests, fileobj):
+    """Write to fileobj a tar.gz bundle with the manifest and the given
+    blobs."""
+    bundle = tarfile.open(fileobj=fileobj, mode='w:gz')
+    try:
+        data = json.dumps(manifest)
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        bundle.addfile(info, StringIO(data))
+
+        for digest in digests:
+            blob_path = store.path(digest)
+            info = tarfile.TarInfo(BUNDLE_BLOBS + digest)
+            info.size = os.path.getsize(blob_path)
+            blob = open(blob_path, 'rb')
+            try:
+                bundle.addfile(info, blob)
+            finally:
+                blob.close()
+    finally:
+        bundle.close()
+
+
+def make_bundle(store, manifest, digests):
+    """Write a bundle to a temporary file and return its path. The
+    caller removes the file."""
+    fd, path = tempfile.mkstemp(prefix='bundle-', suffix='.tar.gz')
+    out = os.fdopen(fd, 'wb')
+    try:
+        write_bundle(store, manifest, digests, out)
+    except:
+        out.close()
+        os.remove(path)
+        raise
+    out.close()
+    return path
+
+
+def push_code(store, manifest, missing_func, upload_func):
+    """Update the code of an agent: missing_func(hashes) returns the
+    blobs the agent lacks, upload_func(bundle_path) uploads a bundle with
+    the manifest and those blobs."""
+    missing = missing_func(manifest_hashes(manifest))
+    bundle_path = make_bundle(store, manifest, missing)
+    try:
+        return upload_func(bundle_path)
+    finally:
+        os.remove(bundle_path)
+
+
+def read_bundle(store, fileobj):
+    """Store the blobs of a bundle and return its manifest. Every blob
+    needed by the manifest must be in the store afterwards."""
+    manifest = None
+    bundle = tarfile.open(fileobj=fileobj, mode='r|*')
+    try:
+        for member in bundle:
+            if member.name == BUNDLE_MANIFEST:
+                manifest = json.loads(bundle.extractfile(member).read())
+            elif member.name.startswith(BUNDLE_BLOBS) and member.isfile():
+                store.add_file(bundle.extractfile(member),
+                               member.name[len(BUNDLE_BLOBS):])
+    finally:
+        bundle.close()
+
+    if manifest is None:
+        raise CodeStoreError('The code bundle has no manifest')
+    missing = store.missing(manifest_hashes(manifest))
+    if missing:
+        raise CodeStoreError('The code bundle lacks %d blobs of the manifest'
+                             % len(missing))
+    return manifest
+
+
+def remove_tree(target):
+    """Remove a code directory, either a plain directory or a symlink
+    made by checkout together with the directory it points to."""
+    if os.path.islink(target):
+        tree = os.path.join(os.path.dirname(target), os.readlink(target))
+        os.remove(target)
+        shutil.rmtree(tree, ignore_errors=True)
+    elif os.path.exists(target):
+        shutil.rmtree(target)
+
+
+def checkout(store, manifest, target, prepare=None):
+    """Build the tree of a manifest next to target and switch target to
+    it with an atomic symlink replacement. prepare(tree) is called on
+    the new tree before the switch."""
+    target = os.path.abspath(target)
+    parent, name = os.path.split(target)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    tree = tempfile.mkdtemp(prefix='.%s.' % name, dir=parent)
+    try:
+        os.chmod(tree, 0755)
+        for path in sorted(manifest['dirs']):
+            dir_path = os.path.join(tree, _check_path(path))
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+
+        for path, (digest, mode) in manifest['files'].items():
+            file_path = os.path.join(tree, _check_path(path))
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            # copied rather than linked: the application may modify its
+            # files, which must not alter the blobs
+            shutil.copyfile(store.path(digest), file_path)
+            os.chmod(file_path, DEFAULT_FILE_MODE if mode is None else mode)
+
+        for path, link in manifest['links'].items():
+            link_path = os.path.join(tree, _check_path(path))
+            if not os.path.isdir(os.path.dirname(link_path)):
+                os.makedirs(os.path.dirname(link_path))
+            os.symlink(link, link_path)
+
+        if prepare is not None:
+            prepare(tree)
+    except:
+        shutil.rmtree(tree, ignore_errors=True)
+        raise
+
+    previous = None
+    if os.path.islink(target):
+        previous = os.path.join(parent, os.readlink(target))
+    elif os.path.exists(target):
+        # code extracted from an archive before
+        shutil.rmtree(target)
+
+    tmp_link = os.path.join(parent, '.%s.link' % name)
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(tree), tmp_link)
+    os.rename(tmp_link, target)
+
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+    return tree
+
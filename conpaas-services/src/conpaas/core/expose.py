@@ -10,13 +10,21 @@
 """
 
 exposed_functions_http_methods = {}
-def expose(http_method):
+exposed_functions_serialized = {}
+def expose(http_method, serialized=None):
     """
     This decorator simply stores the http_method for a given handler (exposed) function 
     in a global dictionary, namely exposed_functions_http_methods 
+
+    Serialized functions of a service are called one at a time. By default, the
+    POST and UPLOAD functions are serialized and the GET functions, which only
+    read the state of the service, are called concurrently.
     """
+    if serialized is None:
+        serialized = http_method != 'GET'
     def decorator(func):
       exposed_functions_http_methods[id(func)] = http_method
+      exposed_functions_serialized[id(func)] = serialized
       def wrapped(self, *args, **kwargs):
         return func(self, *args, **kwargs)
       return wrapped
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.fanout
+    ===================
+
+    ConPaaS core: parallel calls to many agents.
+
+    call_nodes(func, nodes) calls func(node) for every node using a
+    bounded number of threads and collects the result or the error of
+    every call. The caller then decides, through a policy, whether the
+    failures are acceptable:
+
+        REQUIRE_ALL  - every call must succeed
+        REQUIRE_ANY  - at least one call must succeed
+        REQUIRE_NONE - failures are only reported
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import sys
+import time
+import traceback
+import threading
+import Queue
+
+REQUIRE_ALL = 'all'
+REQUIRE_ANY = 'any'
+REQUIRE_NONE = 'none'
+
+DEFAULT_MAX_WORKERS = 16
+
+
+class FanOutTimeout(Exception):
+    """The call to a node did not complete in time."""
+    pass
+
+
+class FanOutResult(object):
+    """
+        Outcome of call_nodes.
+
+        results: dict mapping every node whose call succeeded to its
+                 return value
+        errors: dict mapping every node whose call failed to the
+                exception it raised (FanOutTimeout if it did not
+                complete in time)
+        tracebacks: dict mapping every node whose call raised an
+                    exception to the formatted traceback
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.results = {}
+        self.errors = {}
+        self.tracebacks = {}
+
+    def failed_nodes(self):
+        """Nodes whose call failed, in the order they were given."""
+        return [ node for node in self.nodes if node in self.errors ]
+
+    def succeeded_nodes(self):
+        """Nodes whose call succeeded, in the order they were given."""
+        return [ node for node in self.nodes if node in self.results ]
+
+    def check(self, required=REQUIRE_ALL):
+        """
+            Raise the error of the first failed node if the failures
+            are not acceptable according to 'required'.
+        """
+        failed = self.failed_nodes()
+        if not failed or required == REQUIRE_NONE:
+            return
+        if required == REQUIRE_ANY and len(failed) < len(self.nodes):
+            return
+        raise self.errors[failed[0]]
+
+
+def call_nodes(func, nodes, max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+    """
+        Call func(node) for every node in parallel.
+
+        @param func Function called with a single node as argument
+        @param nodes Sequence of nodes
+        @param max_workers Maximum number of concurrent calls
+        @param timeout Maximum number of seconds to wait for all the
+                       calls; the nodes not done by then get a
+                       FanOutTimeout error (their calls are not
+                       interrupted and their results are discarded)
+
+        @return A FanOutResult
+    """
+    nodes = list(nodes)
+    outcome = FanOutResult(nodes)
+    if not nodes:
+        return outcome
+
+    if len(nodes) == 1 and timeout is None:
+        # nothing to run in parallel
+        _call(func, nodes[0], outcome)
+        return outcome
+
+    pending = Queue.Queue()
+    for index, node in enumerate(nodes):
+        pending.put((index, node))
+    done = Queue.Queue()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                index, node = pending.get_nowait()
+            except Queue.Empty:
+                return
+            partial = FanOutResult([node])
+            _call(func, node, partial)
+            lock.acquire()
+            try:
+                if index not in finished:
+                    finished.add(index)
+                    outcome.results.update(partial.results)
+                    outcome.errors.update(partial.errors)
+                    outcome.tracebacks.update(partial.tracebacks)
+            finally:
+                lock.release()
+            done.put(index)
+
+    finished = set()
+    for _ in range(min(max_workers, len(nodes))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for _ in nodes:
+        try:
+            if deadline is None:
+                # a timeout keeps the wait interruptible
+                done.get(True, 365 * 24 * 3600)
+            else:
+                done.get(True, max(deadline - time.time(), 0))
+        except Queue.Empty:
+            break
+
+    lock.acquire()
+    try:
+        for index, node in enumerate(nodes):
+            if index not in finished:
+                finished.add(index)
+                outcome.errors[node] = FanOutTimeout(
+                    'No answer from node %s after %s seconds' % (node, timeout))
+    finally:
+        lock.release()
+
+    return outcome
+
+
+def _call(func, node, outcome):
+    try:
+        outcome.results[node] = func(node)
+    except Exception as ex:
+        outcome.errors[node] = ex
+        outcome.tracebacks[node] = ''.join(
+            traceback.format_exception(*sys.exc_info()))
@@ -25,6 +25,9 @@ class BaseGanglia(object):
     GANGLIA_CONFD = os.path.join(GANGLIA_ETC, 'conf.d')
     GMOND_CONF    = os.path.join(GANGLIA_ETC, 'gmond.conf')
     GANGLIA_MODULES_DIR = '/usr/lib/ganglia/python_modules/'
+    # Helpers imported by the modules, by directory relative to cps_home
+    SHARED_MODULES = [ (os.path.join('contrib', 'ganglia_modules'), 'log_tailer'),
+                       (os.path.join('src', 'conpaas', 'core'), 'latency') ]
 
     def __init__(self):
         """Set basic values"""
@@ -63,6 +66,10 @@ class BaseGanglia(object):
         
     def add_modules(self, modules):
         """Install additional modules and restart ganglia-monitor"""
+        for directory, helper in self.SHARED_MODULES:
+            filename = os.path.join(self.cps_home, directory, helper + '.py')
+            copy(filename, self.GANGLIA_MODULES_DIR)
+
         for module in modules:
             # Copy conf files into ganglia conf.d
             filename = os.path.join(self.cps_home, 'contrib', 
@@ -19,17 +19,25 @@
     part by the python socket API and thus required to work
     with httplib.
 
+    Connections are kept alive (HTTP/1.1) and reused through a
+    per-(host, port) pool of TLS connections, so repeated calls to the
+    same manager or agent do not pay a full handshake each time. Idle
+    connections are evicted after a timeout and SSL sessions are
+    cached to resume handshakes when a new connection is needed.
+
     It implements the following methods:
         - https_get
         - https_post
         - jsonrpc_post
         - jsonrpc_get
+        - jsonrpc_batch
+        - jsonrpc_download
 
     :copyright: (C) 2010-2013 by Contrail Consortium.
 """
 
+import errno
 import socket
-import mimetypes
 from cStringIO import StringIO
 from urllib import urlencode
 
@@ -41,14 +49,25 @@ from conpaas.core.misc import file_get_contents
 import time
 import json
 import httplib
+import threading
 
 from . import x509
+from . import multipart
+
+# Bytes read from the connection at a time by jsonrpc_download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 __client_ctx = None
+__client_ctx_key = None
 __uid = None
 __aid = None
 
 def conpaas_init_ssl_ctx(dir, role, uid=None, aid=None):
+    global __client_ctx, __client_ctx_key, __uid, __aid
+    # Re-initializing with the same arguments keeps the current context
+    # (and thus the pooled connections created with it).
+    if __client_ctx is not None and __client_ctx_key == (dir, role, uid, aid):
+        return
     cert_file = dir + '/cert.pem'
     key_file = dir + '/key.pem'
     ca_cert_file = dir + '/ca_cert.pem'
@@ -66,15 +85,18 @@ def conpaas_init_ssl_ctx(dir, role, uid=None, aid=None):
             # Extract uid from the certificate itself
             uid = x509.get_x509_dn_field(file_get_contents(cert_file), 'UID')
 
-    global __client_ctx, __uid, __aid
     __client_ctx = _init_context(SSL.SSLv23_METHOD, cert_file, key_file,
                         ca_cert_file, verify_callback)
+    __client_ctx_key = (dir, role, uid, aid)
     __uid = uid
     __aid = aid
+    _pool.clear()
 
 def conpaas_init_ssl_ctx_no_certs():
-    global __client_ctx
+    global __client_ctx, __client_ctx_key
     __client_ctx = SSL.Context(SSL.SSLv23_METHOD)
+    __client_ctx_key = None
+    _pool.clear()
 
 def is_ssl_ctx_initialized():
     return isinstance(__client_ctx, SSL.Context)
@@ -94,12 +116,157 @@ class HTTPSConnection(HTTPConnection):
             assert isinstance(self.ssl_ctx, SSL.Context), self.ssl_ctx
         except KeyError:
             self.ssl_ctx = SSL.Context(SSL.SSLv23_METHOD)
+        # SSL session to resume (if any), updated after each handshake
+        self.ssl_session = ssl.get('ssl_session')
         HTTPConnection.__init__(self, host, port, strict)
 
     def connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock = SSLConnectionWrapper(self.ssl_ctx, sock)
+        if self.ssl_session is not None and _SSL_SESSIONS:
+            self.sock.set_session(self.ssl_session)
         self.sock.connect((self.host, self.port))
+        if _SSL_SESSIONS:
+            self.sock.do_handshake()
+            self.ssl_session = self.sock.get_session()
+
+
+# Session resumption is only available in recent pyOpenSSL versions
+_SSL_SESSIONS = hasattr(SSL.Connection, 'set_session')
+
+
+class HTTPSConnectionPool(object):
+    """
+        Pool of keep-alive HTTPS connections indexed by (host, port).
+
+        Connections are taken out of the pool for the duration of a
+        request and put back afterwards, so a connection is never
+        shared between threads. At most 'max_per_host' idle
+        connections are kept for every (host, port); connections idle
+        for more than 'idle_timeout' seconds are closed. The last SSL
+        session negotiated with every (host, port) is remembered and
+        used to resume the handshake of new connections.
+    """
+
+    def __init__(self, max_per_host=4, idle_timeout=30):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port, ssl_ctx):
+        """
+            @return A tuple (connection, reused), where 'reused' is True
+                    if the connection was already open
+        """
+        key = (host, port)
+        now = time.time()
+        expired = []
+        conn = None
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(candidate)
+                else:
+                    conn = candidate
+                    break
+            session = self._sessions.get(key)
+        finally:
+            self._lock.release()
+
+        for old in expired:
+            old.close()
+
+        if conn is not None:
+            return conn, True
+        return HTTPSConnection(host, port=port, ssl_context=ssl_ctx,
+                               ssl_session=session), False
+
+    def put(self, host, port, conn):
+        """
+            Return a connection to the pool once its response has been
+            entirely read.
+        """
+        key = (host, port)
+        self._remember_session(key, conn)
+        if conn.sock is None:
+            # closed by httplib because the server did not keep it alive
+            return
+
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append((conn, time.time()))
+                conn = None
+        finally:
+            self._lock.release()
+
+        if conn is not None:
+            conn.close()
+
+    def discard(self, host, port, conn):
+        """Close a connection which failed and must not be reused."""
+        self._remember_session((host, port), conn)
+        conn.close()
+
+    def _remember_session(self, key, conn):
+        if conn.ssl_session is None:
+            return
+        self._lock.acquire()
+        try:
+            self._sessions[key] = conn.ssl_session
+        finally:
+            self._lock.release()
+
+    def evict_idle(self):
+        """Close all connections idle for more than idle_timeout."""
+        now = time.time()
+        expired = []
+        self._lock.acquire()
+        try:
+            for key, idle in self._idle.items():
+                keep = [ (c, t) for c, t in idle if now - t <= self.idle_timeout ]
+                expired.extend([ c for c, t in idle if now - t > self.idle_timeout ])
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+        finally:
+            self._lock.release()
+        for conn in expired:
+            conn.close()
+
+    def clear(self):
+        """Close all idle connections and forget cached SSL sessions."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+            self._sessions = {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+_pool = HTTPSConnectionPool()
+
+def set_connection_pool_limits(max_per_host=None, idle_timeout=None):
+    """Tune the keep-alive connection pool shared by all requests."""
+    if max_per_host is not None:
+        _pool.max_per_host = max_per_host
+    if idle_timeout is not None:
+        _pool.idle_timeout = idle_timeout
+    _pool.evict_idle()
+
+def close_connections():
+    """Close all the pooled keep-alive connections."""
+    _pool.clear()
 
 
 class SSLConnectionWrapper(object):
@@ -113,6 +280,14 @@ class SSLConnectionWrapper(object):
     default_buf_size = 8192
     def __init__(self, ssl_ctx, sock):
         self._ssl_conn = SSL.Connection(ssl_ctx, sock)
+        # Data received but not consumed yet. It is kept here rather
+        # than in the file objects because httplib creates a new file
+        # object for every response on a keep-alive connection.
+        self._rbuf = ''
+        # Like python sockets, the connection stays open until the
+        # file objects returned by makefile are closed.
+        self._makefile_refs = 0
+        self._close_pending = False
 
     def __getattr__(self, name):
         """
@@ -126,34 +301,53 @@ class SSLConnectionWrapper(object):
             We need to provide this method, which is specific to python
             socket API as it is required by the httplib.
 
-            This function just reads from the socket and writes to a
-            StringIO object.
+            Data is read lazily from the socket, only as much as
+            requested, so that the connection can be reused for the
+            next request once a response has been consumed.
 
-            @return: file object of type cStringIO.StringIO for data returned
-                     from socket
+            @return: file-like object reading from the connection
         """
-        _buf_size = self.__class__.default_buf_size
+        self._makefile_refs += 1
+        return _SSLFileObject(self)
 
-        fileobject = StringIO()
-        try:
-            while True:
-                try:
-                    buf = self._ssl_conn.recv(_buf_size)
-                except SSL.WantReadError:
-                    # time.sleep(1)
-                    continue
-                if not buf:
-                    break
-                fileobject.write(buf)
+    def close(self):
+        """
+            Close the connection, unless a response is still being read
+            through a file object (httplib closes the connection right
+            after the response headers when the server does not keep
+            it alive).
+        """
+        if self._makefile_refs > 0:
+            self._close_pending = True
+        else:
+            self._ssl_conn.close()
 
-        except (SSL.ZeroReturnError, SSL.SysCallError):
-            # Ignore the exception thrown by httplib
-            # when incomplete content received
-            pass
+    def _decref_makefile(self):
+        self._makefile_refs -= 1
+        if self._makefile_refs <= 0 and self._close_pending:
+            self._ssl_conn.close()
 
-        # Start reading buffer from beginning
-        fileobject.seek(0)
-        return fileobject
+    def _recv_some(self):
+        """
+            Append the next chunk of data from the socket to the read
+            buffer.
+
+            @return: False if the connection was closed by the peer
+        """
+        _buf_size = self.__class__.default_buf_size
+        while True:
+            try:
+                buf = self._ssl_conn.recv(_buf_size)
+            except SSL.WantReadError:
+                continue
+            except (SSL.ZeroReturnError, SSL.SysCallError):
+                # Ignore the exception thrown by httplib
+                # when incomplete content received
+                return False
+            if not buf:
+                return False
+            self._rbuf += buf
+            return True
 
     def shutdown(self, _arg):
         """
@@ -163,6 +357,65 @@ class SSLConnectionWrapper(object):
         return self._ssl_conn.shutdown()
 
 
+class _SSLFileObject(object):
+    """
+        Minimal read-only file object over a SSLConnectionWrapper,
+        providing the methods used by httplib.HTTPResponse.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._closed = False
+
+    def read(self, size=-1):
+        conn = self._conn
+        if size is None or size < 0:
+            while conn._recv_some():
+                pass
+            size = len(conn._rbuf)
+        elif not conn._rbuf:
+            # return whatever is available, like a socket file with bufsize 0
+            conn._recv_some()
+        data, conn._rbuf = conn._rbuf[:size], conn._rbuf[size:]
+        return data
+
+    def readline(self, size=-1):
+        conn = self._conn
+        start = 0
+        while True:
+            end = conn._rbuf.find('\n', start)
+            if end >= 0:
+                end += 1
+                break
+            if size >= 0 and len(conn._rbuf) >= size:
+                end = size
+                break
+            start = len(conn._rbuf)
+            if not conn._recv_some():
+                end = len(conn._rbuf)
+                break
+        if size >= 0:
+            end = min(end, size)
+        line, conn._rbuf = conn._rbuf[:end], conn._rbuf[end:]
+        return line
+
+    def close(self):
+        # The underlying connection stays open for the next response,
+        # unless it was closed while this file was in use.
+        if not self._closed:
+            self._closed = True
+            self._conn._decref_makefile()
+
+    def flush(self):
+        pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+
 def _init_context(protocol, cert_file, key_file,
                  ca_cert_file, verify_callback, verify_depth=9):
     ctx=SSL.Context(protocol)
@@ -296,6 +549,69 @@ def _conpaas_callback_director(connection, x509, errnum, errdepth, ok):
 
     return ok
 
+# Errors of a connection the server closed before reading the request
+_STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+def _stale_connection_error(e):
+    """
+        Whether 'e', raised while sending a request or waiting for its
+        status line, shows that the server had closed the connection
+        before receiving the request, so that no response is coming.
+    """
+    if isinstance(e, httplib.BadStatusLine):
+        # the connection was closed before the status line
+        return e.line in ('', "''")
+    if isinstance(e, (socket.error, SSL.SysCallError)):
+        return len(e.args) > 0 and e.args[0] in _STALE_ERRNOS
+    return False
+
+def _send_request(host, port, method, uri, body=None, headers={}):
+    """
+        Send a request over a pooled keep-alive connection and read the
+        status line and headers of the response.
+
+        A request is only sent again, over a new connection, when the
+        server had closed the reused connection it was sent on: the
+        connection was reset while sending, or closed before any byte
+        of the response. Other errors, like a timeout waiting for the
+        response, are raised, as the server may have processed the
+        request.
+
+        @return A tuple (connection, response)
+    """
+    while True:
+        h, reused = _pool.get(host, port, __client_ctx)
+        try:
+            if hasattr(body, 'rewind'):
+                # a streamed body may have been partly sent already
+                body.rewind()
+            h.request(method, uri, body, headers)
+            return h, h.getresponse()
+        except Exception as e:
+            _pool.discard(host, port, h)
+            if reused and _stale_connection_error(e):
+                continue
+            raise
+        except:
+            _pool.discard(host, port, h)
+            raise
+
+def _https_request(host, port, method, uri, body=None, headers={}):
+    """
+        Send a request over a pooled keep-alive connection.
+
+        @return A tuple containing the return code
+        and the response to the HTTP request
+    """
+    h, r = _send_request(host, port, method, uri, body, headers)
+    try:
+        data = r.read()
+    except:
+        _pool.discard(host, port, h)
+        raise
+    _pool.put(host, port, h)
+    return r.status, data
+
 def https_get(host, port, uri, params=None):
     """Creates the VMs associated with the list of nodes. It also tests
        if the agents started correctly.
@@ -312,19 +628,11 @@ def https_get(host, port, uri, params=None):
         @return A tuple containing the return code
         and the response to the HTTP request
     """
-    h = HTTPSConnection(host, port=port, ssl_context=__client_ctx)
     if params:
         if 'service_id' not in params:
             params['service_id'] = 0
-        h.putrequest('GET', '%s?%s' % (uri, urlencode(params)))
-    else:
-        h.putrequest('GET', uri)
-    h.putheader('Connection', 'close')
-    h.endheaders()
-    r = h.getresponse()
-    body = r.read()
-    h.close()
-    return r.status, body
+        uri = '%s?%s' % (uri, urlencode(params))
+    return _https_request(host, port, 'GET', uri)
 
 def https_post(host, port, uri, params={}, files=[]):
     """
@@ -334,7 +642,9 @@ def https_post(host, port, uri, params={}, files=[]):
         @param params A dictionary containing key:value pairs for regular
                       form fields.
         @param files A sequence of (name, filename, value) tuples for
-                     data to be uploaded as files
+                     data to be uploaded as files. The value is either
+                     the data or a file object the data is streamed
+                     from.
 
         @return A tuple containing the return code
         and the response to the HTTP request
@@ -342,18 +652,10 @@ def https_post(host, port, uri, params={}, files=[]):
     if 'service_id' not in params:
         params['service_id'] = 0
 
-    content_type, body = _encode_multipart_formdata(params, files)
-    h = HTTPSConnection(host, port=port, ssl_context=__client_ctx)
-    h.putrequest('POST', uri)
-    h.putheader('Content-Type', content_type)
-    h.putheader('Content-Length', str(len(body)))
-    h.putheader('Connection', 'close')
-    h.endheaders()
-    h.send(body)
-    r = h.getresponse()
-    body = r.read()
-    h.close()
-    return r.status, body
+    content_type, body = multipart.encode_multipart_formdata(params, files)
+    headers = { 'Content-Type': content_type,
+                'Content-Length': str(len(body)) }
+    return _https_request(host, port, 'POST', uri, body, headers)
 
 def _encode_multipart_formdata(params, files):
     """
@@ -364,36 +666,14 @@ def _encode_multipart_formdata(params, files):
                      data to be uploaded as files.
 
         @return A tuple, (content_type, body), ready for
-                httplib.HTTP instance
+                httplib.HTTP instance, with the body as a string.
+                https_post streams the body instead.
     """
-    '''
-        TODO: For some reason we receive the filename in
-        unicode and the CRLF.join(L) crashes.
-        To solve this, I converted the filename to ascii.
-    '''
-    BOUNDARY = '----------_BoUnDaRy_StRiNg_$'
-    CRLF = '\r\n'
-    L = []
-    for key in params:
-        L.append('--' + BOUNDARY)
-        L.append('Content-Disposition: form-data; name="%s"' % key)
-        L.append('')
-        L.append(str(params[key]))
-    for (key, filename, value) in files:
-        L.append('--' + BOUNDARY)
-        L.append('Content-Disposition: form-data; name="%s"; filename="%s"' \
-                % (key, filename.encode('ascii')))
-        L.append('Content-Type: %s' % _get_content_type(filename))
-        L.append('')
-        L.append(value)
-    L.append('--' + BOUNDARY + '--')
-    L.append('')
-    body = CRLF.join(L)
-    content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
-    return content_type, body
+    content_type, body = multipart.encode_multipart_formdata(params, files)
+    return content_type, body.read()
 
 def _get_content_type(filename):
-    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return multipart.get_content_type(filename)
 
 def jsonrpc_get(host, port, uri, method, service_id=0, params=None):
     """
@@ -408,21 +688,61 @@ def jsonrpc_get(host, port, uri, method, service_id=0, params=None):
         @return A tuple containing the return code
         and the response to the HTTP request
     """
-    h = HTTPSConnection(host, port=port, ssl_context=__client_ctx)
-
     all_params = { 'service_id': service_id, 'method': method, 'id': '1' }
     # all_params = {'method': method, 'id': '1'}
     if params:
         all_params['params'] = json.dumps(params)
 
-    h.putrequest('GET', '%s?%s' % (uri, urlencode(all_params)))
-    h.putheader('Content-Type', 'application/json')
-    h.putheader('Connection', 'close')
-    h.endheaders()
-    r = h.getresponse()
-    body = r.read()
-    h.close()
-    return r.status, body
+    headers = { 'Content-Type': 'application/json' }
+    return _https_request(host, port, 'GET',
+                          '%s?%s' % (uri, urlencode(all_params)),
+                          headers=headers)
+
+def jsonrpc_download(host, port, uri, method, fileobj, service_id=0,
+                     params=None, offset=0, post=False):
+    """
+        HTTPS GET request as application/json to a method returning a
+        file, which is written to 'fileobj' in chunks instead of being
+        kept in memory.
+
+        @param fileobj A file-like object the downloaded data is
+                       written to
+        @param post (Optional) Call the method with a POST request, for
+                    the methods creating the file they return
+        @param offset (Optional) Only download the file from this byte
+                      on, to resume an interrupted download
+
+        @return A tuple containing the return code and the number of
+        bytes written to 'fileobj'
+    """
+    all_params = { 'service_id': service_id, 'method': method, 'id': '1' }
+    headers = { 'Content-Type': 'application/json' }
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+    if post:
+        all_params['params'] = params or {}
+        body = json.dumps(all_params)
+        headers['Content-Length'] = str(len(body))
+        h, r = _send_request(host, port, 'POST', uri, body, headers)
+    else:
+        if params:
+            all_params['params'] = json.dumps(params)
+        uri = '%s?%s' % (uri, urlencode(all_params))
+        h, r = _send_request(host, port, 'GET', uri, None, headers)
+
+    written = 0
+    try:
+        while True:
+            chunk = r.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            fileobj.write(chunk)
+            written += len(chunk)
+    except:
+        _pool.discard(host, port, h)
+        raise
+    _pool.put(host, port, h)
+    return r.status, written
 
 def jsonrpc_post(host, port, uri, method, service_id=0, params={}):
     """
@@ -441,17 +761,38 @@ def jsonrpc_post(host, port, uri, method, service_id=0, params={}):
     body = json.dumps(all_params)
 
     # body = json.dumps({'method': method, 'params': params, 'id': '1'})
-    h = HTTPSConnection(host, port=port, ssl_context=__client_ctx)
-    h.putrequest('POST', uri)
-    h.putheader('Content-Type', 'application/json')
-    h.putheader('Content-Length', str(len(body)))
-    h.putheader('Connection', 'close')
-    h.endheaders()
-    h.send(body)
-    r = h.getresponse()
-    body = r.read()
-    h.close()
-    return r.status, body
+    headers = { 'Content-Type': 'application/json',
+                'Content-Length': str(len(body)) }
+    return _https_request(host, port, 'POST', uri, body, headers)
+
+def jsonrpc_batch(host, port, uri, calls, service_id=0):
+    """
+        Post several JSON-RPC calls to an HTTPS server in a single
+        request (JSON-RPC batch). The server dispatches all of them and
+        answers with the array of their results.
+
+        @param calls A sequence of (method, params) or
+                     (method, params, service_id) tuples
+        @param service_id The service of the calls which do not
+                          specify one
+
+        @return A tuple containing the return code
+        and the response to the HTTP request
+    """
+    batch = []
+    for request_id, call in enumerate(calls):
+        if len(call) == 3:
+            method, params, call_service_id = call
+        else:
+            method, params = call
+            call_service_id = service_id
+        batch.append({ 'service_id': call_service_id, 'method': method,
+                       'params': params or {}, 'id': request_id })
+    body = json.dumps(batch)
+
+    headers = { 'Content-Type': 'application/json',
+                'Content-Length': str(len(body)) }
+    return _https_request(host, port, 'POST', uri, body, headers)
 
 def check_response(response):
     """Check the given HTTP response, returning the result if everything went
@@ -466,6 +807,27 @@ def check_response(response):
 
     return data['result']
 
+def check_batch_response(response):
+    """Check the HTTP response to a batch, returning the list of results
+    in the order of the calls. The result of a call which failed is a
+    dictionary holding its 'error'."""
+    code, body = response
+    if code != httplib.OK:
+        raise Exception('Received http response code %d' % (code))
+
+    data = json.loads(body)
+    if isinstance(data, dict):
+        raise Exception(data['error'])
+
+    results = [ None ] * len(data)
+    for entry in data:
+        if entry.get('error'):
+            result = { 'error': entry['error'] }
+        else:
+            result = entry['result']
+        results[entry['id']] = result
+    return results
+
 if __name__ == "__main__":
     conpaas_init_ssl_ctx('/etc/conpaas-security/certs', 'manager')
     print https_post('testbed2.conpaas.eu', 443,
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.https.multipart
+    ============================
+
+    ConPaaS core: streaming multipart/form-data encoding and parsing.
+
+    MultipartBody is a file-like request body generated part by part,
+    so that uploaded files are read from disk while they are sent
+    instead of being joined in memory. Its length is known in advance
+    to be sent as Content-Length.
+
+    parse_multipart reads a multipart/form-data body incrementally.
+    Uploaded files are spooled to temporary files once they get larger
+    than SPOOL_MAX_SIZE bytes, so memory use does not depend on the
+    size of the upload.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import os
+import cgi
+import mimetypes
+import tempfile
+
+BOUNDARY = '----------_BoUnDaRy_StRiNg_$'
+CRLF = '\r\n'
+
+# Bytes read from files and from the connection at a time
+CHUNK_SIZE = 64 * 1024
+
+# Uploaded files larger than this are spooled to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Maximum size of the headers of a part and of a regular form field
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class MultipartError(Exception):
+    """The multipart/form-data body is malformed."""
+    pass
+
+
+class MultipartBody(object):
+    """
+        File-like multipart/form-data body.
+
+        @param params A dictionary containing key:value pairs
+                      for regular form fields.
+
+        @param files A sequence of (name, filename, value) tuples for
+                     data to be uploaded as files. A value is either a
+                     string or a file object opened for reading, which
+                     is read from its current position while the body
+                     is sent.
+    """
+
+    def __init__(self, params, files):
+        self.content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
+        self._parts = []
+        for key in params:
+            self._parts.append(CRLF.join([
+                '--' + BOUNDARY,
+                'Content-Disposition: form-data; name="%s"' % key,
+                '',
+                str(params[key]) ]) + CRLF)
+        for (key, filename, value) in files:
+            # filenames may be unicode, the headers have to be plain
+            # strings
+            self._parts.append(CRLF.join([
+                '--' + BOUNDARY,
+                'Content-Disposition: form-data; name="%s"; filename="%s"' \
+                    % (key, filename.encode('ascii')),
+                'Content-Type: %s' % get_content_type(filename),
+                '',
+                '' ]))
+            if hasattr(value, 'read'):
+                self._parts.append((value, value.tell()))
+            else:
+                self._parts.append(value)
+            self._parts.append(CRLF)
+        self._parts.append('--' + BOUNDARY + '--' + CRLF)
+        self.rewind()
+
+    def __len__(self):
+        length = 0
+        for part in self._parts:
+            if isinstance(part, tuple):
+                fileobj, start = part
+                length += _file_size(fileobj) - start
+            else:
+                length += len(part)
+        return length
+
+    def rewind(self):
+        """Start the body over, e.g. to send it again."""
+        self._chunks = self._generate()
+        self._buffer = ''
+
+    def _generate(self):
+        for part in self._parts:
+            if isinstance(part, tuple):
+                fileobj, start = part
+                fileobj.seek(start)
+                chunk = fileobj.read(CHUNK_SIZE)
+                while chunk:
+                    yield chunk
+                    chunk = fileobj.read(CHUNK_SIZE)
+            elif part:
+                yield part
+
+    def read(self, size=-1):
+        data = [ self._buffer ]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = self._chunks.next()
+            except StopIteration:
+                break
+            data.append(chunk)
+            length += len(chunk)
+        data = ''.join(data)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def encode_multipart_formdata(params, files):
+    """
+        @return A tuple, (content_type, body), ready for
+                httplib.HTTP instance. The body is a MultipartBody.
+    """
+    body = MultipartBody(params, files)
+    return body.content_type, body
+
+
+def get_content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _file_size(fileobj):
+    try:
+        return os.fstat(fileobj.fileno()).st_size
+    except (AttributeError, OSError):
+        position = fileobj.tell()
+        fileobj.seek(0, 2)
+        size = fileobj.tell()
+        fileobj.seek(position)
+        return size
+
+
+class UploadedPart(object):
+    """
+        A part of a multipart/form-data body.
+
+        name: the name of the form field
+        filename: the name of the uploaded file, None for regular fields
+        value: the value of a regular field
+        file: a file object positioned at the start of the uploaded data
+    """
+
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.value = None
+        self.file = None
+
+
+def parse_multipart(fp, content_type, length):
+    """
+        Parse a multipart/form-data body of 'length' bytes read from
+        'fp'.
+
+        @param content_type The value of the Content-Type header, which
+                            holds the boundary
+
+        @return A list of UploadedPart in the order of the body
+
+        Raises MultipartError if the body is malformed.
+    """
+    ctype, pdict = cgi.parse_header(content_type)
+    boundary = pdict.get('boundary')
+    if ctype != 'multipart/form-data' or not boundary:
+        raise MultipartError('Missing multipart boundary')
+    parser = _MultipartParser(fp, boundary, length)
+    parts = list(parser.parts())
+    parser.drain()
+    return parts
+
+
+class _MultipartParser(object):
+
+    def __init__(self, fp, boundary, length):
+        self.fp = fp
+        self.remaining = length
+        # the body is parsed as if it started with a line break, so
+        # that every boundary is preceded by CRLF
+        self.buffer = CRLF
+        self.delimiter = CRLF + '--' + boundary
+
+    def _fill(self):
+        """Read more data into the buffer, return False at the end."""
+        if self.remaining <= 0:
+            return False
+        data = self.fp.read(min(CHUNK_SIZE, self.remaining))
+        if not data:
+            raise MultipartError('Unexpected end of body')
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def drain(self):
+        """Read and discard what is left of the body."""
+        while self._fill():
+            self.buffer = ''
+
+    def _skip_to_delimiter(self, sink=None):
+        """
+            Consume the buffer up to the next delimiter (included),
+            passing the data before it to 'sink'.
+        """
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if sink is not None:
+                    sink(self.buffer[:index])
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                return
+            # the end of the buffer may be the start of a delimiter
+            if len(self.buffer) > keep:
+                if sink is not None:
+                    sink(self.buffer[:-keep])
+                self.buffer = self.buffer[-keep:]
+            if not self._fill():
+                raise MultipartError('Missing closing boundary')
+
+    def _read_until(self, separator, limit):
+        while True:
+            index = self.buffer.find(separator)
+            if index >= 0:
+                data = self.buffer[:index]
+                self.buffer = self.buffer[index + len(separator):]
+                return data
+            if len(self.buffer) > limit:
+                raise MultipartError('Part headers too long')
+            if not self._fill():
+                raise MultipartError('Unexpected end of body')
+
+    def parts(self):
+        # the preamble is ignored
+        self._skip_to_delimiter()
+        while True:
+            while len(self.buffer) < 2 and self._fill():
+                pass
+            if self.buffer.startswith('--'):
+                # closing delimiter, the epilogue is ignored
+                return
+            line = self._read_until(CRLF, MAX_HEADER_SIZE)
+            if line.strip():
+                raise MultipartError('Invalid boundary line')
+            yield self._read_part()
+
+    def _read_part(self):
+        headers = {}
+        raw = self._read_until(CRLF + CRLF, MAX_HEADER_SIZE)
+        for line in raw.split(CRLF):
+            if not line:
+                continue
+            key, sep, value = line.partition(':')
+            if not sep:
+                raise MultipartError('Invalid part header: %s' % line)
+            headers[key.strip().lower()] = value.strip()
+
+        disposition, options = cgi.parse_header(
+            headers.get('content-disposition', ''))
+        if disposition != 'form-data' or 'name' not in options:
+            raise MultipartError('Invalid Content-Disposition')
+        part = UploadedPart(options['name'], options.get('filename'))
+
+        if part.filename is None:
+            data = []
+            size = [0]
+            def sink(chunk):
+                size[0] += len(chunk)
+                if size[0] > MAX_FIELD_SIZE:
+                    raise MultipartError('Field %s too large' % part.name)
+                data.append(chunk)
+            self._skip_to_delimiter(sink)
+            part.value = ''.join(data)
+        else:
+            part.file = tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE)
+            self._skip_to_delimiter(part.file.write)
+            part.file.seek(0)
+        return part
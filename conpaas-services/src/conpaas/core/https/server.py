@@ -23,6 +23,27 @@
     python libraries with a SSL.Connection object provided
     by the pyopenssl library.
 
+    Requests are served by a bounded pool of worker threads and
+    connections are kept alive (HTTP/1.1) between requests, so that a
+    slow call does not block the other callers. The number of workers
+    and the number of connections waiting for a free worker can be set
+    with the HTTPS_WORKERS and HTTPS_QUEUE_SIZE options in the 'manager'
+    or 'agent' section of the config file. With HTTPS_WORKERS = 0,
+    requests are served one at a time, one request per connection.
+    A kept-alive connection does not hold a worker while it is idle:
+    it is watched by a thread of its own until its next request.
+
+    The methods changing the state of a service (its POST and UPLOAD
+    methods, and the GET methods exposed with serialized=True) run one
+    at a time, as they did when the server served a single request at
+    a time. The other GET methods only read the state of the services
+    and run concurrently, so that status polls are not held up.
+
+    Files returned through HttpFileDownloadResponse are streamed in
+    chunks of FILE_CHUNK_SIZE bytes, so that large files are sent with
+    constant memory. A single byte range ('Range: bytes=first-last')
+    can be requested to resume or tail a download.
+
     :copyright: (C) 2010-2013 by Contrail Consortium.
 """
 
@@ -30,22 +51,31 @@ import socket
 import urlparse
 import httplib
 import json
-import cgi
 import os
 import sys
+import select
+import time
+import threading
 import traceback
+import Queue
 
 from SocketServer import BaseServer
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 from OpenSSL import SSL
 
 from conpaas.core import log
-from conpaas.core.expose import exposed_functions_http_methods
+from conpaas.core import rpcstats
+from conpaas.core.https import multipart
+from conpaas.core.expose import exposed_functions_http_methods, exposed_functions_serialized
 # from conpaas.core.expose import exposed_functions
 # from conpaas.core.services import manager_services
 from conpaas.core.services import agent_services
 
 
+# Bytes read from a file and written to the connection at a time
+FILE_CHUNK_SIZE = 64 * 1024
+
+
 class HttpError(Exception): pass
 
 
@@ -76,17 +106,180 @@ class HttpFileDownloadResponse(HttpResponse):
 
 
 class HTTPSServer(HTTPServer):
-    def __init__(self, server_address, handler, ctx):
+    """
+        HTTPS server handing every accepted connection to a pool of
+        'workers' threads. At most 'queue_size' connections wait for a
+        free worker, further connections are closed right away. With
+        workers=0, connections are served in the accepting thread.
+    """
+
+    # Seconds a kept-alive connection may stay idle between requests
+    keepalive_timeout = 15
+    # Idle kept-alive connections kept at most, the oldest are closed
+    max_idle_connections = 256
+
+    def __init__(self, server_address, handler, ctx, workers=8,
+                 queue_size=32):
         BaseServer.__init__(self, server_address, handler)
         self.socket = SSL.Connection(ctx, socket.socket(self.address_family,
                                                         self.socket_type))
         self.server_bind()
         self.server_activate()
+        self._start_workers(workers, queue_size)
+
+    def _start_workers(self, workers, queue_size):
+        self.workers = workers
+        self._requests = Queue.Queue(max(queue_size, 1))
+        self._worker_threads = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._process_requests)
+            worker.daemon = True
+            worker.start()
+            self._worker_threads.append(worker)
+
+        # idle kept-alive connection -> (client_address, idle since)
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._closing = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        if workers:
+            watcher = threading.Thread(target=self._watch_idle)
+            watcher.daemon = True
+            watcher.start()
+
+    def process_request(self, request, client_address):
+        if not self.workers:
+            return HTTPServer.process_request(self, request, client_address)
+        try:
+            self._requests.put_nowait((request, client_address))
+        except Queue.Full:
+            sys.stderr.write('Too many pending connections, dropping '
+                             'connection from %s\n' % (client_address, ))
+            sys.stderr.flush()
+            self.shutdown_request(request)
+
+    def _process_requests(self):
+        while True:
+            request, client_address = self._requests.get()
+            if request is None:
+                return
+            keep_alive = False
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                keep_alive = not handler.close_connection
+            except:
+                self.handle_error(request, client_address)
+            if keep_alive:
+                self._keep_idle(request, client_address)
+                continue
+            try:
+                self.shutdown_request(request)
+            except:
+                pass
+
+    def _keep_idle(self, request, client_address):
+        """
+        Watch a kept-alive connection until its next request, without
+        holding a worker.
+        """
+        oldest = None
+        self._idle_lock.acquire()
+        try:
+            self._idle[request] = (client_address, time.time())
+            if len(self._idle) > self.max_idle_connections:
+                oldest = min(self._idle, key=lambda conn: self._idle[conn][1])
+                del self._idle[oldest]
+        finally:
+            self._idle_lock.release()
+        if oldest is not None:
+            self._close_idle(oldest)
+        os.write(self._wakeup_w, 'x')
+
+    def _take_idle(self, request):
+        self._idle_lock.acquire()
+        try:
+            return self._idle.pop(request, (None, None))[0]
+        finally:
+            self._idle_lock.release()
+
+    def _close_idle(self, request):
+        try:
+            self.shutdown_request(request)
+        except:
+            pass
+
+    def _watch_idle(self):
+        """
+        Hand the idle kept-alive connections to the workers when their
+        next request arrives, and close the ones idle for longer than
+        keepalive_timeout.
+        """
+        while not self._closing:
+            self._idle_lock.acquire()
+            try:
+                idle = self._idle.items()
+            finally:
+                self._idle_lock.release()
+
+            now = time.time()
+            timeout = None
+            watched = [ self._wakeup_r ]
+            for request, (client_address, since) in idle:
+                left = since + self.keepalive_timeout - now
+                if left <= 0:
+                    if self._take_idle(request) is not None:
+                        self._close_idle(request)
+                else:
+                    watched.append(request)
+                    timeout = left if timeout is None else min(timeout, left)
+
+            try:
+                readable, _, _ = select.select(watched, [], [], timeout)
+            except (select.error, socket.error, SSL.Error):
+                # a connection closed by the client, watch the others
+                for request in watched[1:]:
+                    try:
+                        select.select([ request ], [], [], 0)
+                    except (select.error, socket.error, SSL.Error):
+                        if self._take_idle(request) is not None:
+                            self._close_idle(request)
+                continue
+
+            for request in readable:
+                if request is self._wakeup_r:
+                    os.read(self._wakeup_r, 4096)
+                    continue
+                client_address = self._take_idle(request)
+                if client_address is not None:
+                    self.process_request(request, client_address)
+
+        self._idle_lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._idle_lock.release()
+        for request in idle:
+            self._close_idle(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self._closing = True
+        os.write(self._wakeup_w, 'x')
+        for _ in self._worker_threads:
+            self._requests.put((None, None))
 
     def shutdown_request(self, request):
         request.shutdown()
 
 
+def _serialized(http_method, callback):
+    """Whether the method 'callback' changes the state of its service."""
+    closure = getattr(callback, 'func_closure', None)
+    if closure and id(closure[0].cell_contents) in exposed_functions_serialized:
+        return exposed_functions_serialized[id(closure[0].cell_contents)]
+    return http_method != 'GET'
+
+
 class ConpaasRequestHandlerComponent(object):
     def __init__(self):
         self.exposed_functions = {}
@@ -112,6 +305,10 @@ class ConpaasSecureServer(HTTPSServer):
     It maps HTTP requests to functions implemented in the manager or
     agent class through the _register_method function.
 
+    The number of calls, the number of errors and the latencies of
+    every method are recorded in rpc_stats and returned by the
+    built-in 'get_rpc_stats' GET method of service 0.
+
     '''
 
     def __init__(self, server_address, config_parser, role, **kwargs):
@@ -119,6 +316,14 @@ class ConpaasSecureServer(HTTPSServer):
         self.instances = {}
         self.config_parser = config_parser
         self.callback_dict = {'GET': {}, 'POST': {}, 'UPLOAD': {}}
+        # (http_method, service_id, func_name) -> callback
+        self.dispatch_table = {}
+        # (http_method, service_id, func_name) of the methods changing the
+        # state of their service, which run one at a time
+        self.serialized_methods = set()
+        # service_id -> lock serializing its methods
+        self.service_locks = {}
+        self.rpc_stats = rpcstats.RPCStats()
 
         if role == 'manager':
             from conpaas.core.manager import ApplicationManager
@@ -153,20 +358,52 @@ class ConpaasSecureServer(HTTPSServer):
         for http_method in handler_exposed_functions:
             for func_name in handler_exposed_functions[http_method]:
                 self._register_method(http_method, 0, func_name, handler_exposed_functions[http_method][func_name])
+        self._register_method('GET', 0, 'get_rpc_stats', self.get_rpc_stats)
 
         # Start the HTTPS server
         ctx = self._conpaas_init_ssl_ctx(role, config_parser.get(role, 'CERT_DIR'), SSL.SSLv23_METHOD)
-        HTTPSServer.__init__(self, server_address, ConpaasRequestHandler, ctx)
+        workers = 8
+        if config_parser.has_option(role, 'HTTPS_WORKERS'):
+            workers = config_parser.getint(role, 'HTTPS_WORKERS')
+        queue_size = 32
+        if config_parser.has_option(role, 'HTTPS_QUEUE_SIZE'):
+            queue_size = config_parser.getint(role, 'HTTPS_QUEUE_SIZE')
+        HTTPSServer.__init__(self, server_address, ConpaasRequestHandler, ctx,
+                             workers, queue_size)
 
 
     def _register_method(self, http_method, service_id, func_name, callback):
         if service_id not in self.callback_dict[http_method]:
             self.callback_dict[http_method][service_id] = {}
         self.callback_dict[http_method][service_id][func_name] = callback
+        self.dispatch_table[(http_method, service_id, func_name)] = callback
+        if _serialized(http_method, callback):
+            self.serialized_methods.add((http_method, service_id, func_name))
+        if service_id not in self.service_locks:
+            self.service_locks[service_id] = threading.RLock()
 
     def _deregister_methods(self, service_id):
         for http_method in self.callback_dict:
-            del self.callback_dict[http_method][service_id]
+            if service_id in self.callback_dict[http_method]:
+                del self.callback_dict[http_method][service_id]
+        for key in self.dispatch_table.keys():
+            if key[1] == service_id:
+                del self.dispatch_table[key]
+                self.serialized_methods.discard(key)
+
+    def get_rpc_stats(self, kwargs):
+        """Return the call statistics of every service (or only of
+        'service', if given) and reset them if 'reset' is true."""
+        service_id = kwargs.get('service')
+        if service_id is not None:
+            try:
+                service_id = int(service_id)
+            except (TypeError, ValueError):
+                return HttpErrorResponse("'service' should be an integer")
+        stats = self.rpc_stats.summary(service_id)
+        if kwargs.get('reset'):
+            self.rpc_stats.reset()
+        return HttpJsonResponse(stats)
 
     # def _register_method(self, http_method, func_name, callback):
     #     self.callback_dict[http_method][func_name] = callback
@@ -275,6 +512,8 @@ class ConpaasSecureServer(HTTPSServer):
         ctx.load_verify_locations(ca_cert_file)
         ctx.set_verify(SSL.VERIFY_PEER|SSL.VERIFY_FAIL_IF_NO_PEER_CERT,
                        verify_callback)
+        # required to let clients resume their SSL sessions
+        ctx.set_session_id('conpaas-%s' % role)
 
         return ctx
 
@@ -298,6 +537,12 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
                           'application/jsonrequest']
     MULTIPART_CONTENT_TYPE = 'multipart/form-data'
 
+    # keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # buffer the status line and headers, they are flushed after
+    # every response
+    wbufsize = -1
+
     def setup(self):
         """
         Overriding StreamRequestHandler.setup() in SocketServer.py
@@ -310,6 +555,23 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
         self.rfile = socket._fileobject(self.request, "rb", self.rbufsize)
         self.wfile = socket._fileobject(self.request, "wb", self.wbufsize)
 
+    def handle(self):
+        """
+        Handle the requests already received on the connection. Unless
+        close_connection is set, the server then watches the connection
+        for the next requests.
+        """
+        self.close_connection = 1
+        self.handle_one_request()
+        self.wfile.flush()
+        while not self.close_connection and self._request_received():
+            self.handle_one_request()
+            self.wfile.flush()
+
+    def _request_received(self):
+        # data read from the connection that would be lost with rfile
+        return self.rfile._rbuf.tell() or self.request.pending()
+
     def handle_one_request(self):
         '''
         Handle a single HTTP request.
@@ -320,12 +582,19 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
 
         '''
 
-        self.raw_requestline = self.rfile.readline()
+        try:
+            self.raw_requestline = self.rfile.readline()
+        except (SSL.ZeroReturnError, SSL.SysCallError, socket.error):
+            # connection closed by the client
+            self.raw_requestline = ''
         if not self.raw_requestline:
             self.close_connection = 1
             return
         if not self.parse_request(): # An error code has been sent, just exit
             return
+        if not self.server.workers:
+            # a kept-alive connection would block all the other clients
+            self.close_connection = 1
         parsed_url = urlparse.urlparse(self.path)
         # we allow calls to / only
         if parsed_url.path != '/':
@@ -352,9 +621,15 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
 
     def _handle_post(self):
         if self.headers['content-type'] in self.JSON_CONTENT_TYPES:
-            self._dispatch('POST', self._parse_jsonrpc_post_params())
+            params = self._parse_jsonrpc_post_params()
+            if isinstance(params, list):
+                self._dispatch_batch(params)
+            else:
+                self._dispatch('POST', params)
         elif self.headers['content-type'].startswith(self.MULTIPART_CONTENT_TYPE):
-            self._dispatch('UPLOAD', self._parse_upload_params())
+            params = self._parse_upload_params()
+            if params is not None:
+                self._dispatch('UPLOAD', params)
         else:
             self.send_error(httplib.UNSUPPORTED_MEDIA_TYPE)
 
@@ -378,37 +653,53 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
         return params
 
     def _parse_upload_params(self):
-        post_data = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD': 'POST'})
+        '''Parse a multipart/form-data body. Uploaded files are spooled
+        to temporary files, so they are never held in memory as a whole.
+        Returns None (after sending an error) if the body is invalid.'''
+        length = self.headers.get('content-length', '')
+        if not length.isdigit():
+            self.send_error(httplib.LENGTH_REQUIRED)
+            return None
+        try:
+            parts = multipart.parse_multipart(self.rfile,
+                                              self.headers['content-type'],
+                                              int(length))
+        except multipart.MultipartError, e:
+            # the rest of the body cannot be told from the next request
+            self.close_connection = 1
+            self.send_error(httplib.BAD_REQUEST, str(e))
+            return None
         params = {}
         # get rid of repeated params, pick the last one
-        if post_data.list:
-            for k in post_data.keys():
-                if isinstance(post_data[k], list): record = post_data[k][-1]
-                else: record = post_data[k]
-                if record.filename == None:
-                    params[record.name] = record.value
-                else:
-                    params[record.name] = FileUploadField(record.filename, record.file)
+        for part in parts:
+            if part.filename is None:
+                params[part.name] = part.value
+            else:
+                params[part.name] = FileUploadField(part.filename, part.file)
         return params
 
     def _dispatch(self, callback_type, params):
         if 'service_id' not in params:
             self.send_service_missing(callback_type, params)
             return
-        if int(params['service_id']) not in self.server.callback_dict[callback_type]:
+        try:
+            callback_service_id = int(params.pop('service_id'))
+        except (TypeError, ValueError):
+            callback_service_id = None
+        if callback_service_id not in self.server.callback_dict[callback_type]:
             self.send_service_not_found(callback_type, params)
             return
 
-        callback_service_id = int(params.pop('service_id'))
-
         if 'method' not in params:
             self.send_method_missing(callback_type, params)
             return
-        if params['method'] not in self.server.callback_dict[callback_type][callback_service_id]:
+        callback_name = params.pop('method')
+        callback = self.server.dispatch_table.get(
+            (callback_type, callback_service_id, callback_name))
+        if callback is None:
             self.send_method_not_found(callback_type, params)
             return
 
-        callback_name = params.pop('method')
         callback_params = {}
         if callback_type != 'UPLOAD':
             if 'params' in params:
@@ -419,7 +710,7 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
             request_id = 1
         try:
             # response = self._do_dispatch(callback_type, callback_name, callback_params)
-            response = self._do_dispatch(callback_type, callback_service_id, callback_name, callback_params)
+            response = self._do_dispatch(callback_type, callback, callback_service_id, callback_name, callback_params)
             if isinstance(response, HttpFileDownloadResponse):
                 self.send_file_response(httplib.OK, response.file,{'Content-disposition': 'attachement; filename="%s"' % (response.filename)})
             elif isinstance(response, HttpErrorResponse):
@@ -434,33 +725,205 @@ class ConpaasRequestHandler(BaseHTTPRequestHandler):
             sys.stderr.write(errmsg + '\n')
             sys.stderr.flush()
 
+    def _dispatch_batch(self, requests):
+        '''
+        Dispatch a JSON-RPC batch: every request of the array is
+        dispatched in turn and the response is the array of their
+        results. Requests without an 'id' are notifications and get no
+        result. As there is no HTTP method per request, each method is
+        looked up among the POST and then the GET methods.
+        '''
+        if not requests:
+            self.send_custom_response(httplib.OK,
+                    json.dumps({'error': 'Empty batch', 'id': None}))
+            return
+
+        results = []
+        for request in requests:
+            result = self._dispatch_batch_request(request)
+            if not isinstance(request, dict) or 'id' in request:
+                results.append(result)
+        self.send_custom_response(httplib.OK, json.dumps(results))
+
+    def _dispatch_batch_request(self, request):
+        if not isinstance(request, dict):
+            return {'error': 'Invalid request', 'id': None}
+
+        request_id = request.get('id')
+        if 'service_id' not in request:
+            return {'error': 'Did not specify service', 'id': request_id}
+        if 'method' not in request:
+            return {'error': 'Did not specify method', 'id': request_id}
+
+        try:
+            callback_service_id = int(request['service_id'])
+        except (TypeError, ValueError):
+            callback_service_id = None
+        callback_name = request['method']
+        callback_params = request.get('params', {})
+        for callback_type in ('POST', 'GET'):
+            callback = self.server.dispatch_table.get(
+                (callback_type, callback_service_id, callback_name))
+            if callback is not None:
+                break
+        else:
+            if not [ services for services in self.server.callback_dict.values()
+                     if callback_service_id in services ]:
+                return {'error': 'Service not found', 'id': request_id}
+            return {'error': 'Method not found', 'id': request_id}
+
+        try:
+            response = self._do_dispatch(callback_type, callback, callback_service_id, callback_name, callback_params)
+        except:
+            errmsg = 'Error when calling method %s on service %s with params %s: %s' \
+                    % (callback_name, callback_service_id, callback_params, traceback.format_exc())
+            sys.stderr.write(errmsg + '\n')
+            sys.stderr.flush()
+            return {'error': errmsg, 'id': request_id}
+
+        if isinstance(response, HttpErrorResponse):
+            return {'error': response.message, 'id': request_id}
+        elif isinstance(response, HttpJsonResponse):
+            return {'result': response.obj, 'error': None, 'id': request_id}
+        return {'error': 'Method %s cannot be called in a batch' % callback_name,
+                'id': request_id}
+
     # def _do_dispatch(self, callback_type, callback_name, params):
         # return self.server.callback_dict[callback_type][callback_name](self.server.instance, params)
 
-    def _do_dispatch(self, callback_type, callback_service_id, callback_name, params):
-        return self.server.callback_dict[callback_type][callback_service_id][callback_name](params)
+    def _do_dispatch(self, callback_type, callback, callback_service_id, callback_name, params):
+        lock = None
+        if (callback_type, callback_service_id, callback_name) in self.server.serialized_methods:
+            lock = self.server.service_locks.get(callback_service_id)
+        if lock is not None:
+            lock.acquire()
+        start = time.time()
+        error = True
+        try:
+            response = callback(params)
+            error = isinstance(response, HttpErrorResponse)
+            return response
+        finally:
+            if lock is not None:
+                lock.release()
+            self.server.rpc_stats.record(callback_service_id, callback_name,
+                                         time.time() - start, error)
 
     def send_custom_response(self, code, body=None):
         '''Convenience method to send a custom HTTP response.
         code: HTTP Response code.
         body: Optional HTTP response content.
         '''
+        if body is None:
+            body = ''
         self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
         self.end_headers()
-        if body != None:
-            print >>self.wfile, body,
+        self.wfile.write(body)
+        self.wfile.flush()
 
     def send_file_response(self, code, filename, headers=None):
-        fd = open(filename)
-        stat = os.fstat(fd.fileno())
-        self.send_response(code)
-        for h in headers:
-            self.send_header(h, headers[h])
-        self.send_header('Content-length', stat.st_size)
-        self.end_headers()
-        while fd.tell() != stat.st_size:
-            print >>self.wfile, fd.read(),
-        fd.close()
+        '''Stream the contents of a file as the HTTP response.
+        code: HTTP Response code.
+        filename: Path of the file to send.
+        headers: Optional dict of additional HTTP headers.
+
+        The file is sent in chunks of FILE_CHUNK_SIZE bytes. If the
+        request has a satisfiable 'Range: bytes=...' header, only that
+        byte range is sent with a 206 (Partial Content) response.
+        '''
+        fd = open(filename, 'rb')
+        try:
+            size = os.fstat(fd.fileno()).st_size
+            try:
+                byte_range = self._parse_range(self.headers.get('range'), size)
+            except HttpError:
+                self.send_response(httplib.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.send_header('Content-Length', '0')
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.flush()
+                return
+
+            if byte_range is None:
+                first, last = 0, size - 1
+            else:
+                code = httplib.PARTIAL_CONTENT
+                first, last = byte_range
+            self.send_response(code)
+            for h in headers or {}:
+                self.send_header(h, headers[h])
+            self.send_header('Accept-Ranges', 'bytes')
+            if byte_range is not None:
+                self.send_header('Content-Range',
+                                 'bytes %d-%d/%d' % (first, last, size))
+            self.send_header('Content-Length', str(last - first + 1))
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+
+            try:
+                fd.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = fd.read(min(FILE_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # the file was truncated while being sent
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                self.wfile.flush()
+            except (SSL.Error, socket.error):
+                # the client went away, the response cannot be completed
+                self.close_connection = 1
+                return
+            if remaining > 0:
+                # less data than announced, the client must not reuse
+                # the connection
+                self.close_connection = 1
+        finally:
+            fd.close()
+
+    def _parse_range(self, header, size):
+        '''Parse the value of a Range header for a file of 'size' bytes.
+
+        Returns the (first, last) byte positions of the requested range,
+        or None if the whole file has to be sent (no header, an invalid
+        header or several ranges). Raises HttpError if the range cannot
+        be satisfied.
+        '''
+        if not header:
+            return None
+        unit, _, spec = header.strip().partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+        first, sep, last = spec.strip().partition('-')
+        try:
+            if not sep:
+                return None
+            if not first:
+                # suffix range: the last 'last' bytes
+                length = int(last)
+                if length <= 0 or size == 0:
+                    raise HttpError('Range not satisfiable')
+                return max(size - length, 0), size - 1
+            first = int(first)
+            if last:
+                last = min(int(last), size - 1)
+            else:
+                last = size - 1
+        except ValueError:
+            return None
+        if first < 0 or first > last:
+            if first < size:
+                # e.g. 'bytes=5-2', a syntactically invalid range
+                return None
+            raise HttpError('Range not satisfiable')
+        return first, last
 
     def send_method_missing(self, method, params):
         self.send_custom_response(httplib.BAD_REQUEST, 'Did not specify method')
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.latency
+    ====================
+
+    ConPaaS core: mergeable histograms of response times.
+
+    A LatencyHistogram answers percentiles with a relative error of at
+    most 'accuracy'. The values are counted in buckets whose bounds grow
+    geometrically, so a histogram stays small (a few hundred buckets from
+    microseconds to minutes) however many values it holds, and the
+    histograms of several nodes or intervals are merged by adding up
+    their buckets.
+
+    Histograms travel between the nodes and the manager as the plain
+    dicts of to_dict() and from_dict(). A node may export the histogram
+    of all the values since it started: the values of an interval are
+    then the difference() between two exports.
+
+    This module only depends on the standard library, as it is also
+    installed next to the Ganglia modules of the agents.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import math
+
+DEFAULT_ACCURACY = 0.01
+
+# values counted as zeros, too small for the buckets
+MIN_VALUE = 1e-9
+
+
+class LatencyHistogram(object):
+
+    def __init__(self, accuracy=DEFAULT_ACCURACY):
+        if not 0 < accuracy < 1:
+            raise ValueError('Invalid accuracy %s' % accuracy)
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value, count=1):
+        self.count += count
+        self.total += value * count
+        if value <= MIN_VALUE:
+            self.zeros += count
+        else:
+            key = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def _check_accuracy(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Histograms of different accuracies: %s and %s'
+                             % (self.accuracy, other.accuracy))
+
+    def merge(self, other):
+        """Add the values of other to this histogram."""
+        self._check_accuracy(other)
+        self.count += other.count
+        self.total += other.total
+        self.zeros += other.zeros
+        for key, n in other.buckets.iteritems():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def difference(self, earlier):
+        """
+        Return the histogram of the values added since this histogram was
+        'earlier', or None if it holds values that are no longer here (the
+        histograms do not come from the same series).
+        """
+        self._check_accuracy(earlier)
+        result = LatencyHistogram(self.accuracy)
+        result.count = self.count - earlier.count
+        result.total = max(self.total - earlier.total, 0.0)
+        result.zeros = self.zeros - earlier.zeros
+        if result.count < 0 or result.zeros < 0:
+            return None
+        for key, n in earlier.buckets.iteritems():
+            if self.buckets.get(key, 0) < n:
+                return None
+        for key, n in self.buckets.iteritems():
+            n -= earlier.buckets.get(key, 0)
+            if n:
+                result.buckets[key] = n
+        return result
+
+    def copy(self):
+        result = LatencyHistogram(self.accuracy)
+        result.merge(self)
+        return result
+
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, p):
+        """The value at percentile p (0-100), 0 for an empty histogram."""
+        if self.count == 0:
+            return 0
+        rank = int(math.ceil(p / 100.0 * self.count)) or 1
+        if rank <= self.zeros:
+            return 0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                break
+        # the middle of the bucket, in relative terms
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def to_dict(self):
+        # JSON objects only have string keys
+        return { 'accuracy': self.accuracy,
+                 'count': self.count,
+                 'total': self.total,
+                 'zeros': self.zeros,
+                 'buckets': dict((str(key), n)
+                                 for key, n in self.buckets.iteritems()) }
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['accuracy'])
+        result.count = data['count']
+        result.total = data['total']
+        result.zeros = data['zeros']
+        result.buckets = dict((int(key), n)
+                              for key, n in data['buckets'].iteritems())
+        return result
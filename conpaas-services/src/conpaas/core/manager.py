@@ -21,6 +21,7 @@ import json, httplib
 
 from conpaas.core import git
 from conpaas.core import https
+from conpaas.core import fanout
 from conpaas.core.log import create_logger, create_standalone_logger
 from conpaas.core.expose import expose
 from conpaas.core.callbacker import DirectorCallbacker
@@ -73,6 +74,9 @@ class BaseManager(ConpaasRequestHandlerComponent):
 
     AGENT_PORT = 5555
 
+    # Maximum number of agents called in parallel by _call_agents
+    AGENT_CALL_WORKERS = fanout.DEFAULT_MAX_WORKERS
+
     def __init__(self, config_parser):
         ConpaasRequestHandlerComponent.__init__(self)
 
@@ -133,6 +137,31 @@ class BaseManager(ConpaasRequestHandlerComponent):
                 raise Exception("Wrong node type '%s' for service type '%s'."
                                 % (role, self.get_service_type()))
 
+    def _call_agents(self, func, nodes, errmsg, required=fanout.REQUIRE_ALL,
+                     timeout=None, error_state=True):
+        """Call func(node) for all the nodes in parallel.
+
+        Every failure is logged with the message 'errmsg' % node. If the
+        failures are not acceptable according to 'required' (see
+        conpaas.core.fanout), the service goes into the ERROR state (unless
+        'error_state' is False) and the error of the first failed node is
+        raised.
+
+        Returns a dict mapping the nodes to the results of their calls."""
+        outcome = fanout.call_nodes(func, nodes, self.AGENT_CALL_WORKERS,
+                                    timeout)
+        for node in outcome.failed_nodes():
+            self.logger.error('%s: %s' % (errmsg % node,
+                outcome.tracebacks.get(node, outcome.errors[node])))
+        try:
+            outcome.check(required)
+        except:
+            if error_state:
+                self.state_set(self.S_ERROR,
+                               msg=errmsg % outcome.failed_nodes()[0])
+            raise
+        return outcome.results
+
     def check_credits(self):
         credit = self.callbacker.get_credit()
         if credit['credit'] <= 0:
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+    conpaas.core.rpcstats
+    =====================
+
+    ConPaaS core: per-method statistics of the calls served by a
+    manager or an agent.
+
+    For every (service_id, method) pair, RPCStats counts the calls and
+    the errors and keeps a histogram of the latencies. Histogram buckets
+    grow geometrically (by a factor 2^(1/4), from 0.1 ms to several
+    minutes), so memory use is constant and the reported percentiles
+    are within 20% of the exact ones.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import bisect
+import threading
+
+# Upper bounds (in seconds) of the latency buckets
+BUCKET_BOUNDS = [ 0.0001 * 2 ** (i / 4.0) for i in range(88) ]
+
+PERCENTILES = (50, 95, 99)
+
+
+class MethodStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # the last bucket holds the latencies above all the bounds
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def record(self, seconds, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += seconds
+        if seconds > self.max_time:
+            self.max_time = seconds
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile."""
+        rank = self.calls * percent / 100.0
+        count = 0
+        for index, bucket in enumerate(self.buckets):
+            count += bucket
+            if bucket and count >= rank:
+                if index == len(BUCKET_BOUNDS):
+                    return self.max_time
+                return min(BUCKET_BOUNDS[index], self.max_time)
+        return self.max_time
+
+    def summary(self):
+        summary = { 'calls': self.calls,
+                    'errors': self.errors,
+                    'mean': self.total_time / self.calls if self.calls else 0.0,
+                    'max': self.max_time }
+        for percent in PERCENTILES:
+            summary['p%d' % percent] = self.percentile(percent)
+        return summary
+
+
+class RPCStats(object):
+    """
+        Thread-safe registry of MethodStats. Latencies are in seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def record(self, service_id, method, seconds, error=False):
+        self._lock.acquire()
+        try:
+            key = (service_id, method)
+            stats = self._methods.get(key)
+            if stats is None:
+                stats = self._methods[key] = MethodStats()
+            stats.record(seconds, error)
+        finally:
+            self._lock.release()
+
+    def summary(self, service_id=None):
+        """
+            @return A dict mapping every service_id (or only the given
+                    one) to a dict mapping its called methods to their
+                    calls, errors, mean, max, p50, p95 and p99
+                    latencies.
+        """
+        self._lock.acquire()
+        try:
+            summary = {}
+            for (sid, method), stats in self._methods.items():
+                if service_id is not None and sid != service_id:
+                    continue
+                summary.setdefault(sid, {})[method] = stats.summary()
+            return summary
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._methods = {}
+        finally:
+            self._lock.release()
@@ -1,5 +1,6 @@
 import json
 import memcache
+import time
 
 class EdgeLocation:
 
@@ -53,6 +54,11 @@ class NetworkSnapshot:
         self.edge_locations = []
         self.mc = memcache.Client(['127.0.0.1:11211'])
         self.MEMCACHE_KEY = 'snapshot'
+        self.MEMCACHE_TTL = 3600 # seconds
+        # an unchanged snapshot is written again before it expires
+        self.MEMCACHE_REFRESH = 600 # seconds
+        self.saved_json = None
+        self.saved_time = 0
 
     def clear(self):
         self.edge_locations = []
@@ -73,7 +79,14 @@ class NetworkSnapshot:
         objs = []
         for edge_location in self.edge_locations:
             objs.append(edge_location.__dict__)
-        self.mc.set(self.MEMCACHE_KEY, json.dumps(objs), 3600)
+        json_data = json.dumps(objs)
+        now = time.time()
+        if json_data == self.saved_json and \
+                now - self.saved_time < self.MEMCACHE_REFRESH:
+            return
+        if self.mc.set(self.MEMCACHE_KEY, json_data, self.MEMCACHE_TTL):
+            self.saved_json = json_data
+            self.saved_time = now
 
     def __str__(self):
         return str(self.edge_locations)
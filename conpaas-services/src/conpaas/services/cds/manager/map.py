@@ -1,30 +1,71 @@
 
+import heapq
 import memcache
-import sys
+import time
+from collections import deque
 
 from edge import EdgeLocation
 
 
 class GlobalMap:
 
-    def __init__(self, map_filename):
+    # how to measure the distance between two countries: the number of
+    # borders crossed, or the sum of the latencies (ms) given in the map
+    WEIGHTINGS = ('hops', 'latency')
+
+    MEMCACHE_TTL = 900 # seconds
+    # unchanged keys are written again before they expire
+    MEMCACHE_REFRESH = 300 # seconds
+
+    def __init__(self, map_filename, weighting='hops'):
+        if not weighting in self.WEIGHTINGS:
+            raise Exception('Unknown weighting "%s", expected one of %s'
+                            % (weighting, ', '.join(self.WEIGHTINGS)))
+        self.weighting = weighting
         self.map = {}
+        self.latency = {}
         self.load_map(map_filename)
         self.null_edge = EdgeLocation('', '', [])
+        self.dist = None
+        # edge locations by country, as of the last assignment
+        self.by_country = {}
+        # the country of the nearest edge locations, for each country
+        self.nearest = dict.fromkeys(self.map)
+        self.edge_map = dict.fromkeys(self.map, self.null_edge)
+        # countries whose edge location is not in memcache yet
+        self.changed = set(self.map)
+        self.mc = memcache.Client(['127.0.0.1:11211'])
+        self.memcache_time = 0
 
-    def add_neighbors(self, u, v):
+    def add_neighbors(self, u, v, latency=None):
         if not u in self.map:
             self.map[u] = set()
         if not v in self.map[u]:
             self.map[u].add(v)
+        if latency is not None:
+            self.latency[(u, v)] = latency
 
     def load_map(self, map_filename):
+        # each line holds two neighboring countries, and optionally the
+        # latency between them
         self.map = {}
+        self.latency = {}
         f = open(map_filename, 'r')
         for line in f.readlines():
-            (u, v) = line.split()
-            self.add_neighbors(u, v)
-            self.add_neighbors(v, u)
+            fields = line.split()
+            if not fields:
+                continue
+            (u, v) = fields[:2]
+            if len(fields) > 2:
+                latency = float(fields[2])
+            elif self.weighting == 'latency':
+                raise Exception('No latency between %s and %s in "%s"'
+                                % (u, v, map_filename))
+            else:
+                latency = None
+            self.add_neighbors(u, v, latency)
+            self.add_neighbors(v, u, latency)
+        f.close()
 
     def check_connectivity(self):
         visited = {}
@@ -34,10 +75,10 @@ class GlobalMap:
             if not src:
                 src = country
         # visit countries with a BFS
-        queue = [src]
+        queue = deque([src])
         visited[src] = True
         while queue:
-            country = queue.pop(0)
+            country = queue.popleft()
             for neighbor in self.map[country]:
                 if not visited[neighbor]:
                     queue.append(neighbor)
@@ -47,51 +88,127 @@ class GlobalMap:
                 raise Exception('Countries map does not have connectivity: '
                                 '%s unreachable' % (country))
 
+    def weight(self, u, v):
+        if self.weighting == 'latency':
+            return self.latency[(u, v)]
+        return 1
+
+    def shortest_paths(self, src):
+        # Dijkstra, which visits the countries in BFS order for hops
+        dist = {src: 0}
+        heap = [(0, src)]
+        while heap:
+            (d, country) = heapq.heappop(heap)
+            if d > dist[country]:
+                continue
+            for neighbor in self.map[country]:
+                nd = d + self.weight(country, neighbor)
+                if not neighbor in dist or nd < dist[neighbor]:
+                    dist[neighbor] = nd
+                    heapq.heappush(heap, (nd, neighbor))
+        return dist
+
+    def compute_distances(self):
+        # the map does not change, so the distances between all the
+        # countries are computed once
+        self.dist = {}
+        for country in self.map.iterkeys():
+            self.dist[country] = self.shortest_paths(country)
+
+    def closer(self, src, other, country):
+        # whether the edge locations in src are nearer to country than those
+        # in other; ties go to the first country by name, so that the
+        # assignment does not depend on the order of the updates
+        if other is None:
+            return True
+        return ((self.dist[src][country], src) <
+                (self.dist[other][country], other))
+
+    def find_nearest(self, country):
+        nearest = None
+        for src in self.by_country:
+            if src in self.dist[country] and \
+                    self.closer(src, nearest, country):
+                nearest = src
+        return nearest
+
     def assign_edge_locations(self, edge_locations):
+        if self.dist is None:
+            self.compute_distances()
         # group edge locations by country
         by_country = {}
         for node in edge_locations:
+            if not node.country in self.map:
+                continue
             if not node.country in by_country:
                 by_country[node.country] = []
             by_country[node.country].append(node)
-        # init the BFS parameters
-        dist = {}
-        parent = {}
-        for country in self.map.iterkeys():
-            dist[country] = sys.maxint
-            parent[country] = None
-        queue = []
-        for country in by_country:
-            queue.append(country)
-            dist[country] = 0
-            parent[country] = country
-        while queue:
-            country = queue.pop(0)
-            for neighbor in self.map[country]:
-                if dist[neighbor] > dist[country] + 1:
-                    dist[neighbor] = dist[country] + 1;
-                    parent[neighbor] = parent[country]
-                    queue.append(neighbor)
-        # assign an edge location to each country
-        self.edge_map = {}
+        for nodes in by_country.itervalues():
+            nodes.sort()
+        # countries where edge locations joined or left
+        updated = set()
+        for country in set(by_country) | set(self.by_country):
+            if by_country.get(country) != self.by_country.get(country):
+                updated.add(country)
+        if not updated:
+            return
+        self.by_country = by_country
+        # reassign the countries whose nearest edge locations left, or that
+        # are nearer to edge locations that joined
+        joined = [ src for src in updated if src in by_country ]
+        affected = set()
         for country in self.map.iterkeys():
-            if parent[country]:
-                el = by_country[parent[country]]
-                self.edge_map[country] = el[0]
-                if len(el) > 1:
-                    el.append(el.pop(0))
+            if self.nearest[country] in updated:
+                affected.add(country)
             else:
-                # if there is no edge location
-                self.edge_map[country] = self.null_edge
+                for src in joined:
+                    if src in self.dist[country] and \
+                            self.closer(src, self.nearest[country], country):
+                        affected.add(country)
+                        break
+        reassigned = set(updated)
+        for country in affected:
+            reassigned.add(self.nearest[country])
+            self.nearest[country] = self.find_nearest(country)
+            reassigned.add(self.nearest[country])
+        # spread the countries served by each updated country over its edge
+        # locations
+        served = {}
+        for country in sorted(self.map):
+            src = self.nearest[country]
+            if src is not None and src in reassigned:
+                if not src in served:
+                    served[src] = []
+                served[src].append(country)
+        for country in affected:
+            if self.nearest[country] is None:
+                self.set_edge(country, self.null_edge)
+        for (src, countries) in served.iteritems():
+            nodes = by_country[src]
+            for i, country in enumerate(countries):
+                self.set_edge(country, nodes[i % len(nodes)])
+
+    def set_edge(self, country, edge):
+        if edge.address != self.edge_map[country].address:
+            self.changed.add(country)
+        self.edge_map[country] = edge
 
     def update_memcache(self):
-        mc = memcache.Client(['127.0.0.1:11211'])
+        # only the changed keys are written, except for a periodic refresh
+        # of all the keys before they expire
+        now = time.time()
+        if now - self.memcache_time >= self.MEMCACHE_REFRESH:
+            countries = self.edge_map.keys()
+            self.memcache_time = now
+        elif self.changed:
+            countries = self.changed
+        else:
+            return
         data = {}
-        for country in self.edge_map:
+        for country in countries:
             data[country] = self.edge_map[country].address
-        mc.set_multi(data, 900)
+        # the keys not stored are written again next time
+        self.changed = set(self.mc.set_multi(data, self.MEMCACHE_TTL))
 
     def __str__(self):
         return str(self.map)
-
-
@@ -12,15 +12,18 @@ from map import GlobalMap
 
 class NetworkMonitor:
 
-    def __init__(self, port, map_filename):
+    def __init__(self, port, map_filename, weighting='hops'):
         self.port = port
         self.map_filename = map_filename
         self.logger = logging.getLogger('network-monitor')
-        self.cmap = GlobalMap(map_filename)
+        self.cmap = GlobalMap(map_filename, weighting)
         self.logger.info('Loaded %d countries from "%s"'
                          %(len(self.cmap.map), map_filename))
         self.cmap.check_connectivity()
         self.logger.info('The graph of countries is connected...')
+        self.cmap.compute_distances()
+        self.logger.info('Computed the distances between countries (%s)'
+                         %(weighting))
 
     def read_and_close(self, sock, edge_locations):
         try:
@@ -108,12 +111,17 @@ def main():
     argParser.add_option('--map', dest='map', type=str,
                          default='globalmap.txt',
                          help='the file containing the graph of countries')
+    argParser.add_option('--weighting', dest='weighting', type='choice',
+                         choices=list(GlobalMap.WEIGHTINGS), default='hops',
+                         help='the distance between countries: the number of'
+                         ' borders crossed (hops), or the sum of the latencies'
+                         ' given in the map (latency)')
     argParser.add_option('--port', dest='port', type=int, default=7777,
                          help='the port to listen for network snapshot'
                          ' subscribers')
     (options, args) = argParser.parse_args()
     setup_logging()
-    nmon = NetworkMonitor(options.port, options.map)
+    nmon = NetworkMonitor(options.port, options.map, options.weighting)
     nmon.monitor()
 
 if __name__ == '__main__':
@@ -43,7 +43,6 @@ import signal
 from threading import Thread
 from subprocess import Popen, PIPE
 from os.path import exists, devnull, join, lexists
-from shutil import rmtree
 import pickle
 import zipfile
 import tarfile
@@ -55,6 +54,8 @@ from conpaas.core.https.server import HttpJsonResponse, HttpErrorResponse,\
     FileUploadField
 from conpaas.core.agent import BaseAgent, AgentException
 from conpaas.core import git
+from conpaas.core import codestore
+from conpaas.services.generic.agent import client
 from conpaas.core.misc import run_cmd
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
@@ -75,6 +76,7 @@ class GenericAgent(BaseAgent):
         self.GENERIC_DIR = config_parser.get('agent', 'CONPAAS_HOME')
         self.VAR_CACHE = config_parser.get('agent', 'VAR_CACHE')
         self.CODE_DIR = join(self.VAR_CACHE, 'bin')
+        self.code_store = codestore.BlobStore(join(self.VAR_CACHE, 'code_blobs'))
         self.VOLUME_DIR = '/media'
         self.env = {}
         self.processes = {}
@@ -107,9 +109,45 @@ class GenericAgent(BaseAgent):
         self.logger.info('Agent initialized')
         return HttpJsonResponse()
 
+    @expose('POST')
+    def missing_code_blobs(self, kwargs):
+        """Return which of the given blobs are not in the code cache"""
+        exp_params = [('hashes', is_list)]
+        try:
+            hashes = check_arguments(exp_params, kwargs)
+            missing = self.code_store.missing(hashes)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+        return HttpJsonResponse({ 'missing' : missing })
+
+    @expose('POST')
+    def relay_code(self, kwargs):
+        """Send a code version of the code cache to another agent"""
+        exp_params = [('peer', is_string),
+                      ('port', is_pos_int),
+                      ('codeVersionId', is_string),
+                      ('manifest', is_dict)]
+        try:
+            peer, port, codeVersionId, manifest = check_arguments(exp_params, kwargs)
+            if self.code_store.missing(codestore.manifest_hashes(manifest)):
+                raise Exception("Code version '%s' is not in the code cache" % codeVersionId)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        self.logger.info("Relaying code version '%s' to %s" % (codeVersionId, peer))
+        try:
+            codestore.push_code(self.code_store, manifest,
+                lambda hashes: client.missing_code_blobs(peer, port, hashes),
+                lambda bundle: client.update_code(peer, port, codeVersionId,
+                                                  'bundle', bundle))
+        except Exception as ex:
+            self.logger.exception('Failed to relay the code to %s' % peer)
+            return HttpErrorResponse("%s" % ex)
+        return HttpJsonResponse()
+
     @expose('UPLOAD')
     def update_code(self, kwargs):
-        valid_filetypes = [ 'zip', 'tar', 'git' ]
+        valid_filetypes = [ 'zip', 'tar', 'git', 'bundle' ]
         exp_params = [('filetype', is_in_list(valid_filetypes)),
                       ('codeVersionId', is_string),
                       ('file', is_uploaded_file, None),
@@ -125,7 +163,13 @@ class GenericAgent(BaseAgent):
 
         self.logger.info("Updating code to version '%s'" % codeVersionId)
 
-        if filetype == 'zip':
+        if filetype == 'bundle':
+            try:
+                manifest = codestore.read_bundle(self.code_store, file.file)
+            except Exception as ex:
+                self.logger.exception('Failed to read the code bundle')
+                return HttpErrorResponse("%s" % ex)
+        elif filetype == 'zip':
             source = zipfile.ZipFile(file.file, 'r')
         elif filetype == 'tar':
             source = tarfile.open(fileobj=file.file)
@@ -139,15 +183,18 @@ class GenericAgent(BaseAgent):
 
         target_dir = self.CODE_DIR
 
-        if exists(target_dir):
-            rmtree(target_dir)
-
-        if filetype == 'git':
+        if filetype == 'bundle':
+            codestore.checkout(self.code_store, manifest, target_dir)
+            # only the blobs of the active code are needed for the next update
+            self.code_store.prune(codestore.manifest_hashes(manifest))
+        elif filetype == 'git':
+            codestore.remove_tree(target_dir)
             subdir = str(self.SERVICE_ID)
             self.logger.debug("git_enable_revision('%s', '%s', '%s', '%s')" %
                     (target_dir, source, revision, subdir))
             git.git_enable_revision(target_dir, source, revision, subdir)
         else:
+            codestore.remove_tree(target_dir)
             source.extractall(target_dir)
 
         self.logger.info("Code updated, executing the 'init' command")
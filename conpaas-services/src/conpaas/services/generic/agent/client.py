@@ -39,7 +39,6 @@ import json
 import httplib
 
 from conpaas.core import https
-from conpaas.core.misc import file_get_contents
 
 class AgentException(Exception):
     pass
@@ -72,6 +71,19 @@ def init_agent(host, port, agents_info):
     }
     return _check(https.client.jsonrpc_post(host, port, '/', method, params=params))
 
+def missing_code_blobs(host, port, hashes):
+    """POST (hashes) missing_code_blobs"""
+    method = 'missing_code_blobs'
+    params = { 'hashes': hashes }
+    return _check(https.client.jsonrpc_post(host, port, '/', method, params=params))['missing']
+
+def relay_code(host, port, peer, peer_port, codeVersionId, manifest):
+    """POST (peer, port, codeVersionId, manifest) relay_code"""
+    method = 'relay_code'
+    params = { 'peer': peer, 'port': peer_port,
+               'codeVersionId': codeVersionId, 'manifest': manifest }
+    return _check(https.client.jsonrpc_post(host, port, '/', method, params=params))
+
 def update_code(host, port, codeVersionId, filetype, filepath):
     """UPLOAD (filetype, codeVersionId, file) update_code"""
     params = {
@@ -82,8 +94,12 @@ def update_code(host, port, codeVersionId, filetype, filepath):
 
     if filetype != 'git':
         # File-based code uploads
-        files = [('file', filepath, file_get_contents(filepath))]
-        return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        code = open(filepath, 'rb')
+        try:
+            files = [('file', filepath, code)]
+            return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        finally:
+            code.close()
     else:
         # For git-based code uploads, filepath contains the git revision
         params['revision'] = filepath
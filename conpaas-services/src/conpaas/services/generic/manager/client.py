@@ -111,8 +111,12 @@ def upload_authorized_key(host, port, filepath):
 def upload_code_version(host, port, filepath):
     """UPLOAD (code) upload_code_version"""
     params = { 'method' : 'upload_code_version' }
-    files = [('code', filepath, file_get_contents(filepath))]
-    return _check(https.client.https_post(host, port, '/', params, files=files))
+    code = open(filepath, 'rb')
+    try:
+        files = [('code', filepath, code)]
+        return _check(https.client.https_post(host, port, '/', params, files=files))
+    finally:
+        code.close()
 
 def download_code_version(host, port, codeVersionId):
     """GET (codeVersionId) download_code_version"""
@@ -36,7 +36,7 @@ POSSIBILITY OF SUCH DAMAGE.
 """
 
 from threading import Thread
-from shutil import rmtree
+from shutil import rmtree, copyfileobj
 import pickle
 import zipfile
 import tarfile
@@ -49,6 +49,9 @@ from conpaas.core.expose import expose
 from conpaas.core.manager import BaseManager, ManagerException
 
 from conpaas.core import git
+from conpaas.core import codestore
+from conpaas.core import coderelay
+from conpaas.core import fanout
 from conpaas.core.https.server import HttpJsonResponse, HttpErrorResponse,\
     HttpFileDownloadResponse, FileUploadField
 from conpaas.services.generic.misc import archive_open, archive_get_members,\
@@ -87,6 +90,10 @@ class GenericManager(BaseManager):
         BaseManager.__init__(self, config_parser)
 
         self.code_repo = config_parser.get('manager', 'CODE_REPO')
+        self.code_store = codestore.BlobStore(os.path.join(self.code_repo, '.blobs'))
+        self.code_relay_seeds = coderelay.DEFAULT_SEEDS
+        if config_parser.has_option('manager', 'CODE_RELAY_SEEDS'):
+            self.code_relay_seeds = config_parser.getint('manager', 'CODE_RELAY_SEEDS')
 
         if kwargs['reset_config']:
             self._create_initial_configuration()
@@ -205,15 +212,11 @@ echo "" >> /root/generic.out
         self.logger.info("Initializing agents %s" %
                 [ node.id for node in nodes ])
 
-        for serviceNode in nodes:
-            try:
-                client.init_agent(serviceNode.ip, self.AGENT_PORT, agents_info)
-            except client.AgentException:
-                self.logger.exception('Failed initialize agent at node %s'
-                        % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to initialize agent at node %s'
-                        % str(serviceNode))
-                raise
+        def init_agent(serviceNode):
+            client.init_agent(serviceNode.ip, self.AGENT_PORT, agents_info)
+
+        self._call_agents(init_agent, nodes,
+                'Failed to initialize agent at node %s')
 
     def on_stop(self):
         """Delete all nodes and switch to status STOPPED"""
@@ -411,10 +414,7 @@ echo "" >> /root/generic.out
         upload = code.file
         codeVersionId = os.path.basename(name)
 
-        bytes = upload.read(2048)
-        while len(bytes) != 0:
-            fd.write(bytes)
-            bytes = upload.read(2048)
+        copyfileobj(upload, fd)
         fd.close()
 
         arch = archive_open(name)
@@ -495,23 +495,42 @@ echo "" >> /root/generic.out
         self.logger.info("Updating code to version '%s' at agents %s" %
                 (config.currentCodeVersion, [ node.id for node in nodes ]))
 
-        for node in nodes:
+        codeType = config.codeVersions[config.currentCodeVersion].type
+        if codeType != 'git':
+            manifest = codestore.archive_manifest(self.code_store,
+                    os.path.join(self.code_repo, config.currentCodeVersion))
+
+        def update_code(node):
             # Push the current code version via GIT if necessary
-            if config.codeVersions[config.currentCodeVersion].type == 'git':
+            if codeType == 'git':
                 filepath = config.codeVersions[config.currentCodeVersion].filename
                 _, err = git.git_push(git.DEFAULT_CODE_REPO, node.ip)
                 if err:
                     self.logger.debug('git-push to %s: %s' % (node.ip, err))
-            else:
-                filepath = os.path.join(self.code_repo, config.currentCodeVersion)
-            try:
                 client.update_code(node.ip, self.AGENT_PORT, config.currentCodeVersion,
-                                     config.codeVersions[config.currentCodeVersion].type,
-                                     filepath)
-            except client.AgentException:
-                self.logger.exception('Failed to update code at node %s' % str(node))
-                self.state_set(self.S_ERROR, msg='Failed to update code at node %s' % str(node))
-                raise
+                                     codeType, filepath)
+            else:
+                # send only the files the agent does not have yet
+                codestore.push_code(self.code_store, manifest,
+                    lambda hashes: client.missing_code_blobs(node.ip,
+                                                             self.AGENT_PORT, hashes),
+                    lambda bundle: client.update_code(node.ip, self.AGENT_PORT,
+                                                      config.currentCodeVersion,
+                                                      'bundle', bundle))
+
+        if codeType != 'git' and self.code_relay_seeds \
+                and len(nodes) > self.code_relay_seeds:
+            # the agents having the code already send it to the others
+            def relay_code(source, node):
+                client.relay_code(source.ip, self.AGENT_PORT, node.ip,
+                                  self.AGENT_PORT, config.currentCodeVersion,
+                                  manifest)
+
+            relay = coderelay.CodeRelay(update_code, relay_code,
+                                        self.code_relay_seeds, self.logger)
+            update_code = relay.update
+
+        self._call_agents(update_code, nodes, 'Failed to update code at node %s')
 
     @expose('POST')
     def delete_code_version(self, kwargs):
@@ -527,6 +546,7 @@ echo "" >> /root/generic.out
                                   detail='Cannot remove the active code version')
             return HttpErrorResponse("%s" % ex)
 
+        filename = None
         if not config.codeVersions[codeVersionId].type == 'git':
             filename = os.path.abspath(os.path.join(self.code_repo, codeVersionId))
             if not filename.startswith(self.code_repo + '/') or not os.path.exists(filename):
@@ -539,6 +559,16 @@ echo "" >> /root/generic.out
         config.codeVersions.pop(codeVersionId)
         self._configuration_set(config)
 
+        if filename is not None:
+            # drop the blobs only the deleted version used
+            try:
+                codestore.prune_archives(self.code_store,
+                    [ os.path.join(self.code_repo, version.id)
+                      for version in config.codeVersions.values()
+                      if version.type != 'git' ])
+            except Exception as ex:
+                self.logger.exception('Failed to prune the code store: %s' % ex)
+
         return HttpJsonResponse()
 
     def check_create_volume(self, volume_name, volume_size, agent_id):
@@ -591,43 +621,38 @@ echo "" >> /root/generic.out
 
         return HttpJsonResponse({ 'state': self.state_get() })
 
+    def _get_scripts_status(self):
+        def get_script_status(node):
+            return client.get_script_status(node.ip, self.AGENT_PORT)['scripts']
+
+        return self._call_agents(get_script_status, self.nodes,
+                "Failed to obtain script status at node %s",
+                required=fanout.REQUIRE_NONE, error_state=False)
+
     def _is_script_running(self, command):
         script_name = "%s.sh" % command
-        for node in self.nodes:
-            try:
-                res = client.get_script_status(node.ip, self.AGENT_PORT)
-                if res['scripts'][script_name] == "RUNNING":
-                    return True
-            except client.AgentException:
-                message = ("Failed to obtain script status at node %s" % str(node));
-                self.logger.exception(message)
+        for scripts in self._get_scripts_status().values():
+            if scripts.get(script_name) == "RUNNING":
+                return True
         return False
 
     def _are_scripts_running(self):
-        for node in self.nodes:
-            try:
-                res = client.get_script_status(node.ip, self.AGENT_PORT)
-                if "RUNNING" in res['scripts'].values():
-                    return True
-            except client.AgentException:
-                message = ("Failed to obtain script status at node %s" % str(node));
-                self.logger.exception(message)
+        for scripts in self._get_scripts_status().values():
+            if "RUNNING" in scripts.values():
+                return True
         return False
 
     def _do_execute_script(self, command, nodes, parameters=''):
         self.logger.info("Executing the '%s' command at agents %s" %
                 (command, [ node.id for node in nodes ]))
 
-        for node in nodes:
-            try:
-                client.execute_script(node.ip, self.AGENT_PORT, command,
-                        parameters, self.agents_info)
-            except client.AgentException:
-                message = ("Failed to execute the '%s' command at node %s" %
-                        (command, str(node)));
-                self.logger.exception(message)
-                self.state_set(self.S_ERROR, msg=message)
-                raise
+        def execute_script(node):
+            client.execute_script(node.ip, self.AGENT_PORT, command,
+                    parameters, self.agents_info)
+
+        errmsg = "Failed to execute the '%s' command" % command
+        self._call_agents(execute_script, nodes,
+                errmsg.replace('%', '%%') + " at node %s")
 
     @expose('GET')
     def get_script_status(self, kwargs):
@@ -638,16 +663,18 @@ echo "" >> /root/generic.out
         except Exception as ex:
             return HttpErrorResponse("%s" % ex)
 
+        def get_script_status(node):
+            return client.get_script_status(node.ip, self.AGENT_PORT)['scripts']
+
+        try:
+            scripts = self._call_agents(get_script_status, self.nodes,
+                    "Failed to obtain script status at node %s")
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
         agents = {}
-        for node in self.nodes:
-            try:
-                res = client.get_script_status(node.ip, self.AGENT_PORT)
-                agents[node.id] = res['scripts']
-            except client.AgentException as ex:
-                message = ("Failed to obtain script status at node %s" % str(node));
-                self.logger.exception(message)
-                self.state_set(self.S_ERROR, msg=message)
-                return HttpErrorResponse("%s" % ex)
+        for node in scripts:
+            agents[node.id] = scripts[node]
 
         return HttpJsonResponse({ 'agents' : agents })
 
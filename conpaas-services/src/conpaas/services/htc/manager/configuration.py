@@ -4,6 +4,9 @@ Created on Jul 23, 2013
 @author: Vlad
 '''
 import random
+from array import array
+
+INFINITY = float('inf')
 
 class Configuration:
     def __init__(self,types_list, cost_list, limit_list):
@@ -15,7 +18,6 @@ class Configuration:
         self.conf = {}
         self.costs = dict(zip(types_list,cost_list))
         self.limits = dict(zip(types_list,limit_list))
-        self.ratios={}
         for k in self.keys:
             self.costs[self.keys[k]]=self.costs[k]
             del self.costs[k]
@@ -26,8 +28,7 @@ class Configuration:
             self.rav[self.keys[k]] = 0
             self.conf[self.keys[k]]= 0
         random.seed()
-        self.conf_dict = {}
-        self.m = {}
+        self.tmax = -1
     
     def relevant_time_unit(self):
         t=60
@@ -55,10 +56,6 @@ class Configuration:
                 self.rav[self.keys[m_type]] = value/8
 
             
-    def compute_ratios(self):
-        for k in self.costs:
-            self.ratios[k] = round(self.costs[k]/self.throughput[k], 5 )
-    
     def compute_tmax(self):
         tmax = 0
         for k in self.throughput:
@@ -71,72 +68,67 @@ class Configuration:
             c += self.conf[k]*self.costs[k]
         return c
             
-    def cheap_check(self,start,target):
-        cheap_list = self.costs.values()
-        sorted_list = sorted(self.costs.values())
-        cheap = 0
-        for p in sorted_list:
-            kp = cheap_list.index(p)
-            if start + self.throughput[kp] > target and kp in self.ratios.keys() :
-                self.conf[kp]+=1
-                cheap=1
-                break
-        return cheap
-    def compute_configuration(self, target):
-               
-        for k in self.averages:
-            self.conf[k]= 0
-        self.compute_ratios()
-        
-        start = 0        
-        
-        while start < target and len(self.ratios)>0:
-            if self.cheap_check(start, target) ==1:
-                return self.conf
-            
-            r = self.ratios.values()
-            m = min(r)
-            for km in self.ratios:
-                if self.ratios[km] == m:
-                    break
-            while self.limits[km] > self.conf[km]:
-                start+=self.throughput[km]
-                self.conf[km]+=1
-                if start >= target:
-                    return self.conf
-                if self.cheap_check(start, target) == 1:
-                    return self.conf
-            del self.ratios[km]
-        
-        return self.conf
-    
     def dynamic_configuration(self):
-        
-        tmax = self.compute_tmax()
-        for k in self.limits:
-            self.conf[k]=self.limits[k]
-        t = tmax - 1
-        self.conf_dict = {}
-        self.conf_dict[tmax] = self.conf
-        self.m = {}
-        self.m[tmax] = self.cost_conf()
-        while t >= 0:
-            self.m[t]=self.m[t+1]
-            km = -1 
-            for k in self.throughput:   
-                if tmax - self.throughput[k] >= t:
-                    if self.m[t] > self.m[t+self.throughput[k]] - self.costs[k] and self.conf_dict[t+self.throughput[k]][k]>0:
-                        self.m[t] = self.m[t+self.throughput[k]] - self.costs[k]
-                        km = k
-            if km > -1:
-                self.conf_dict[t] = self.conf_dict[t+self.throughput[km]].copy()
-                self.conf_dict[t][km] -= 1
-            else:
-                self.conf_dict[t] = self.conf_dict[t+1].copy()
-            
-            t-=1
-        self.m[0]=0
-        return self.m
+        """
+        Build the table of the cheapest configurations for every throughput
+        up to tmax, the throughput of all the machines. This is a bounded
+        knapsack: the limit of every machine type is split in items of 1, 2,
+        4, ... machines, each taken at most once, and best[s] is the lowest
+        cost of a set of items with a throughput of exactly s. The table is
+        kept, so get_configuration and get_cost answer any target from it.
+        """
+        self.items = []
+        for k in sorted(self.throughput):
+            throughput = int(self.throughput[k])
+            if throughput <= 0:
+                continue
+            left = self.limits[k]
+            count = 1
+            while left > 0:
+                count = min(count, left)
+                self.items.append((k, count, throughput * count, self.costs[k] * count))
+                left -= count
+                count *= 2
+
+        tmax = sum(weight for _, _, weight, _ in self.items)
+        best = [0.0] + [INFINITY] * tmax
+        # taken[i][s] is set if item i is in the cheapest set of throughput s
+        # among the first i+1 items
+        self.taken = []
+        for _, _, weight, cost in self.items:
+            shifted = [b + cost for b in best[:len(best) - weight]]
+            self.taken.append(bytearray(weight) +
+                              bytearray(1 if c < b else 0 for b, c in zip(best[weight:], shifted)))
+            best = best[:weight] + [c if c < b else b for b, c in zip(best[weight:], shifted)]
 
+        # a throughput of at least t: the cheapest exact throughput s >= t
+        self.cost_table = array('d', best)
+        self.throughput_table = array('l', range(tmax + 1))
+        for t in range(tmax - 1, -1, -1):
+            if self.cost_table[t + 1] <= self.cost_table[t]:
+                self.cost_table[t] = self.cost_table[t + 1]
+                self.throughput_table[t] = self.throughput_table[t + 1]
+        self.tmax = tmax
+        return tmax
 
+    def get_cost(self, target):
+        """Cost of the cheapest configuration with a throughput of at least
+        target, None if there is none"""
+        if target > self.tmax:
+            return None
+        return self.cost_table[max(target, 0)]
 
+    def get_configuration(self, target):
+        """Cheapest configuration with a throughput of at least target, as
+        a dictionary of machine counts with the machine type index as key,
+        None if there is none"""
+        if target > self.tmax:
+            return None
+        conf = dict((k, 0) for k in self.limits)
+        s = self.throughput_table[max(target, 0)]
+        for i in range(len(self.items) - 1, -1, -1):
+            if self.taken[i][s]:
+                k, count, weight, _ = self.items[i]
+                conf[k] += count
+                s -= weight
+        return conf
@@ -2,6 +2,9 @@
 import sys
 import time
 import xmltodict
+from array import array
+from subprocess import Popen, PIPE
+from xml.etree import cElementTree
 import pprint 
 pp = pprint.PrettyPrinter(indent=4,stream=sys.stderr)
 
@@ -111,6 +114,158 @@ def get_poll_dict(xmldict):
             print >> sys.stderr, "------ res_dict ------"
         return res_dict
 
+
+HISTORY_ATTRS = [ 'HtcJob', 'HtcBag', 'HtcTask', 'RemoteWallClockTime',
+                  'MATCH_EXP_MachineCloudMachineType',
+                  'ClusterId', 'ProcId', 'CompletionDate' ]
+
+
+def classad_value(elem):
+    """
+    Value of an <a> element of condor's XML output, converted as in
+    get_poll_dict
+    """
+    for v in elem:
+        text = (v.text or '').encode('ascii', 'ignore')
+        if v.tag == 'r':
+            return float(text)
+        if v.tag == 'i':
+            return int(text)
+        if v.tag == 's':
+            return text if v.text is not None else 'None'
+        if v.tag == 'b':
+            return 'True' if v.get('v') == 't' else 'False'
+        if v.tag == 'e':
+            return text
+    return None
+
+
+def iter_history(stream, attrs=HISTORY_ATTRS):
+    """
+    Parse condor's XML output from stream one ClassAd at a time, yielding
+    a dict of the given attributes for each of them
+    """
+    try:
+        for _, elem in cElementTree.iterparse(stream):
+            if elem.tag != 'c':
+                continue
+            record = {}
+            for a in elem:
+                if a.get('n') in attrs:
+                    record[a.get('n')] = classad_value(a)
+            elem.clear()
+            yield record
+    except SyntaxError:
+        # no ClassAds at all, or the output was cut
+        return
+
+
+class BagProgress(object):
+    """
+    Completed tasks of a bag, in compact arrays: the task number, the run
+    time and an index in machine_types for every completed task
+    """
+
+    def __init__(self, job_id, bag_id):
+        self.job_id = job_id
+        self.bag_id = bag_id
+        self.tasks = array('l')
+        self.run_times = array('d')
+        self.types = array('B')
+        self.machine_types = []
+        self.task_sets = set()
+        self.total_times = {}
+        self.counts = {}
+
+    def add(self, record):
+        machine_type = record.get('MATCH_EXP_MachineCloudMachineType', 'None')
+        if machine_type not in self.machine_types:
+            self.machine_types.append(machine_type)
+            self.total_times[machine_type] = 0.0
+            self.counts[machine_type] = 0
+        run_time = float(record.get('RemoteWallClockTime', 0))
+        self.tasks.append(record['HtcTask'])
+        self.run_times.append(run_time)
+        self.types.append(self.machine_types.index(machine_type))
+        self.task_sets.add(record['HtcTask'])
+        self.total_times[machine_type] += run_time
+        self.counts[machine_type] += 1
+
+    def completed_tasks(self):
+        return len(self.tasks)
+
+    def completed_task_sets(self):
+        return len(self.task_sets)
+
+    def average_run_times(self):
+        return dict((t, self.total_times[t] / self.counts[t]) for t in self.machine_types)
+
+    def poll_dict(self):
+        """The completed tasks in the format of get_poll_dict"""
+        res_dict = {}
+        for i in range(len(self.tasks)):
+            taskid = "%d.%d.%d" % (self.job_id, self.bag_id, self.tasks[i])
+            res_dict.setdefault(taskid, []).append({
+                'HtcJob': self.job_id,
+                'HtcBag': self.bag_id,
+                'HtcTask': self.tasks[i],
+                'RemoteWallClockTime': self.run_times[i],
+                'MATCH_EXP_MachineCloudMachineType': self.machine_types[self.types[i]] })
+        return res_dict
+
+
+class HistoryTracker(object):
+    """
+    Follows the tasks of a bag completing in condor_history. Each poll
+    only asks for the ClassAds completed since the last one (a cursor on
+    CompletionDate) and parses them as a stream, so the cost of a poll
+    does not grow with the number of tasks already completed.
+    """
+
+    def __init__(self, job_id, bag_id):
+        self.progress = BagProgress(job_id, bag_id)
+        self.cursor = 0
+        # jobs completed at the cursor date, already counted
+        self.cursor_jobs = set()
+
+    def command(self):
+        return [ 'condor_history', '-constraint',
+                 'HtcJob == %d && HtcBag == %d && CompletionDate >= %d'
+                 % (self.progress.job_id, self.progress.bag_id, self.cursor),
+                 '-xml' ]
+
+    def consume(self, records):
+        """Add the records not seen yet, return how many there were"""
+        new = 0
+        cursor = self.cursor
+        cursor_jobs = set(self.cursor_jobs)
+        for record in records:
+            date = record.get('CompletionDate', 0)
+            job = (record.get('ClusterId'), record.get('ProcId'))
+            if date < self.cursor or (date == self.cursor and job in self.cursor_jobs):
+                continue
+            self.progress.add(record)
+            new += 1
+            if date > cursor:
+                cursor = date
+                cursor_jobs = set()
+            if date == cursor:
+                cursor_jobs.add(job)
+        self.cursor = cursor
+        self.cursor_jobs = cursor_jobs
+        return new
+
+    def poll(self):
+        """
+        Read the new ClassAds from condor_history, return how many there
+        were or None if condor_history failed
+        """
+        proc = Popen(self.command(), stdout=PIPE)
+        records = list(iter_history(proc.stdout))
+        if proc.wait() != 0:
+            return None
+        return self.consume(records)
+
 """
 
 
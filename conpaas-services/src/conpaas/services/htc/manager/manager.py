@@ -399,9 +399,10 @@ class HTCManager(BaseManager):
             vals = { 'curstate': self.state, 'action': 'get_config' }
             return HttpErrorResponse(self.WRONG_STATE_MSG % vals)
         t = int(kwargs['t'])
-        if t not in self.configuration.conf_dict:
+        conf = self.configuration.get_configuration(t)
+        if conf is None:
             return HttpErrorResponse("manager not configured yet for throughput = "+ str(t))
-        return HttpJsonResponse({"conf":self.configuration.conf_dict[t]})
+        return HttpJsonResponse({"conf":conf})
     
     @expose('POST')
     def get_m(self,kwargs):
@@ -410,9 +411,10 @@ class HTCManager(BaseManager):
             vals = { 'curstate': self.state, 'action': 'get_cost' }
             return HttpErrorResponse(self.WRONG_STATE_MSG % vals)
         t = int(kwargs['t'])
-        if t not in self.configuration.m:
+        cost = self.configuration.get_cost(t)
+        if cost is None:
             return HttpErrorResponse("manager not configured yet for throughput = "+ str(t))
-        return HttpJsonResponse({"conf":self.configuration.m[t]})
+        return HttpJsonResponse({"conf":cost})
 
     @expose('POST')
     def select(self,kwargs):
@@ -421,18 +423,19 @@ class HTCManager(BaseManager):
             vals = { 'curstate': self.state, 'action': 'select' }
             return HttpErrorResponse(self.WRONG_STATE_MSG % vals)
         t = int(kwargs['t'])
-        if t not in self.configuration.m:
+        conf = self.configuration.get_configuration(t)
+        if conf is None:
             return HttpErrorResponse("manager not configured yet for throughput = "+ str(t))
         for k in self.pool:
-            while self.pool[k] > self.configuration.conf_dict[t][self.configuration.keys[k]]:
+            while self.pool[k] > conf[self.configuration.keys[k]]:
                 wid=self.service.get_worker_id(k)
                 self._do_remove_nodes(wid)
-            if self.pool[k] < self.configuration.conf_dict[t][self.configuration.keys[k]]:
-                count = self.configuration.conf_dict[t][self.configuration.keys[k]] - self.pool[k]  
+            if self.pool[k] < conf[self.configuration.keys[k]]:
+                count = conf[self.configuration.keys[k]] - self.pool[k]  
 		self.state = self.S_ADAPTING
                 Thread(target=self._do_add_nodes, args=[count, 'cloud.amsterdam.'+ str(k)]).start()
 	self.logger.info(str(self.service))
-        return HttpJsonResponse({"conf:":self.configuration.m[t]})
+        return HttpJsonResponse({"conf:":self.configuration.get_cost(t)})
 
     def update_configuration(self, tasks_dict):
         f1 = open('t1','a')
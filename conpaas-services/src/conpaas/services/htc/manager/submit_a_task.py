@@ -43,9 +43,10 @@ def remove_node_info(hostsfile, ip):
 		if not re.search('^' + ip, line):
 			targetfile.write(line)
 
-def submit_a_task(jobnr, bagnr, tasknr, commandline, workerlist, thedict={}):
-        # print >> sys.stderr, 'tesing_subnit = %s' % testing_submit
-        setup_dict = dict(
+FARM_DIR = "/var/lib/condor/taskfarm"
+
+def _setup_dict(jobnr, bagnr):
+        return dict(
                 Universe = 'vanilla' ,
                 Log = 'htc.$(Cluster).$(Process).log' ,
                 Output = 'htc.$(Cluster).$(Process).out' ,
@@ -53,15 +54,55 @@ def submit_a_task(jobnr, bagnr, tasknr, commandline, workerlist, thedict={}):
                 should_transfer_files = 'YES' ,
                 when_to_transfer_output = 'ON_EXIT' ,
                 HtcJob = jobnr ,
-                HtcBag = bagnr,
-                HtcTask = tasknr     # should be tasknr from original file
+                HtcBag = bagnr
         )
+
+def _enter_farm_dir():
+        if not os.path.isdir(FARM_DIR):
+                os.system("sudo -u condor mkdir -p %s" % FARM_DIR)
+                # os.makedirs(FARM_DIR, 0777)
+        os.chdir(FARM_DIR)
+
+def _write_task_script(base_filename, commandline):
+        thetask_file = '%s.thetask' % (base_filename)
+        fd = open( thetask_file, "w" ) # or die("Cannot create %s: %s" % (filename, error_nr))
+        fd.write( "#!/bin/bash\n%s\n" % commandline )
+        fd.close()
+        os.chmod( thetask_file, os.stat(thetask_file).st_mode | stat.S_IEXEC | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH )
+        return thetask_file
+
+def _write_setup(fd, setup_dict, thedict):
+        for k, v in setup_dict.iteritems():
+            if k[:3] == 'Htc':
+                    fd.write( "+%s = %s\n" % (k, v) )
+            else:
+                    fd.write( "%s = %s\n" % (k, v) )
+        for k, v in thedict.iteritems():
+            fd.write( "%s = %s\n" % (k, v) )
+
+def _write_queue(fd, workerlist):
+        queued = False
+        for w in workerlist:
+                fd.write("Requirements = TARGET.CloudMachineType ==  \"%s\"\n" % w)
+                fd.write( "queue 1\n\n" )
+                queued = True
+        if not queued:
+                fd.write( "queue 1\n" )
+
+def _condor_submit(classad_file):
+        command = "sudo -u condor condor_submit %s" % classad_file
+        if testing_submit:
+                command = "echo " + command
+        else:
+                os.system("echo " + command)
+        os.system(command)
+
+def submit_a_task(jobnr, bagnr, tasknr, commandline, workerlist, thedict={}):
+        # print >> sys.stderr, 'tesing_subnit = %s' % testing_submit
+        setup_dict = _setup_dict(jobnr, bagnr)
+        setup_dict['HtcTask'] = tasknr     # should be tasknr from original file
         command = commandline.split(' ')
-        farm_dir = "/var/lib/condor/taskfarm"
-        if not os.path.isdir(farm_dir):
-		os.system("sudo -u condor mkdir -p %s" % farm_dir)
-                # os.makedirs(farm_dir, 0777)
-        os.chdir(farm_dir)
+        _enter_farm_dir()
         if command[0] == "java":
             setup_dict["Universe"] = 'java'
             classpath = ''
@@ -87,11 +128,7 @@ def submit_a_task(jobnr, bagnr, tasknr, commandline, workerlist, thedict={}):
         # set up the task file
 	base_filename = 'htc-j-%d-b-%d-t-%d' % (jobnr, bagnr, tasknr)
         print >> sys.stderr, 'submit_a_task ', base_filename, "\t'%s'\t" % commandline, workerlist
-        thetask_file = '%s.thetask' % (base_filename)
-        fd = open( thetask_file, "w" ) # or die("Cannot create %s: %s" % (filename, error_nr))
-        fd.write( "#!/bin/bash\n%s\n" % commandline )
-        fd.close()
-        os.chmod( thetask_file, os.stat(thetask_file).st_mode | stat.S_IEXEC | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH )
+        thetask_file = _write_task_script(base_filename, commandline)
         # set up the ClassAd submit file
         classad_file = '%s.classad' % (base_filename)
         fd = open( classad_file, "w" ) # or die("Cannot create %s: %s" % (filename, error_nr))
@@ -99,30 +136,50 @@ def submit_a_task(jobnr, bagnr, tasknr, commandline, workerlist, thedict={}):
                 setup_dict['Cmd'] = thetask_file
         # setup_dict['ConpaasWorkerType'] = workertype
         # setup_dict['ConpaasSequenceNumber'] = tasknr
-        for k, v in setup_dict.iteritems():
-            if k[:3] == 'Htc':
-                    fd.write( "+%s = %s\n" % (k, v) )
-            else:
-                    fd.write( "%s = %s\n" % (k, v) )
-        for k, v in thedict.iteritems():
-            fd.write( "%s = %s\n" % (k, v) )
-        queued = False
-        for w in workerlist:
-                fd.write("Requirements = TARGET.CloudMachineType ==  \"%s\"\n" % w)
-                fd.write( "queue 1\n\n" )
-                queued = True
-        if not queued:
-                fd.write( "queue 1\n" )
+        _write_setup(fd, setup_dict, thedict)
+        _write_queue(fd, workerlist)
         fd.close()
         if testing_submit:
                 os.system("head -v -n 20 %s" % thetask_file)
                 os.system("head -v -n 20 %s" % classad_file)
-        command = "sudo -u condor condor_submit %s" % classad_file
+        _condor_submit(classad_file)
+        return
+
+def submit_a_bag(jobnr, bagnr, tasks, thedict={}):
+        """
+        Submit the tasks of a bag with a single condor_submit call, using
+        one submit description with a queue statement per task. tasks is a
+        list of (tasknr, commandline, workerlist) tuples, as the arguments
+        of submit_a_task.
+        """
+        _enter_farm_dir()
+        plain_tasks = []
+        replicated_tasks = []
+        for task in tasks:
+                if task[1].split(' ')[0] == 'java':
+                        # java tasks have their own executable and classes
+                        submit_a_task(jobnr, bagnr, task[0], task[1], task[2], thedict)
+                elif task[2]:
+                        replicated_tasks.append(task)
+                else:
+                        plain_tasks.append(task)
+        if not plain_tasks and not replicated_tasks:
+                return
+        classad_file = 'htc-j-%d-b-%d.classad' % (jobnr, bagnr)
+        print >> sys.stderr, 'submit_a_bag ', classad_file, len(plain_tasks) + len(replicated_tasks), 'tasks'
+        fd = open( classad_file, "w" )
+        _write_setup(fd, _setup_dict(jobnr, bagnr), thedict)
+        # a Requirements line holds for all the queue statements after it,
+        # so the tasks without worker types go first
+        for tasknr, commandline, workerlist in plain_tasks + replicated_tasks:
+                base_filename = 'htc-j-%d-b-%d-t-%d' % (jobnr, bagnr, tasknr)
+                fd.write( "\n+HtcTask = %s\n" % tasknr )
+                fd.write( "Cmd = %s\n" % _write_task_script(base_filename, commandline) )
+                _write_queue(fd, workerlist)
+        fd.close()
         if testing_submit:
-                command = "echo " + command
-        else:
-                os.system("echo " + command)
-        os.system(command)
+                os.system("head -v -n 40 %s" % classad_file)
+        _condor_submit(classad_file)
         return
 
 if __name__ == "__main__":
@@ -11,7 +11,6 @@ import time
 import random
 import submit_a_task
 import get_run_time
-import xmltodict
 import pprint 
 pp = pprint.PrettyPrinter(indent=4,stream=sys.stderr)
 
@@ -135,12 +134,10 @@ class TaskFarm:
                     self.tf_job_dict[jb_key] = {}
                     bag_path = self.jobs[job_id].popleft()
                     lines = open(bag_path,'r').readlines()
-                    line = 0
-                    for l in lines:
-                        submit_a_task.submit_a_task( job_id, bag_id, line, l, [] )
-                        line += 1
-                        #callback function that needs to state whether a task is done
-                        print l
+                    line = len(lines)
+                    submit_a_task.submit_a_bag( job_id, bag_id,
+                            [ (i, l, []) for i, l in enumerate(lines) ] )
+                    print "submitted %d tasks of bag %s" % (line, jb_key)
                     self.tf_job_dict[jb_key]['SamplingReady'] = False
                     self.tf_job_dict[jb_key]['CompletedTasks'] = 0
                     self.tf_job_dict[jb_key]['TotalTasks'] = line
@@ -190,17 +187,17 @@ class TaskFarm:
             taken = lines.pop(take)             # remove from original list
             sample_list.append(taken)           # add to sample list
 
-        # third: submit all tasks in separate commands
+        # third: submit all tasks with a single command
         self.tf_job_dict[jb_key]['SamplingReady'] = False
-        # TODO  to use condor more efficiently, create just one ClassAd file
         sys.stdout.flush()
+        tasks = []
         for i in range(0,size):
-            #function that submits on each worker type
             print >> sys.stderr, 'sample_job sampling ', job_id, i, sample_list[i]
             if i < replication_size:   # to replicate job on all worker types, use type_list
-                submit_a_task.submit_a_task( job_id, bag_id, i, sample_list[i], type_list ) 
+                tasks.append( (i, sample_list[i], type_list) )
             else:
-                submit_a_task.submit_a_task( job_id, bag_id, i, sample_list[i], [] ) 
+                tasks.append( (i, sample_list[i], []) )
+        submit_a_task.submit_a_bag( job_id, bag_id, tasks )
 
         # Put all lines that were not yet submitted in a file for later execution, and put the filename "in front of" the queue
         filename_leftovers = "%s/lo-j%d-b%d" % ( os.path.dirname(bag_path), job_id, bag_id )
@@ -233,60 +230,31 @@ class TaskFarm:
     def _do_poll(self, job_id, bag_id):
         _try = 0
         jb_key = "%d.%d" % (job_id,bag_id)
-        filename = "hist-%d-%d.xml" % ( job_id, bag_id )
-        command = "condor_history -constraint 'HtcJob == %d && HtcBag == %d' -xml > %s" % ( job_id, bag_id, filename )
+        tracker = get_run_time.HistoryTracker(job_id, bag_id)
+        progress = tracker.progress
         while True:
             _try += 1
             _trystr = "Try %d (%s) :" % (_try, jb_key)
-            # get condor_history and analyse
-            ret_val = os.system( command )
-            if ret_val != 0:
+            # only the tasks completed since the last poll are read
+            if tracker.poll() is None:
                 # wait a little until the first results come in
-                print >> sys.stderr, _trystr, "wait a little until the first results come in on", filename
+                print >> sys.stderr, _trystr, "wait a little until the first results come in"
                 time.sleep(1)
                 continue
-            # now we have created a file, check if it has any classads
-            xml = open(filename).read()
-            xmldict = xmltodict.parse(xml)
 
-            print >> sys.stderr, "type(xmldict) = ", type(xmldict)
-            if not ( type(xmldict) == dict and xmldict.has_key('classads') ):
-                print >> sys.stderr, _trystr, "No classads, wait a little until the first results come in"
-                time.sleep(4)
-                continue
-
-            print >> sys.stderr, "type(xmldict['classads']) = ", type(xmldict['classads'])
-            if not ( type(xmldict['classads']) == dict and xmldict['classads'].has_key('c') ) :
-                print >> sys.stderr, _trystr, "No classads <c> entries, wait a little until the first results come in"
-                time.sleep(4)
-                continue
-
-            print >> sys.stderr, "type(xmldict['classads']['c']) = ", type(xmldict['classads']['c'])
-            if not ( type(xmldict['classads']['c']) == list and xmldict['classads']['c'][0].has_key('a') ) :
-                print >> sys.stderr, _trystr, "No classads attributes, wait a little until the first results come in"
-                time.sleep(4)
-                continue
-
-            print >> sys.stderr, _trystr, "start polling", filename
-            poll_dict = get_run_time.get_poll_dict(xmldict)
-            print >> sys.stderr, _trystr, "polling done", filename
-            completed_tasks = 0
-            for _ in poll_dict.keys():
-                completed_tasks += len(poll_dict[_])
-            completed_task_sets = poll_dict.keys().__len__()
+            completed_tasks = progress.completed_tasks()
             self.tf_dict['completed_tasks'] += ( completed_tasks - self.tf_job_dict[jb_key]['CompletedTasks'] )
             self.tf_job_dict[jb_key]['CompletedTasks'] = completed_tasks
-            self.tf_job_dict[jb_key]['CompletedTaskSets'] = completed_task_sets
+            self.tf_job_dict[jb_key]['CompletedTaskSets'] = progress.completed_task_sets()
+            self.tf_job_dict[jb_key]['AverageRunTimes'] = progress.average_run_times()
             
             print >> sys.stderr, "polling %s, try %d: SubmittedTasks = %d, CompletedTasks = %d" % ( jb_key, _try, self.tf_job_dict[jb_key]['SubmittedTasks'], self.tf_job_dict[jb_key]['CompletedTasks'] )
-            #if _try == 50:
-            #    self.tf_job_dict[jb_key]['SamplingReady'] = True
 
             if self.tf_job_dict[jb_key]['CompletedTasks'] == self.tf_job_dict[jb_key]['SubmittedTasks']:
-                self.tf_job_info[jb_key] = poll_dict
+                self.tf_job_info[jb_key] = progress.poll_dict()
                 self.tf_job_dict[jb_key]['SamplingReady'] = True
 
             if self.tf_job_dict[jb_key]['SamplingReady'] == True:
-                pp.pprint(poll_dict)
+                pp.pprint(self.tf_job_dict[jb_key])
                 return
             time.sleep(4)
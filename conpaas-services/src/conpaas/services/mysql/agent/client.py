@@ -74,11 +74,12 @@ def check_agent_process(host, port):
 
 def load_dump(host, port, mysqldump_path):
     params = {'method': 'load_dump'}
-    f = open(mysqldump_path, 'r')
-    filecontent = f.read()
-    f.close()
-    files = [('mysqldump_file', mysqldump_path, filecontent)]
-    return _check(https.client.https_post(host, port, '/', params=params, files=files))
+    f = open(mysqldump_path, 'rb')
+    try:
+        files = [('mysqldump_file', mysqldump_path, f)]
+        return _check(https.client.https_post(host, port, '/', params=params, files=files))
+    finally:
+        f.close()
 
 
 def stop(host, port):
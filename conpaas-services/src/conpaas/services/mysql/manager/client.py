@@ -9,7 +9,6 @@ import json
 import sys
 
 from conpaas.core import https
-from conpaas.core.misc import file_get_contents
 
 
 class ManagerException(Exception):
@@ -142,8 +141,12 @@ def getGangliaParams(host, port):
 
 def load_dump(host, port, mysqldump_path):
     params = {'method': 'load_dump'}
-    files = [('mysqldump_file', mysqldump_path, file_get_contents(mysqldump_path))]
-    return _check(https.client.https_post(host, port, '/', params, files=files))
+    dump = open(mysqldump_path, 'rb')
+    try:
+        files = [('mysqldump_file', mysqldump_path, dump)]
+        return _check(https.client.https_post(host, port, '/', params, files=files))
+    finally:
+        dump.close()
 
 
 def remove_specific_nodes(host, port, ip):
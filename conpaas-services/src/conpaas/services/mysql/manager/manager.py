@@ -7,6 +7,7 @@
 from threading import Thread, Timer
 import os
 import tempfile
+import shutil
 import string
 from random import choice
 import collections
@@ -26,6 +27,7 @@ from conpaas.core.misc import run_cmd_code
 import conpaas.services.mysql.agent.client as agent
 from conpaas.services.mysql.agent.client import AgentException
 from conpaas.services.mysql.manager.config import Configuration
+from conpaas.services.mysql.manager.metrics import MetricsCollector
 
 import logging
 import commands
@@ -49,6 +51,7 @@ class MySQLManager(BaseManager):
         # self.controller.config_clouds({"mem": "512", "cpu": "1"})
         self.root_pass = None
         self.config = Configuration(conf, self.logger)
+        self.metrics = MetricsCollector(self.logger)
         self.logger.debug("Leaving MySQLServer initialization")
 
     def get_service_type(self):
@@ -93,6 +96,7 @@ class MySQLManager(BaseManager):
     def _start_mysqld(self, nodes):
         dev_name = None
         existing_nodes = self.config.get_nodes_addr()
+        # Galera nodes join the cluster one at a time
         for serviceNode in nodes:
             try:
                 agent.start_mysqld(serviceNode.ip, self.config.AGENT_PORT, existing_nodes, serviceNode.volumes[0].dev_name)
@@ -105,24 +109,25 @@ class MySQLManager(BaseManager):
             nodesIp=[]
             nodesIp = ["%s:%s" % (node.ip, self.config.MYSQL_PORT)  # FIXME: find real mysql port instead of default 3306
                          for node in nodes]
-            for glb in glb_nodes:
-                agent.add_glbd_nodes(glb.ip, self.config.AGENT_PORT, nodesIp)
+            self._call_agents(lambda glb: agent.add_glbd_nodes(glb.ip, self.config.AGENT_PORT, nodesIp),
+                              glb_nodes, 'Failed to add MySQL nodes to GLB node %s',
+                              error_state=False)
             return True
         except Exception as ex:
             self.logger.exception('Failed to configure new GLB node: %s' % ex)
             raise
 
     def _start_glbd(self, new_glb_nodes):
-        for new_glb in new_glb_nodes:
-            try:
-                nodes = ["%s:%s" % (node.ip, self.config.MYSQL_PORT)  # FIXME: find real mysql port instead of default 3306
-                         for node in self.config.get_nodes()]
-                self.logger.debug('create_glb_node all mysql nodes = %s' % nodes)
-                self.logger.debug('create_glb_node for new_glb.ip  = %s' % new_glb.ip)
-                agent.start_glbd(new_glb.ip, self.config.AGENT_PORT, nodes)
-            except AgentException:
-                self.logger.exception('Failed to start GLB at node %s' % new_glb.ip)
-                raise
+        nodes = ["%s:%s" % (node.ip, self.config.MYSQL_PORT)  # FIXME: find real mysql port instead of default 3306
+                 for node in self.config.get_nodes()]
+        self.logger.debug('create_glb_node all mysql nodes = %s' % nodes)
+
+        def start_glbd(new_glb):
+            self.logger.debug('create_glb_node for new_glb.ip  = %s' % new_glb.ip)
+            agent.start_glbd(new_glb.ip, self.config.AGENT_PORT, nodes)
+
+        self._call_agents(start_glbd, new_glb_nodes,
+                          'Failed to start GLB at node %s', error_state=False)
 
     @expose('GET')
     def list_nodes(self, kwargs):
@@ -227,68 +232,21 @@ class MySQLManager(BaseManager):
             'meanDelete' : float, average number of delete queries across the nodes
             'inserts': int array, array within the  number of insert queries across the nodes
             'meanInsert': float average number of insert  queries across the nodes
+            'selectRates', 'insertRates', 'deleteRates', 'updateRates':
+                float arrays, queries per second of each node since the
+                previous sample (null for a node sampled the first time)
+            'meanSelectRate', 'meanInsertRate', 'meanDeleteRate',
+            'meanUpdateRate': float, average queries per second across the
+                nodes (null if no node was sampled before)
+
+        All the variables of a node are read with a single query over a
+        connection kept open, and the nodes are queried in parallel. The
+        results are cached for a second.
         """
         nodes = self.config.get_nodes()
-        loads=[]
-        load=0.0
-        updates=[]
-        update=0.0
-        selects=[]
-        select=0
-        deletes=[]
-        delete=0
-        inserts=[]
-        insert=0
-        for node in nodes:
-            # self.logger.debug('connecting to: %s, using username: %s and pwd: %s' % (node.ip, 'root', self.root_pass))
-            db = MySQLdb.connect(node.ip, 'root', self.root_pass)
-            exc = db.cursor()
-            exc.execute("SHOW STATUS LIKE 'wsrep_local_recv_queue_avg';")
-            localLoad=exc.fetchone()[1]
-            loads.append(localLoad)
-            load=load+float(localLoad)
-            #select
-            exc.execute("SHOW GLOBAL STATUS LIKE 'Com_select';")
-            localSelect=exc.fetchone()[1]
-            selects.append(localSelect)
-            select=select+float(localSelect)
-            #insert
-            exc.execute("SHOW GLOBAL STATUS LIKE 'Com_insert';")
-            localInsert=exc.fetchone()[1]
-            inserts.append(localInsert)
-            insert=insert+float(localInsert)
-            #delete
-            exc.execute("SHOW GLOBAL STATUS LIKE 'Com_delete';")
-            localDelete=exc.fetchone()[1]
-            deletes.append(localDelete)
-            delete=delete+float(localDelete)
-            #update
-            exc.execute("SHOW GLOBAL STATUS LIKE 'Com_update';")
-            localUpdate=exc.fetchone()[1]
-            updates.append(localUpdate)
-            update=update+float(localUpdate)
-
-        if len(nodes)!=0 :
-            l=len(nodes)
-        else:
-            l=1
-        meanLoad=load/l
-        meanSelect=select/l
-        meanUpdate=update/l
-        meanDelete=delete/l
-        meanInsert=insert/l
-        return HttpJsonResponse({
-                     'loads': loads,
-                     'meanLoad': meanLoad,
-                     'updates': updates,
-                     'meanUpdate' : meanUpdate,
-                     'selects': selects,
-                     'meanSelect': meanSelect,
-                     'deletes' : deletes,
-                     'meanDelete' : meanDelete,
-                     'inserts': inserts,
-                     'meanInsert': meanInsert
-                                     })
+        metrics = self.metrics.collect([node.ip for node in nodes],
+                                       'root', self.root_pass)
+        return HttpJsonResponse(metrics)
 
     @expose('GET')
     def getGangliaParams(self, kwargs):
@@ -361,11 +319,12 @@ class MySQLManager(BaseManager):
         glb_nodes = self.config.get_glb_nodes()
         nodesIp = ["%s:%s" % (node.ip, self.config.MYSQL_PORT)  # FIXME: find real mysql port instead of default 3306
                          for node in rm_reg_nodes]
-        for glb in glb_nodes:
-                agent.remove_glbd_nodes(glb.ip, self.config.AGENT_PORT, nodesIp)
+        self._call_agents(lambda glb: agent.remove_glbd_nodes(glb.ip, self.config.AGENT_PORT, nodesIp),
+                          glb_nodes, 'Failed to remove MySQL nodes from GLB node %s',
+                          error_state=False)
         nodes = rm_reg_nodes + rm_glb_nodes
-        for node in nodes:
-            agent.stop(node.ip, self.config.AGENT_PORT)
+        self._call_agents(lambda node: agent.stop(node.ip, self.config.AGENT_PORT),
+                          nodes, 'Failed to stop node %s', error_state=False)
         self.config.remove_nodes(nodes)
         if (len(self.config.get_nodes()) +len(self.config.get_glb_nodes())==0 ):
             self.state_set(self.S_STOPPED)
@@ -522,6 +481,7 @@ class MySQLManager(BaseManager):
         return HttpJsonResponse({'state': self.state, 'type': 'mysql'})
 
     def on_stop(self):
+        self.metrics.close()
         res = self._do_remove_nodes(self.config.serviceNodes.values(),self.config.glb_service_nodes.values())
         self.config.serviceNodes = {}
         self.config.glb_service_nodes = {}
@@ -569,10 +529,7 @@ class MySQLManager(BaseManager):
         fd, filename = tempfile.mkstemp(dir='/tmp')
         fd = os.fdopen(fd, 'w')
         upload = mysqldump_file.file
-        bytes = upload.read(2048)
-        while len(bytes) != 0:
-            fd.write(bytes)
-            bytes = upload.read(2048)
+        shutil.copyfileobj(upload, fd)
         fd.close()
 
         # at least one agent since state is S_RUNNING
@@ -618,7 +575,7 @@ class MySQLManager(BaseManager):
             return HttpErrorResponse("Failed to run mysqldump: %s." % error)
 
 
-    @expose('GET')
+    @expose('GET', serialized=True)
     def remove_specific_nodes(self, kwargs):
         """
         Remove MySQL Galera nodes.
@@ -663,7 +620,7 @@ class MySQLManager(BaseManager):
         Thread(target=self._do_remove_nodes, args=[rm_reg_nodes,rm_glb_nodes]).start()
         return HttpJsonResponse()
 
-    @expose('GET')
+    @expose('GET', serialized=True)
     def setMySqlParams(self, kwargs):
         """
         set a specified global variable of mysql to the value provided
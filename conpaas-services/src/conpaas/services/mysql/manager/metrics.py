@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Status variables of the MySQL Galera nodes, as served by getMeanLoad.
+
+    The collector keeps a connection to every node and reads all the
+    variables in a single query per node, querying the nodes in parallel.
+    A query failing on a kept connection, which the node may have closed
+    meanwhile, is retried once on a new connection.
+    Counters are turned into rates from the previous sample of the node,
+    and the result is cached for a short time so that frequent polling
+    does not load the cluster.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import time
+from threading import Lock
+
+import MySQLdb
+
+from conpaas.core import fanout
+
+LOAD_VARIABLE = 'wsrep_local_recv_queue_avg'
+
+# counters of the queries, with the name of the rate in the results
+COUNTERS = [('Com_select', 'select'),
+            ('Com_insert', 'insert'),
+            ('Com_delete', 'delete'),
+            ('Com_update', 'update')]
+
+STATUS_QUERY = "SHOW GLOBAL STATUS WHERE Variable_name IN (%s);" % \
+    ', '.join("'%s'" % name for name in [LOAD_VARIABLE] + [c for c, _ in COUNTERS])
+
+# seconds during which the last results are served again
+DEFAULT_TTL = 1.0
+
+# seconds to wait for a node accepting a connection, short as the
+# collector waits for all the nodes
+CONNECT_TIMEOUT = 5
+
+
+class MetricsCollector(object):
+
+    def __init__(self, logger, ttl=DEFAULT_TTL, connect=MySQLdb.connect,
+                 clock=time):
+        self.logger = logger
+        self.ttl = ttl
+        self.connect = connect
+        self.clock = clock
+        self.connections = {}   # ip -> connection
+        self.samples = {}       # ip -> (time, status variables)
+        self.cached = None
+        self.cached_time = None
+        self.cached_ips = None
+        self.lock = Lock()
+
+    def _read_status(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(STATUS_QUERY)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        return dict((name.lower(), value) for name, value in rows)
+
+    def _query(self, ip, user, password):
+        conn = self.connections.get(ip)
+        if conn is not None:
+            try:
+                return self._read_status(conn)
+            except (MySQLdb.OperationalError, MySQLdb.InterfaceError) as ex:
+                # the connection was lost (e.g. the node restarted or
+                # closed it for being idle): retry on a new one
+                self.logger.warning('Lost the connection to MySQL node %s (%s), '
+                                    'reconnecting' % (ip, ex))
+                self._close_connection(ip)
+
+        conn = self.connect(ip, user, password,
+                            connect_timeout=CONNECT_TIMEOUT)
+        self.connections[ip] = conn
+        try:
+            return self._read_status(conn)
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+            # the next call opens a new connection
+            self.close_node(ip)
+            raise
+
+    def _close_connection(self, ip):
+        conn = self.connections.pop(ip, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close_node(self, ip):
+        self._close_connection(ip)
+        self.samples.pop(ip, None)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for ip in self.connections.keys():
+                self.close_node(ip)
+            self.cached = None
+        finally:
+            self.lock.release()
+
+    def collect(self, ips, user, password):
+        """
+        Return the load and the query counters of every node, their mean
+        across the nodes, and the query rates since the previous sample
+        of the nodes (None for the nodes sampled for the first time).
+        """
+        self.lock.acquire()
+        try:
+            now = self.clock.time()
+            if self.cached is not None and self.cached_ips == ips \
+                    and now - self.cached_time < self.ttl:
+                return self.cached
+
+            for ip in self.connections.keys():
+                if ip not in ips:
+                    self.close_node(ip)
+
+            outcome = fanout.call_nodes(
+                lambda ip: self._query(ip, user, password), ips)
+            for ip in outcome.failed_nodes():
+                self.logger.error('Failed to read the status of MySQL node %s: %s'
+                                  % (ip, outcome.errors[ip]))
+            outcome.check()
+
+            result = self._summarize(ips, outcome.results, now)
+            self.cached = result
+            self.cached_time = now
+            self.cached_ips = list(ips)
+            return result
+        finally:
+            self.lock.release()
+
+    def _summarize(self, ips, status, now):
+        result = {'loads': [], 'meanLoad': 0.0}
+        for _, name in COUNTERS:
+            result[name + 's'] = []
+            result[name + 'Rates'] = []
+
+        for ip in ips:
+            variables = status[ip]
+            result['loads'].append(variables[LOAD_VARIABLE.lower()])
+            previous = self.samples.get(ip)
+            for counter, name in COUNTERS:
+                value = variables[counter.lower()]
+                result[name + 's'].append(value)
+                rate = None
+                if previous is not None and now > previous[0]:
+                    delta = float(value) - float(previous[1][counter.lower()])
+                    # a negative delta means the counters were reset
+                    rate = max(delta, 0.0) / (now - previous[0])
+                result[name + 'Rates'].append(rate)
+            self.samples[ip] = (now, variables)
+
+        count = max(len(ips), 1)
+        result['meanLoad'] = sum(float(v) for v in result['loads']) / count
+        for _, name in COUNTERS:
+            mean_name = 'mean' + name.capitalize()
+            result[mean_name] = sum(float(v) for v in result[name + 's']) / count
+            rates = [r for r in result[name + 'Rates'] if r is not None]
+            result[mean_name + 'Rate'] = sum(rates) / len(rates) if rates else None
+        return result
@@ -26,14 +26,19 @@ class ScalarisAgent(BaseAgent):
       self.first_node = config_parser.get('agent', 'FIRST_NODE')
       self.known_hosts = config_parser.get('agent', 'KNOWN_HOSTS')
       self.mgmt_server = config_parser.get('agent', 'MGMT_SERVER')
+      # kept-alive connections to the local scalaris node
+      self.scalaris_pool = scalaris.ClusterConnectionPool()
 
     @expose('GET')
     def get_service_info(self, kwargs):
       self.logger.info('called get_service_info')
       try:
           params = []
-          json = scalaris.JSONConnection()
-          res = json.call('get_service_info', params)
+          json = self.scalaris_pool.get_connection()
+          try:
+              res = json.call('get_service_info', params)
+          finally:
+              self.scalaris_pool.release_connection(json)
           return HttpJsonResponse(res)
       except HttpError as e:
           self.logger.info('exception in get_service_info: %s', e)
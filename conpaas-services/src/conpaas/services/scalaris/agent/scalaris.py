@@ -15,8 +15,8 @@
 
 import json
 
-import httplib, urlparse, base64, urllib
-import os, threading, numbers
+import httplib, urlparse, base64
+import os, threading, numbers, time
 from datetime import datetime, timedelta
 
 if 'SCALARIS_JSON_URL' in os.environ and os.environ['SCALARIS_JSON_URL'] != '':
@@ -28,6 +28,26 @@ DEFAULT_TIMEOUT = 5
 """socket timeout in seconds"""
 DEFAULT_PATH = '/jsonrpc.yaws'
 """path to the json rpc page"""
+DEFAULT_MAX_BATCH = 100
+"""maximum number of operations sent in a single req_list call by BatchingClient"""
+DEFAULT_NODE_RETRY = 30
+"""seconds during which ClusterConnectionPool does not use a node that failed"""
+
+def _escape_body(params_json):
+    """
+    Escapes the characters of a JSON request which the URL decoding of the
+    request body by the scalaris JSON API would alter: '%' and '+', and '?',
+    after which yaws stops decoding. Compact JSON has no other such
+    characters, so the rest of the request is sent as is instead of being
+    URL-quoted as a whole.
+    """
+    if '%' in params_json:
+        params_json = params_json.replace('%', '%25')
+    if '+' in params_json:
+        params_json = params_json.replace('+', '%2B')
+    if '?' in params_json:
+        params_json = params_json.replace('?', '%3F')
+    return params_json
 
 class JSONConnection(object):
     """
@@ -38,6 +58,7 @@ class JSONConnection(object):
         """
         Creates a JSON connection to the given URL using the given TCP timeout
         """
+        self.url = url
         try:
             uri = urlparse.urlparse(url)
             self._conn = httplib.HTTPConnection(uri.hostname, uri.port,
@@ -52,41 +73,39 @@ class JSONConnection(object):
         """
         Calls the given function with the given parameters via the JSON
         interface of scalaris.
+        If the connection was closed by the node (e.g. a kept-alive connection
+        timed out), the call is sent once more on a new connection.
         """
         params2 = {'jsonrpc': '2.0',
                   'method': function,
                   'params': params,
                   'id': 0}
-        try:
+        # use compact JSON encoding:
+        body = _escape_body(json.dumps(params2, separators=(',',':')))
+        headers = {"Content-type": "application/json; charset=utf-8"}
+        attempts = 2 if retry_if_bad_status else 1
+        while True:
+            attempts -= 1
             data = None
             response = None
-            # use compact JSON encoding:
-            params_json = json.dumps(params2, separators=(',',':'))
-            headers = {"Content-type": "application/json; charset=utf-8"}
-            # note: we need to quote, e.g. if a '%' is in the value string:
-            self._conn.request("POST", path, urllib.quote(params_json), headers)
-            response = self._conn.getresponse()
-            #print response.status, response.reason
-            data = response.read().decode('utf-8')
-            if (response.status < 200 or response.status >= 300):
-                raise ConnectionError(data, response = response)
-            response_json = json.loads(data)
-            return response_json['result']
-        except httplib.BadStatusLine as instance:
-            #print 'HTTP STATUS:', response.status, response.reason, params_json
-            self.close()
-            if retry_if_bad_status:
-                return self.call(function, params, path = path, retry_if_bad_status = False)
-            else:
+            try:
+                self._conn.request("POST", path, body, headers)
+                response = self._conn.getresponse()
+                data = response.read().decode('utf-8')
+                if (response.status < 200 or response.status >= 300):
+                    raise ConnectionError(data, response = response)
+                response_json = json.loads(data)
+                return response_json['result']
+            except httplib.BadStatusLine as instance:
+                self.close()
+                if attempts == 0:
+                    raise ConnectionError(data, response = response, error = instance)
+            except ConnectionError:
+                self.close()
+                raise
+            except Exception as instance:
+                self.close()
                 raise ConnectionError(data, response = response, error = instance)
-        except ConnectionError:
-            #print 'HTTP STATUS:', response.status, response.reason, params_json
-            self.close()
-            raise
-        except Exception as instance:
-            #print 'HTTP STATUS:', response.status, response.reason, params_json
-            self.close()
-            raise ConnectionError(data, response = response, error = instance)
 
     @staticmethod
     def encode_value(value):
@@ -670,14 +689,18 @@ class DeleteResult(object):
 
 class ConnectionPool(object):
     """
-    Implements a simple (thread-safe) connection pool for Scalaris connections.
+    Implements a simple (thread-safe) connection pool for Scalaris connections
+    to a single node.
     """
     
-    def __init__(self, max_connections):
+    def __init__(self, max_connections, url = DEFAULT_URL, timeout = DEFAULT_TIMEOUT):
         """
-        Create a new connection pool with the given maximum number of connections.
+        Create a new connection pool with the given maximum number of connections
+        (0 for no maximum) to the node at the given URL.
         """
         self._max_connections = max_connections
+        self._url = url
+        self._timeout = timeout
         self._available_conns = []
         self._checked_out_sema = threading.BoundedSemaphore(value=max_connections)
         self._wait_cond = threading.Condition()
@@ -687,7 +710,7 @@ class ConnectionPool(object):
         Creates a new connection for the pool. Override this to use some other
         connection class than JSONConnection.
         """
-        return JSONConnection()
+        return JSONConnection(self._url, self._timeout)
     
     def _get_connection(self):
         """
@@ -696,11 +719,9 @@ class ConnectionPool(object):
         been hit.
         """
         conn = None
-        if self._max_connections == 0:
-            conn = self._new_connection()
-        elif self._checked_out_sema.acquire(False):
+        if self._max_connections == 0 or self._checked_out_sema.acquire(False):
             try:
-                conn = self._available_conns.pop(0)
+                conn = self._available_conns.pop()
             except IndexError:
                 conn = self._new_connection()
         return conn
@@ -715,36 +736,296 @@ class ConnectionPool(object):
         If the timeout is hit and no connection is available, <tt>None</tt> is
         returned.
         """
-        if timeout == None:
-            return self._get_connection()
-        else:
-            if isinstance(timeout, numbers.Integral ):
+        self._wait_cond.acquire()
+        try:
+            conn = self._get_connection()
+            if conn is not None or timeout is None:
+                return conn
+            if isinstance(timeout, numbers.Integral):
                 timeout = timedelta(milliseconds=timeout)
-            start = datetime.now()
-            while True:
-                conn = self._get_connection()
-                if not conn is None:
-                    return conn
-                self._wait_cond.wait(timeout.microseconds / 1000.0)
-                end = datetime.now()
-                if end - start > timeout:
+            end = datetime.now() + timeout
+            while conn is None:
+                remaining = end - datetime.now()
+                if remaining <= timedelta(0):
                     return None
+                self._wait_cond.wait(remaining.total_seconds())
+                conn = self._get_connection()
+            return conn
+        finally:
+            self._wait_cond.release()
     
     def release_connection(self, connection):
         """
         Puts the given connection back into the pool.
         """
-        self._available_conns.append(connection)
-        self._checked_out_sema.release()
-        self._wait_cond.notify_all()
+        self._wait_cond.acquire()
+        try:
+            self._available_conns.append(connection)
+            if self._max_connections != 0:
+                self._checked_out_sema.release()
+            self._wait_cond.notify_all()
+        finally:
+            self._wait_cond.release()
     
     def close_all(self):
         """
         Close all connections to scalaris.
         """
-        for conn in self._available_conns:
-            conn.close()
-        self._available_conns = []
+        self._wait_cond.acquire()
+        try:
+            for conn in self._available_conns:
+                conn.close()
+            self._available_conns = []
+        finally:
+            self._wait_cond.release()
+
+class ClusterConnectionPool(object):
+    """
+    Connection pools to several nodes of a scalaris ring (thread-safe).
+    Connections are taken from the nodes in turn, which spreads the requests
+    across the ring, and a node whose connection failed is left out for
+    node_retry seconds (unless all the nodes failed).
+    """
+    
+    def __init__(self, urls = None, max_connections = 0, timeout = DEFAULT_TIMEOUT,
+                 node_retry = DEFAULT_NODE_RETRY):
+        """
+        Create connection pools to the nodes at the given URLs (by default
+        the default one), with at most max_connections connections per node
+        (0 for no maximum).
+        """
+        if urls is None:
+            urls = [DEFAULT_URL]
+        if len(urls) == 0:
+            raise ValueError("No scalaris node given")
+        self._urls = list(urls)
+        self._pools = dict((url, ConnectionPool(max_connections, url, timeout)) for url in self._urls)
+        self._node_retry = node_retry
+        self._failed = {}
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def _nodes_in_turn(self):
+        """
+        Returns the URLs of the nodes in the order in which to try them.
+        """
+        self._lock.acquire()
+        try:
+            start = self._next
+            self._next = (self._next + 1) % len(self._urls)
+            urls = self._urls[start:] + self._urls[:start]
+            now = time.time()
+            for url, failed in self._failed.items():
+                if now - failed >= self._node_retry:
+                    del self._failed[url]
+            alive = [url for url in urls if url not in self._failed]
+            if len(alive) == 0:
+                # all the nodes failed, the one which failed first may be back
+                alive = sorted(urls, key = lambda url: self._failed[url])
+            return alive
+        finally:
+            self._lock.release()
+    
+    def get_connection(self, timeout = None):
+        """
+        Gets a connection to the next node having one available, waiting at
+        most the given timeout (see ConnectionPool.get_connection) for a
+        connection to the next node if none has.
+        """
+        urls = self._nodes_in_turn()
+        for url in urls:
+            conn = self._pools[url].get_connection()
+            if conn is not None:
+                return conn
+        return self._pools[urls[0]].get_connection(timeout)
+    
+    def get_urls(self):
+        """
+        Returns the URLs of the nodes of the pool.
+        """
+        return list(self._urls)
+    
+    def release_connection(self, connection, failed = False):
+        """
+        Puts the given connection back into the pool of its node. If failed,
+        the node is left out for a while.
+        """
+        if failed:
+            self._lock.acquire()
+            try:
+                self._failed[connection.url] = time.time()
+            finally:
+                self._lock.release()
+        self._pools[connection.url].release_connection(connection)
+    
+    def close_all(self):
+        """
+        Close all connections to scalaris.
+        """
+        for pool in self._pools.values():
+            pool.close_all()
+
+class _BatchedOperation(object):
+    """
+    Read or write waiting to be sent by BatchingClient.
+    """
+    
+    def __init__(self, request, process_result):
+        self.request = request
+        self.process_result = process_result
+        self.result = None
+        self.error = None
+        self.done = False
+    
+    def get_result(self):
+        """
+        Returns the processed result of the operation or raises its error.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.process_result(self.result)
+
+class BatchingClient(object):
+    """
+    Single read and write operations on scalaris, as TransactionSingleOp, for
+    many threads at a time (e.g. the session handlers of a web server).
+    Operations issued at the same time are sent together in single req_list
+    calls of at most max_batch operations, over connections of a
+    ClusterConnectionPool: while max_in_flight calls are in progress, new
+    operations wait and go with the next call. A call whose connection failed
+    is sent once more to another node.
+    """
+    
+    def __init__(self, pool = None, max_batch = DEFAULT_MAX_BATCH, max_in_flight = None):
+        """
+        Create a new client sending the operations over the given pool (by
+        default a ClusterConnectionPool to the default URL), with at most
+        max_in_flight calls at a time (by default two per node).
+        """
+        if pool is None:
+            pool = ClusterConnectionPool()
+        if max_in_flight is None:
+            max_in_flight = 2 * len(pool.get_urls())
+        if max_batch < 1 or max_in_flight < 1:
+            raise ValueError("max_batch and max_in_flight must be integers > 0")
+        self._pool = pool
+        self._max_batch = max_batch
+        self._max_in_flight = max_in_flight
+        self._pending = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+    
+    @staticmethod
+    def _process_result_write(result):
+        JSONConnection.check_fail_abort(result)
+        return JSONConnection.process_result_write(result)
+    
+    def _send(self, batch):
+        """
+        Sends the operations of batch in a single req_list call and stores
+        their results.
+        """
+        requests = [op.request for op in batch]
+        error = None
+        for attempt in range(2):
+            conn = self._pool.get_connection(DEFAULT_TIMEOUT * 1000)
+            if conn is None:
+                error = ConnectionError(None, error = 'no connection to scalaris available')
+                break
+            try:
+                result = conn.callp('/api/tx.yaws', 'req_list_commit_each', [requests])
+                result = conn.process_result_req_list_tso(result)
+                if len(result) != len(batch):
+                    raise UnknownError(result)
+            except ConnectionError as instance:
+                self._pool.release_connection(conn, failed = True)
+                error = instance
+                continue
+            except Exception as instance:
+                self._pool.release_connection(conn)
+                error = instance
+                break
+            self._pool.release_connection(conn)
+            for op, op_result in zip(batch, result):
+                op.result = op_result
+                op.done = True
+            return
+        for op in batch:
+            op.error = error
+            op.done = True
+    
+    def _execute(self, ops):
+        """
+        Queues the given operations and returns once they are all done,
+        sending the queued operations while calls may be added.
+        """
+        self._cond.acquire()
+        try:
+            self._pending.extend(ops)
+            while not all(op.done for op in ops):
+                if self._in_flight >= self._max_in_flight or len(self._pending) == 0:
+                    self._cond.wait()
+                    continue
+                batch = self._pending[:self._max_batch]
+                del self._pending[:self._max_batch]
+                self._in_flight += 1
+                self._cond.release()
+                try:
+                    self._send(batch)
+                finally:
+                    self._cond.acquire()
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+        finally:
+            self._cond.release()
+        return ops
+    
+    def read(self, key):
+        """
+        Read the value at key.
+        """
+        op = _BatchedOperation({'read': key}, JSONConnection.process_result_read)
+        return self._execute([op])[0].get_result()
+    
+    def write(self, key, value):
+        """
+        Write the value to key.
+        """
+        op = _BatchedOperation({'write': {key: JSONConnection.encode_value(value)}},
+                               self._process_result_write)
+        self._execute([op])[0].get_result()
+    
+    def read_many(self, keys):
+        """
+        Read the values at the given keys. Returns a dict of the values of
+        the keys found.
+        """
+        ops = self._execute([_BatchedOperation({'read': key}, JSONConnection.process_result_read)
+                             for key in keys])
+        values = {}
+        for key, op in zip(keys, ops):
+            try:
+                values[key] = op.get_result()
+            except NotFoundError:
+                pass
+        return values
+    
+    def write_many(self, values):
+        """
+        Write the values of the given dict to their keys.
+        """
+        ops = self._execute([_BatchedOperation({'write': {key: JSONConnection.encode_value(value)}},
+                                               self._process_result_write)
+                             for key, value in values.items()])
+        for op in ops:
+            op.get_result()
+    
+    def close_connection(self):
+        """
+        Close the connections to scalaris
+        (they will automatically be re-opened on the next request).
+        """
+        self._pool.close_all()
 
 class TransactionSingleOp(object):
     """
@@ -8,7 +8,6 @@ import httplib
 import json
 
 from conpaas.core import https
-from conpaas.core.misc import file_get_contents
 
 
 class AgentException(Exception):
@@ -26,7 +25,7 @@ def _check(response):
     if data['error']:
         raise AgentException(data['error'])
     else:
-        return True
+        return data['result']
 
 
 def createScalaris(host, port, first_node, known_hosts):
@@ -66,6 +65,11 @@ def getHttpProxyState(host, port):
     return _check(https.client.jsonrpc_get(host, port, '/', method))
 
 
+def getResponseTimeHistograms(host, port):
+    method = 'getResponseTimeHistograms'
+    return _check(https.client.jsonrpc_get(host, port, '/', method))
+
+
 def createHttpProxy(host, port, proxy_port, code_version, cdn=False, web_list=[], fpm_list=[], tomcat_list=[], tomcat_servlets=[]):
     method = 'createHttpProxy'
     params = {
@@ -144,6 +148,25 @@ def stopPHP(host, port):
     return _check(https.client.jsonrpc_post(host, port, '/', method))
 
 
+def missingCodeBlobs(host, port, hashes):
+    method = 'missingCodeBlobs'
+    params = {
+        'hashes': hashes,
+    }
+    return _check(https.client.jsonrpc_post(host, port, '/', method, params=params))['missing']
+
+
+def relayCode(host, port, peer, peer_port, method, codeVersionId, manifest):
+    params = {
+        'peer': peer,
+        'port': peer_port,
+        'method': method,
+        'codeVersionId': codeVersionId,
+        'manifest': manifest,
+    }
+    return _check(https.client.jsonrpc_post(host, port, '/', 'relayCode', params=params))
+
+
 def updatePHPCode(host, port, codeVersionId, filetype, filepath):
     params = {
         'method': 'updatePHPCode',
@@ -153,8 +176,12 @@ def updatePHPCode(host, port, codeVersionId, filetype, filepath):
 
     if filetype != 'git':
         # File-based code uploads
-        files = [('file', filepath, file_get_contents(filepath))]
-        return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        code = open(filepath, 'rb')
+        try:
+            files = [('file', filepath, code)]
+            return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        finally:
+            code.close()
     else:
         # For git-based code uploads, filepath contains the git revision
         params['revision'] = filepath
@@ -188,8 +215,12 @@ def updateTomcatCode(host, port, codeVersionId, filetype, filepath):
 
     if filetype != 'git':
         # File-based code uploads
-        files = [('file', filepath, file_get_contents(filepath))]
-        return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        code = open(filepath, 'rb')
+        try:
+            files = [('file', filepath, code)]
+            return _check(https.client.https_post(host, port, '/', params=params, files=files))
+        finally:
+            code.close()
     else:
         # For git-based code uploads, filepath contains the git revision
         params['revision'] = filepath
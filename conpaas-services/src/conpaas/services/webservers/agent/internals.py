@@ -7,19 +7,21 @@
 from os.path import exists, devnull, join
 from subprocess import Popen
 from os import remove, makedirs, rename
-from shutil import rmtree
 from threading import Lock
 import pickle
+import json
 import zipfile
 import tarfile
 import copy
 
 from conpaas.core.agent import BaseAgent, AgentException
 from conpaas.services.webservers.agent import role
+from conpaas.services.webservers.agent import client
 
 from conpaas.core.https.server import HttpErrorResponse, HttpJsonResponse, FileUploadField
 from conpaas.core.expose import expose
 from conpaas.core import git
+from conpaas.core import codestore
 
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
@@ -45,6 +47,8 @@ class WebServersAgent(BaseAgent):
         self.php_file = join(self.VAR_TMP, 'php.pickle')
         self.tomcat_file = join(self.VAR_TMP, 'tomcat.pickle')
         self.scalaris_file = join(self.VAR_TMP, 'scalaris.pickle')
+        # written by the nginx_proxy_mon Ganglia module
+        self.histogram_file = join(self.VAR_CACHE, 'nginx-proxy-histograms.json')
 
         self.web_lock = Lock()
         self.webservertomcat_lock = Lock()
@@ -53,6 +57,8 @@ class WebServersAgent(BaseAgent):
         self.tomcat_lock = Lock()
         self.scalaris_lock = Lock()
 
+        self.code_store = codestore.BlobStore(join(self.VAR_CACHE, 'code_blobs'))
+
         self.WebServer = role.NginxStatic
         self.HttpProxy = role.NginxProxy
 
@@ -209,6 +215,28 @@ class WebServersAgent(BaseAgent):
         with self.httpproxy_lock:
             return self._get(kwargs, self.httpproxy_file, self.HttpProxy)
 
+    @expose('GET')
+    def getResponseTimeHistograms(self, kwargs):
+        """GET the histograms of the response times of the HttpProxy since
+        its monitoring started, empty if there are none yet"""
+        try:
+            exp_params = []
+            check_arguments(exp_params, kwargs)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        if not exists(self.histogram_file):
+            return HttpJsonResponse({})
+        try:
+            f = open(self.histogram_file)
+            try:
+                histograms = json.load(f)
+            finally:
+                f.close()
+        except Exception as ex:
+            return HttpErrorResponse("Failed to read the response time histograms: %s" % ex)
+        return HttpJsonResponse(histograms)
+
     @expose('POST')
     def stopWebServer(self, kwargs):
         """KILL the WebServer"""
@@ -335,9 +363,46 @@ class WebServersAgent(BaseAgent):
         #  self.logger.exception('Failed to start the script to fix the session handlers')
         #  raise OSError('Failed to start the script to fix the session handlers')
 
+    @expose('POST')
+    def missingCodeBlobs(self, kwargs):
+        """Return which of the given blobs are not in the code cache"""
+        exp_params = [('hashes', is_list)]
+        try:
+            hashes = check_arguments(exp_params, kwargs)
+            missing = self.code_store.missing(hashes)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+        return HttpJsonResponse({'missing': missing})
+
+    @expose('POST')
+    def relayCode(self, kwargs):
+        """Send a code version of the code cache to another agent"""
+        exp_params = [('peer', is_string),
+                      ('port', is_pos_int),
+                      ('method', is_in_list(['updatePHPCode', 'updateTomcatCode'])),
+                      ('codeVersionId', is_string),
+                      ('manifest', is_dict)]
+        try:
+            peer, port, method, codeVersionId, manifest = check_arguments(exp_params, kwargs)
+            if self.code_store.missing(codestore.manifest_hashes(manifest)):
+                raise Exception("Code version '%s' is not in the code cache" % codeVersionId)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        try:
+            codestore.push_code(
+                self.code_store, manifest,
+                lambda hashes: client.missingCodeBlobs(peer, port, hashes),
+                lambda bundle: getattr(client, method)(peer, port, codeVersionId,
+                                                       'bundle', bundle))
+        except Exception as ex:
+            self.logger.exception('Failed to relay the code to %s' % peer)
+            return HttpErrorResponse("%s" % ex)
+        return HttpJsonResponse()
+
     @expose('UPLOAD')
     def updatePHPCode(self, kwargs):
-        valid_filetypes = [ 'zip', 'tar', 'git' ]
+        valid_filetypes = ['zip', 'tar', 'git', 'bundle']
         exp_params = [('filetype', is_in_list(valid_filetypes)),
                       ('codeVersionId', is_string),
                       ('file', is_uploaded_file, None),
@@ -351,6 +416,23 @@ class WebServersAgent(BaseAgent):
         except Exception as ex:
             return HttpErrorResponse("%s" % ex)
 
+        if not exists(join(self.VAR_CACHE, 'www')):
+            makedirs(join(self.VAR_CACHE, 'www'))
+
+        target_dir = join(self.VAR_CACHE, 'www', codeVersionId)
+
+        if filetype == 'bundle':
+            try:
+                manifest = codestore.read_bundle(self.code_store, file.file)
+                codestore.checkout(self.code_store, manifest, target_dir,
+                                   prepare=self.fix_session_handlers)
+                # only the blobs of the active code are needed for the next update
+                self.code_store.prune(codestore.manifest_hashes(manifest))
+            except Exception as ex:
+                self.logger.exception('Failed to update the PHP code')
+                return HttpErrorResponse("%s" % ex)
+            return HttpJsonResponse()
+
         if filetype == 'zip':
             source = zipfile.ZipFile(file.file, 'r')
         elif filetype == 'tar':
@@ -358,12 +440,7 @@ class WebServersAgent(BaseAgent):
         elif filetype == 'git':
             source = git.DEFAULT_CODE_REPO
 
-        if not exists(join(self.VAR_CACHE, 'www')):
-            makedirs(join(self.VAR_CACHE, 'www'))
-
-        target_dir = join(self.VAR_CACHE, 'www', codeVersionId)
-        if exists(target_dir):
-            rmtree(target_dir)
+        codestore.remove_tree(target_dir)
 
         if filetype == 'git':
             subdir = str(self.SERVICE_ID)
@@ -417,7 +494,7 @@ class WebServersAgent(BaseAgent):
 
     @expose('UPLOAD')
     def updateTomcatCode(self, kwargs):
-        valid_filetypes = [ 'zip', 'tar', 'git' ]
+        valid_filetypes = ['zip', 'tar', 'git', 'bundle']
         exp_params = [('filetype', is_in_list(valid_filetypes)),
                       ('codeVersionId', is_string),
                       ('file', is_uploaded_file, None),
@@ -431,6 +508,19 @@ class WebServersAgent(BaseAgent):
         except Exception as ex:
             return HttpErrorResponse("%s" % ex)
 
+        target_dir = join(self.VAR_CACHE, 'tomcat_instance', 'webapps', codeVersionId)
+
+        if filetype == 'bundle':
+            try:
+                manifest = codestore.read_bundle(self.code_store, file.file)
+                codestore.checkout(self.code_store, manifest, target_dir)
+                # only the blobs of the active code are needed for the next update
+                self.code_store.prune(codestore.manifest_hashes(manifest))
+            except Exception as ex:
+                self.logger.exception('Failed to update the Tomcat code')
+                return HttpErrorResponse("%s" % ex)
+            return HttpJsonResponse()
+
         if filetype == 'zip':
             source = zipfile.ZipFile(file.file, 'r')
         elif filetype == 'tar':
@@ -438,9 +528,7 @@ class WebServersAgent(BaseAgent):
         elif filetype == 'git':
             source = git.DEFAULT_CODE_REPO
 
-        target_dir = join(self.VAR_CACHE, 'tomcat_instance', 'webapps', codeVersionId)
-        if exists(target_dir):
-            rmtree(target_dir)
+        codestore.remove_tree(target_dir)
 
         if filetype == 'git':
             subdir = str(self.SERVICE_ID)
@@ -4,7 +4,7 @@ Cost_controller is responsible for the management of the cost related activities
 @author: fernandez
 """
 
-from time import time
+import time
 from datetime import datetime, timedelta
 try:
     import simplejson as json
@@ -20,10 +20,11 @@ RELEASE_BEFORE_MAX = 20
 
 class Cost_Controller:
 
-    def __init__(self, logger, iaas_driver):
+    def __init__(self, logger, iaas_driver, clock=time):
         self.vmes_usage = {}
         self.logger = logger
         self.iaas_driver = iaas_driver
+        self.clock = clock
         self.cost_vmes_removal = 0
         self.total_cost = 0
         pricing_file_path = self.get_pricing_file_path()
@@ -102,7 +103,7 @@ class Cost_Controller:
         self.logger.info("cost_shutdown_constraint: Checking if it is possible to release " + str(ip) + " vm ")
         for ip_dict, (boottime, inst_type) in self.vmes_usage.iteritems():
             if ip_dict == ip:
-                time_secs = time() - boottime
+                time_secs = self.clock.time() - boottime
                 sec = timedelta(seconds=int(time_secs))
                 d = datetime(1, 1, 1) + sec
 
@@ -119,7 +120,7 @@ class Cost_Controller:
 
         for ip_dict, (boottime, inst_type) in self.vmes_usage.iteritems():
             if ip_dict in array_backends and inst_type == instance:
-                time_secs = time() - boottime
+                time_secs = self.clock.time() - boottime
                 sec = timedelta(seconds=int(time_secs))
                 d = datetime(1, 1, 1) + sec
 
@@ -138,7 +139,7 @@ class Cost_Controller:
     def print_vm_cost(self):
         self.total_cost = 0
         for ip, (boottime, inst_type) in self.vmes_usage.iteritems():
-            time_secs = time() - boottime
+            time_secs = self.clock.time() - boottime
             sec = timedelta(seconds=int(time_secs))
             d = datetime(1, 1, 1) + sec
             inst_cost = self.instances_type_price[self.iaas_driver][inst_type]
@@ -167,7 +168,7 @@ class Cost_Controller:
     def calculate_cost(self, ip):
         for ip_dict, (boottime, inst_type) in self.vmes_usage.iteritems():
             if ip_dict == ip:
-                time_secs = time() - boottime
+                time_secs = self.clock.time() - boottime
                 sec = timedelta(seconds=int(time_secs))
                 d = datetime(1, 1, 1) + sec
 
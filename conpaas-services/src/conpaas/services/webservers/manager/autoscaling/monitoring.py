@@ -9,14 +9,19 @@ import sys
 from subprocess import Popen, PIPE
 import socket
 from time import time
-from os import path, listdir
+from os import path
 from conpaas.services.webservers.manager.autoscaling.performance import ServicePerformance, ServiceNodePerf, StatUtils
+from conpaas.services.webservers.manager.autoscaling import rrd
 from conpaas.services.webservers.manager import client
+from conpaas.core.latency import LatencyHistogram
 
 
 DEFAULT_NUM_CPU = 1.0
 DEFAULT_RAM_MEMORY = '1034524.0'
 
+# Response times of which the proxies export histograms
+RESPONSE_TIME_HISTOGRAMS = ['web_response_time_lb', 'php_response_time_lb']
+
 
 class Monitoring_Controller:
 
@@ -30,6 +35,14 @@ class Monitoring_Controller:
         self.ganglia_rrd_dir = ganglia_rrd_dir
         self.last_collect_time = time()
 
+        # Ganglia RRD directory of every node IP
+        self.ganglia_hosts = {}
+        # (node IP, metric name) -> [timestamps, values] fetched for the
+        # current autoscaling step
+        self.collected_metrics = {}
+        # last histograms exported by every proxy IP
+        self.proxy_histograms = {}
+
         self.stat_utils = StatUtils()
 
         try:
@@ -111,41 +124,52 @@ class Monitoring_Controller:
         self.logger.info('Updating nodes information from ConPaaS manager...')
         self.logger.info('Updated service nodes: %s' % str(perf_info.serviceNodes))
 
-    def collect_monitoring_metric(self, node_ip, metric_name):
-        timestamps = []
-        param_values = []
-        # Added this for EC2, where the RRD directory names in Ganglia are hosts and not IPs:
-        ganglia_dir_name = ''
+    def _ganglia_dir_name(self, node_ip):
+        """
+        Name of the Ganglia RRD directory of a node. The mapping is
+        cached, so the reverse DNS lookup is done once per node.
+        """
+        dir_name = self.ganglia_hosts.get(node_ip)
+        if dir_name is not None:
+            return dir_name
 
+        # Added this for EC2, where the RRD directory names in Ganglia are hosts and not IPs:
         if node_ip.find('amazonaws') > 0:  # this is an IP address
-            ganglia_dir_name = node_ip
+            dir_name = node_ip
         else:  # this is a DNS name
-            for ganglia_host in listdir(self.ganglia_rrd_dir):
-                #self.logger.error('collect from ganglia host: ' + str(ganglia_host))
-                if ganglia_host.find('Summary') > 0:
-                    continue
-                try:
-                    hostname, array, array_ip = socket.gethostbyaddr(node_ip)
-                except Exception as ex:
-                    self.logger.warning('Found private ip when trying to get the hostname for ip %s: %s. ' % (str(node_ip), ex))
-                    ganglia_dir_name = node_ip
-                    break
-                #self.logger.error('gethostbyaddr: ' + hostname)
-                if ganglia_host == hostname:
-                    ganglia_dir_name = ganglia_host
-                    break
-
-        rrd_file_name = self.ganglia_rrd_dir + ganglia_dir_name + '/' + metric_name + '.rrd'
-#        self.logger.debug('rrd_file_name: ' + str(rrd_file_name))
-#    logger.info('Searching in RRD file:' + rrd_file_name)
+            try:
+                hostname, array_names, array_ip = socket.gethostbyaddr(node_ip)
+            except Exception as ex:
+                self.logger.warning('Found private ip when trying to get the hostname for ip %s: %s. ' % (str(node_ip), ex))
+                dir_name = node_ip
+            else:
+                if not path.isdir(path.join(self.ganglia_rrd_dir, hostname)):
+                    # Ganglia has not created it yet, look it up again next time
+                    return ''
+                dir_name = hostname
+
+        self.ganglia_hosts[node_ip] = dir_name
+        return dir_name
+
+    def _collect_from(self):
+        return self.last_collect_time - (time() - self.last_collect_time)
+
+    def _fetch_monitoring_metric(self, node_ip, metric_name, collect_from):
+        rrd_file_name = path.join(self.ganglia_rrd_dir, self._ganglia_dir_name(node_ip), metric_name + '.rrd')
         if (not path.isfile(rrd_file_name)):
             self.logger.error('RRD file not found: ' + rrd_file_name)
             return []
 
-        #logger.info('Getting monitoring info for node %s, parameter %s ...' % (node_ip, metric_name))
-#    logger.info('last collect time: ' + str(int(self.last_collect_time)))
-        collect_from = self.last_collect_time - (time() - self.last_collect_time)
-        #collect_from = self.last_collect_time
+        try:
+            timestamps, param_values = rrd.fetch(rrd_file_name, 'AVERAGE', start=collect_from, resolution=15, missing=-1)
+        except (rrd.RRDError, IOError) as ex:
+            self.logger.warning('Could not read %s (%s), using rrdtool' % (rrd_file_name, ex))
+            return self._rrdtool_fetch(rrd_file_name, collect_from)
+        return [timestamps, param_values]
+
+    def _rrdtool_fetch(self, rrd_file_name, collect_from):
+        timestamps = []
+        param_values = []
         fetch_cmd = ['rrdtool', 'fetch', '-s', str(int(collect_from)), '-r', '15',
                      str(rrd_file_name), 'AVERAGE']
         self.logger.debug("Fetching data with command: %s" % ' '.join(fetch_cmd))
@@ -154,7 +178,6 @@ class Monitoring_Controller:
 
         lines = stdout_req.splitlines()
         for line in lines:
-            # logger.debug(line)
             tokens = line.split()
             if (line.find('sum') >= 0 or len(tokens) < 2):
                 continue
@@ -166,21 +189,42 @@ class Monitoring_Controller:
             else:
                 param_values.append(-1)
 
-        # Cleaning the memory allocated by subprocess.Popen()
-        try:
-            proc.terminate()
-        except OSError:
-            #  logger.critical("Cannot kill the subprocess.popen rrdtool")
-            # can't kill a dead proc
-            pass
-
-        #logger.debug('timestamps: ' + str(timestamps))
-        #logger.debug('param values: ' + str(param_values))
         return [timestamps, param_values]
 
+    def collect_monitoring_metric(self, node_ip, metric_name):
+        """
+        Return [timestamps, values] of a metric of a node since the last
+        collection, or [] if the metric is not available. Metrics
+        fetched by init_collect_monitoring_data are not read again.
+        """
+        ret = self.collected_metrics.get((node_ip, metric_name))
+        if ret is None:
+            ret = self._fetch_monitoring_metric(node_ip, metric_name, self._collect_from())
+        if len(ret) == 0:
+            return []
+        # callers modify the series they get
+        return [list(ret[0]), list(ret[1])]
+
     def init_collect_monitoring_data(self):
+        """
+        Fetch, in one pass, all the metrics of all the nodes needed by
+        the collect_monitoring_data_* methods of this step.
+        """
         self.perf_info = self._performance_info_get()
 
+        collect_from = self._collect_from()
+        self.collected_metrics = {}
+        for node in self.perf_info.serviceNodes.values():
+            metrics = set()
+            if node.isRunningProxy:
+                metrics.update(self.monitoring_metrics_proxy)
+            if node.isRunningWeb:
+                metrics.update(self.monitoring_metrics_web)
+            if node.isRunningBackend:
+                metrics.update(self.monitoring_metrics_backend)
+            for metric_name in metrics:
+                self.collected_metrics[(node.ip, metric_name)] = self._fetch_monitoring_metric(node.ip, metric_name, collect_from)
+
     # FIXME: dead code?
     def collect_monitoring_data(self):
 
@@ -432,5 +476,51 @@ class Monitoring_Controller:
             proxy_monitoring_data[proxy_node.ip] = self.stat_utils.filter_monitoring_data(proxy_monitoring_data[proxy_node.ip], self.monitoring_metrics_proxy)
 
         self.last_collect_time = time()
+        self.collected_metrics = {}
 
         return proxy_monitoring_data
+
+    def collect_response_time_histograms(self):
+        """
+        Return the histograms of the response times of the requests served
+        by all the proxies since the previous call, by metric name, or {}
+        if they are not available.
+
+        The proxies export the histograms of all the response times since
+        their monitoring started: the histograms of the last interval are
+        the differences with the previous exports, merged across proxies.
+        A proxy seen for the first time only provides the reference of the
+        next call.
+        """
+        try:
+            proxies = client.get_response_time_histograms(self.manager_host, self.manager_port)['proxies']
+        except Exception as ex:
+            self.logger.warning('Could not retrieve the response time histograms: %s' % ex)
+            return {}
+
+        merged = dict((metric, LatencyHistogram()) for metric in RESPONSE_TIME_HISTOGRAMS)
+        collected = {}
+        for ip, exported in proxies.iteritems():
+            if not exported:
+                continue
+            histograms = dict((metric, LatencyHistogram.from_dict(exported[metric]))
+                              for metric in RESPONSE_TIME_HISTOGRAMS)
+            collected[ip] = (exported['started'], histograms)
+
+            previous = self.proxy_histograms.get(ip)
+            if previous is None:
+                continue
+            for metric in RESPONSE_TIME_HISTOGRAMS:
+                if previous[0] == exported['started']:
+                    interval = histograms[metric].difference(previous[1][metric])
+                else:
+                    # the monitoring of the proxy restarted
+                    interval = histograms[metric]
+                if interval is None:
+                    self.logger.warning('Inconsistent response time histograms of proxy %s' % ip)
+                    continue
+                merged[metric].merge(interval)
+
+        # proxies that were removed are forgotten
+        self.proxy_histograms = collected
+        return merged
@@ -0,0 +1,221 @@
+"""
+Vectorized and online forecasting models for the autoscaling.
+
+The models of Prediction_Models are refitted on the whole monitoring history
+at every autoscaling step. The online models of this module keep their state
+between steps and are only updated with the samples added to a series since
+the previous step:
+
+    RecursiveLeastSquares: autoregressive model fitted by recursive least
+                           squares, with exponential forgetting.
+    HoltWinters: streaming state of Prediction_Models.holtwinters.
+
+OnlineModels keeps one model per series. Fitting the statsmodels models is
+CPU bound, so Prediction_Models runs them in the process pool of this module
+(run_heavy) instead of in threads serialized by the GIL.
+"""
+
+import threading
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+# Order and forgetting factor of the online autoregressive model
+AR_ORDER = 5
+AR_FORGETTING = 0.98
+# Initial covariance of the RLS estimates, high values let the first samples
+# set the coefficients
+RLS_DELTA = 1000.0
+
+# Processes fitting the heavy models and time to wait for one of them
+HEAVY_MODEL_PROCESSES = 2
+HEAVY_MODEL_TIMEOUT = 60
+
+
+def correlation(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    assert len(x) == len(y)
+    assert len(x) > 0
+    xdiff = x - x.mean()
+    ydiff = y - y.mean()
+    return float(np.dot(xdiff, ydiff) / np.sqrt(np.dot(xdiff, xdiff) * np.dot(ydiff, ydiff)))
+
+
+class RecursiveLeastSquares(object):
+
+    """
+    Autoregressive model y[t] = c + a1 * y[t-1] + ... + ap * y[t-p], whose
+    coefficients are updated with every new sample. The weight of a sample
+    in the fit is forgetting ** age, so the model follows workload changes.
+    """
+
+    def __init__(self, order=AR_ORDER, forgetting=AR_FORGETTING, delta=RLS_DELTA):
+        self.order = order
+        self.forgetting = forgetting
+        self.theta = np.zeros(order + 1)
+        self.P = np.eye(order + 1) * delta
+        # last samples, the latest first
+        self.lags = deque(maxlen=order)
+
+    def update(self, values):
+        for value in values:
+            value = float(value)
+            if len(self.lags) == self.order:
+                x = np.concatenate(([1.0], self.lags))
+                Px = np.dot(self.P, x)
+                gain = Px / (self.forgetting + np.dot(x, Px))
+                self.theta += gain * (value - np.dot(self.theta, x))
+                self.P = (self.P - np.outer(gain, Px)) / self.forgetting
+            self.lags.appendleft(value)
+
+    def forecast(self, num_predictions):
+        if len(self.lags) < self.order:
+            raise ValueError('AR(%d) model needs at least %d samples' % (self.order, self.order))
+        lags = np.array(self.lags)
+        forecast = []
+        for i in range(num_predictions):
+            value = self.theta[0] + np.dot(self.theta[1:], lags)
+            forecast.append(float(value))
+            lags = np.concatenate(([value], lags[:-1]))
+        return forecast
+
+
+class HoltWinters(object):
+
+    """
+    Multiplicative Holt-Winters model with a season of c samples, that also
+    forecasts c samples. The level, trend and seasonal indices are
+    initialized from the first two seasons, as in
+    Prediction_Models.holtwinters, and then updated with every sample:
+    feeding a series at once or in pieces gives the same forecast.
+    """
+
+    def __init__(self, alpha, beta, gamma, c):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.c = c
+        self.level = None
+        self.trend = None
+        # seasonal indices of the next c samples
+        self.seasonal = None
+        # samples received before the model could be initialized
+        self.pending = []
+
+    def _initialize(self, y):
+        c = self.c
+        y = np.asarray(y[:2 * c], dtype=float)
+        ybar1 = y[:c].mean()
+        ybar2 = y[c:].mean()
+        b0 = (ybar2 - ybar1) / c
+        a0 = ybar1 - b0 * (c + 1) / 2.0
+        indices = y / (a0 + np.arange(1, 2 * c + 1) * b0)
+        seasonal = (indices[:c] + indices[c:]) / 2.0
+        seasonal *= c / seasonal.sum()
+        self.level = a0
+        self.trend = b0
+        self.seasonal = deque(seasonal.tolist())
+
+    def update(self, values):
+        if self.seasonal is None:
+            self.pending.extend(values)
+            if len(self.pending) < 2 * self.c:
+                return
+            values = self.pending
+            self.pending = []
+            self._initialize(values)
+
+        alpha, beta, gamma = self.alpha, self.beta, self.gamma
+        level, trend, seasonal = self.level, self.trend, self.seasonal
+        for y in values:
+            s = seasonal.popleft()
+            last_level = level
+            level = alpha * y / s + (1.0 - alpha) * (last_level + trend)
+            trend = beta * (level - last_level) + (1.0 - beta) * trend
+            seasonal.append(gamma * y / level + (1.0 - gamma) * s)
+        self.level, self.trend = level, trend
+
+    def forecast(self):
+        if self.seasonal is None:
+            raise ValueError('Holt-Winters model needs at least %d samples' % (2 * self.c))
+        return [float((self.level + self.trend * (m + 1)) * s)
+                for m, s in enumerate(self.seasonal)]
+
+
+class OnlineModels(object):
+
+    """
+    Online models of several series, identified by keys. Every model counts
+    the samples it was fed, so that only the samples appended to its series
+    since the previous update are fed to it, whatever their values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def update(self, key, factory, series, total=None):
+        """
+        Return the model of key fed the samples of series it was not fed yet.
+        total is the number of samples appended to the series since its
+        start, series holding the last of them. By default, every sample of
+        series is new. If total went back, as when the series starts over, a
+        new model, factory(), is fed the whole series.
+        """
+        series = list(series)
+        self._lock.acquire()
+        try:
+            model, fed = self._models.get(key, (None, 0))
+            if total is None:
+                total = fed + len(series)
+            if model is None or total < fed:
+                model = factory()
+                fed = total - len(series)
+            # the samples dropped from the window before being fed are lost
+            new = min(total - fed, len(series))
+            if new > 0:
+                model.update(series[len(series) - new:])
+            self._models[key] = (model, total)
+            return model
+        finally:
+            self._lock.release()
+
+    def reset(self, key=None):
+        self._lock.acquire()
+        try:
+            if key is None:
+                self._models = {}
+            else:
+                self._models.pop(key, None)
+        finally:
+            self._lock.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def process_pool():
+    """The pool of processes fitting the heavy models, created on first use."""
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = multiprocessing.Pool(HEAVY_MODEL_PROCESSES)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+
+def run_heavy(func, *args):
+    """
+    Return func(*args) computed in the process pool, or in this process if
+    the pool cannot be created. func must be a module-level function.
+    """
+    try:
+        pool = process_pool()
+    except OSError:
+        return func(*args)
+    return pool.apply_async(func, args).get(HEAVY_MODEL_TIMEOUT)
@@ -58,6 +58,11 @@ class Prediction_Models:
 
         return forecast
 
+    def recursive_least_squares(self, php_resp_time, num_predictions, key=None):
+        forecast = []
+
+        return forecast
+
     def arma(self, php_resp_time, num_predictions):
         forecast = []
 
@@ -82,7 +87,7 @@ class Prediction_Models:
 
         return forecast
 
-    def exponential_smoothing(self, php_resp_time, num_predictions):
+    def exponential_smoothing(self, php_resp_time, num_predictions, key=None):
         forecast = []
 
         return forecast
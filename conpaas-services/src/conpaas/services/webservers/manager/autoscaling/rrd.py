@@ -0,0 +1,211 @@
+"""
+Reader for the RRD files written by rrdtool (and thus by Ganglia).
+
+It reads the series of a round robin archive straight from the file,
+the same way 'rrdtool fetch' does, without spawning a process. RRD files
+are written in the native format of the machine: the byte order and the
+sizes and alignments of the C types are detected from the float cookie
+of the header. Versions 0001 to 0004 of the format are supported.
+"""
+
+import struct
+from array import array
+from time import time
+
+RRD_COOKIE = 'RRD\0'
+FLOAT_COOKIE = 8.642135E130
+SUPPORTED_VERSIONS = ('0001', '0002', '0003', '0004')
+
+# (word size, alignment of doubles) of the supported platforms:
+# 64-bit, 32-bit x86 and 32-bit platforms aligning doubles on 8 bytes
+LAYOUTS = ((8, 8), (4, 4), (4, 8))
+
+# Size of the arrays of parameters ('unival par[10]') of the structures
+PAR_SIZE = 10 * 8
+
+
+class RRDError(Exception):
+    pass
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class RRDHeader(object):
+
+    """
+    Header of an RRD file: data sources, round robin archives and the
+    offsets of their data.
+    """
+
+    def __init__(self, fd):
+        head = fd.read(128)
+        if len(head) < 16 or head[:4] != RRD_COOKIE:
+            raise RRDError('Not an RRD file')
+        self.version = head[4:8]
+        if self.version not in SUPPORTED_VERSIONS:
+            raise RRDError('Unsupported RRD version %s' % self.version)
+
+        self.byte_order = None
+        for byte_order in ('<', '>'):
+            for word, dalign in LAYOUTS:
+                offset = _align(9, dalign)
+                if len(head) < offset + 8:
+                    continue
+                if struct.unpack_from(byte_order + 'd', head, offset)[0] == FLOAT_COOKIE:
+                    self.byte_order, self.word, self.dalign = byte_order, word, dalign
+                    break
+            if self.byte_order is not None:
+                break
+        if self.byte_order is None:
+            raise RRDError('Unknown RRD file layout')
+
+        order = self.byte_order
+        ulong = 'Q' if self.word == 8 else 'I'
+        struct_align = max(self.word, self.dalign)
+
+        # stat_head_t
+        offset = _align(9, self.dalign) + 8
+        self.ds_cnt, self.rra_cnt, self.pdp_step = struct.unpack_from(order + ulong * 3, head, offset)
+        offset = _align(offset + 3 * self.word, self.dalign) + PAR_SIZE
+        offset = _align(offset, struct_align)
+
+        ds_def_size = _align(_align(40, self.dalign) + PAR_SIZE, struct_align)
+        rra_cnt_offset = _align(20, self.word)
+        rra_par_offset = _align(rra_cnt_offset + 2 * self.word, self.dalign)
+        rra_def_size = _align(rra_par_offset + PAR_SIZE, struct_align)
+        live_head_size = 2 * self.word if self.version >= '0003' else self.word
+        pdp_prep_size = _align(_align(30, self.dalign) + PAR_SIZE, struct_align)
+        cdp_prep_size = PAR_SIZE
+
+        header_size = (offset + self.ds_cnt * ds_def_size + self.rra_cnt * rra_def_size +
+                       live_head_size + self.ds_cnt * pdp_prep_size +
+                       self.rra_cnt * self.ds_cnt * cdp_prep_size + self.rra_cnt * self.word)
+        data = head + fd.read(header_size - len(head))
+        if len(data) < header_size:
+            raise RRDError('Truncated RRD header')
+
+        self.ds_names = []
+        for i in range(self.ds_cnt):
+            self.ds_names.append(data[offset:offset + 20].split('\0', 1)[0])
+            offset += ds_def_size
+
+        # list of [consolidation function, row count, PDPs per row,
+        # current row, offset of the data]
+        self.rras = []
+        for i in range(self.rra_cnt):
+            cf = data[offset:offset + 20].split('\0', 1)[0]
+            row_cnt, pdp_cnt = struct.unpack_from(order + ulong * 2, data, offset + rra_cnt_offset)
+            self.rras.append([cf, row_cnt, pdp_cnt])
+            offset += rra_def_size
+
+        self.last_up = struct.unpack_from(order + ulong, data, offset)[0]
+        offset += live_head_size
+        offset += self.ds_cnt * pdp_prep_size + self.rra_cnt * self.ds_cnt * cdp_prep_size
+
+        # current row and data offset of every archive
+        data_offset = header_size
+        for i in range(self.rra_cnt):
+            cur_row = struct.unpack_from(order + ulong, data, offset)[0]
+            offset += self.word
+            self.rras[i].extend([cur_row, data_offset])
+            data_offset += self.rras[i][1] * self.ds_cnt * 8
+
+    def choose_rra(self, cf, start, end, resolution):
+        """
+        Index of the archive 'rrdtool fetch' would read: the one whose
+        step is the closest to the resolution among the archives
+        covering the requested period, or else the one covering most of
+        the period.
+        """
+        best_full = best_part = None
+        for index, (rra_cf, row_cnt, pdp_cnt, cur_row, data_offset) in enumerate(self.rras):
+            if rra_cf != cf:
+                continue
+            step = pdp_cnt * self.pdp_step
+            cal_end = self.last_up - self.last_up % step
+            cal_start = cal_end - step * row_cnt
+            step_diff = abs(resolution - step)
+            if cal_start <= start:
+                if best_full is None or step_diff < best_full[0]:
+                    best_full = (step_diff, index)
+            else:
+                match = (end - start) - (cal_start - start)
+                if best_part is None or (match, -step_diff) > best_part[:2]:
+                    best_part = (match, -step_diff, index)
+        if best_full is not None:
+            return best_full[1]
+        if best_part is not None:
+            return best_part[2]
+        raise RRDError('No %s archive' % cf)
+
+
+def fetch(filename, cf='AVERAGE', start=None, end=None, resolution=None, ds=None, missing=None):
+    """
+    Read a series from an RRD file, like 'rrdtool fetch'.
+
+    @param cf Consolidation function of the archive
+    @param start, end Time interval (defaults: one day ago, now)
+    @param resolution Wanted step in seconds (default: the base step)
+    @param ds Name of the data source (default: the first one)
+    @param missing Value replacing unknown (NaN) values
+
+    @return A tuple of two arrays: the timestamps, which are the ends
+            of the intervals, and the values
+    """
+    if end is None:
+        end = time()
+    if start is None:
+        start = end - 86400
+    start, end = int(start), int(end)
+
+    fd = open(filename, 'rb')
+    try:
+        header = RRDHeader(fd)
+        if resolution is None:
+            resolution = header.pdp_step
+        if ds is None:
+            ds_index = 0
+        elif ds in header.ds_names:
+            ds_index = header.ds_names.index(ds)
+        else:
+            raise RRDError('No data source %s' % ds)
+
+        rra_cf, row_cnt, pdp_cnt, cur_row, data_offset = header.rras[header.choose_rra(cf, start, end, resolution)]
+        step = pdp_cnt * header.pdp_step
+        start -= start % step
+        if end % step:
+            end += step - end % step
+
+        timestamps = array('l', xrange(start + step, end + 1, step))
+        values = array('d', [float('nan')]) * len(timestamps)
+
+        rra_end = header.last_up - header.last_up % step
+        rra_start = rra_end - step * (row_cnt - 1)
+        first = max(start + step, rra_start)
+        last = min(end, rra_end)
+        if first <= last:
+            nrows = (last - first) // step + 1
+            row = (cur_row + 1 + (first - rra_start) // step) % row_cnt
+            rows = array('d')
+            while len(rows) < nrows * header.ds_cnt:
+                count = min(nrows - len(rows) // header.ds_cnt, row_cnt - row)
+                fd.seek(data_offset + row * header.ds_cnt * 8)
+                chunk = fd.read(count * header.ds_cnt * 8)
+                if len(chunk) < count * header.ds_cnt * 8:
+                    raise RRDError('Truncated RRD file')
+                rows.fromstring(chunk)
+                row = 0
+            if (header.byte_order == '<') != (struct.pack('=H', 1) == struct.pack('<H', 1)):
+                rows.byteswap()
+            if header.ds_cnt > 1:
+                rows = rows[ds_index::header.ds_cnt]
+            index = (first - start - step) // step
+            values[index:index + nrows] = rows
+    finally:
+        fd.close()
+
+    if missing is not None:
+        values = array('d', [value if value == value else missing for value in values])
+    return timestamps, values
@@ -6,7 +6,7 @@ Central component of this autoscaling system.
 """
 
 import math
-from time import time, sleep
+import time
 from conpaas.services.webservers.manager.autoscaling import log
 from conpaas.services.webservers.manager.autoscaling.performance import StatUtils
 from conpaas.services.webservers.manager.autoscaling.cost_aware import Cost_Controller
@@ -17,13 +17,13 @@ from conpaas.services.webservers.manager.autoscaling.profiler import Profiler
 from conpaas.services.webservers.manager.autoscaling.prediction.prediction_models import Prediction_Models
 from conpaas.services.webservers.manager.autoscaling.strategy.adaptive_strategy import Strategy_Finder
 
-from conpaas.services.webservers.manager.autoscaling.monitoring import Monitoring_Controller
+from conpaas.services.webservers.manager.autoscaling.monitoring import Monitoring_Controller, RESPONSE_TIME_HISTOGRAMS
 
 from collections import deque
 from datetime import datetime
 from multiprocessing.pool import ThreadPool
 import itertools
-from threading import Thread
+from threading import Thread, Event, Lock
 import httplib
 
 PATH_LOG_FILE = '/tmp/provisioning.log'
@@ -44,10 +44,30 @@ MIN_CPU_USAGE = 25
 UPPER_THRS_SLO = 0.75
 LOWER_THRS_SLO = 0.35
 
+# Percentiles of the response times across the proxies checked against the SLO: the service
+# needs more nodes when TAIL_PERCENTILE is over UPPER_THRS_SLO * slo or EXTREME_PERCENTILE over
+# the SLO, and no node is removed while EXTREME_PERCENTILE is over UPPER_THRS_SLO * slo.
+TAIL_PERCENTILE = 95
+EXTREME_PERCENTILE = 99
+# Requests below which the percentiles are not taken into account
+MIN_TAIL_REQUESTS = 100
+
 # This two boundaries represents the percentage according to the SLO for which the prediction will be triggered.
 UPPER_THRS_PREDICTION = 0.6
 LOWER_THRS_PREDICTION = 0.4
 
+# Seconds between two collections of monitoring data, and before retrying a
+# collection that failed. Ganglia stores a sample every 15 seconds.
+MONITORING_INTERVAL = 30
+MONITORING_RETRY_INTERVAL = 15
+# Seconds between two scaling decisions while the SLO is not violated
+DECISION_INTERVAL = 300
+# Samples per metric kept for the next decision, 20 minutes of Ganglia data
+MAX_PENDING_SAMPLES = 80
+# Seconds the decisions wait for the first monitoring data of a new node,
+# before they are taken without it
+NEW_NODE_GRACE_PERIOD = 300
+
 # This variable represents the number of times the system will retry a scaling operation (remove,add)
 NUM_RETRIES_SCALING_ACTION = 3
 
@@ -64,8 +84,11 @@ class Queue:
     def __init__(self, lst=[], size=0):
         self.q = deque(lst)
         self.size = size
+        # items of the sequences pushed so far
+        self.total = sum(len(seq) for seq in lst)
 
     def push(self, seq):
+        self.total += len(seq)
         # FIXME: use Python 2.7 deque(lst, maxlen=size) in __init__
         if len(self.q) <= self.size:
             self.q.append(seq)
@@ -84,10 +107,18 @@ class ProvisioningManager:
     time_between_changes = TIME_BTW_SCALING_ACTIONS
     time_between_scaling_predictions = TIME_BTW_SCALING_PREDICTIONS
 #
+    monitoring_interval = MONITORING_INTERVAL
+    decision_interval = DECISION_INTERVAL
 
     ganglia_rrd_dir = '/var/lib/ganglia/rrds/conpaas/'
 
-    def __init__(self, config_parser):
+    def __init__(self, config_parser, manager_client=client, clock=time):
+        """
+        manager_client is the client of the ConPaaS manager adding and removing the nodes,
+        and clock provides time() and sleep(), by default the ones of the time module.
+        """
+        self.client = manager_client
+        self.clock = clock
         try:
             self.slo = 700
 
@@ -97,6 +128,20 @@ class ProvisioningManager:
             self.backend_monitoring_data = {}
             self.proxy_monitoring_data = {}
 
+            # (web, backend, proxy) monitoring data collected since the last decision
+            self.pending_monitoring_data = None
+            # Histograms of the response times across the proxies, by metric, of the
+            # last decision and collected since then
+            self.response_time_histograms = {}
+            self.pending_histograms = {}
+            # Time each node of the service was first listed, its start time for the autoscaling
+            self.node_start_times = {}
+            self.monitoring_lock = Lock()
+            # Set by the monitoring thread to take a decision before the next decision_interval
+            self.decision_event = Event()
+            self.stop_event = Event()
+            self.actions_thread = None
+
             self.last_change_time = 0
             self.last_scaling_operation = 0
             self.calculate_scaling_error = False
@@ -122,7 +167,7 @@ class ProvisioningManager:
 
             self.iaas_driver = config_parser.get('iaas', 'DRIVER').upper()
 
-            self.cost_controller = Cost_Controller(logger, self.iaas_driver)
+            self.cost_controller = Cost_Controller(logger, self.iaas_driver, clock)
 
             # Parameters to establish a preference for selecting the most appropriate resource.
             self.optimal_scaling = Strategy_Finder(logger, self.iaas_driver, self.cost_controller, 'low', True, self.weight_slow_violation)
@@ -131,7 +176,7 @@ class ProvisioningManager:
 
             self.monitoring = Monitoring_Controller(logger, self.cost_controller, config_parser, '/root/config.cfg', MANAGER_HOST, MANAGER_PORT, PS_RUNNING, self.ganglia_rrd_dir)
 
-            self.dyc_load_balancer = Dynamic_Load_Balancer(logger, MANAGER_HOST, MANAGER_PORT, client)
+            self.dyc_load_balancer = Dynamic_Load_Balancer(logger, MANAGER_HOST, MANAGER_PORT, manager_client)
 
             self.profiler = Profiler(logger, self.slo, self.cost_controller, MAX_CPU_USAGE, MIN_CPU_USAGE, UPPER_THRS_SLO, LOWER_THRS_SLO)
 
@@ -142,6 +187,31 @@ class ProvisioningManager:
         logger.debug('**** Web monitoring data: *****\n' + str(self.web_monitoring_data))
         logger.debug('**** Backend monitoring data: *****\n' + str(self.backend_monitoring_data))
         logger.debug('**** Proxy monitoring data: *****\n' + str(self.proxy_monitoring_data))
+        for metric in RESPONSE_TIME_HISTOGRAMS:
+            tail = self.response_time_tail(metric)
+            if tail is not None:
+                logger.debug('**** %s: p%d %s ms, p%d %s ms' % (metric, TAIL_PERCENTILE, tail[0], EXTREME_PERCENTILE, tail[1]))
+
+    def response_time_tail(self, metric, histograms=None):
+        """
+        Return the TAIL_PERCENTILE and EXTREME_PERCENTILE of the response times of metric
+        across the proxies, by default since the previous decision, or None if there are
+        too few requests to tell.
+        """
+        if histograms is None:
+            histograms = self.response_time_histograms
+        histogram = histograms.get(metric)
+        if histogram is None or histogram.count < MIN_TAIL_REQUESTS:
+            return None
+        return histogram.percentile(TAIL_PERCENTILE), histogram.percentile(EXTREME_PERCENTILE)
+
+    def tail_above_slo(self, tail):
+        """Whether the tail of the response times calls for more nodes."""
+        return tail is not None and (tail[0] > UPPER_THRS_SLO * self.slo or tail[1] > self.slo)
+
+    def tail_near_slo(self, tail):
+        """Whether the tail of the response times is too close to the SLO to remove a node."""
+        return tail is not None and tail[1] > UPPER_THRS_SLO * self.slo
 
     def prediction_evaluation_proxy(self, proxy_ip, php_resp_data):
 
@@ -154,9 +224,11 @@ class ProvisioningManager:
 
             logger.debug("PhP response time list data: " + str(php_resp_filtered))
 
-            async_result_ar = self.pool_predictors.apply_async(self.predictor.auto_regression, (php_resp_filtered, 30))
+            # The AR and Holt-Winters models of each proxy are updated online with the samples collected since
+            # the last decision, VAR is fitted in a process pool
+            async_result_ar = self.pool_predictors.apply_async(self.predictor.recursive_least_squares, (php_resp_filtered, 30, proxy_ip))
             async_result_lr = self.pool_predictors.apply_async(self.predictor.linear_regression, (php_resp_filtered, 30))
-            async_result_exp_smoothing = self.pool_predictors.apply_async(self.predictor.exponential_smoothing, (php_resp_filtered, 12))
+            async_result_exp_smoothing = self.pool_predictors.apply_async(self.predictor.exponential_smoothing, (php_resp_filtered, 12, proxy_ip))
             async_result_var = self.pool_predictors.apply_async(self.predictor.vector_auto_regression, (php_resp_filtered, php_resp_filtered, 30))
             #  async_result_arma =  self.pool_predictors.apply_async(self.predictor.arma, (php_resp_filtered,30))
 
@@ -325,7 +397,7 @@ class ProvisioningManager:
             list_cpu_data.extend(value)
 
         logger.info("calculate_strategy: list_cpu_data  " + str(list_cpu_data))
-        strategy = self.optimal_scaling.calculate_adaptive_scaling(backend_nodes, combination_machines, cpu_usage_backends, req_rate_backends, max_performance_throughtput, min_performance_throughtput, capacity_inst_type, list_cpu_data, list_req_rate_data)
+        strategy = self.optimal_scaling.calculate_adaptive_scaling(backend_nodes, combination_machines, cpu_usage_backends, req_rate_backends, max_performance_throughtput, min_performance_throughtput, capacity_inst_type, list_cpu_data, list_req_rate_data, self.predictorScaler_cpu_usage_1h.total, self.predictorScaler_req_rate_1h.total)
 
         logger.info("calculate_strategy: Final strategy: " + str(strategy))
 
@@ -379,13 +451,13 @@ class ProvisioningManager:
         ret = {'add_web_nodes': 0, 'remove_web_nodes': 0, 'add_backend_nodes': 0, 'remove_backend_nodes': 0, 'vm_backend_instance': 'small', 'vm_web_instance': 'small', 'node_ip_remove': ''}
 
         perf_info = self.monitoring._performance_info_get()
-        web_nodes = perf_info.getWebServiceNodes()
-        backend_nodes = perf_info.getBackendServiceNodes()
-        proxy_nodes = perf_info.getProxyServiceNodes()
+        web_nodes = self.monitored_nodes(perf_info.getWebServiceNodes(), self.web_monitoring_data)
+        backend_nodes = self.monitored_nodes(perf_info.getBackendServiceNodes(), self.backend_monitoring_data)
+        proxy_nodes = self.monitored_nodes(perf_info.getProxyServiceNodes(), self.proxy_monitoring_data)
 
         self.profiler.store_instance_workload(backend_nodes, self.backend_monitoring_data)
 
-        current_time = time()
+        current_time = self.clock.time()
         if (current_time - self.last_change_time < self.time_between_changes):
             self.trigger_weight_balancing = True
             logger.info('Configuration was recently updated, not making any decisions for now...')
@@ -431,6 +503,19 @@ class ProvisioningManager:
             if avg_backend_resp_time_lb < 10 or (avg_backend_resp_time_lb < LOWER_THRS_SLO * self.slo and self.obtain_prediciton_decision(False, LOWER_THRS_SLO * self.slo)):
                 n_backend_to_remove = 1
 
+        # TAIL LATENCY VERIFICATION #####
+        # The averages hide the spikes, the percentiles across all the proxies do not
+        web_tail = self.response_time_tail('web_response_time_lb')
+        backend_tail = self.response_time_tail('php_response_time_lb')
+        logger.debug('Found tail values for proxy web response time: %s backend response time: %s'
+                     % (str(web_tail), str(backend_tail)))
+
+        if self.tail_above_slo(web_tail):
+            n_web_to_add = 1
+
+        if self.tail_above_slo(backend_tail):
+            n_backend_to_add = 1
+
         # CPU AVERAGE VERIFICATION #####
         for web_node in web_nodes:
             avg_cpu_web_node = self.stat_utils.compute_weight_average(self.web_monitoring_data[web_node.ip]['cpu_user'])
@@ -534,10 +619,12 @@ class ProvisioningManager:
 
         if((avg_cpu_after_removal > MAX_CPU_USAGE and len(consolidate_vm) == 0)
            or (avg_cpu_user_backend > 40 and self.obtain_prediciton_decision(True, 0.5 * self.slo))
-           or (avg_backend_req_rate_lb / len(backend_nodes) > 1.3 and avg_backend_resp_time_lb > 0.5 * self.slo)):
+           or (avg_backend_req_rate_lb / len(backend_nodes) > 1.3 and avg_backend_resp_time_lb > 0.5 * self.slo)
+           or self.tail_near_slo(backend_tail)):
             abort_backend_removal = 1
 
-        if((avg_web_req_rate_lb >= 4.0 and avg_cpu_web > 40) or (avg_web_req_rate_lb >= 4.0 and avg_web_resp_time_lb > 0.5 * self.slo)):
+        if((avg_web_req_rate_lb >= 4.0 and avg_cpu_web > 40) or (avg_web_req_rate_lb >= 4.0 and avg_web_resp_time_lb > 0.5 * self.slo)
+           or self.tail_near_slo(web_tail)):
             abort_web_removal = 1
 
         if (len(backend_nodes) == MIN_NUM_BACKENDS or n_backend_to_add != 0 or abort_backend_removal == 1):
@@ -571,7 +658,7 @@ class ProvisioningManager:
             self.trigger_prediction = 0
             strategy = self.calculate_strategy(avg_cpu_user_backend, backend_nodes, sum_php_req_rate_backends, avg_cpu_user_backend)
             self.calculate_scaling_error = True
-            self.last_scaling_operation = time()
+            self.last_scaling_operation = self.clock.time()
             ret['vm_backend_instance'] = strategy
 
         self.cost_controller.print_vm_cost()
@@ -595,7 +682,7 @@ class ProvisioningManager:
             if n_backend_to_add > 0:
                 concurrent_ops = False
                 perf_info = self.monitoring._performance_info_get()
-                backend_nodes = perf_info.getBackendServiceNodes()
+                backend_nodes = self.monitored_nodes(perf_info.getBackendServiceNodes(), self.backend_monitoring_data)
 
                 for op, (vm_type, num) in sorted(strategy):
                     if 'add' in op:
@@ -606,14 +693,14 @@ class ProvisioningManager:
                         while not added_node and num_retries > 0:
                             try:
                                 logger.info('Adding backend nodes: host=%s, port=%s, backend=%s , vm_type: %s ' % (MANAGER_HOST, MANAGER_PORT, num, vm_type))
-                                client.add_nodes(MANAGER_HOST, MANAGER_PORT, web=0, backend=num, cloud='default', vm_backend_instance=vm_type, vm_web_instance=vm_web_type)
+                                self.client.add_nodes(MANAGER_HOST, MANAGER_PORT, web=0, backend=num, cloud='default', vm_backend_instance=vm_type, vm_web_instance=vm_web_type)
                                 added_node = True
                             except Exception as ex:
                                 logger.warning('Error when trying to add a node: %s' % ex)
                                 num_retries = num_retries - 1
                                 logger.warning('Node cannot be added at this time, retrying in 1min. Number of additional retries: ' + str(num_retries))
                                 added_node = False
-                                sleep(100)
+                                self.clock.sleep(100)
 
                     if 'remove' in op:
                         logger.info('Removing backend nodes, quantity: %s , vm_type: %s ' % (str(num), str(vm_type)))
@@ -623,27 +710,30 @@ class ProvisioningManager:
                         for vm_ip in vmes_ip:
                             if concurrent_ops:
                                 # Before I used 60, but it seems it is not enough for the system to recognize the changes...
-                                sleep(100)
+                                self.clock.sleep(100)
                             num_retries = NUM_RETRIES_SCALING_ACTION
                             removed_node = False
                             while not removed_node and num_retries > 0:
                                 try:
-                                    client.remove_nodes(MANAGER_HOST, MANAGER_PORT, web=0, backend=1, node_ip=vm_ip)
-                                    #remove_node = True
-
-                                    server_id = self.dyc_load_balancer.get_updated_backend_weights_id(vm_ip)
-                                    self.killed_backends.append(server_id)
-                                    self.dyc_load_balancer.remove_updated_backend_weights(server_id)
-                                    self.dyc_load_balancer.remove_updated_backend_weights_id(vm_ip)
-
+                                    self.client.remove_nodes(MANAGER_HOST, MANAGER_PORT, web=0, backend=1, node_ip=vm_ip)
+                                    removed_node = True
                                 except Exception as ex:
                                     logger.warning('Error when trying to remove a node: ' + str(ex))
                                     num_retries = num_retries - 1
                                     logger.warning('Node cannot be removed at this time, retrying in 1min. Number of additional retries: ' + str(num_retries))
                                     removed_node = False
-                                    sleep(100)
+                                    self.clock.sleep(100)
+
+                            if removed_node:
+                                try:
+                                    server_id = self.dyc_load_balancer.get_updated_backend_weights_id(vm_ip)
+                                    self.killed_backends.append(server_id)
+                                    self.dyc_load_balancer.remove_updated_backend_weights(server_id)
+                                    self.dyc_load_balancer.remove_updated_backend_weights_id(vm_ip)
+                                except:
+                                    logger.warning("Backend weight cannot be deleted for the backend with ip " + str(vm_ip))
 
-                self.last_change_time = time()
+                self.last_change_time = self.clock.time()
 
             if n_web_to_add > 0:
                 num_retries = NUM_RETRIES_SCALING_ACTION
@@ -652,7 +742,7 @@ class ProvisioningManager:
                     try:
                         logger.info('Adding a web node: %d , inst type: %s ' % (n_web_to_add, str(vm_web_type)))
                         vm_backend_type = self.optimal_scaling.get_vm_inst_types()[0]
-                        client.add_nodes(MANAGER_HOST, MANAGER_PORT, web=n_web_to_add, backend=0, cloud='default', vm_backend_instance=vm_backend_type, vm_web_instance=vm_web_type)
+                        self.client.add_nodes(MANAGER_HOST, MANAGER_PORT, web=n_web_to_add, backend=0, cloud='default', vm_backend_instance=vm_backend_type, vm_web_instance=vm_web_type)
                         added_node = True
                     except Exception as ex:
                         logger.exception('Error when trying to add a web node.')
@@ -662,13 +752,13 @@ class ProvisioningManager:
                         wait_time = 100
                         logger.warning('Web node cannot be added at this time, retrying in %s seconds. Number of additional retries: %s' % (wait_time, num_retries))
                         added_node = False
-                        sleep(wait_time)
+                        self.clock.sleep(wait_time)
 
-                self.last_change_time = time()
+                self.last_change_time = self.clock.time()
 
         if ((n_backend_to_remove > 0 or n_web_to_remove > 0) and len(ip) > 0):
             logger.info('Removing web nodes: %d , backend nodes: %d ' % (n_web_to_remove, n_backend_to_remove))
-            client.remove_nodes(MANAGER_HOST, MANAGER_PORT, web=n_web_to_remove, backend=n_backend_to_remove, node_ip=ip)
+            self.client.remove_nodes(MANAGER_HOST, MANAGER_PORT, web=n_web_to_remove, backend=n_backend_to_remove, node_ip=ip)
             if n_backend_to_remove > 0:
                 try:
                     server_id = self.dyc_load_balancer.get_updated_backend_weights_id(ip)
@@ -677,75 +767,282 @@ class ProvisioningManager:
                     self.dyc_load_balancer.remove_updated_backend_weights_id(ip)
                 except:
                     logger.warning("Backend weight cannot be deleted for the backend with ip " + str(ip))
-            self.last_change_time = time()
+            self.last_change_time = self.clock.time()
             logger.info('After triggering the remove operation web nodes: %d , backend nodes: %d ' % (n_web_to_remove, n_backend_to_remove))
-            self.last_change_time = time()
+            self.last_change_time = self.clock.time()
+
+    def run_actions(self, actions):
+        try:
+            self.execute_actions(actions)
+        except Exception as ex:
+            logger.critical('Autoscaling: Error when executing the scaling actions ' + str(ex))
+            self.last_change_time = self.clock.time()
+
+    def start_actions(self, actions):
+        """
+        Execute the actions in a thread of their own, so that the monitoring data is still
+        collected while the nodes are added or removed. Return whether there was any action.
+        """
+        if (actions['add_backend_nodes'] == 0 and actions['remove_backend_nodes'] == 0
+           and actions['add_web_nodes'] == 0 and actions['remove_web_nodes'] == 0):
+            return False
+        self.actions_thread = Thread(target=self.run_actions, args=(actions,))
+        self.actions_thread.daemon = True
+        self.actions_thread.start()
+        return True
+
+    def actions_running(self):
+        return self.actions_thread is not None and self.actions_thread.is_alive()
+
+    def in_cooldown(self):
+        return self.actions_running() or self.clock.time() - self.last_change_time < self.time_between_changes
+
+    def merge_monitoring_data(self, pending, monitoring_data):
+        """
+        Append to the pending data of every node the samples of monitoring_data it does not
+        have yet. Consecutive collections overlap, samples are told apart by their timestamps.
+        """
+        for ip, node_data in monitoring_data.iteritems():
+            if ip not in pending or 'timestamps' not in pending[ip]:
+                pending[ip] = dict((metric, list(values)) for metric, values in node_data.iteritems())
+                continue
+            if 'timestamps' not in node_data:
+                continue
+            node_pending = pending[ip]
+            known = set(node_pending['timestamps'])
+            for index, timestamp in enumerate(node_data['timestamps']):
+                if timestamp in known:
+                    continue
+                known.add(timestamp)
+                for metric, values in node_data.iteritems():
+                    if metric != 'timestamps' and index < len(values):
+                        node_pending.setdefault(metric, []).append(values[index])
+                node_pending['timestamps'].append(timestamp)
+            for metric, values in node_pending.iteritems():
+                if len(values) > MAX_PENDING_SAMPLES:
+                    del values[:len(values) - MAX_PENDING_SAMPLES]
+
+    def slo_violated(self, proxy_monitoring_data, backend_monitoring_data, histograms={}):
+        """
+        Whether the last monitoring data is close to an SLO violation or to the saturation of
+        the backends, which calls for a decision before the next decision_interval.
+        """
+        for metric in RESPONSE_TIME_HISTOGRAMS:
+            tail = self.response_time_tail(metric, histograms)
+            if self.tail_above_slo(tail):
+                logger.info('SLO violation across the proxies: %s p%d %s ms, p%d %s ms'
+                            % (metric, TAIL_PERCENTILE, tail[0], EXTREME_PERCENTILE, tail[1]))
+                return True
+        for ip, node_data in proxy_monitoring_data.iteritems():
+            for metric in ('web_response_time_lb', 'php_response_time_lb'):
+                if len(node_data.get(metric, [])) > 0:
+                    resp_time = self.stat_utils.compute_weight_average_response(node_data[metric], self.slo, self.weight_slow_violation)
+                    if resp_time > UPPER_THRS_SLO * self.slo:
+                        logger.info('SLO violation on proxy %s: %s %s ms' % (ip, metric, resp_time))
+                        return True
+        for ip, node_data in backend_monitoring_data.iteritems():
+            if len(node_data.get('cpu_user', [])) > 0:
+                cpu_usage = self.stat_utils.compute_weight_average(node_data['cpu_user'])
+                if cpu_usage > MAX_CPU_USAGE:
+                    logger.info('CPU usage of backend %s over the limit: %s' % (ip, cpu_usage))
+                    return True
+        return False
 
     def collect_monitoring_data(self):
+        """
+        Collect the monitoring data since the previous collection and add it to the data of
+        the next decision. Return whether the data of every tier was retrieved.
+        """
         self.monitoring.init_collect_monitoring_data()
 
-        self.web_monitoring_data = self.monitoring.collect_monitoring_data_web()
-        self.backend_monitoring_data = self.monitoring.collect_monitoring_data_backend()
-        self.proxy_monitoring_data = self.monitoring.collect_monitoring_data_proxy()
+        web_monitoring_data = self.monitoring.collect_monitoring_data_web()
+        backend_monitoring_data = self.monitoring.collect_monitoring_data_backend()
+        proxy_monitoring_data = self.monitoring.collect_monitoring_data_proxy()
 
-        if len(self.proxy_monitoring_data) == 0 or len(self.backend_monitoring_data) == 0 or len(self.web_monitoring_data) == 0:
+        if len(proxy_monitoring_data) == 0 or len(backend_monitoring_data) == 0 or len(web_monitoring_data) == 0:
             return False
 
+        histograms = self.monitoring.collect_response_time_histograms()
+
+        self.monitoring_lock.acquire()
+        try:
+            if self.pending_monitoring_data is None:
+                self.pending_monitoring_data = ({}, {}, {})
+            for pending, monitoring_data in zip(self.pending_monitoring_data,
+                                                (web_monitoring_data, backend_monitoring_data, proxy_monitoring_data)):
+                self.merge_monitoring_data(pending, monitoring_data)
+            for metric, histogram in histograms.iteritems():
+                if metric in self.pending_histograms:
+                    self.pending_histograms[metric].merge(histogram)
+                else:
+                    self.pending_histograms[metric] = histogram.copy()
+        finally:
+            self.monitoring_lock.release()
+
+        if not self.in_cooldown() and self.slo_violated(proxy_monitoring_data, backend_monitoring_data, histograms):
+            self.decision_event.set()
+
+        return True
+
+    def missing_monitoring_data(self, pending):
+        """
+        Whether a node of the service that started less than NEW_NODE_GRACE_PERIOD seconds ago
+        has no monitoring data in pending yet. The nodes without data for longer are left out of
+        the decision.
+        """
+        now = self.clock.time()
+        perf_info = self.monitoring._performance_info_get()
+        web_monitoring_data, backend_monitoring_data, proxy_monitoring_data = pending
+        start_times = {}
+        missing = False
+        for nodes, monitoring_data in ((perf_info.getWebServiceNodes(), web_monitoring_data),
+                                       (perf_info.getBackendServiceNodes(), backend_monitoring_data),
+                                       (perf_info.getProxyServiceNodes(), proxy_monitoring_data)):
+            for node in nodes:
+                start_time = start_times[node.ip] = self.node_start_times.get(node.ip, now)
+                if node.ip in monitoring_data:
+                    continue
+                if now - start_time < NEW_NODE_GRACE_PERIOD:
+                    missing = True
+                else:
+                    logger.warning('No monitoring data from node %s since %d seconds, deciding without it'
+                                   % (node.ip, now - start_time))
+        # the removed nodes are forgotten
+        self.node_start_times = start_times
+        return missing
+
+    def monitored_nodes(self, nodes, monitoring_data):
+        """The nodes with monitoring data for this decision, see missing_monitoring_data."""
+        return [node for node in nodes if node.ip in monitoring_data]
+
+    def take_monitoring_data(self):
+        """
+        Make the monitoring data collected since the last decision the data of this decision.
+        Return False if there is none, or if it lacks the data of some node.
+        """
+        self.monitoring_lock.acquire()
+        try:
+            pending = self.pending_monitoring_data
+            if pending is None:
+                logger.warning('No monitoring data was retrieved since the last decision, will retry later...')
+                return False
+            if self.missing_monitoring_data(pending):
+                logger.info('Waiting for the monitoring data of the new nodes...')
+                return False
+            self.pending_monitoring_data = None
+            self.response_time_histograms = self.pending_histograms
+            self.pending_histograms = {}
+        finally:
+            self.monitoring_lock.release()
+
+        self.web_monitoring_data, self.backend_monitoring_data, self.proxy_monitoring_data = pending
+        return True
+
+    def do_monitoring(self):
+        """
+        Collect the monitoring data every monitoring_interval until the autoscaling stops.
+        """
+        while self.autoscaling_running:
+            try:
+                logger.debug('Synchronizing node info with manager...')
+                self.monitoring.nodes_info_update(self.killed_backends)
+                logger.debug('Collecting monitoring data...')
+                ret = self.collect_monitoring_data()
+            except Exception as ex:
+                logger.warning('Autoscaling: Error when collecting the monitoring data ' + str(ex))
+                ret = False
+
+            if not ret:
+                logger.warning('Monitoring data was not properly retrieved, will retry later...')
+                self.stop_event.wait(MONITORING_RETRY_INTERVAL)
+            else:
+                self.stop_event.wait(self.monitoring_interval)
+
+    def start_weight_adjustment(self):
+        Thread(target=self.dyc_load_balancer.adjust_node_weights, args=(self.monitoring, self.backend_monitoring_data)).start()
+
+    def provisioning_step(self, step_no):
+        """
+        Take a decision on the monitoring data collected since the previous one and start
+        the actions decided. Return whether a decision was taken.
+        """
+        if self.actions_running():
+            logger.info('Scaling actions in progress, not making any decisions for now...')
+            return False
+
+        if not self.take_monitoring_data():
+            return False
+
+        tstart = datetime.now()
+
+        self.log_monitoring_data()
+
+        actions = self.decide_actions()
+        scaling = self.start_actions(actions)
+
+        # Adjust node weights every 2 steps
+        if ((step_no % 2 == 0 and not scaling) or self.trigger_weight_balancing):
+            logger.info('Calling adjust_node_weights ...')
+            self.start_weight_adjustment()
+            self.trigger_weight_balancing = False
+
+        tend = datetime.now()
+        logger.info('--> EXECUTION TIME SCALING DECISION: %s ' % str(tend - tstart))
         return True
 
     def stop_provisioning(self):
         self.autoscaling_running = False
+        self.stop_event.set()
+        self.decision_event.set()
         # try:
             #   os.remove(PATH_LOG_FILE)
         # except OSError as e:
             #   logger.critical('stop_provisioning: Error when removing the autoscaling log '+str(e))
 
-    def do_provisioning(self, slo, cooldown_time, slo_fulfillment_degree):
+    def do_provisioning(self, slo, cooldown_time, slo_fulfillment_degree, decision_interval=DECISION_INTERVAL):
+        """
+        Run the autoscaling until stop_provisioning is called.
+
+        The monitoring data is collected continuously by a thread of its own, which wakes this
+        one up as soon as the SLO is about to be violated. Otherwise a decision is taken every
+        decision_interval seconds, on the data collected since the previous decision. The
+        decided actions are executed in the background, and no decision is taken until they
+        are done and the cooldown time is over.
+        """
         step_no = 0
         self.slo = slo
         self.time_between_changes = cooldown_time * 60
+        self.decision_interval = decision_interval
         self.autoscaling_running = True
+        self.stop_event.clear()
+        self.decision_event.clear()
+        self.pending_monitoring_data = None
+        self.pending_histograms = {}
         self.optimal_scaling.set_slo_fulfillment_degree(slo_fulfillment_degree)
         logger.info('Autoscaling: Starting with QoS autoscaling: ' + str(slo_fulfillment_degree))
 
+        monitoring_thread = Thread(target=self.do_monitoring)
+        monitoring_thread.daemon = True
+        monitoring_thread.start()
+
         try:
+            wait_time = self.decision_interval
             while self.autoscaling_running:
-                step_no += 1
-                tstart = datetime.now()
-
-                print 'Synchronizing node info with manager...'
-                self.monitoring.nodes_info_update(self.killed_backends)
-                print "Collecting monitoring data..."
-
-                ret = self.collect_monitoring_data()
-
-                if not ret:
-                    logger.warning('Monitoring data was not properly retrieved, will retry later...')
-                    sleep(60)
-                    continue
+                self.decision_event.wait(wait_time)
+                self.decision_event.clear()
+                if not self.autoscaling_running:
+                    break
+
+                if self.provisioning_step(step_no + 1):
+                    step_no += 1
+                    wait_time = self.decision_interval
                 else:
-                    self.log_monitoring_data()
-
-                    actions = self.decide_actions()
-                    self.execute_actions(actions)
-
-                    n_backend_to_add = actions['add_backend_nodes']
-                    n_backend_to_remove = actions['remove_backend_nodes']
-                    n_web_to_add = actions['add_web_nodes']
-                    n_web_to_remove = actions['remove_web_nodes']
-
-                    # Adjust node weights every 3 steps
-                    if ((step_no % 2 == 0 and n_backend_to_add == 0 and n_backend_to_remove == 0
-                       and n_web_to_add == 0 and n_web_to_remove == 0) or self.trigger_weight_balancing):
-                        logger.info('Calling adjust_node_weights ...')
-                        Thread(target=self.dyc_load_balancer.adjust_node_weights(self.monitoring, self.backend_monitoring_data)).start()
-                        self.trigger_weight_balancing = False
-
-                    tend = datetime.now()
-                    logger.info('--> EXECUTION TIME SCALING DECISION: %s ' % str(tend - tstart))
-
-                    sleep(300)
+                    # Retry as soon as new monitoring data is collected
+                    wait_time = self.monitoring_interval
 
             logger.info('Autoscaling: Terminated.')
         except Exception as ex:
             logger.critical('Autoscaling: Error in the autoscaling system ' + str(ex))
+        finally:
+            self.autoscaling_running = False
+            self.stop_event.set()
@@ -0,0 +1,533 @@
+"""
+Trace replay simulator of the autoscaling.
+
+It runs the decisions of the ProvisioningManager against a simulated PHP
+service instead of Ganglia, the ConPaaS manager and the IaaS:
+
+    Trace: request rate of the service over time, synthetic or recorded
+           (an RRD file of Ganglia or a text file of 'timestamp value'
+           lines, as printed by 'rrdtool fetch').
+    SimulatedClock: time of the simulation, sleeping advances it.
+    SimulatedCloud: fake IaaS and manager client. Nodes serve requests
+                    boot_time seconds after being requested, and are
+                    billed per started hour from the request on.
+    TraceMonitoring: fake monitoring source, which computes the samples
+                     Ganglia would have collected from the request rate
+                     of the trace and the nodes running.
+
+Every node serves its share of the requests with a response time of
+service_time / (1 - utilization), and a cpu usage proportional to the
+utilization. The capacity of a node is proportional to the compute units
+of its instance type. As in an M/M/1 queue, the response times of the
+requests are exponentially distributed around that mean, which the
+response time histograms of the proxies are drawn from.
+
+Simulator.run replays a trace and returns a Report with the SLO violation
+rates of the mean and of the TAIL_PERCENTILE of the response times, the VM
+hours, the cost and the latency of the decisions.
+"""
+
+import math
+import random
+import time
+from bisect import bisect_right
+from ConfigParser import ConfigParser
+
+from conpaas.services.webservers.manager.autoscaling import rrd
+from conpaas.services.webservers.manager.autoscaling import scaler
+from conpaas.services.webservers.manager.autoscaling.scaler import ProvisioningManager
+from conpaas.services.webservers.manager.autoscaling.performance import ServicePerformance, ServiceNodePerf
+from conpaas.services.webservers.manager.autoscaling.monitoring import RESPONSE_TIME_HISTOGRAMS
+from conpaas.core.latency import LatencyHistogram
+
+# Seconds between two monitoring samples, as stored by Ganglia
+SAMPLE_STEP = 15
+# Seconds from the request of a node until it serves requests
+BOOT_TIME = 120
+# Timestamp of the start of the synthetic traces
+SIMULATION_START = 1400000000
+
+# Requests per second a compute unit serves at 100% cpu usage, and time to
+# serve a request without queueing (ms), per tier
+BACKEND_REQ_RATE_PER_UNIT = 5.0
+BACKEND_SERVICE_TIME = 100.0
+WEB_REQ_RATE_PER_UNIT = 50.0
+WEB_SERVICE_TIME = 10.0
+PROXY_REQ_RATE_PER_UNIT = 200.0
+# Cpu usage of an idle node
+IDLE_CPU_USAGE = 2.0
+# Over this utilization, the response time grows linearly with the load
+MAX_UTILIZATION = 0.95
+# Response time (ms) when no backend is running, and longest response time
+REQUEST_TIMEOUT = 30000.0
+# Response times drawn into the histograms per sample and tier
+HISTOGRAM_REQUESTS_PER_SAMPLE = 100
+
+# cpu_num and mem_total reported by the instance types, which
+# Cost_Controller.instance_type_detector maps back to the types
+INSTANCE_HARDWARE = {
+    'OPENNEBULA': {'small': (1.0, 1034524.0), 'medium': (4.0, 3635248.0),
+                   'highcpu-medium': (6.0, 3635248.0), 'large': (8.0, 7864548.0)},
+    'EC2': {'m1.small': (1.0, 1800000.0), 'm1.medium': (1.0, 3800000.0),
+            'm1.large': (2.0, 7864548.0), 'c1.medium': (2.0, 1800000.0)},
+}
+
+
+class Trace(object):
+
+    """
+    Request rate of a service over time, constant between two samples.
+    """
+
+    def __init__(self, timestamps, rates):
+        if len(timestamps) == 0:
+            raise ValueError('Empty trace')
+        samples = sorted(zip(timestamps, rates))
+        self.timestamps = [timestamp for timestamp, rate in samples]
+        self.rates = [float(rate) for timestamp, rate in samples]
+        self.start = self.timestamps[0]
+        self.end = self.timestamps[-1]
+
+    def rate(self, timestamp):
+        index = bisect_right(self.timestamps, timestamp) - 1
+        return self.rates[max(index, 0)]
+
+
+def synthetic_trace(rate_function, duration, step=SAMPLE_STEP, start=SIMULATION_START):
+    """
+    Trace of duration seconds, whose request rate is rate_function(seconds
+    since the start of the trace).
+    """
+    timestamps = range(start, start + int(duration) + 1, step)
+    return Trace(timestamps, [max(rate_function(timestamp - start), 0) for timestamp in timestamps])
+
+
+def spike_trace(base_rate, peak_rate, duration, peak_start, peak_duration):
+    return synthetic_trace(lambda t: peak_rate if peak_start <= t < peak_start + peak_duration else base_rate,
+                           duration)
+
+
+def wave_trace(mean_rate, amplitude, duration, period=86400, noise=0.0, seed=None):
+    """
+    Daily-like trace: a sine wave, with gaussian noise of standard deviation
+    noise * mean_rate.
+    """
+    generator = random.Random(seed)
+    return synthetic_trace(lambda t: mean_rate + amplitude * math.sin(2 * math.pi * t / period) +
+                           generator.gauss(0, noise * mean_rate),
+                           duration)
+
+
+def load_trace(filename, ds=None):
+    """
+    Load a recorded trace: the base archive of an RRD file, such as the
+    web_request_rate_lb of a proxy in Ganglia, or a text file of
+    'timestamp value' lines. Unknown values are skipped.
+    """
+    fd = open(filename, 'rb')
+    try:
+        is_rrd = fd.read(len(rrd.RRD_COOKIE)) == rrd.RRD_COOKIE
+        fd.seek(0)
+        if is_rrd:
+            header = rrd.RRDHeader(fd)
+        else:
+            lines = fd.readlines()
+    finally:
+        fd.close()
+
+    timestamps = []
+    rates = []
+    if is_rrd:
+        cf, row_cnt, pdp_cnt = min(header.rras, key=lambda rra: rra[2])[:3]
+        span = row_cnt * pdp_cnt * header.pdp_step
+        samples = zip(*rrd.fetch(filename, start=header.last_up - span, end=header.last_up, ds=ds))
+    else:
+        samples = []
+        for line in lines:
+            tokens = line.replace(':', ' ').split()
+            try:
+                samples.append((int(tokens[0]), float(tokens[1])))
+            except (IndexError, ValueError):
+                continue
+    for timestamp, rate in samples:
+        if rate == rate:
+            timestamps.append(timestamp)
+            rates.append(rate)
+    return Trace(timestamps, rates)
+
+
+class SimulatedClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedNode(object):
+
+    def __init__(self, vmid, ip, role, inst_type, start_time, ready_time):
+        self.vmid = vmid
+        self.ip = ip
+        self.role = role
+        self.inst_type = inst_type
+        self.start_time = start_time
+        self.ready_time = ready_time
+        self.stop_time = None
+
+
+class SimulatedCloud(object):
+
+    """
+    Nodes of the simulated service. It implements the calls of the manager
+    client used by the autoscaling.
+    """
+
+    def __init__(self, clock, boot_time=BOOT_TIME):
+        self.clock = clock
+        self.boot_time = boot_time
+        # every node started, removed or not
+        self.nodes = []
+        # weights of the backends, by node id
+        self.weights = {}
+        self.nodes_added = 0
+        self.nodes_removed = 0
+
+    def start_node(self, role, inst_type, booted=False):
+        number = len(self.nodes) + 1
+        now = self.clock.time()
+        node = SimulatedNode('vm-%d' % number, '10.0.%d.%d' % (number / 250, number % 250 + 1), role, inst_type,
+                             now, now if booted else now + self.boot_time)
+        self.nodes.append(node)
+        return node
+
+    def running_nodes(self, role=None, at=None):
+        if at is None:
+            at = self.clock.time()
+        return [node for node in self.nodes
+                if node.ready_time <= at and (node.stop_time is None or node.stop_time > at)
+                and (role is None or node.role == role)]
+
+    def list_nodes(self, host, port):
+        nodes = {'proxy': [], 'web': [], 'backend': []}
+        for node in self.running_nodes():
+            nodes[node.role].append(node.vmid)
+        return nodes
+
+    def get_node_info(self, host, port, serviceNodeId):
+        for node in self.nodes:
+            if node.vmid == serviceNodeId:
+                return {'serviceNode': {'id': node.vmid, 'ip': node.ip}}
+        raise Exception('Invalid node %s' % serviceNodeId)
+
+    def add_nodes(self, host, port, proxy=None, web=None, backend=None, cloud=None,
+                  vm_backend_instance=None, vm_web_instance=None):
+        for role, count, inst_type in (('web', web, vm_web_instance), ('backend', backend, vm_backend_instance)):
+            for i in range(count or 0):
+                self.start_node(role, inst_type)
+                self.nodes_added += 1
+        return {}
+
+    def remove_nodes(self, host, port, proxy=None, web=None, backend=None, node_ip=None):
+        """
+        Remove the node of node_ip if given, otherwise the last nodes of every role.
+        """
+        to_remove = []
+        for role, count in (('web', web), ('backend', backend)):
+            if not count:
+                continue
+            nodes = self.running_nodes(role)
+            if node_ip:
+                to_remove += [node for node in nodes if node.ip == node_ip]
+            else:
+                to_remove += nodes[-count:]
+        if node_ip and len(to_remove) == 0:
+            raise Exception('No node to remove with IP %s' % node_ip)
+        for node in to_remove:
+            node.stop_time = self.clock.time()
+            self.weights.pop(node.vmid, None)
+            self.nodes_removed += 1
+        return {}
+
+    def update_nodes_weight(self, host, port, web=None, backend=None):
+        self.weights.update(backend or {})
+        return {}
+
+
+class TraceMonitoring(object):
+
+    """
+    Monitoring source with the interface of Monitoring_Controller used by
+    the ProvisioningManager.
+    """
+
+    def __init__(self, logger, cost_controller, cloud, trace, slo, compute_units, hardware, noise=0.0, seed=None):
+        self.logger = logger
+        self.cost_controller = cost_controller
+        self.cloud = cloud
+        self.trace = trace
+        self.slo = slo
+        # compute units of an instance type
+        self.compute_units = compute_units
+        self.hardware = hardware
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.latency_random = random.Random(seed)
+
+        self.perf_info = ServicePerformance()
+        self.last_collect_time = cloud.clock.time()
+        self.collected_data = ({}, {}, {})
+        self.collected_histograms = {}
+
+        self.samples = 0
+        self.slo_violations = 0
+        self.tail_slo_violations = 0
+        self.max_backends = 0
+
+    def _performance_info_get(self):
+        return self.perf_info
+
+    def nodes_info_update(self, killed_backends):
+        perf_info = ServicePerformance()
+        for node in self.cloud.running_nodes():
+            if node.vmid not in killed_backends:
+                perf_info.serviceNodes[node.vmid] = ServiceNodePerf(node.vmid, node.ip, node.role == 'proxy',
+                                                                    node.role == 'web', node.role == 'backend',
+                                                                    scaler.PS_RUNNING)
+        self.perf_info = perf_info
+
+    def _serve(self, req_rate, node, req_rate_per_unit, service_time):
+        """Return the cpu usage of node and its response time when serving req_rate."""
+        utilization = req_rate / (req_rate_per_unit * self.compute_units(node.inst_type))
+        cpu_usage = min(IDLE_CPU_USAGE + (100 - IDLE_CPU_USAGE) * utilization, 100.0)
+        if utilization < MAX_UTILIZATION:
+            resp_time = service_time / (1 - utilization)
+        else:
+            resp_time = service_time / (1 - MAX_UTILIZATION) * utilization / MAX_UTILIZATION
+        return cpu_usage, resp_time
+
+    def _add_sample(self, monitoring_data, node, timestamp, values):
+        cpu_num, mem_total = self.hardware[node.inst_type]
+        values.update({'cpu_num': cpu_num, 'mem_total': mem_total, 'boottime': node.start_time})
+        node_data = monitoring_data.setdefault(node.ip, {'timestamps': []})
+        node_data['timestamps'].append(timestamp)
+        for metric, value in values.iteritems():
+            node_data.setdefault(metric, []).append(value)
+
+    def _add_response_times(self, metric, resp_time):
+        histogram = self.collected_histograms[metric]
+        for i in range(HISTOGRAM_REQUESTS_PER_SAMPLE):
+            histogram.add(min(self.latency_random.expovariate(1.0 / resp_time), REQUEST_TIMEOUT))
+
+    def _collect_sample(self, timestamp):
+        web_monitoring_data, backend_monitoring_data, proxy_monitoring_data = self.collected_data
+        req_rate = self.trace.rate(timestamp)
+        if self.noise > 0:
+            req_rate *= max(self.random.gauss(1, self.noise), 0)
+
+        backends = self.cloud.running_nodes('backend', timestamp)
+        weights = [float(self.cloud.weights.get(node.vmid, ServiceNodePerf.DEFAULT_NODE_WEIGHT)) for node in backends]
+        php_resp_time = 0.0
+        for node, weight in zip(backends, weights):
+            node_req_rate = req_rate * weight / sum(weights)
+            cpu_usage, resp_time = self._serve(node_req_rate, node, BACKEND_REQ_RATE_PER_UNIT, BACKEND_SERVICE_TIME)
+            php_resp_time += resp_time * weight / sum(weights)
+            self._add_sample(backend_monitoring_data, node, timestamp,
+                             {'php_request_rate': node_req_rate, 'php_response_time': resp_time,
+                              'cpu_user': cpu_usage, 'cpu_system': cpu_usage / 10})
+        if len(backends) == 0:
+            php_resp_time = REQUEST_TIMEOUT
+
+        webs = self.cloud.running_nodes('web', timestamp)
+        web_resp_time = 0.0
+        for node in webs:
+            cpu_usage, resp_time = self._serve(req_rate / len(webs), node, WEB_REQ_RATE_PER_UNIT, WEB_SERVICE_TIME)
+            web_resp_time += resp_time / len(webs)
+            self._add_sample(web_monitoring_data, node, timestamp,
+                             {'web_request_rate': req_rate / len(webs), 'web_response_time': resp_time,
+                              'cpu_user': cpu_usage})
+        if len(webs) == 0:
+            web_resp_time = REQUEST_TIMEOUT
+
+        proxies = self.cloud.running_nodes('proxy', timestamp)
+        for node in proxies:
+            cpu_usage, resp_time = self._serve(req_rate, node, PROXY_REQ_RATE_PER_UNIT, 0)
+            self._add_sample(proxy_monitoring_data, node, timestamp,
+                             {'web_request_rate_lb': req_rate, 'web_response_time_lb': web_resp_time,
+                              'php_request_rate_lb': req_rate, 'php_response_time_lb': php_resp_time,
+                              'cpu_user': cpu_usage})
+        if len(proxies) > 0:
+            self._add_response_times('web_response_time_lb', web_resp_time)
+            self._add_response_times('php_response_time_lb', php_resp_time)
+
+        self.samples += 1
+        if php_resp_time > self.slo:
+            self.slo_violations += 1
+        # percentile of the exponential distribution
+        if min(-math.log(1 - scaler.TAIL_PERCENTILE / 100.0) * php_resp_time, REQUEST_TIMEOUT) > self.slo:
+            self.tail_slo_violations += 1
+        self.max_backends = max(self.max_backends, len(backends))
+
+    def init_collect_monitoring_data(self):
+        """
+        Compute the samples since the previous collection, and register the
+        nodes to the cost controller as the boottime metric does.
+        """
+        self.collected_data = ({}, {}, {})
+        self.collected_histograms = dict((metric, LatencyHistogram()) for metric in RESPONSE_TIME_HISTOGRAMS)
+        now = self.cloud.clock.time()
+        timestamp = self.last_collect_time - self.last_collect_time % SAMPLE_STEP + SAMPLE_STEP
+        while timestamp <= now:
+            self._collect_sample(timestamp)
+            timestamp += SAMPLE_STEP
+
+        for node in self.cloud.running_nodes():
+            cpu_num, mem_total = self.hardware[node.inst_type]
+            self.cost_controller.update_vm_usage(node.ip, node.start_time,
+                                                 self.cost_controller.instance_type_detector(cpu_num, mem_total))
+
+    def collect_monitoring_data_web(self):
+        return self.collected_data[0]
+
+    def collect_monitoring_data_backend(self):
+        return self.collected_data[1]
+
+    def collect_monitoring_data_proxy(self):
+        self.last_collect_time = self.cloud.clock.time()
+        return self.collected_data[2]
+
+    def collect_response_time_histograms(self):
+        return self.collected_histograms
+
+
+class SimulatedProvisioningManager(ProvisioningManager):
+
+    """
+    ProvisioningManager executing the actions in the simulation loop, and
+    timing its decisions.
+    """
+
+    def __init__(self, config_parser, cloud, clock):
+        ProvisioningManager.__init__(self, config_parser, cloud, clock)
+        self.decision_latencies = []
+
+    def decide_actions(self):
+        start = time.time()
+        try:
+            return ProvisioningManager.decide_actions(self)
+        finally:
+            self.decision_latencies.append(time.time() - start)
+
+    def start_actions(self, actions):
+        # The simulated cloud answers at once, a thread would only sleep on the simulated clock
+        if (actions['add_backend_nodes'] == 0 and actions['remove_backend_nodes'] == 0
+           and actions['add_web_nodes'] == 0 and actions['remove_web_nodes'] == 0):
+            return False
+        self.run_actions(actions)
+        return True
+
+    def start_weight_adjustment(self):
+        self.dyc_load_balancer.adjust_node_weights(self.monitoring, self.backend_monitoring_data)
+
+
+class Report(object):
+
+    def __init__(self, duration, samples, slo_violations, tail_slo_violations, vm_hours, cost,
+                 decision_latencies, nodes_added, nodes_removed, max_backends):
+        self.duration = duration
+        self.samples = samples
+        self.slo_violations = slo_violations
+        self.slo_violation_rate = float(slo_violations) / samples if samples else 0.0
+        self.tail_slo_violations = tail_slo_violations
+        self.tail_slo_violation_rate = float(tail_slo_violations) / samples if samples else 0.0
+        self.vm_hours = vm_hours
+        self.cost = cost
+        self.decisions = len(decision_latencies)
+        self.decision_latency_avg = sum(decision_latencies) / len(decision_latencies) if decision_latencies else 0.0
+        self.decision_latency_max = max(decision_latencies) if decision_latencies else 0.0
+        self.nodes_added = nodes_added
+        self.nodes_removed = nodes_removed
+        self.max_backends = max_backends
+
+    def __str__(self):
+        return '\n'.join([
+            'Duration: %.1f h' % (self.duration / 3600.0),
+            'SLO violations: %d of %d samples (%.2f%%)' % (self.slo_violations, self.samples,
+                                                           100 * self.slo_violation_rate),
+            'SLO violations of the p%d: %d (%.2f%%)' % (scaler.TAIL_PERCENTILE, self.tail_slo_violations,
+                                                        100 * self.tail_slo_violation_rate),
+            'VM hours: %.2f, cost: %.3f' % (self.vm_hours, self.cost),
+            'Decisions: %d, latency avg: %.1f ms, max: %.1f ms' % (self.decisions, 1000 * self.decision_latency_avg,
+                                                                   1000 * self.decision_latency_max),
+            'Nodes added: %d, removed: %d, max backends: %d' % (self.nodes_added, self.nodes_removed,
+                                                                self.max_backends)])
+
+
+class Simulator(object):
+
+    def __init__(self, iaas_driver='OPENNEBULA', boot_time=BOOT_TIME, noise=0.0, seed=0):
+        self.iaas_driver = iaas_driver
+        self.boot_time = boot_time
+        self.noise = noise
+        self.seed = seed
+
+    def run(self, trace, slo=700, cooldown_time=10, slo_fulfillment_degree='low',
+            decision_interval=scaler.DECISION_INTERVAL, backends=1, backend_type=None):
+        """
+        Replay trace through the decisions of a ProvisioningManager configured
+        as do_provisioning does, on a service starting with a proxy, a web
+        server and backends of backend_type (default: the smallest type).
+        """
+        clock = SimulatedClock(trace.start)
+        cloud = SimulatedCloud(clock, self.boot_time)
+
+        config_parser = ConfigParser()
+        config_parser.add_section('iaas')
+        config_parser.set('iaas', 'DRIVER', self.iaas_driver)
+        manager = SimulatedProvisioningManager(config_parser, cloud, clock)
+
+        smallest_type = manager.optimal_scaling.get_vm_inst_types()[0]
+        cloud.start_node('proxy', smallest_type, booted=True)
+        cloud.start_node('web', smallest_type, booted=True)
+        for i in range(backends):
+            cloud.start_node('backend', backend_type or smallest_type, booted=True)
+
+        monitoring = TraceMonitoring(scaler.logger, manager.cost_controller, cloud, trace, slo,
+                                     manager.optimal_scaling.get_compute_units,
+                                     INSTANCE_HARDWARE[self.iaas_driver], self.noise, self.seed)
+        manager.monitoring = monitoring
+
+        manager.slo = slo
+        manager.time_between_changes = cooldown_time * 60
+        manager.decision_interval = decision_interval
+        manager.optimal_scaling.set_slo_fulfillment_degree(slo_fulfillment_degree)
+
+        # The loops of do_monitoring and do_provisioning, on the simulated clock
+        step_no = 0
+        next_decision = clock.time() + decision_interval
+        while clock.time() < trace.end:
+            clock.now = min(clock.time() + manager.monitoring_interval, trace.end)
+            monitoring.nodes_info_update(manager.killed_backends)
+            manager.collect_monitoring_data()
+            if manager.decision_event.is_set() or clock.time() >= next_decision:
+                manager.decision_event.clear()
+                if manager.provisioning_step(step_no + 1):
+                    step_no += 1
+                    next_decision = clock.time() + decision_interval
+                else:
+                    next_decision = clock.time() + manager.monitoring_interval
+
+        vm_hours = cost = 0.0
+        prices = manager.cost_controller.get_instance_prices()[self.iaas_driver]
+        for node in cloud.nodes:
+            hours = ((node.stop_time or clock.time()) - node.start_time) / 3600.0
+            vm_hours += hours
+            cost += math.ceil(hours) * prices[node.inst_type]
+
+        return Report(clock.time() - trace.start, monitoring.samples, monitoring.slo_violations,
+                      monitoring.tail_slo_violations, vm_hours, cost, manager.decision_latencies,
+                      cloud.nodes_added, cloud.nodes_removed, monitoring.max_backends)
@@ -25,6 +25,9 @@ from os.path import join as pjoin
 
 COMPUTE_UNITS_FILE_PATH = 'data/compute_units.json'
 
+# Largest number of machines of a proposed scaling strategy
+MAX_STRATEGY_NODES = 100
+
 
 class Strategy_Finder:
 
@@ -35,6 +38,7 @@ class Strategy_Finder:
         self.stat_utils = StatUtils()
 
         self.scaling_decision = []
+        self.scaling_decision_keys = set()
         self.other_possible_combinations = []
 
         self.iaas_driver = iaas_driver
@@ -105,19 +109,10 @@ class Strategy_Finder:
         return compute_units_file_path
 
     def insert_combination(self, cpu_capacity, combination):
-        exist = 0
-        for decision, (cpu_value) in self.scaling_decision:
-            if len(decision) == len(combination):
-                times = 0
-                for vm in combination:
-                    if not vm in decision:
-                        break
-                    else:
-                        times += 1
-                if times == len(combination):
-                    exist = 1
-
-        if exist == 0:
+        # Combinations are multisets of instance types
+        key = tuple(sorted(combination))
+        if key not in self.scaling_decision_keys:
+            self.scaling_decision_keys.add(key)
             self.scaling_decision.append((combination, (cpu_capacity)))
             #self.logger.info("Optimal_Scaler: adding a possible scaling decisions: "+str(combination))
 
@@ -132,7 +127,11 @@ class Strategy_Finder:
     def get_compute_units(self, inst_type):
         return self.classification.compute_units_instance(self.iaas_driver, inst_type)
 
-    def prediction_evaluation(self, cpu_data, req_rate_data):
+    def prediction_evaluation(self, cpu_data, req_rate_data, cpu_data_total=None, req_rate_data_total=None):
+        """
+        Forecast the cpu usage and request rate. cpu_data and req_rate_data are the last samples of
+        their series, the totals count the samples of the whole series (see Prediction_Models).
+        """
         self.logger.info("prediction_evaluation: Predicting future values for cpu_data " + str(cpu_data) + " request rate list " + str(req_rate_data))
         try:
             data_cpu_filtered = cpu_data
@@ -145,15 +144,16 @@ class Strategy_Finder:
             # self.logger.debug("OptimalScaler: Request rate filtered before prediciton: "+str(data_req_rate_filtered))
             # self.logger.debug("OptimalScaler: Cpu usage filtered before prediciton: "+str(data_cpu_filtered))
 
-            async_result_req_ar = self.pool_predictors.apply_async(self.performance_predictor.auto_regression, (data_req_rate_filtered, 20))
+            # The AR and Holt-Winters models of each series are updated online, VAR is fitted in a process pool
+            async_result_req_ar = self.pool_predictors.apply_async(self.performance_predictor.recursive_least_squares, (data_req_rate_filtered, 20, 'req_rate', req_rate_data_total))
             async_result_req_lr = self.pool_predictors.apply_async(self.performance_predictor.linear_regression, (data_req_rate_filtered, 20))
-            async_result_req_exp_smoothing = self.pool_predictors.apply_async(self.performance_predictor.exponential_smoothing, (data_req_rate_filtered, 2))
+            async_result_req_exp_smoothing = self.pool_predictors.apply_async(self.performance_predictor.exponential_smoothing, (data_req_rate_filtered, 2, 'req_rate', req_rate_data_total))
 
             #  async_result_req_arma =  self.pool_predictors.apply_async(self.performance_predictor.arma, (data_req_rate_filtered,8))
 
-            async_result_cpu_ar = self.pool_predictors.apply_async(self.performance_predictor.auto_regression, (data_cpu_filtered, 20))
+            async_result_cpu_ar = self.pool_predictors.apply_async(self.performance_predictor.recursive_least_squares, (data_cpu_filtered, 20, 'cpu', cpu_data_total))
             async_result_cpu_lr = self.pool_predictors.apply_async(self.performance_predictor.linear_regression, (data_cpu_filtered, 20))
-            async_result_cpu_exp_smoothing = self.pool_predictors.apply_async(self.performance_predictor.exponential_smoothing, (data_cpu_filtered, 12))
+            async_result_cpu_exp_smoothing = self.pool_predictors.apply_async(self.performance_predictor.exponential_smoothing, (data_cpu_filtered, 12, 'cpu', cpu_data_total))
             # async_result_cpu_arma =  self.pool_predictors.apply_async(self.performance_predictor.arma, (data_cpu_filtered,20))
             async_result_cpu_var = self.pool_predictors.apply_async(self.performance_predictor.vector_auto_regression, (data_cpu_filtered, data_cpu_filtered, 20))
 
@@ -341,147 +341,97 @@ class Strategy_Finder:
 
         return float(capacity) / float(len(combination) + 1)
 
-    def add_new_resources(self, possible_combinations, max_performance_throughtput):
-        # self.logger.info( "add_new_resources: Adding additional resoruces starting ...")
-
-        try:
-            for x in self.vm_inst_types:
-                if self.capacity_inst_type[x] > 0:
-                    cpu_capacity = self.calculate_cpu_capacity(possible_combinations, x)
-                    if cpu_capacity > max_performance_throughtput:
-            # if performance_margin > 0 and performance_margin < (0.1 * 700):
-            #    performance_margin = 0
-                        aux = []
-                        for it in possible_combinations:
-                            aux.append(it)
-                        aux.append(x)
-                        self.add_new_resources(aux, max_performance_throughtput)
-                    elif cpu_capacity < max_performance_throughtput and cpu_capacity > self.min_performance_throughput:
-                        aux = []
-                        for it in possible_combinations:
-                            aux.append(it)
-                        aux.append(x)
-            #  self.logger.debug("horizontal_scaling_strategy: cpu_capacity "+str(cpu_capacity)+" combination "+str(aux)+" capacity inst: "+str(self.capacity_inst_type[x]))
-                        self.insert_combination(cpu_capacity, aux)
-        # self.logger.info( "horizontal_scaling_strategy: Horizontal scaling strategy finished.")
-        except Exception as e:
-            raise Exception("horizontal_scaling_strategy: Error calculating horizontal scaling strategy " + str(e))
-
-    def filter_scaling_strategy(self, current_combination, proposed_combination):
-
-        diff_combo = Counter(proposed_combination)
-        diff_combo.subtract(current_combination)
-
-        if self.cost_policy:
-            for vm_type, count in diff_combo.items():
-                if count < 0:
-                    if not self.cost_controller.check_shutdown_constraint(self.nodes, vm_type, math.fabs(count)):
-                        self.logger.info("filter_scaling_strategy: Proposed strategy cannot be chosen due to the shutdown constraint: " + str(diff_combo))
-                        return True
-
-    def replace_scaling_strategy_recursive(self, original_combination, current_combination, max_performance_throughtput, iterator):
-        if len(current_combination) > 6:
-            searching_range = 6
-        else:
-            searching_range = len(current_combination)
-
-        for cb in xrange(searching_range):
-            if (cb > iterator):
-                for x in self.vm_inst_types:
-
-                    if self.capacity_inst_type[x] > 0:
-                #  if x != current_combination[cb]:
-
-                        combination = []
-                        for it in xrange(searching_range):
-                            if it != cb:
-                                combination.append(current_combination[it])
-
-                        cpu_capacity = self.calculate_cpu_capacity(combination, x)
-                        combination.append(x)
-
-                        if not self.filter_scaling_strategy(original_combination, combination):
-
-                            if cpu_capacity < max_performance_throughtput and cpu_capacity > self.min_performance_throughput:
-                                # self.logger.debug("vertical_scaling_strategy_recursive: cpu_capacity "+str(cpu_capacity)+" combination "+str(combination)+" capacity inst: "+str(self.capacity_inst_type[x]))
-                                self.insert_combination(cpu_capacity, combination)
-
-                            if cb < (searching_range - 1):
-                                self.replace_scaling_strategy_recursive(original_combination, combination, max_performance_throughtput, cb)
-                            elif cpu_capacity > max_performance_throughtput:
-                                self.add_new_resources(combination, max_performance_throughtput)
-
-    """
-      This function calculates possible scaling strategies considering the current scaling strategy and replacing their resources for other with
-      better hardware configuration.
-  """
-
-    def replace_scaling_strategy(self, current_combination, max_performance_throughtput):
-        self.logger.info("replace_scaling_strategy: Vertical scaling strategy starting ...")
-
-        if len(current_combination) > 6:
-            searching_range = 6
+    def find_combinations(self, capacities, index, remaining, total, counts, low, high, margin, found):
+        """
+          Appends to found every (counts, total) such that counts[index:] add up to remaining machines and
+          the sum of their capacities plus total lies between low and high. The sum must also exceed margin
+          plus the capacity of the weakest machine, that is the first type chosen. Capacities are sorted in
+          decreasing order, so the branches which cannot reach these bounds are cut as soon as possible.
+        """
+        capacity = capacities[index]
+        if total == 0:
+            first_low = max(low, margin + capacity)
         else:
-            searching_range = len(current_combination)
-        try:
-            for cb in xrange(searching_range):
-                for x in self.vm_inst_types:
-                    if self.capacity_inst_type[x] > 0:
-                    #  if x != current_combination[cb]:
-                        combination = []
-                        for it in xrange(searching_range):
-                            if it != cb:
-                                combination.append(current_combination[it])
-
-                        cpu_capacity = self.calculate_cpu_capacity(combination, x)
-                        combination.append(x)
-
-                        if not self.filter_scaling_strategy(current_combination, combination):
-
-                            if cpu_capacity < max_performance_throughtput and cpu_capacity > self.min_performance_throughput:
-                            # self.logger.debug("calculate_scaling_in_strategy: cpu_capacity "+str(cpu_capacity)+" combination "+str(combination)+" capacity inst: "+str(self.capacity_inst_type[x]))
-                                self.insert_combination(cpu_capacity, combination)
-
-                            if cb < (searching_range - 1):
-                                self.replace_scaling_strategy_recursive(current_combination, combination, max_performance_throughtput, cb)
-                            elif cpu_capacity > max_performance_throughtput:
-                                self.add_new_resources(combination, max_performance_throughtput)
-
-            self.logger.info("replace_scaling_strategy: Vertical scaling strategy finished ")
-        except Exception as e:
-            raise Exception("replace_scaling_strategy: Error calculating vertical scaling strategy " + str(e))
+            first_low = low
+
+        if index == len(capacities) - 1:
+            total += remaining * capacity
+            if first_low <= total <= high:
+                counts[index] = remaining
+                found.append((list(counts), total))
+                counts[index] = 0
+            return
+
+        for count in xrange(remaining + 1):
+            new_total = total + count * capacity
+            new_low = first_low if count > 0 else low
+            left = remaining - count
+            # Highest and lowest sums reachable with the remaining types
+            if new_total + left * capacities[index + 1] < new_low:
+                continue
+            if new_total + left * capacities[-1] > high:
+                break
+            counts[index] = count
+            self.find_combinations(capacities, index + 1, left, new_total, counts, new_low, high, margin, found)
+        counts[index] = 0
 
-    def calculate_scaling_strategy(self, current_combination, max_performance_throughtput):
-        try:
-            self.propose_new_scaling_strategy(max_performance_throughtput)
-            self.replace_scaling_strategy(current_combination, max_performance_throughtput)
-        except Exception as e:
-            raise Exception("calculate_scaling_strategy: Error calculating scaling combination " + str(e))
     """
-  This function calculates possible scaling strategies without considering the current scaling strategy
+      This function calculates the possible scaling strategies: the combinations of instance types with a
+      cpu usage per machine between the min and max performance throughput.
+
+      A combination of k machines whose capacities add up to S has a cpu usage of L * S / k^2, with
+      L = forecast_req_rate * req_complexity_rate (see calculate_cpu_capacity). Only the number of machines
+      of each type matters, so the combinations of every size are enumerated once, as multisets, and the
+      sizes and partial sums of capacities which cannot reach the range are pruned. Combinations which still
+      fulfill the max performance throughput without one of their machines cost more than needed and are
+      not proposed: without its weakest machine, the one with the highest capacity, a combination must be
+      overloaded.
   """
 
-    def propose_new_scaling_strategy(self, max_performance_throughtput):
-        self.logger.info("propose_new_scaling_strategy: Starting to calculate scaling IN strategies starting ...")
-
+    def calculate_scaling_strategy(self, max_performance_throughtput):
+        self.logger.info("calculate_scaling_strategy: Scaling strategy starting ...")
         try:
-            for x in self.vm_inst_types:
-                if self.capacity_inst_type[x] > 0:
+            load = float(self.forecast_req_rate_predicted * self.req_complexity_rate)
+            inst_types = sorted([(self.capacity_inst_type[x], x) for x in self.vm_inst_types if self.capacity_inst_type.get(x, 0) > 0], reverse=True)
+            if load <= 0 or len(inst_types) == 0:
+                self.logger.info("calculate_scaling_strategy: No load or capacities to calculate a scaling strategy.")
+                return
+
+            capacities = [capacity for capacity, x in inst_types]
+            # The cpu usage of k machines is between L * min_capacity / k and L * max_capacity / k
+            min_size = max(1, int(load * capacities[-1] / max_performance_throughtput))
+            max_size = MAX_STRATEGY_NODES
+            if self.min_performance_throughput > 0:
+                max_size = min(max_size, int(load * capacities[0] / self.min_performance_throughput) + 1)
+
+            for size in xrange(min_size, max_size + 1):
+                found = []
+                low = self.min_performance_throughput * size * size / load
+                high = max_performance_throughtput * size * size / load
+                # A single machine is never removed
+                if size > 1:
+                    margin = max_performance_throughtput * (size - 1) * (size - 1) / load
+                else:
+                    margin = -capacities[0]
+                self.find_combinations(capacities, 0, size, 0, [0] * len(capacities), low, high, margin, found)
+
+                for counts, total in found:
+                    cpu_capacity = load * total / (size * size)
+                    if not (cpu_capacity < max_performance_throughtput and cpu_capacity > self.min_performance_throughput):
+                        continue
+                    if size > 1:
+                        weakest = capacities[min(index for index, count in enumerate(counts) if count > 0)]
+                        if load * (total - weakest) / ((size - 1) * (size - 1)) <= max_performance_throughtput:
+                            continue
 
-                    cpu_capacity = self.forecast_req_rate_predicted * self.req_complexity_rate * self.capacity_inst_type[x]
                     combination = []
-                    combination.append(x)
-
-                    if cpu_capacity < max_performance_throughtput and cpu_capacity > self.min_performance_throughput:
-                    #  self.logger.debug("calculate_scaling_in_strategy: cpu_capacity "+str(cpu_capacity)+" combination "+str(combination)+" capacity inst: "+str(self.capacity_inst_type[x]))
-                        self.insert_combination(cpu_capacity, combination)
+                    for (capacity, x), count in zip(inst_types, counts):
+                        combination.extend([x] * count)
+                    self.insert_combination(cpu_capacity, combination)
 
-                    if cpu_capacity > max_performance_throughtput:
-                        self.add_new_resources(combination, max_performance_throughtput)
-
-            self.logger.info("propose_new_scaling_strategy: Calculated scaling IN strategies. ")
+            self.logger.info("calculate_scaling_strategy: Found " + str(len(self.scaling_decision)) + " scaling strategies of " + str(min_size) + " to " + str(max_size) + " machines.")
         except Exception as e:
-            raise Exception("propose_new_scaling_strategy: Error calculating consolation scaling combination " + str(e))
+            raise Exception("calculate_scaling_strategy: Error calculating scaling combination " + str(e))
 
     def calculate_cost_strategy(self, cpu_capacity, number_machines, diff_strategy, new_strategy):
         self.logger.info("calculate_cost_strategy:  new strategy " + str(new_strategy) + " difference strategy " + str(diff_strategy) + " capacity: " + str(cpu_capacity))
@@ -700,13 +650,14 @@ class Strategy_Finder:
 
         return complexity_rate
 
-    def calculate_adaptive_scaling(self, backend_nodes, combination_machines, cpu_capacity_now, req_rate_now, max_performance_throughput, min_performance_throughput, capacity_inst_type, cpu_data_last_hour, req_rate_data_last_hour):
+    def calculate_adaptive_scaling(self, backend_nodes, combination_machines, cpu_capacity_now, req_rate_now, max_performance_throughput, min_performance_throughput, capacity_inst_type, cpu_data_last_hour, req_rate_data_last_hour, cpu_data_total=None, req_rate_data_total=None):
         self.logger.info("calculate_adaptive_scaling: calculating the optimal strategy to provision: " + str(cpu_capacity_now) + " req_rate " + str(req_rate_now) + " with max perf: " + str(max_performance_throughput))
 
         strategy = []
         final_combination = []
         self.strategy_max_performance = 0
         self.scaling_decision = []
+        self.scaling_decision_keys = set()
         self.nodes = []
         self.nodes = backend_nodes
 
@@ -729,7 +680,7 @@ class Strategy_Finder:
             self.logger.info("calculate_adaptive_scaling: capacity_inst_types " + str(self.capacity_inst_type))
 
             try:
-                self.prediction_evaluation(cpu_data_last_hour, req_rate_data_last_hour)
+                self.prediction_evaluation(cpu_data_last_hour, req_rate_data_last_hour, cpu_data_total, req_rate_data_total)
                 self.req_complexity_rate = self.get_request_complexity_rate(combination_machines, self.obtain_cpu_forecast(), self.obtain_req_rate_forecast())
             except Exception as e:
                 self.logger.error("calculate_adaptive_scaling: Error trying to predict req_rate and cpu_usage future values")
@@ -740,7 +691,7 @@ class Strategy_Finder:
 
             self.logger.info("calculate_adaptive_scaling: Cpu capacity predicted " + str(self.forecast_cpu_predicted) + " Forecast req_rate: " + str(self.forecast_req_rate_predicted) + " Req_complexity rate: " + str(self.req_complexity_rate))
 
-            self.calculate_scaling_strategy(combination_machines, max_performance_throughput)
+            self.calculate_scaling_strategy(max_performance_throughput)
 
             self.logger.info("calculate_adaptive_scaling: Find the best scaling decision: " + str(self.scaling_decision))
 
@@ -752,6 +703,8 @@ class Strategy_Finder:
             current_combo = Counter(combination_machines)
             #medium_capacity = self.get_strategy_with_medium_capacity()
             strategies = []
+            # Many strategies release the same VMs, the shutdown constraint is checked once
+            shutdown_allowed = {}
 
             for combination, (cpu_capacity) in self.scaling_decision:
                 diff_combo = Counter(combination)
@@ -763,7 +716,9 @@ class Strategy_Finder:
                 if self.cost_policy:
                     for vm_type, count in diff_combo.items():
                         if count < 0:
-                            if not self.cost_controller.check_shutdown_constraint(backend_nodes, vm_type, math.fabs(count)):
+                            if (vm_type, count) not in shutdown_allowed:
+                                shutdown_allowed[(vm_type, count)] = self.cost_controller.check_shutdown_constraint(backend_nodes, vm_type, math.fabs(count))
+                            if not shutdown_allowed[(vm_type, count)]:
                                 reject_strategy = True
                                 self.logger.info("calculate_adaptive_scaling: Strategy cannot be chosen due to the shutdown constraint: " + str(diff_combo))
 
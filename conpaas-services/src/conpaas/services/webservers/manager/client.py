@@ -138,6 +138,11 @@ def list_nodes(host, port):
     return _check(https.client.jsonrpc_get(host, port, '/', method))
 
 
+def get_response_time_histograms(host, port):
+    method = 'get_response_time_histograms'
+    return _check(https.client.jsonrpc_get(host, port, '/', method))
+
+
 def get_node_info(host, port, serviceNodeId):
     method = 'get_node_info'
     params = {'serviceNodeId': serviceNodeId}
@@ -168,8 +173,12 @@ def off_autoscaling(host, port):
 
 def upload_code_version(host, port, filepath):
     params = {'method': 'upload_code_version'}
-    files = [('code', filepath, file_get_contents(filepath))]
-    return _check(https.client.https_post(host, port, '/', params, files=files))
+    code = open(filepath, 'rb')
+    try:
+        files = [('code', filepath, code)]
+        return _check(https.client.https_post(host, port, '/', params, files=files))
+    finally:
+        code.close()
 
 
 def upload_authorized_key(host, port, filepath):
@@ -62,6 +62,7 @@ Created on Feb 8, 2011
 from threading import Thread, Timer
 import collections
 import tempfile
+import shutil
 import os
 import os.path
 import time
@@ -82,6 +83,9 @@ from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_uploaded_file
 
 from conpaas.core import git
+from conpaas.core import codestore
+from conpaas.core import coderelay
+from conpaas.core import fanout
 
 
 class BasicWebserversManager(BaseManager):
@@ -105,10 +109,26 @@ class BasicWebserversManager(BaseManager):
         # self.controller.generate_context('web')
 
         self.code_repo = config_parser.get('manager', 'CODE_REPO')
+        self.code_store = codestore.BlobStore(os.path.join(self.code_repo, '.blobs'))
+        self.code_relay_seeds = coderelay.DEFAULT_SEEDS
+        if config_parser.has_option('manager', 'CODE_RELAY_SEEDS'):
+            self.code_relay_seeds = config_parser.getint('manager', 'CODE_RELAY_SEEDS')
 
     def get_service_type(self):
         return 'web'
 
+    def _code_update_func(self, config, nodes, update_code, relay_code):
+        """Return the function updating the code of a node: either
+        update_code(node), which uploads the code from the manager, or a
+        relay of the code through the agents having it already."""
+        codeType = config.codeVersions[config.currentCodeVersion].type
+        if codeType == 'git' or not self.code_relay_seeds \
+                or len(nodes) <= self.code_relay_seeds:
+            return update_code
+        relay = coderelay.CodeRelay(update_code, relay_code,
+                                    self.code_relay_seeds, self.logger)
+        return relay.update
+
     def get_node_roles(self):
         return [ self.ROLE_BACKEND, self.ROLE_WEB, self.ROLE_PROXY ]
 
@@ -218,60 +238,42 @@ class BasicWebserversManager(BaseManager):
         raise Exception("BasicWebservicesManager._update_proxy(...) must be overridden by extending classes.")
 
     def _stop_proxy(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.stopHttpProxy(serviceNode.ip, self.AGENT_PORT)
-            except client.AgentException:
-                self.logger.exception(
-                    'Failed to stop proxy at node %s' % str(serviceNode))
-                self.state_set(
-                    self.S_ERROR, msg='Failed to stop proxy at node %s' % str(serviceNode))
-                raise
+        def stop_proxy(serviceNode):
+            client.stopHttpProxy(serviceNode.ip, self.AGENT_PORT)
+
+        self._call_agents(stop_proxy, nodes, 'Failed to stop proxy at node %s')
 
     def _start_web(self, config, nodes):
         if config.prevCodeVersion is None:
             code_versions = [config.currentCodeVersion]
         else:
             code_versions = [config.currentCodeVersion, config.prevCodeVersion]
-        for serviceNode in nodes:
-            try:
-                client.createWebServer(serviceNode.ip, self.AGENT_PORT,
-                                       config.web_config.port,
-                                       code_versions)
-            except client.AgentException:
-                self.logger.exception(
-                    'Failed to start web at node %s' % str(serviceNode))
-                self.state_set(
-                    self.S_ERROR, msg='Failed to start web at node %s' % str(serviceNode))
-                raise
+
+        def start_web(serviceNode):
+            client.createWebServer(serviceNode.ip, self.AGENT_PORT,
+                                   config.web_config.port,
+                                   code_versions)
+
+        self._call_agents(start_web, nodes, 'Failed to start web at node %s')
 
     def _update_web(self, config, nodes):
         if config.prevCodeVersion is None:
             code_versions = [config.currentCodeVersion]
         else:
             code_versions = [config.currentCodeVersion, config.prevCodeVersion]
-        for webNode in nodes:
-            try:
-                client.updateWebServer(webNode.ip, self.AGENT_PORT,
-                                       config.web_config.port,
-                                       code_versions)
-            except client.AgentException:
-                self.logger.exception(
-                    'Failed to update web at node %s' % str(webNode))
-                self.state_set(
-                    self.S_ERROR, msg='Failed to update web at node %s' % str(webNode))
-                raise
+
+        def update_web(webNode):
+            client.updateWebServer(webNode.ip, self.AGENT_PORT,
+                                   config.web_config.port,
+                                   code_versions)
+
+        self._call_agents(update_web, nodes, 'Failed to update web at node %s')
 
     def _stop_web(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.stopWebServer(serviceNode.ip, self.AGENT_PORT)
-            except client.AgentException:
-                self.logger.exception('Failed to stop web at node %s'
-                                      % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to stop web at node %s'
-                                % str(serviceNode))
-                raise
+        def stop_web(serviceNode):
+            client.stopWebServer(serviceNode.ip, self.AGENT_PORT)
+
+        self._call_agents(stop_web, nodes, 'Failed to stop web at node %s')
 
     def _start_backend(self, config, nodes):
         raise Exception("BasicWebservicesManager._start_backend(...) must be overridden by extending classes.")
@@ -1242,6 +1244,37 @@ class BasicWebserversManager(BaseManager):
                             }
         })
 
+    @expose('GET')
+    def get_response_time_histograms(self, kwargs):
+        """
+        Return the histograms of the response times of every proxy, by IP,
+        as exported by the proxies (see conpaas.core.latency). The proxies
+        are queried in parallel, and the ones that fail are left out.
+        """
+        try:
+            exp_params = []
+            check_arguments(exp_params, kwargs)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        try:
+            self.check_state([self.S_RUNNING, self.S_ADAPTING])
+        except:
+            return HttpJsonResponse({'proxies': {}})
+
+        config = self._configuration_get()
+
+        def get_histograms(serviceNode):
+            return client.getResponseTimeHistograms(serviceNode.ip, self.AGENT_PORT)
+
+        results = self._call_agents(get_histograms, config.getProxyServiceNodes(),
+                                    'Failed to get the response time histograms of node %s',
+                                    required=fanout.REQUIRE_NONE, error_state=False)
+        return HttpJsonResponse({
+            'proxies': dict((serviceNode.ip, histograms)
+                            for serviceNode, histograms in results.iteritems())
+        })
+
     @expose('POST')
     def migrate_nodes(self, kwargs):
         """
@@ -1494,10 +1527,7 @@ class BasicWebserversManager(BaseManager):
         upload = code.file
         codeVersionId = os.path.basename(name)
 
-        bytes = upload.read(2048)
-        while len(bytes) != 0:
-            fd.write(bytes)
-            bytes = upload.read(2048)
+        shutil.copyfileobj(upload, fd)
         fd.close()
 
         arch = archive_open(name)
@@ -1534,6 +1564,7 @@ class BasicWebserversManager(BaseManager):
                                   detail='Cannot remove the active code version')
             return HttpErrorResponse("%s" % ex)
 
+        filename = None
         if not config.codeVersions[codeVersionId].type == 'git':
             filename = os.path.abspath(os.path.join(self.code_repo, codeVersionId))
             if not filename.startswith(self.code_repo + '/') or not os.path.exists(filename):
@@ -1546,6 +1577,16 @@ class BasicWebserversManager(BaseManager):
         config.codeVersions.pop(codeVersionId)
         self._configuration_set(config)
 
+        if filename is not None:
+            # drop the blobs only the deleted version used
+            try:
+                codestore.prune_archives(self.code_store,
+                    [ os.path.join(self.code_repo, version.id)
+                      for version in config.codeVersions.values()
+                      if version.type != 'git' ])
+            except Exception as ex:
+                self.logger.exception('Failed to prune the code store: %s' % ex)
+
         return HttpJsonResponse()
 
     @expose('UPLOAD')
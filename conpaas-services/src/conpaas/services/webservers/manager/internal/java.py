@@ -23,6 +23,7 @@ from conpaas.core.manager import BaseManager
 from . import BasicWebserversManager, ManagerException
 from conpaas.core.expose import expose
 from conpaas.core import git
+from conpaas.core import codestore
 
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
@@ -62,32 +63,53 @@ class JavaManager(BasicWebserversManager):
         return logs
 
     def _update_code(self, config, nodes):
-        for serviceNode in nodes:
+        codeType = config.codeVersions[config.currentCodeVersion].type
+        if codeType != 'git':
+            manifest = codestore.archive_manifest(
+                self.code_store, os.path.join(self.code_repo, config.currentCodeVersion))
+
+        def update_code(serviceNode):
             # Push the current code version via GIT if necessary
-            if config.codeVersions[config.currentCodeVersion].type == 'git':
+            if codeType == 'git':
                 filepath = config.codeVersions[config.currentCodeVersion].filename
                 _, err = git.git_push(git.DEFAULT_CODE_REPO, serviceNode.ip)
                 if err:
                     self.logger.debug('git-push to %s: %s' % (serviceNode.ip, err))
-            else:
-                filepath = os.path.join(self.code_repo, config.currentCodeVersion)
-
-            try:
-                # UPLOAD TOMCAT CODE TO TOMCAT
-                if serviceNode.isRunningBackend:
-                    client.updateTomcatCode(
-                        serviceNode.ip, 5555, config.currentCodeVersion,
-                        config.codeVersions[config.currentCodeVersion].type,
-                        filepath)
-                if serviceNode.isRunningProxy or serviceNode.isRunningWeb:
-                    client.updatePHPCode(
-                        serviceNode.ip, 5555, config.currentCodeVersion,
-                        config.codeVersions[config.currentCodeVersion].type,
-                        filepath)
-            except client.AgentException:
-                self.logger.exception('Failed to update code at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to update code at node %s' % str(serviceNode))
-                return
+
+            def upload(update_func):
+                if codeType == 'git':
+                    update_func(serviceNode.ip, 5555, config.currentCodeVersion,
+                                codeType, filepath)
+                else:
+                    # Send only the files the agent does not have yet
+                    codestore.push_code(
+                        self.code_store, manifest,
+                        lambda hashes: client.missingCodeBlobs(serviceNode.ip, 5555, hashes),
+                        lambda bundle: update_func(serviceNode.ip, 5555,
+                                                   config.currentCodeVersion,
+                                                   'bundle', bundle))
+
+            # UPLOAD TOMCAT CODE TO TOMCAT
+            if serviceNode.isRunningBackend:
+                upload(client.updateTomcatCode)
+            if serviceNode.isRunningProxy or serviceNode.isRunningWeb:
+                upload(client.updatePHPCode)
+
+        def relay_code(source, serviceNode):
+            methods = []
+            if serviceNode.isRunningBackend:
+                methods.append('updateTomcatCode')
+            if serviceNode.isRunningProxy or serviceNode.isRunningWeb:
+                methods.append('updatePHPCode')
+            for method in methods:
+                client.relayCode(source.ip, 5555, serviceNode.ip, 5555, method,
+                                 config.currentCodeVersion, manifest)
+
+        try:
+            self._call_agents(self._code_update_func(config, nodes, update_code, relay_code),
+                              nodes, 'Failed to update code at node %s')
+        except client.AgentException:
+            return
 
     def _start_proxy(self, config, nodes):
         kwargs = {
@@ -96,17 +118,16 @@ class JavaManager(BasicWebserversManager):
             'tomcat_servlets': self._get_servlet_urls(config.currentCodeVersion),
         }
 
-        for proxyNode in nodes:
-            try:
-                if config.currentCodeVersion is not None:
-                    client.createHttpProxy(proxyNode.ip, 5555,
-                                           config.proxy_config.port,
-                                           config.currentCodeVersion,
-                                           **kwargs)
-            except client.AgentException:
-                self.logger.exception('Failed to start proxy at node %s' % str(proxyNode))
-                self.state_set(self.S_ERROR, msg='Failed to start proxy at node %s' % str(proxyNode))
-                raise
+        if config.currentCodeVersion is None:
+            return
+
+        def start_proxy(proxyNode):
+            client.createHttpProxy(proxyNode.ip, 5555,
+                                   config.proxy_config.port,
+                                   config.currentCodeVersion,
+                                   **kwargs)
+
+        self._call_agents(start_proxy, nodes, 'Failed to start proxy at node %s')
 
     def _update_proxy(self, config, nodes):
         kwargs = {
@@ -115,35 +136,28 @@ class JavaManager(BasicWebserversManager):
             'tomcat_servlets': self._get_servlet_urls(config.currentCodeVersion),
         }
 
-        for proxyNode in nodes:
-            try:
-                if config.currentCodeVersion is not None:
-                    client.updateHttpProxy(proxyNode.ip, 5555,
-                                           config.proxy_config.port,
-                                           config.currentCodeVersion,
-                                           **kwargs)
-            except client.AgentException:
-                self.logger.exception('Failed to update proxy at node %s' % str(proxyNode))
-                self.state_set(self.S_ERROR, msg='Failed to update proxy at node %s' % str(proxyNode))
-                raise
+        if config.currentCodeVersion is None:
+            return
+
+        def update_proxy(proxyNode):
+            client.updateHttpProxy(proxyNode.ip, 5555,
+                                   config.proxy_config.port,
+                                   config.currentCodeVersion,
+                                   **kwargs)
+
+        self._call_agents(update_proxy, nodes, 'Failed to update proxy at node %s')
 
     def _start_backend(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.createTomcat(serviceNode.ip, 5555, config.backend_config.port)
-            except client.AgentException:
-                self.logger.exception('Failed to start Tomcat at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to start Tomcat at node %s' % str(serviceNode))
-                raise
+        def start_tomcat(serviceNode):
+            client.createTomcat(serviceNode.ip, 5555, config.backend_config.port)
+
+        self._call_agents(start_tomcat, nodes, 'Failed to start Tomcat at node %s')
 
     def _stop_backend(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.stopTomcat(serviceNode.ip, 5555)
-            except client.AgentException:
-                self.logger.exception('Failed to stop Tomcat at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to stop Tomcat at node %s' % str(serviceNode))
-                raise
+        def stop_tomcat(serviceNode):
+            client.stopTomcat(serviceNode.ip, 5555)
+
+        self._call_agents(stop_tomcat, nodes, 'Failed to stop Tomcat at node %s')
 
     @expose('GET')
     def get_service_info(self, kwargs):
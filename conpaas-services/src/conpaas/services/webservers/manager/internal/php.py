@@ -20,6 +20,7 @@ from . import BasicWebserversManager, ManagerException
 from conpaas.core.expose import expose
 
 from conpaas.core import git
+from conpaas.core import codestore
 
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
@@ -89,24 +90,35 @@ class PHPManager(BasicWebserversManager):
                 raise
 
     def _update_code(self, config, nodes):
-        for serviceNode in nodes:
+        codeType = config.codeVersions[config.currentCodeVersion].type
+        if codeType != 'git':
+            manifest = codestore.archive_manifest(
+                self.code_store, os.path.join(self.code_repo, config.currentCodeVersion))
+
+        def update_code(serviceNode):
             # Push the current code version via GIT if necessary
-            if config.codeVersions[config.currentCodeVersion].type == 'git':
+            if codeType == 'git':
                 filepath = config.codeVersions[config.currentCodeVersion].filename
                 _, err = git.git_push(git.DEFAULT_CODE_REPO, serviceNode.ip)
                 if err:
                     self.logger.debug('git-push to %s: %s' % (serviceNode.ip, err))
+                client.updatePHPCode(serviceNode.ip, 5555, config.currentCodeVersion,
+                                     codeType, filepath)
             else:
-                filepath = os.path.join(self.code_repo, config.currentCodeVersion)
+                # Send only the files the agent does not have yet
+                codestore.push_code(
+                    self.code_store, manifest,
+                    lambda hashes: client.missingCodeBlobs(serviceNode.ip, 5555, hashes),
+                    lambda bundle: client.updatePHPCode(serviceNode.ip, 5555,
+                                                        config.currentCodeVersion,
+                                                        'bundle', bundle))
 
-            try:
-                client.updatePHPCode(serviceNode.ip, 5555, config.currentCodeVersion,
-                                     config.codeVersions[config.currentCodeVersion].type,
-                                     filepath)
-            except client.AgentException:
-                self.logger.exception('Failed to update code at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to update code at node %s' % str(serviceNode))
-                raise
+        def relay_code(source, serviceNode):
+            client.relayCode(source.ip, 5555, serviceNode.ip, 5555, 'updatePHPCode',
+                             config.currentCodeVersion, manifest)
+
+        self._call_agents(self._code_update_func(config, nodes, update_code, relay_code),
+                          nodes, 'Failed to update code at node %s')
 
     def _start_proxy(self, config, nodes):
         kwargs = {
@@ -115,17 +127,16 @@ class PHPManager(BasicWebserversManager):
             'cdn': config.cdn,
         }
 
-        for proxyNode in nodes:
-            try:
-                if config.currentCodeVersion is not None:
-                    client.createHttpProxy(proxyNode.ip, 5555,
-                                           config.proxy_config.port,
-                                           config.currentCodeVersion,
-                                           **kwargs)
-            except client.AgentException:
-                self.logger.exception('Failed to start proxy at node %s' % str(proxyNode))
-                self.state_set(self.S_ERROR, msg='Failed to start proxy at node %s' % str(proxyNode))
-                raise
+        if config.currentCodeVersion is None:
+            return
+
+        def start_proxy(proxyNode):
+            client.createHttpProxy(proxyNode.ip, 5555,
+                                   config.proxy_config.port,
+                                   config.currentCodeVersion,
+                                   **kwargs)
+
+        self._call_agents(start_proxy, nodes, 'Failed to start proxy at node %s')
 
     def _update_proxy(self, config, nodes):
         kwargs = {
@@ -134,46 +145,36 @@ class PHPManager(BasicWebserversManager):
             'cdn': config.cdn
         }
 
-        for proxyNode in nodes:
-            try:
-                if config.currentCodeVersion is not None:
-                    client.updateHttpProxy(proxyNode.ip, 5555,
-                                           config.proxy_config.port,
-                                           config.currentCodeVersion,
-                                           **kwargs)
-            except client.AgentException:
-                self.logger.exception('Failed to update proxy at node %s' % str(proxyNode))
-                self.state_set(self.S_ERROR, msg='Failed to update proxy at node %s' % str(proxyNode))
-                raise
+        if config.currentCodeVersion is None:
+            return
+
+        def update_proxy(proxyNode):
+            client.updateHttpProxy(proxyNode.ip, 5555,
+                                   config.proxy_config.port,
+                                   config.currentCodeVersion,
+                                   **kwargs)
+
+        self._call_agents(update_proxy, nodes, 'Failed to update proxy at node %s')
 
     def _start_backend(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.createPHP(serviceNode.ip, 5555, config.backend_config.port,
-                                 config.backend_config.scalaris, config.backend_config.php_conf.conf)
-            except client.AgentException:
-                self.logger.exception('Failed to start php at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to start php at node %s' % str(serviceNode))
-                raise
+        def start_php(serviceNode):
+            client.createPHP(serviceNode.ip, 5555, config.backend_config.port,
+                             config.backend_config.scalaris, config.backend_config.php_conf.conf)
+
+        self._call_agents(start_php, nodes, 'Failed to start php at node %s')
 
     def _update_backend(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.updatePHP(serviceNode.ip, 5555, config.backend_config.port,
-                                 config.backend_config.scalaris, config.backend_config.php_conf.conf)
-            except client.AgentException:
-                self.logger.exception('Failed to update php at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to update php at node %s' % str(serviceNode))
-                raise
+        def update_php(serviceNode):
+            client.updatePHP(serviceNode.ip, 5555, config.backend_config.port,
+                             config.backend_config.scalaris, config.backend_config.php_conf.conf)
+
+        self._call_agents(update_php, nodes, 'Failed to update php at node %s')
 
     def _stop_backend(self, config, nodes):
-        for serviceNode in nodes:
-            try:
-                client.stopPHP(serviceNode.ip, 5555)
-            except client.AgentException:
-                self.logger.exception('Failed to stop php at node %s' % str(serviceNode))
-                self.state_set(self.S_ERROR, msg='Failed to stop php at node %s' % str(serviceNode))
-                raise
+        def stop_php(serviceNode):
+            client.stopPHP(serviceNode.ip, 5555)
+
+        self._call_agents(stop_php, nodes, 'Failed to stop php at node %s')
 
     @expose('GET')
     def get_service_info(self, kwargs):
@@ -4,24 +4,40 @@
     :copyright: (C) 2010-2013 by Contrail Consortium.
 """
 
-from os.path import exists, join
-from os import makedirs, remove
+from os.path import exists, join, getmtime
+from os import makedirs, remove, listdir
 
 from conpaas.core.expose import expose
 from conpaas.core.https.server import HttpJsonResponse, HttpErrorResponse
 from conpaas.core.https.server import HttpFileDownloadResponse
 from conpaas.services.xtreemfs.agent import role
+from conpaas.services.xtreemfs import snapshot
 from conpaas.core.agent import BaseAgent, AgentException
-from conpaas.core.misc import run_cmd
+from conpaas.core.misc import run_cmd, run_cmd_code
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
     is_int, is_pos_nul_int, is_pos_int, is_dict, is_dict2, is_bool,\
     is_uploaded_file
 
 from threading import Lock
+from subprocess import Popen, PIPE
 import pickle
 import base64
 import copy
+import re
+import shutil
+
+# what a snapshot of the agent holds:
+#     /etc/cpsagent/certs/ (original agent certificates)
+#     /etc/xos/xtreemfs/ (config files, SSL-certificates, policies)
+#     /var/lib/xtreemfs/ (save everything, after shutting down the services)
+#     /var/log/xtreemfs/ (xtreemfs log files)
+SNAPSHOT_DIRS = "var/lib/xtreemfs/ etc/xos/xtreemfs/ var/log/xtreemfs/ etc/cpsagent/certs"
+
+SNAPSHOT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# tar states of the last snapshots kept to build incremental ones on
+SNAPSHOT_STATES = 2
 
 class XtreemFSAgent(BaseAgent):
     def __init__(self,
@@ -50,6 +66,9 @@ class XtreemFSAgent(BaseAgent):
         self.dir_lock = Lock()
         self.osd_lock = Lock()
 
+        self.snapshot_dir = join(self.VAR_TMP, 'snapshots')
+        self.snapshot_lock = Lock()
+
         self.DIR = role.DIR
         self.MRC = role.MRC
         self.OSD = role.OSD
@@ -246,21 +265,108 @@ class XtreemFSAgent(BaseAgent):
         except Exception as ex:
             return HttpErrorResponse("%s" % ex)
 
-        # pack data from:
-        #     /etc/cpsagent/certs/ (original agent certificates)
-        #     /etc/xos/xtreemfs/ (config files, SSL-certificates, policies)
-        #     /var/lib/xtreemfs/ (save everything, after shutting down the services)
-        #     /var/log/xtreemfs/ (xtreemfs log files)
         filename = "/root/snapshot.tar.gz"
-        dirs = "var/lib/xtreemfs/ etc/xos/xtreemfs/ var/log/xtreemfs/ etc/cpsagent/certs"
 
-        err, out = run_cmd("tar -czf %s %s" % (filename, dirs), "/")
+        err, out = run_cmd("tar -czf %s %s" % (filename, SNAPSHOT_DIRS), "/")
         if err:
             self.logger.exception(err)
             return HttpErrorResponse(err)
 
         return HttpFileDownloadResponse("snapshot.tar.gz", filename)
 
+    def _snapshot_path(self, snapshot_id, extension):
+        return join(self.snapshot_dir, snapshot_id + extension)
+
+    def _prune_snapshots(self, snapshot_id):
+        states = [ name for name in listdir(self.snapshot_dir)
+                   if name.endswith('.snar') ]
+        states.sort(key=lambda name: getmtime(join(self.snapshot_dir, name)))
+        for name in states[:-SNAPSHOT_STATES]:
+            remove(join(self.snapshot_dir, name))
+        for name in listdir(self.snapshot_dir):
+            if name.endswith('.tar.gz') and name != snapshot_id + '.tar.gz':
+                remove(join(self.snapshot_dir, name))
+
+    @expose('POST')
+    def download_snapshot(self, kwargs):
+        """Archive the data of the agent as the part 'snapshot_id' of a
+        streamed snapshot (see conpaas.services.xtreemfs.snapshot). With a
+        'base_id', only what changed since that snapshot is archived."""
+        try:
+            exp_params = [('snapshot_id', is_string),
+                          ('base_id', is_string, None)]
+            snapshot_id, base_id = check_arguments(exp_params, kwargs)
+            for param in snapshot_id, base_id:
+                if param is not None and not SNAPSHOT_ID.match(param):
+                    raise Exception("Invalid snapshot ID '%s'" % param)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        with self.snapshot_lock:
+            if not exists(self.snapshot_dir):
+                makedirs(self.snapshot_dir)
+
+            # the state tar keeps of the archived files, for the
+            # incremental snapshots based on this one
+            state = self._snapshot_path(snapshot_id, '.snar')
+            if base_id is None:
+                if exists(state):
+                    remove(state)
+            else:
+                base_state = self._snapshot_path(base_id, '.snar')
+                if not exists(base_state):
+                    return HttpErrorResponse("Unknown base snapshot '%s'"
+                                             % base_id)
+                shutil.copyfile(base_state, state)
+
+            filename = self._snapshot_path(snapshot_id, '.tar.gz')
+            out, err, code = run_cmd_code("tar -czf %s --listed-incremental=%s %s"
+                                          % (filename, state, SNAPSHOT_DIRS), "/")
+            # 1 means that some files changed while being archived
+            if code > 1:
+                self.logger.error('download_snapshot: %s' % err)
+                return HttpErrorResponse(err)
+            if code:
+                self.logger.warning('download_snapshot: %s' % err)
+
+            self._prune_snapshots(snapshot_id)
+
+        self.logger.info('download_snapshot: archived snapshot %s (base %s)'
+                         % (snapshot_id, base_id))
+        return HttpFileDownloadResponse("snapshot.tar.gz", filename)
+
+    @expose('UPLOAD')
+    def restore_snapshot(self, kwargs):
+        """Restore an archive of download_snapshot, after checking it
+        against its SHA-1 digest. The archives of an incremental snapshot
+        are restored after the ones of its base."""
+        try:
+            exp_params = [('archive', is_uploaded_file),
+                          ('sha1', is_string)]
+            archive, sha1 = check_arguments(exp_params, kwargs)
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        archive = archive.file
+        archive.seek(0)
+        if snapshot.file_digest(archive) != sha1:
+            return HttpErrorResponse('restore_snapshot: the archive does '
+                                     'not match its SHA-1 digest')
+        archive.seek(0)
+
+        self.logger.info('restore_snapshot: restoring archive')
+        # the archives carry the tar state of the directories, which
+        # removes the files deleted since the base snapshot
+        proc = Popen(['tar', '-xz', '--listed-incremental=/dev/null', '-C', '/'],
+                     stdin=archive, stdout=PIPE, stderr=PIPE, close_fds=True)
+        out, err = proc.communicate()
+        if proc.returncode:
+            self.logger.error('restore_snapshot: %s' % err)
+            return HttpErrorResponse(err)
+
+        self.logger.info('restore_snapshot: archive restored successfully')
+        return HttpJsonResponse()
+
     @expose('POST')
     def set_certificates(self, kwargs):
         try:
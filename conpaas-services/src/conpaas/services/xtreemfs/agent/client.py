@@ -76,6 +76,31 @@ def set_snapshot(host, port, archive_url):
   params = { 'archive_url': archive_url }
   return _check(https.client.jsonrpc_post(host, port, '/', method,
       params=params))
+
+def download_snapshot(host, port, fileobj, snapshot_id, base_id=None):
+  """Write the archive of the agent for a streamed snapshot to fileobj.
+  An error of the agent is written instead of the archive."""
+  method = 'download_snapshot'
+  params = { 'snapshot_id': snapshot_id }
+  if base_id:
+    params['base_id'] = base_id
+  code, written = https.client.jsonrpc_download(host, port, '/', method,
+      fileobj, params=params, post=True)
+  if code != httplib.OK: raise Exception('Received http response code %d' % (code))
+  return written
+
+def restore_snapshot(host, port, filename, sha1):
+  params = {
+    'method': 'restore_snapshot',
+    'sha1': sha1
+  }
+  archive = open(filename, 'rb')
+  try:
+    files = [ ('archive', filename, archive) ]
+    return _check(https.client.https_post(host, port, '/', params=params,
+        files=files))
+  finally:
+    archive.close()
       
 def set_certificates(host, port, certs):
   method = 'set_certificates'
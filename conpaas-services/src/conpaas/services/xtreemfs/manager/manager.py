@@ -13,18 +13,22 @@ from conpaas.core.manager import ManagerException
 from conpaas.core.manager import WrongNrNodesException
 
 from conpaas.core.https.server import HttpJsonResponse, HttpErrorResponse
+from conpaas.core.https.server import HttpFileDownloadResponse
 from conpaas.core.misc import run_cmd
 
 from conpaas.services.xtreemfs.agent import client
+from conpaas.services.xtreemfs import snapshot
 
 from conpaas.core.misc import check_arguments, is_in_list, is_not_in_list,\
     is_list, is_non_empty_list, is_list_dict, is_list_dict2, is_string,\
     is_int, is_pos_nul_int, is_pos_int, is_dict, is_dict2, is_bool,\
     is_uploaded_file
 
+import os
 import time
 import uuid
 import base64
+import shutil
 import subprocess
 import tempfile
 
@@ -90,6 +94,12 @@ class XtreemFSManager(BaseManager):
         self.client_cert_filename = self.config_parser.get('manager', 'CERT_DIR') + "/client.p12"
         self.client_cert_passphrase = "asdf1234"
 
+        # streamed snapshots, see download_service_snapshot
+        self.snapshot_dir = os.path.join(
+                self.config_parser.get('manager', 'VAR_CACHE'), 'snapshots')
+        # ID and node IDs of the last streamed snapshot taken or restored
+        self.last_snapshot = None
+
     def get_service_type(self):
         return 'xtreemfs'
 
@@ -159,7 +169,7 @@ class XtreemFSManager(BaseManager):
         return node_uuid
 
     def _create_certs(self, nodes):
-        for node in nodes:
+        def create_certs(node):
             certs = {}
             # create a temporary directory
             tmpdir = tempfile.mkdtemp()
@@ -179,6 +189,10 @@ class XtreemFSManager(BaseManager):
             # transfer data to agent node
             client.set_certificates(node.ip, 5555, certs)
 
+        self._call_agents(create_certs, nodes,
+                          'Failed to set certificates at node %s',
+                          error_state=False)
+
     def _create_client_cert(self, passphrase, adminflag):
         # create a temporary directory
         # self.logger.debug('_create_client_cert: creating tmp dir')
@@ -220,62 +234,50 @@ class XtreemFSManager(BaseManager):
     def _start_dir(self, nodes):
         self.logger.debug("_start_dir(%s)" % nodes)
 
-        for node in nodes:
-            try:
-                dir_uuid = self.__get__uuid(node.id, self.ROLE_DIR)
-                client.createDIR(node.ip, 5555, dir_uuid)
-            except client.AgentException:
-                self.logger.exception('Failed to start DIR at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+        uuids = dict([ (node.id, self.__get__uuid(node.id, self.ROLE_DIR))
+                       for node in nodes ])
+        self._call_agents(
+            lambda node: client.createDIR(node.ip, 5555, uuids[node.id]),
+            nodes, 'Failed to start DIR at node %s')
 
     def _stop_dir(self, nodes, remove):
-        for node in nodes:
-            try:
-                client.stopDIR(node.ip, 5555)
-            except client.AgentException:
-                self.logger.exception('Failed to stop DIR at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+        def stop_dir(node):
+            client.stopDIR(node.ip, 5555)
             if remove:
                 del self.dir_node_uuid_map[node.id]
 
+        self._call_agents(stop_dir, nodes, 'Failed to stop DIR at node %s')
+
     def _start_mrc(self, nodes):
-        for node in nodes:
-            try:
-                mrc_uuid = self.__get__uuid(node.id, self.ROLE_MRC)
-                client.createMRC(node.ip, 5555, self.dirNodes[0].ip, mrc_uuid)
-            except client.AgentException:
-                self.logger.exception('Failed to start MRC at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+        uuids = dict([ (node.id, self.__get__uuid(node.id, self.ROLE_MRC))
+                       for node in nodes ])
+        dir_ip = self.dirNodes[0].ip
+        self._call_agents(
+            lambda node: client.createMRC(node.ip, 5555, dir_ip, uuids[node.id]),
+            nodes, 'Failed to start MRC at node %s')
 
     def _stop_mrc(self, nodes, remove):
-        for node in nodes:
-            try:
-                client.stopMRC(node.ip, 5555)
-            except client.AgentException:
-                self.logger.exception('Failed to stop MRC at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+        def stop_mrc(node):
+            client.stopMRC(node.ip, 5555)
             if remove:
                 del self.mrc_node_uuid_map[node.id]
 
-    def _start_osd(self, nodes):
-        dev_name = None
-        for idx, node in enumerate(nodes):
-            volume_associated = False
+        self._call_agents(stop_mrc, nodes, 'Failed to stop MRC at node %s')
+
+    def _start_osd(self, nodes, mkfs=True):
+        uuids = {}
+        for node in nodes:
             osd_uuid = self.__get__uuid(node.id, self.ROLE_OSD)
             # osd_uuid = node.volumes[0].vol_name
             self.osd_uuid_volume_map[osd_uuid] = node.volumes[0].vol_id
+            uuids[node.id] = osd_uuid
+
+        def start_osd(node):
             dev_name = node.volumes[0].dev_name
-            try:
-                client.createOSD(node.ip, 5555, self.dirNodes[0].ip, osd_uuid,
-                        mkfs=not volume_associated, device_name=dev_name)
-            except client.AgentException:
-                self.logger.exception('Failed to start OSD at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+            client.createOSD(node.ip, 5555, self.dirNodes[0].ip, uuids[node.id],
+                    mkfs=mkfs, device_name=dev_name)
+
+        self._call_agents(start_osd, nodes, 'Failed to start OSD at node %s')
 
     # def _start_osd(self, nodes, cloud=None):
     #     dev_name = None
@@ -323,13 +325,16 @@ class XtreemFSManager(BaseManager):
 
         If drain is True, data is moved to other OSDs."""
 
-        for node in nodes:
-            try:
-                client.stopOSD(node.ip, 5555, drain)
-            except client.AgentException:
-                self.logger.exception('Failed to stop OSD at node %s' % node)
-                self.state_set(self.S_ERROR)
-                raise
+        def stop_osd(node):
+            client.stopOSD(node.ip, 5555, drain)
+
+        if drain:
+            # drained data must not move to an OSD which is being stopped
+            for node in nodes:
+                self._call_agents(stop_osd, [ node ],
+                                  'Failed to stop OSD at node %s')
+        else:
+            self._call_agents(stop_osd, nodes, 'Failed to stop OSD at node %s')
 
             # volume_id = self.osd_uuid_volume_map[self.osd_node_uuid_map[node.id]]
             # self.detach_volume(volume_id)
@@ -444,10 +449,12 @@ class XtreemFSManager(BaseManager):
     #     self.logger.info('XtreemFS service was started up')
     #     self.state_set(self.S_RUNNING)
 
-    def _start_all(self):
+    def _start_all(self, mkfs=True):
+        """Start all xtreemfs services on all agents. 'mkfs' is False to
+        keep the file systems of the OSDs, e.g. after a snapshot."""
         self._start_dir(self.dirNodes)
         self._start_mrc(self.mrcNodes)
-        self._start_osd(self.osdNodes)
+        self._start_osd(self.osdNodes, mkfs)
 
     def _stop_all(self, remove=True):
         """Stop all xtreemfs services on all agents (first osd, then mrc, then
@@ -545,24 +552,30 @@ class XtreemFSManager(BaseManager):
         self.mrcNodes += mrcNodesAdded
         self.osdNodes += osdNodesAdded
 
-        for node in nodes:
-            client.startup(node.ip, 5555)
+        self._call_agents(lambda node: client.startup(node.ip, 5555), nodes,
+                          'Failed to start up agent at node %s',
+                          error_state=False)
 
         if not resuming:
             # create certificates for DIR, MRC, OSD and copy them to the agent
             self._create_certs(nodes)
 
         # Startup DIR agents
+        results = self._call_agents(lambda node: client.createDIR(node.ip, 5555),
+                                    dirNodesAdded, 'Failed to start DIR at node %s',
+                                    error_state=False)
         for node in dirNodesAdded:
-            data = client.createDIR(node.ip, 5555)
-            self.logger.info('Received %s from %s', data, node.id)
-            self.dirCount += 1
+            self.logger.info('Received %s from %s', results[node], node.id)
+        self.dirCount += len(dirNodesAdded)
 
         # Startup MRC agents
+        results = self._call_agents(
+                lambda node: client.createMRC(node.ip, 5555, self.dirNodes[0].ip),
+                                    mrcNodesAdded, 'Failed to start MRC at node %s',
+                                    error_state=False)
         for node in mrcNodesAdded:
-            data = client.createMRC(node.ip, 5555, self.dirNodes[0].ip)
-            self.logger.info('Received %s from %s', data, node.id)
-            self.mrcCount += 1
+            self.logger.info('Received %s from %s', results[node], node.id)
+        self.mrcCount += len(mrcNodesAdded)
 
         # Startup OSD agents (if not resuming)
         if not resuming:
@@ -1222,6 +1235,73 @@ class XtreemFSManager(BaseManager):
         self.logger.debug('set_osd_size: %s' % self.osd_volume_size)
         return self.get_service_info({})
 
+    def _node_snapshot_info(self, node):
+        """The uuids of the XtreemFS services of a node, and the volume of
+        its OSD."""
+        info = {
+                'dir_uuid': self.dir_node_uuid_map.get(node.id),
+                'mrc_uuid': self.mrc_node_uuid_map.get(node.id),
+                'osd_uuid': self.osd_node_uuid_map.get(node.id)
+        }
+
+        # Get ID of attached volume
+        volume_id = self.osd_uuid_volume_map.get(info['osd_uuid'])
+        info['volume'] = volume_id
+
+        if volume_id:
+            volume = self.get_volume(volume_id)
+            info['cloud'] = volume.cloud.cloud_name
+
+        return info
+
+    def _restore_node_state(self, nodes_info):
+        """Rewrite the roles, uuids and volumes of the nodes from the
+        (node, info) pairs of a snapshot."""
+        self.osdNodes = []
+        self.mrcNodes = []
+        self.dirNodes = []
+
+        self.dir_node_uuid_map = {}
+        self.mrc_node_uuid_map = {}
+        self.osd_node_uuid_map = {}
+
+        self.osd_uuid_volume_map = {}
+
+        for node, data in nodes_info:
+            volumeid = data.get('volume')
+            osd_uuid = data.get('osd_uuid')
+            mrc_uuid = data.get('mrc_uuid')
+            dir_uuid = data.get('dir_uuid')
+
+            # If this is a dir node
+            if dir_uuid:
+                self.dir_node_uuid_map[node.id] = dir_uuid
+                self.dirNodes.append(node)
+
+            # If this is a mrc node
+            if mrc_uuid:
+                self.mrc_node_uuid_map[node.id] = mrc_uuid
+                self.mrcNodes.append(node)
+
+            # If this is an OSD node
+            if osd_uuid:
+                self.osd_node_uuid_map[node.id] = osd_uuid
+                self.osdNodes.append(node)
+
+                if volumeid:
+                    self.osd_uuid_volume_map[osd_uuid] = volumeid
+
+                    try:
+                        self.get_volume(volumeid)
+                    except Exception:
+                        # This volume is not in the list of known ones.
+                        volumeCloud = self._init_cloud(data.get('cloud'))
+                        class volume:
+                            id = volumeid
+                            cloud = volumeCloud
+
+                        self.volumes.append(volume)
+
     @expose('POST')
     def get_service_snapshot(self, kwargs):
         try:
@@ -1244,12 +1324,8 @@ class XtreemFSManager(BaseManager):
 
         for node in self.nodes:
             if node.id not in nodes_snapshot:
-                nodes_snapshot[node.id] = {
-                        'data': None,
-                        'dir_uuid': self.dir_node_uuid_map.get(node.id),
-                        'mrc_uuid': self.mrc_node_uuid_map.get(node.id),
-                        'osd_uuid': self.osd_node_uuid_map.get(node.id)
-                }
+                nodes_snapshot[node.id] = self._node_snapshot_info(node)
+                nodes_snapshot[node.id]['data'] = None
 
             try:
                 # get snapshot from this agent node, independent of what
@@ -1264,15 +1340,6 @@ class XtreemFSManager(BaseManager):
                 self.state_set(self.S_ERROR)
                 raise
 
-            # Get ID of attached volume
-            volume_id = self.osd_uuid_volume_map.get(
-                    nodes_snapshot[node.id]['osd_uuid'])
-            nodes_snapshot[node.id]['volume'] = volume_id
-
-            if volume_id:
-                volume = self.get_volume(volume_id)
-                nodes_snapshot[node.id]['cloud'] = volume.cloud.cloud_name
-
             for key in 'dir_uuid', 'mrc_uuid', 'osd_uuid', 'volume':
                 self.logger.debug("nodes_snapshot[%s]['%s']: %s" % (node.id,
                     key, nodes_snapshot[node.id][key]))
@@ -1308,52 +1375,9 @@ class XtreemFSManager(BaseManager):
 
         self.logger.info("set_service_snapshot: stopping all agent services")
 
-        # rewriting state
-        self.osdNodes = []
-        self.mrcNodes = []
-        self.dirNodes = []
-
-        self.dir_node_uuid_map = {}
-        self.mrc_node_uuid_map = {}
-        self.osd_node_uuid_map = {}
-
-        self.osd_uuid_volume_map = {}
+        self._restore_node_state(zip(self.nodes, nodes))
 
         for node, data in zip(self.nodes, nodes):
-            volumeid = data.get('volume')
-            osd_uuid = data.get('osd_uuid')
-            mrc_uuid = data.get('mrc_uuid')
-            dir_uuid = data.get('dir_uuid')
-
-            # If this is a dir node
-            if dir_uuid:
-                self.dir_node_uuid_map[node.id] = dir_uuid
-                self.dirNodes.append(node)
-
-            # If this is a mrc node
-            if mrc_uuid:
-                self.mrc_node_uuid_map[node.id] = mrc_uuid
-                self.mrcNodes.append(node)
-
-            # If this is an OSD node
-            if osd_uuid:
-                self.osd_node_uuid_map[node.id] = osd_uuid
-                self.osdNodes.append(node)
-
-                if volumeid:
-                    self.osd_uuid_volume_map[osd_uuid] = volumeid
-
-                    try:
-                        self.get_volume(volumeid)
-                    except Exception:
-                        # This volume is not in the list of known ones.
-                        volumeCloud = self._init_cloud(data.get('cloud'))
-                        class volume:
-                            id = volumeid
-                            cloud = volumeCloud
-
-                        self.volumes.append(volume)
-
             # Regardless of node type, restore metadata
             try:
                 self.logger.info('set_service_snapshot: restoring %s' %
@@ -1377,6 +1401,217 @@ class XtreemFSManager(BaseManager):
         self.logger.info("set_service_snapshot: all agent services started")
         return HttpJsonResponse()
 
+    @expose('POST')
+    def download_service_snapshot(self, kwargs):
+        """Snapshot the service into a streamed snapshot (see
+        conpaas.services.xtreemfs.snapshot) and download it.
+
+        Unlike get_service_snapshot, the service keeps running: its
+        services are stopped while the agents archive their data and
+        started again afterwards. The archives of the agents are
+        downloaded in parallel and spooled to disk, so that the memory
+        used does not depend on the size of the service. With
+        'incremental', the snapshot only holds what changed since the
+        last snapshot taken, if the nodes are still the same.
+        """
+        try:
+            exp_params = [('incremental', is_bool, False)]
+            incremental = check_arguments(exp_params, kwargs)
+            self.check_state([self.S_RUNNING])
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        nodes = self.nodes[:]
+        node_ids = [ node.id for node in nodes ]
+        base_id = None
+        if incremental:
+            if self.last_snapshot and self.last_snapshot['taken'] \
+                    and self.last_snapshot['nodes'] == node_ids:
+                base_id = self.last_snapshot['id']
+            else:
+                self.logger.info('download_service_snapshot: no snapshot '
+                                 'of these nodes to build on, taking a full one')
+        snapshot_id = uuid.uuid4().hex
+
+        self.state_set(self.S_ADAPTING)
+        if not os.path.isdir(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        workdir = tempfile.mkdtemp(dir=self.snapshot_dir)
+        try:
+            self.logger.debug("Stopping all agent services")
+            self._stop_all(remove=False)
+            try:
+                infos = []
+                for position, node in enumerate(nodes):
+                    info = self._node_snapshot_info(node)
+                    info['part'] = 'node%d' % position
+                    infos.append(info)
+                parts = self._fetch_snapshot_parts(
+                        nodes, infos, workdir, snapshot_id, base_id)
+            finally:
+                self.logger.debug("Starting all agent services")
+                self._start_all(mkfs=False)
+
+            index = {
+                    'id': snapshot_id,
+                    'base': base_id,
+                    'created': int(time.time()),
+                    'nodes': infos,
+                    'parts': parts
+            }
+            paths = dict((part['name'], os.path.join(workdir, part['name']))
+                         for part in parts)
+            filename = os.path.join(self.snapshot_dir,
+                                    'snapshot-%s.tar' % snapshot_id)
+            output = open(filename, 'wb')
+            try:
+                snapshot.write_snapshot(output, index, paths)
+            finally:
+                output.close()
+        except Exception as ex:
+            self.logger.exception('Failed to take snapshot %s' % snapshot_id)
+            self.state_set(self.S_RUNNING)
+            return HttpErrorResponse("%s" % ex)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        # only the last snapshot is kept around
+        for name in os.listdir(self.snapshot_dir):
+            if name.startswith('snapshot-') and name != os.path.basename(filename):
+                os.remove(os.path.join(self.snapshot_dir, name))
+        self.last_snapshot = { 'id': snapshot_id, 'nodes': node_ids,
+                               'taken': True }
+        self.state_set(self.S_RUNNING)
+        self.logger.info('Snapshot %s taken (base %s)' % (snapshot_id, base_id))
+        return HttpFileDownloadResponse(os.path.basename(filename), filename)
+
+    def _fetch_snapshot_parts(self, nodes, infos, workdir, snapshot_id,
+                              base_id):
+        """Spool the archives of the agents and of the manager to
+        workdir, returning the parts of the snapshot."""
+        parts_by_node = dict((node.id, info['part'])
+                             for node, info in zip(nodes, infos))
+
+        def fetch(node):
+            part = parts_by_node[node.id]
+            writer = snapshot.PartWriter(part, os.path.join(workdir, part))
+            try:
+                client.download_snapshot(node.ip, 5555, writer, snapshot_id,
+                                         base_id)
+            finally:
+                entry = writer.close()
+            if not writer.is_gzip():
+                # the agent answered with an error instead of the archive
+                raise Exception(open(writer.path).read(4096))
+            return entry
+
+        entries = self._call_agents(fetch, nodes,
+                                    'Failed to get snapshot from node %s',
+                                    error_state=False)
+        parts = [ entries[node] for node in nodes ]
+
+        # manager data
+        writer = snapshot.PartWriter(snapshot.MANAGER_PART,
+                os.path.join(workdir, snapshot.MANAGER_PART))
+        dirs = self.config_parser.get('manager', 'CERT_DIR')
+        devnull = open(os.devnull, 'w')
+        proc = subprocess.Popen(['tar', '-cz', dirs], cwd='/',
+                                stdout=subprocess.PIPE, stderr=devnull)
+        try:
+            while True:
+                data = proc.stdout.read(snapshot.BLOCK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+        finally:
+            parts.append(writer.close())
+            devnull.close()
+        if proc.wait():
+            raise Exception('Failed to archive %s' % dirs)
+        return parts
+
+    @expose('UPLOAD')
+    def upload_service_snapshot(self, kwargs):
+        """Restore a snapshot of download_service_snapshot on the nodes of
+        the service, in the order of the snapshot.
+
+        The snapshot is checked while it is read and every part is spooled
+        to disk and uploaded to its agent in parallel with the others. An
+        incremental snapshot is only restored right after its base.
+        """
+        exp_params = [('snapshot', is_uploaded_file)]
+        try:
+            snapshot_file = check_arguments(exp_params, kwargs)
+            self.check_state([self.S_RUNNING])
+        except Exception as ex:
+            return HttpErrorResponse("%s" % ex)
+
+        if not os.path.isdir(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        workdir = tempfile.mkdtemp(dir=self.snapshot_dir)
+        try:
+            try:
+                index, paths = snapshot.read_snapshot(snapshot_file.file,
+                                                      workdir)
+            except Exception as ex:
+                self.logger.exception('upload_service_snapshot: invalid snapshot')
+                return HttpErrorResponse("%s" % ex)
+
+            nodes = self.nodes[:]
+            if len(index['nodes']) != len(nodes):
+                err = "upload_service_snapshot: len(nodes) != len(self.nodes)"
+                self.logger.error(err)
+                return HttpErrorResponse(err)
+
+            base_id = index['base']
+            if base_id is not None and (self.last_snapshot is None
+                                        or self.last_snapshot['id'] != base_id):
+                err = ("upload_service_snapshot: snapshot %s is incremental, "
+                       "restore snapshot %s first" % (index['id'], base_id))
+                self.logger.error(err)
+                return HttpErrorResponse(err)
+
+            self.state_set(self.S_ADAPTING)
+            if base_id is None:
+                self._restore_node_state(zip(nodes, index['nodes']))
+            else:
+                # the services run already on top of the base snapshot
+                self.logger.info("upload_service_snapshot: stopping all agent services")
+                self._stop_all(remove=False)
+
+            parts = dict((part['name'], part) for part in index['parts'])
+            infos = dict((node.id, info)
+                         for node, info in zip(nodes, index['nodes']))
+
+            def restore(node):
+                part = parts[infos[node.id]['part']]
+                client.restore_snapshot(node.ip, 5555, paths[part['name']],
+                                        part['sha1'])
+
+            self._call_agents(restore, nodes,
+                              'Failed to restore snapshot at node %s')
+
+            # restore manager data
+            err, out = run_cmd("tar -xzf %s" % paths[snapshot.MANAGER_PART], "/")
+            if err:
+                self.logger.exception(err)
+                self.state_set(self.S_ERROR)
+                return HttpErrorResponse(err)
+
+            self.logger.info("upload_service_snapshot: starting all agent services")
+            self._start_all(mkfs=base_id is None)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        # the agents have no tar state for a restored snapshot, so the
+        # next snapshot taken is a full one
+        self.last_snapshot = { 'id': index['id'],
+                               'nodes': [ node.id for node in nodes ],
+                               'taken': False }
+        self.state_set(self.S_RUNNING)
+        self.logger.info('Snapshot %s restored' % index['id'])
+        return HttpJsonResponse()
+
     @expose('POST')
     def get_user_cert(self, kwargs):
         exp_params = [('user', is_string),
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Streamed snapshots of the XtreemFS service.
+
+    A snapshot is an uncompressed tar stream holding:
+
+        index.json                 - the snapshot ID, the ID of its base
+                                     snapshot, the nodes of the service and
+                                     the parts of the snapshot
+        parts/<part>/<nnnnnn>      - the chunks of every part, in order
+
+    The parts are the gzipped tar archives of the agents, named after the
+    IDs of their nodes, and the archive of the manager ('manager'). Every
+    part is split into chunks of at most CHUNK_SIZE bytes and the index
+    holds the SHA-1 digests of every chunk and of the whole part, so a
+    snapshot is written and read chunk by chunk and checked as it is
+    read, whatever its size.
+
+    The archives of an incremental snapshot only hold what changed since
+    its base snapshot (GNU tar listed-incremental archives), so they are
+    restored after the ones of the base snapshot.
+
+    :copyright: (C) 2010-2013 by Contrail Consortium.
+"""
+
+import os
+import re
+import json
+import tarfile
+import hashlib
+
+from StringIO import StringIO
+
+FORMAT_VERSION = 1
+
+INDEX_NAME = 'index.json'
+
+MANAGER_PART = 'manager'
+
+# Bytes of a part in each chunk
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Bytes copied at a time
+BLOCK_SIZE = 64 * 1024
+
+GZIP_MAGIC = '\x1f\x8b'
+
+_PART_NAME = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def check_part_name(name):
+    if not _PART_NAME.match(name) or name in ('.', '..'):
+        raise SnapshotError('Invalid snapshot part name: %r' % name)
+    return name
+
+
+class PartWriter(object):
+    """File-like object spooling a part to 'path' while hashing its
+    chunks. close() returns the entry of the part in the index."""
+
+    def __init__(self, name, path):
+        self.name = check_part_name(name)
+        self.path = path
+        self.file = open(path, 'wb')
+        self.size = 0
+        self.chunks = []
+        self._hash = hashlib.sha1()
+        self._part_hash = hashlib.sha1()
+        self._left = CHUNK_SIZE
+        self._head = ''
+
+    def write(self, data):
+        if len(self._head) < len(GZIP_MAGIC):
+            self._head += data[:len(GZIP_MAGIC)]
+        while data:
+            piece = data[:self._left]
+            data = data[len(piece):]
+            self.file.write(piece)
+            self._hash.update(piece)
+            self._part_hash.update(piece)
+            self.size += len(piece)
+            self._left -= len(piece)
+            if self._left == 0:
+                self.chunks.append(self._hash.hexdigest())
+                self._hash = hashlib.sha1()
+                self._left = CHUNK_SIZE
+
+    def is_gzip(self):
+        return self._head.startswith(GZIP_MAGIC)
+
+    def close(self):
+        if self._left < CHUNK_SIZE:
+            self.chunks.append(self._hash.hexdigest())
+        self.file.close()
+        return { 'name': self.name, 'size': self.size,
+                 'sha1': self._part_hash.hexdigest(), 'chunks': self.chunks }
+
+
+def _chunk_name(part, number):
+    return 'parts/%s/%06d' % (part, number)
+
+
+def write_snapshot(fileobj, index, paths):
+    """Write the snapshot described by 'index' to 'fileobj', taking the
+    data of every part of index['parts'] from the file paths[name]."""
+    index = dict(index, version=FORMAT_VERSION)
+    arch = tarfile.open(fileobj=fileobj, mode='w|')
+
+    data = json.dumps(index)
+    info = tarfile.TarInfo(INDEX_NAME)
+    info.size = len(data)
+    info.mtime = index.get('created', 0)
+    arch.addfile(info, StringIO(data))
+
+    for part in index['parts']:
+        source = open(paths[part['name']], 'rb')
+        try:
+            left = part['size']
+            for number in range(len(part['chunks'])):
+                info = tarfile.TarInfo(_chunk_name(part['name'], number))
+                info.size = min(left, CHUNK_SIZE)
+                info.mtime = index.get('created', 0)
+                arch.addfile(info, source)
+                left -= info.size
+        finally:
+            source.close()
+    arch.close()
+
+
+def read_snapshot(fileobj, directory):
+    """Read a snapshot from the stream 'fileobj', spooling every part to a
+    file of 'directory'. Every chunk is checked against its digest.
+
+    Returns the index of the snapshot and a dict mapping the parts to the
+    paths of their files."""
+    arch = tarfile.open(fileobj=fileobj, mode='r|')
+    member = arch.next()
+    if member is None or member.name != INDEX_NAME:
+        raise SnapshotError('Not a snapshot: %s is missing' % INDEX_NAME)
+    index = json.loads(arch.extractfile(member).read())
+    if index.get('version') != FORMAT_VERSION:
+        raise SnapshotError('Unsupported snapshot version %s'
+                            % index.get('version'))
+
+    expected = []
+    paths = {}
+    for part in index['parts']:
+        name = check_part_name(part['name'])
+        paths[name] = os.path.join(directory, name)
+        for number, digest in enumerate(part['chunks']):
+            expected.append((name, number, digest))
+    expected.reverse()
+
+    current = None
+    try:
+        while True:
+            member = arch.next()
+            if member is None:
+                break
+            if not expected:
+                raise SnapshotError('Unexpected snapshot member %s'
+                                    % member.name)
+            name, number, digest = expected.pop()
+            if member.name != _chunk_name(name, number) or not member.isfile():
+                raise SnapshotError('Expected the snapshot member %s, got %s'
+                                    % (_chunk_name(name, number), member.name))
+            if number == 0:
+                if current is not None:
+                    current.close()
+                current = open(paths[name], 'wb')
+            if _copy_hashed(arch.extractfile(member), current) != digest:
+                raise SnapshotError('Corrupted snapshot member %s'
+                                    % member.name)
+        if expected:
+            raise SnapshotError('Truncated snapshot: %s is missing'
+                                % _chunk_name(*expected[-1][:2]))
+    finally:
+        if current is not None:
+            current.close()
+    for part in index['parts']:
+        if not part['chunks']:
+            open(paths[part['name']], 'wb').close()
+    return index, paths
+
+
+def file_digest(fileobj):
+    """SHA-1 digest of what is left in 'fileobj'."""
+    return _copy_hashed(fileobj, None)
+
+
+def _copy_hashed(source, target):
+    digest = hashlib.sha1()
+    while True:
+        data = source.read(BLOCK_SIZE)
+        if not data:
+            break
+        digest.update(data)
+        if target is not None:
+            target.write(data)
+    return digest.hexdigest()
+
@@ -0,0 +1,65 @@
+"""
+Chart the time the adaptive scaling Strategy_Finder takes to find the
+candidate scaling strategies of a service against its number of backends.
+
+Usage: python bench_adaptive_strategy.py [max nodes, default 40]
+
+For every number of backends, the current combination is made of random
+OPENNEBULA instance types, with a cpu usage of 30% (scale in) and 90%
+(scale out) per machine.
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.webservers.manager.autoscaling.strategy.adaptive_strategy import Strategy_Finder
+
+# Capacities given by VM_Classification to the OPENNEBULA instance types
+CAPACITY_INST_TYPE = {'small': 16.948815723978793, 'medium': 8.4744078619893966,
+                      'highcpu-medium': 3.3897631447957588, 'large': 4.2372039309946983}
+
+REQ_RATE = 20.0
+
+# Performance throughput range of scaler.py
+MAX_CPU_USAGE = 75
+MIN_CPU_USAGE = 25
+
+
+def find_strategies(finder, combination, cpu_usage):
+    finder.scaling_decision = []
+    finder.scaling_decision_keys = set()
+    finder.capacity_inst_type = CAPACITY_INST_TYPE
+    finder.max_performance_throughput = MAX_CPU_USAGE
+    finder.min_performance_throughput = MIN_CPU_USAGE
+    finder.forecast_req_rate_predicted = REQ_RATE
+    finder.req_complexity_rate = finder.get_request_complexity_rate(combination, cpu_usage, REQ_RATE)
+
+    start = time.time()
+    finder.calculate_scaling_strategy(MAX_CPU_USAGE)
+    return time.time() - start, len(finder.scaling_decision)
+
+
+def main():
+    max_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    logging.basicConfig(level=logging.ERROR)
+    finder = Strategy_Finder(logging.getLogger(__name__), 'OPENNEBULA', None, 'low', False, 2)
+    random.seed(0)
+
+    print '%5s %4s %10s %10s' % ('nodes', 'cpu', 'strategies', 'time (ms)')
+    for nodes in range(1, max_nodes + 1):
+        combination = [random.choice(CAPACITY_INST_TYPE.keys()) for _ in range(nodes)]
+        for cpu_usage in (30, 90):
+            elapsed, found = find_strategies(finder, combination, cpu_usage)
+            # one '#' per millisecond, capped
+            print '%5d %4d %10d %10.2f %s' % (nodes, cpu_usage, found, elapsed * 1000,
+                                              '#' * min(int(elapsed * 1000), 60))
+
+
+if __name__ == '__main__':
+    main()
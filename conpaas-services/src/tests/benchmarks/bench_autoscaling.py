@@ -0,0 +1,53 @@
+"""
+Replay workloads through the autoscaling with the trace replay simulator and
+compare scaling policies: SLO violations of the mean and of the 95th
+percentile of the response times, VM hours, cost and latency of the decisions.
+
+Usage: python bench_autoscaling.py [trace file]
+
+Without a trace file, synthetic traces are replayed: a spike of the request
+rate and a noisy daily-like wave. A trace file is either an RRD file of
+Ganglia, such as the web_request_rate_lb of a proxy, or a text file of
+'timestamp value' lines.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.webservers.manager.autoscaling import simulator
+
+SLO = 700
+
+# (cooldown time in minutes, seconds between decisions, SLO fulfillment degree)
+POLICIES = [(10, 300, 'low'), (10, 300, 'high'), (5, 300, 'low'),
+            (20, 300, 'low'), (10, 60, 'low'), (10, 1800, 'low')]
+
+
+def main():
+    if len(sys.argv) > 1:
+        traces = [(os.path.basename(sys.argv[1]), simulator.load_trace(sys.argv[1]))]
+    else:
+        traces = [('spike', simulator.spike_trace(3, 20, 4 * 3600, 3600, 3600)),
+                  ('wave', simulator.wave_trace(8, 6, 24 * 3600, period=12 * 3600, noise=0.1, seed=0))]
+    sim = simulator.Simulator(seed=0)
+
+    print '%-10s %8s %8s %6s | %8s %8s %8s %8s %9s %11s %11s %8s' % (
+        'trace', 'cooldown', 'interval', 'slo', 'viol (%)', 'p95 (%)', 'VM hours', 'cost', 'decisions',
+        'avg (ms)', 'max (ms)', 'wall (s)')
+    for name, trace in traces:
+        for cooldown_time, decision_interval, slo_fulfillment_degree in POLICIES:
+            start = time.time()
+            report = sim.run(trace, SLO, cooldown_time, slo_fulfillment_degree, decision_interval)
+            print '%-10s %8d %8d %6s | %8.2f %8.2f %8.2f %8.3f %9d %11.1f %11.1f %8.1f' % (
+                name, cooldown_time, decision_interval, slo_fulfillment_degree,
+                100 * report.slo_violation_rate, 100 * report.tail_slo_violation_rate, report.vm_hours, report.cost, report.decisions,
+                1000 * report.decision_latency_avg, 1000 * report.decision_latency_max,
+                time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
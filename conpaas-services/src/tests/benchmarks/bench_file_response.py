@@ -0,0 +1,84 @@
+"""
+Compare the peak memory (RSS) of sending a large file with the former
+send_file_response, which read the whole file at once, and with the
+streaming one.
+
+Usage: python bench_file_response.py [size in MB, default 1024]
+
+Every variant runs in its own process; the response is written to
+/dev/null.
+"""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+import mimetools
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.core.https import server
+
+
+class DevNullHandler(server.ConpaasRequestHandler):
+
+    def __init__(self):
+        self.wfile = open(os.devnull, 'wb')
+        self.headers = mimetools.Message(StringIO('\r\n'))
+        self.request_version = 'HTTP/1.1'
+        self.requestline = 'GET / HTTP/1.1'
+        self.command = 'GET'
+        self.client_address = ('127.0.0.1', 0)
+        self.close_connection = 0
+
+    def send_file_response_whole(self, code, filename, headers=None):
+        # the former implementation
+        fd = open(filename)
+        stat = os.fstat(fd.fileno())
+        self.send_response(code)
+        for h in headers:
+            self.send_header(h, headers[h])
+        self.send_header('Content-length', stat.st_size)
+        self.end_headers()
+        while fd.tell() != stat.st_size:
+            print >>self.wfile, fd.read(),
+        fd.close()
+
+
+def run_variant(variant, filename):
+    handler = DevNullHandler()
+    send = { 'whole': handler.send_file_response_whole,
+             'streaming': handler.send_file_response }[variant]
+    start = time.time()
+    send(200, filename, {})
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print '%-10s peak RSS %8.1f MB  %6.2f s' % (variant, peak, elapsed)
+
+
+def main():
+    if len(sys.argv) == 3:
+        run_variant(sys.argv[1], sys.argv[2])
+        return
+
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    fd, filename = tempfile.mkstemp()
+    try:
+        chunk = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            os.write(fd, chunk)
+        os.close(fd)
+        print 'file size %d MB' % size_mb
+        for variant in ('whole', 'streaming'):
+            subprocess.check_call([sys.executable, __file__, variant, filename])
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare the forecast latency of the autoscaling prediction models against
+the length of the monitoring history: refitting a model on the whole
+history, as done at every autoscaling step before, and updating the online
+model with the samples of the last step.
+
+Usage: python bench_forecasting.py [longest history, default 15360]
+
+Histories start at 60 samples and double up to the longest one. Every step
+adds NEW_SAMPLES samples.
+"""
+
+import os
+import sys
+import time
+import math
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.webservers.manager.autoscaling.prediction import forecasting
+from conpaas.services.webservers.manager.autoscaling.prediction.prediction_models import Prediction_Models, fit_auto_regression
+
+NEW_SAMPLES = 12
+NUM_PREDICTIONS = 20
+REPEAT = 5
+
+
+def correlation_loop(x, y):
+    # the former implementation
+    n = len(x)
+    avg_x = float(sum(x)) / n
+    avg_y = float(sum(y)) / n
+    diffprod = 0
+    xdiff2 = 0
+    ydiff2 = 0
+    for idx in range(n):
+        xdiff = x[idx] - avg_x
+        ydiff = y[idx] - avg_y
+        diffprod += xdiff * ydiff
+        xdiff2 += xdiff * xdiff
+        ydiff2 += ydiff * ydiff
+    return diffprod / math.sqrt(xdiff2 * ydiff2)
+
+
+def workload(length):
+    # a daily-like wave with noise, as the cpu usage of a backend
+    return [50 + 20 * math.sin(i / 40.0) + random.gauss(0, 3) for i in range(length)]
+
+
+def timed(func, *args):
+    start = time.time()
+    try:
+        for _ in range(REPEAT):
+            func(*args)
+    except Exception:
+        # statsmodels AR dates the samples by year, from 1921 on: it fails
+        # on histories longer than pandas dates
+        return float('nan')
+    return (time.time() - start) / REPEAT * 1000
+
+
+def online_step(predictor, key, history, method, *args):
+    # the model is up to date with the history but for the last step
+    predictor.online_models.reset()
+    getattr(predictor, method)(history[:-NEW_SAMPLES], *args + (key, len(history) - NEW_SAMPLES))
+    start = time.time()
+    getattr(predictor, method)(history, *args + (key, len(history)))
+    return (time.time() - start) * 1000
+
+
+def main():
+    longest = int(sys.argv[1]) if len(sys.argv) > 1 else 15360
+    logging.basicConfig(level=logging.CRITICAL)
+    predictor = Prediction_Models(logging.getLogger(__name__))
+    random.seed(0)
+
+    print '%8s | %21s | %21s | %21s' % ('', 'correlation (ms)', 'Holt-Winters (ms)', 'AR (ms)')
+    print '%8s | %10s %10s | %10s %10s | %10s %10s' % ('samples', 'loop', 'numpy', 'refit', 'online',
+                                                     'statsmodels', 'RLS')
+    length = 60
+    while length <= longest:
+        x = workload(length)
+        y = workload(length)
+        print '%8d | %10.3f %10.3f | %10.3f %10.3f | %10.3f %10.3f' % (
+            length,
+            timed(correlation_loop, x, y),
+            timed(forecasting.correlation, x, y),
+            timed(predictor.holtwinters, x, 0.2, 0.1, 0.05, NEW_SAMPLES),
+            online_step(predictor, 'bench', x, 'exponential_smoothing', NEW_SAMPLES),
+            timed(fit_auto_regression, x, NUM_PREDICTIONS),
+            online_step(predictor, 'bench', x, 'recursive_least_squares', NUM_PREDICTIONS))
+        length *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare the HTC configuration solvers on the cheapest mix of machine types
+meeting a throughput: the former dynamic programming, which removes machines
+one at a time from the configuration with all of them, and the bounded
+knapsack table of Configuration.dynamic_configuration.
+
+Usage: python bench_htc_configuration.py [largest limit per type, default 1000]
+
+Three machine types, as in the HTC service: small, medium and large with
+the throughput of 1, 4 and 8 cores. Limits start at 10 machines per type and
+grow tenfold up to the largest one. Costs are the cost of a machine during
+the relevant time unit of the configuration.
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.htc.manager.configuration import Configuration
+
+TYPES = ['small', 'medium', 'large']
+COSTS = [0.05, 0.18, 0.40]          # per hour
+AVERAGE = 45.0                      # seconds per task on a small machine
+QUERIES = 1000
+
+
+def make_configuration(limit):
+    conf = Configuration(TYPES, COSTS, [limit] * len(TYPES))
+    for t in TYPES:
+        conf.set_average(t, AVERAGE, 1)
+    conf.relevant_time_unit()
+    return conf
+
+
+def dynamic_configuration_former(conf):
+    # the former implementation
+    tmax = conf.compute_tmax()
+    for k in conf.limits:
+        conf.conf[k] = conf.limits[k]
+    t = tmax - 1
+    conf_dict = {}
+    conf_dict[tmax] = conf.conf
+    m = {}
+    m[tmax] = conf.cost_conf()
+    while t >= 0:
+        m[t] = m[t + 1]
+        km = -1
+        for k in conf.throughput:
+            if tmax - conf.throughput[k] >= t:
+                if m[t] > m[t + conf.throughput[k]] - conf.costs[k] and conf_dict[t + conf.throughput[k]][k] > 0:
+                    m[t] = m[t + conf.throughput[k]] - conf.costs[k]
+                    km = k
+        if km > -1:
+            conf_dict[t] = conf_dict[t + conf.throughput[km]].copy()
+            conf_dict[t][km] -= 1
+        else:
+            conf_dict[t] = conf_dict[t + 1].copy()
+        t -= 1
+    m[0] = 0
+    return m, conf_dict
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    random.seed(0)
+
+    print '%6s %8s | %21s | %21s | %12s' % ('', '', 'build (ms)', 'query (us)', 'cost excess')
+    print '%6s %8s | %10s %10s | %10s %10s | %5s %6s' % ('limit', 'tmax', 'former', 'knapsack',
+                                                      'former', 'knapsack', 'worse', 'max %')
+    limit = 10
+    while limit <= largest:
+        conf = make_configuration(limit)
+
+        start = time.time()
+        m, conf_dict = dynamic_configuration_former(conf)
+        former_build = time.time() - start
+
+        start = time.time()
+        tmax = conf.dynamic_configuration()
+        knapsack_build = time.time() - start
+
+        targets = [random.randint(0, tmax) for _ in range(QUERIES)]
+        start = time.time()
+        for t in targets:
+            conf_dict[t]
+        former_query = (time.time() - start) / QUERIES
+
+        start = time.time()
+        for t in targets:
+            conf.get_configuration(t)
+        knapsack_query = (time.time() - start) / QUERIES
+
+        # how much more the configurations of the former solver cost
+        worse = 0
+        excess = 0.0
+        for t in targets:
+            optimal = conf.get_cost(t)
+            if m[t] > optimal + 1e-9:
+                worse += 1
+                excess = max(excess, (m[t] - optimal) / optimal)
+
+        print '%6d %8d | %10.1f %10.1f | %10.2f %10.2f | %5d %6.1f' % (
+            limit, tmax, 1000 * former_build, 1000 * knapsack_build,
+            1e6 * former_query, 1e6 * knapsack_query, worse, 100 * excess)
+        limit *= 10
+
+
+if __name__ == '__main__':
+    main()
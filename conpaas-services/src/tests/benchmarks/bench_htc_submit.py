@@ -0,0 +1,94 @@
+"""
+Measure the time to submit a bag of tasks to condor:
+
+    per task - a submit description and a condor_submit call per task
+               (submit_a_task)
+    per bag  - a single submit description and condor_submit call for the
+               whole bag (submit_a_bag)
+
+Usage: python bench_htc_submit.py [largest bag, default 20000]
+
+The submit descriptions and task scripts are written to a temporary
+directory. condor_submit is stood in for by /bin/true, so the times hold
+the writing of the files and the process started per condor_submit call,
+but not the work of condor itself. Bags start at 100 tasks and grow tenfold,
+ending with the largest one; the per task submission stops at 2000 tasks.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.htc.manager import submit_a_task
+
+# bag sizes past which submitting task by task takes too long
+MAX_PER_TASK = 2000
+
+
+def stand_in_condor_submit(classad_file):
+    subprocess.call(['/bin/true', classad_file])
+
+
+def make_tasks(size):
+    # a tenth of the tasks replicated on every worker type, as when sampling
+    return [ (n, '/bin/sleep 1', [ 'small', 'medium', 'large' ] if n % 10 == 0 else [])
+             for n in range(1, size + 1) ]
+
+
+def timed(submit, tasks):
+    submit_a_task.FARM_DIR = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        submit(tasks)
+        return time.time() - start
+    finally:
+        shutil.rmtree(submit_a_task.FARM_DIR)
+
+
+def per_task(tasks):
+    for tasknr, commandline, workerlist in tasks:
+        submit_a_task.submit_a_task(1, 1, tasknr, commandline, workerlist)
+
+
+def per_bag(tasks):
+    submit_a_task.submit_a_bag(1, 1, tasks)
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    submit_a_task._condor_submit = stand_in_condor_submit
+    cwd = os.getcwd()
+    # the progress messages of the submission
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+
+    sizes = []
+    size = 100
+    while size < largest:
+        sizes.append(size)
+        size *= 10
+    sizes.append(largest)
+
+    print '%8s | %10s %10s' % ('tasks', 'per task', 'per bag')
+    try:
+        for size in sizes:
+            tasks = make_tasks(size)
+            if size <= MAX_PER_TASK:
+                former = '%9.2fs' % timed(per_task, tasks)
+            else:
+                former = '%10s' % '-'
+            print '%8d | %s %9.2fs' % (size, former, timed(per_bag, tasks))
+            sys.stdout.flush()
+    finally:
+        sys.stderr = stderr
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Measure the throughput of session-style traffic on scalaris (a read and a
+write of the session of every request) through the JSON clients:
+
+    former   - a connection per thread, one call per operation, with the
+               request URL-quoted as a whole
+    single   - a connection per thread, one call per operation
+               (TransactionSingleOp)
+    batching - the operations of all the threads sent together in
+               req_list calls spread across the nodes (BatchingClient)
+
+Usage: python bench_scalaris_client.py [threads, default 32] [node URL ...]
+
+Without node URLs, the calls go to stand-in nodes started in process,
+which answer every call after a fixed delay (CALL_DELAY) as a scalaris
+node serving requests from its memory would.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import urllib
+import threading
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from conpaas.services.scalaris.agent import scalaris
+from tests.services.test_scalaris_client import yaws_url_decode
+
+STAND_IN_NODES = 3
+CALL_DELAY = 0.002      # seconds
+SESSIONS = 1000
+SESSION_SIZE = 2048     # bytes
+DURATION = 3.0          # seconds per client
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        request = json.loads(yaws_url_decode(body))
+        time.sleep(CALL_DELAY)
+        store = self.server.store
+        if request['method'] == 'read':
+            key = request['params'][0]
+            result = {'status': 'ok', 'value': store[key]} if key in store \
+                else {'status': 'fail', 'reason': 'not_found'}
+        elif request['method'] == 'write':
+            store[request['params'][0]] = request['params'][1]
+            result = {'status': 'ok'}
+        else:
+            result = []
+            for op in request['params'][0]:
+                if 'read' in op:
+                    key = op['read']
+                    result.append({'status': 'ok', 'value': store[key]} if key in store
+                                  else {'status': 'fail', 'reason': 'not_found'})
+                else:
+                    store.update(op['write'])
+                    result.append({'status': 'ok'})
+        data = json.dumps({'jsonrpc': '2.0', 'result': result, 'id': request['id']})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInNode(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+def start_stand_in_nodes(count):
+    store = {}
+    urls = []
+    for i in range(count):
+        server = StandInNode(('127.0.0.1', 0), StandInHandler)
+        server.store = store
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        urls.append('http://127.0.0.1:%d' % server.server_address[1])
+    return urls
+
+
+class FormerConnection(scalaris.JSONConnection):
+    # the former call, URL-quoting the whole request
+
+    def call(self, function, params, path=scalaris.DEFAULT_PATH, retry_if_bad_status=True):
+        params_json = json.dumps({'jsonrpc': '2.0', 'method': function, 'params': params, 'id': 0},
+                                 separators=(',', ':'))
+        self._conn.request('POST', path, urllib.quote(params_json),
+                           {'Content-type': 'application/json; charset=utf-8'})
+        response = self._conn.getresponse()
+        return json.loads(response.read().decode('utf-8'))['result']
+
+
+def session_value(rnd):
+    return ''.join(rnd.choice('abcdefghij%+ "') for _ in range(SESSION_SIZE))
+
+
+def run(threads, make_session_ops):
+    """
+    Run threads threads doing session requests for DURATION seconds, return
+    the operations per second.
+    """
+    done = [0] * threads
+    stop = threading.Event()
+
+    def worker(index):
+        rnd = random.Random(index)
+        read, write = make_session_ops(index)
+        value = session_value(rnd)
+        while not stop.is_set():
+            key = 'session%d' % rnd.randrange(SESSIONS)
+            try:
+                read(key)
+            except scalaris.NotFoundError:
+                pass
+            write(key, value)
+            done[index] += 2
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(done) / (time.time() - start)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    urls = sys.argv[2:] or start_stand_in_nodes(STAND_IN_NODES)
+
+    def former(index):
+        tso = scalaris.TransactionSingleOp(FormerConnection(urls[index % len(urls)]))
+        return tso.read, tso.write
+
+    def single(index):
+        tso = scalaris.TransactionSingleOp(scalaris.JSONConnection(urls[index % len(urls)]))
+        return tso.read, tso.write
+
+    client = scalaris.BatchingClient(scalaris.ClusterConnectionPool(urls))
+
+    def batching(index):
+        return client.read, client.write
+
+    print '%d threads, %d nodes, %d byte sessions' % (threads, len(urls), SESSION_SIZE)
+    print '%-10s %10s' % ('client', 'ops/s')
+    for name, make_session_ops in [('former', former), ('single', single), ('batching', batching)]:
+        print '%-10s %10.0f' % (name, run(threads, make_session_ops))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import time
+import threading
+import unittest
+
+from conpaas.core import fanout
+from conpaas.core import coderelay
+
+
+class TestCodeRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.pushed = []
+        self.relayed = []
+        self.pushing = 0
+        self.max_pushing = 0
+        # the relays from a source which had not received the code yet
+        self.early_relays = []
+
+    def push(self, node):
+        self.lock.acquire()
+        self.pushing += 1
+        self.max_pushing = max(self.max_pushing, self.pushing)
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        self.pushing -= 1
+        self.pushed.append(node)
+        self.lock.release()
+
+    def relay(self, source, node):
+        self.lock.acquire()
+        if source not in self.pushed + [ n for _, n in self.relayed ]:
+            self.early_relays.append((source, node))
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        self.relayed.append((source, node))
+        self.lock.release()
+
+    def test_01_logarithmic(self):
+        nodes = range(50)
+        relay = coderelay.CodeRelay(self.push, self.relay, seeds=2)
+        outcome = fanout.call_nodes(relay.update, nodes, max_workers=len(nodes))
+        outcome.check()
+
+        self.assertEqual(sorted(self.pushed + [ node for _, node in self.relayed ]), nodes)
+        # the manager uploads to at most two nodes at a time, the agents
+        # having the code relay it to the others
+        self.assertTrue(0 < self.max_pushing <= 2)
+        self.assertTrue(len(self.relayed) > len(self.pushed))
+        # only the nodes having the code relay it
+        self.assertEqual(self.early_relays, [])
+
+    def test_02_failed_relay(self):
+        attempts = []
+
+        def relay(source, node):
+            attempts.append(source)
+            if source == 0:
+                raise Exception('broken source')
+            self.relay(source, node)
+
+        relay = coderelay.CodeRelay(self.push, relay, seeds=1)
+        outcome = fanout.call_nodes(relay.update, range(10), max_workers=10)
+        outcome.check()
+        self.assertEqual(len(self.pushed) + len(self.relayed), 10)
+        # the broken source is not used again, and the uploads instead of
+        # its relays take the seed slot too
+        self.assertTrue(attempts.count(0) <= 1)
+        self.assertEqual(self.max_pushing, 1)
+
+    def test_03_failed_fallback(self):
+        attempts = []
+        broken = []
+
+        def relay(source, node):
+            attempts.append(source)
+            if source == 0:
+                broken.append(node)
+                raise Exception('broken source')
+            self.relay(source, node)
+
+        def push(node):
+            if node in broken:
+                raise Exception('broken node')
+            self.push(node)
+
+        relay = coderelay.CodeRelay(push, relay, seeds=1)
+        # node 0 gets the code first and is the source of the first relay
+        relay.update(0)
+        outcome = fanout.call_nodes(relay.update, range(1, 10), max_workers=9)
+        # the source of the failed relay is not used again
+        self.assertEqual(attempts.count(0), 1)
+        self.assertEqual(outcome.failed_nodes(), broken)
+        self.assertEqual(len(self.pushed) + len(self.relayed), 9)
+        self.assertEqual(self.max_pushing, 1)
+
+    def test_04_failed_node(self):
+        def push(node):
+            if node == 0:
+                raise Exception('broken node')
+            self.push(node)
+
+        relay = coderelay.CodeRelay(push, self.relay, seeds=1)
+        outcome = fanout.call_nodes(relay.update, range(10), max_workers=10)
+        self.assertEqual(outcome.failed_nodes(), [0])
+        self.assertEqual(len(self.pushed) + len(self.relayed), 9)
+
+        self.assertRaises(ValueError, coderelay.CodeRelay, push, self.relay, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
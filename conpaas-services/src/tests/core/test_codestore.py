@@ -0,0 +1,180 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+from conpaas.core import codestore
+
+
+def make_tar(path, files, modes={}, links={}):
+    arch = tarfile.open(path, 'w')
+    for name, content in sorted(files.items()):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mode = modes.get(name, 0644)
+        arch.addfile(info, StringIO(content))
+    for name, target in links.items():
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.SYMTYPE
+        info.linkname = target
+        arch.addfile(info)
+    arch.close()
+
+
+class TestCodeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.manager_store = codestore.BlobStore(os.path.join(self.tmpdir, 'manager'))
+        self.agent_store = codestore.BlobStore(os.path.join(self.tmpdir, 'agent'))
+        self.files = dict(('app/file%d.php' % i, 'content %d\n' % i * 100)
+                          for i in range(50))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def archive(self, name, files, **kwargs):
+        path = os.path.join(self.tmpdir, name)
+        make_tar(path, files, **kwargs)
+        return path
+
+    def deploy(self, manifest, target):
+        # what the manager and the agent do on a code update
+        sent = []
+
+        def upload(bundle_path):
+            sent.append(os.path.getsize(bundle_path))
+            bundle = open(bundle_path, 'rb')
+            try:
+                received = codestore.read_bundle(self.agent_store, bundle)
+            finally:
+                bundle.close()
+            codestore.checkout(self.agent_store, received, target)
+
+        codestore.push_code(self.manager_store, manifest,
+                            self.agent_store.missing, upload)
+        return sent[0]
+
+    def test_01_blob_store(self):
+        digest = self.manager_store.add_file(StringIO('hello'))
+        self.assertEqual(digest, 'aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d')
+        self.assertTrue(self.manager_store.has(digest))
+        self.assertEqual(self.manager_store.open(digest).read(), 'hello')
+        self.assertEqual(self.manager_store.missing([digest, '0' * 40, '0' * 40]),
+                         ['0' * 40])
+
+        self.assertRaises(codestore.CodeStoreError, self.manager_store.add_file,
+                          StringIO('hello'), '0' * 40)
+        self.assertRaises(codestore.CodeStoreError, self.manager_store.path,
+                          '../../etc/passwd')
+
+        self.manager_store.prune([])
+        self.assertFalse(self.manager_store.has(digest))
+
+    def test_02_import_archive(self):
+        path = self.archive('code-tar', {'index.php': 'hi', 'bin/init.sh': 'ls'},
+                            modes={'bin/init.sh': 0755}, links={'main.php': 'index.php'})
+        manifest = codestore.archive_manifest(self.manager_store, path)
+        self.assertEqual(sorted(manifest['files']), ['bin/init.sh', 'index.php'])
+        self.assertEqual(manifest['files']['bin/init.sh'][1], 0755)
+        self.assertEqual(manifest['links'], {'main.php': 'index.php'})
+        self.assertEqual(self.manager_store.missing(codestore.manifest_hashes(manifest)), [])
+        # cached, but not by the archive name alone
+        self.assertEqual(codestore.archive_manifest(self.manager_store, path), manifest)
+        os.makedirs(os.path.join(self.tmpdir, 'other'))
+        other = self.archive('other/code-tar', {'other.php': 'ho'})
+        self.assertEqual(codestore.archive_manifest(self.manager_store, other)['files'].keys(),
+                         ['other.php'])
+        self.assertEqual(codestore.archive_manifest(self.manager_store, path), manifest)
+
+        path = os.path.join(self.tmpdir, 'code-zip')
+        arch = zipfile.ZipFile(path, 'w')
+        arch.writestr('dir/', '')
+        arch.writestr('dir/index.php', 'hi')
+        arch.close()
+        manifest = codestore.import_archive(self.manager_store, path)
+        self.assertEqual(manifest['dirs'], ['dir'])
+        self.assertEqual(manifest['files'].keys(), ['dir/index.php'])
+
+        path = self.archive('code-evil', {'../evil.php': 'x'})
+        self.assertRaises(codestore.CodeStoreError, codestore.import_archive,
+                          self.manager_store, path)
+
+    def test_03_checkout(self):
+        path = self.archive('code-1', {'index.php': 'one', 'bin/init.sh': 'ls'},
+                            modes={'bin/init.sh': 0755}, links={'main.php': 'index.php'})
+        manifest = codestore.archive_manifest(self.manager_store, path)
+        target = os.path.join(self.tmpdir, 'www', 'code-1')
+
+        # code extracted from an archive before
+        os.makedirs(target)
+        tree = codestore.checkout(self.manager_store, manifest, target)
+        self.assertTrue(os.path.islink(target))
+        self.assertEqual(open(os.path.join(target, 'main.php')).read(), 'one')
+        self.assertEqual(os.stat(os.path.join(target, 'bin/init.sh')).st_mode & 0777, 0755)
+
+        path = self.archive('code-2', {'index.php': 'two'})
+        manifest = codestore.archive_manifest(self.manager_store, path)
+        prepared = []
+        codestore.checkout(self.manager_store, manifest, target, prepare=prepared.append)
+        self.assertEqual(len(prepared), 1)
+        self.assertEqual(open(os.path.join(target, 'index.php')).read(), 'two')
+        self.assertFalse(os.path.exists(os.path.join(target, 'bin')))
+        # the previous tree is removed
+        self.assertFalse(os.path.exists(tree))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(target))),
+                         sorted(['code-1', os.path.basename(prepared[0])]))
+
+        codestore.remove_tree(target)
+        self.assertEqual(os.listdir(os.path.dirname(target)), [])
+
+    def test_04_delta(self):
+        target = os.path.join(self.tmpdir, 'bin')
+        manifest = codestore.archive_manifest(self.manager_store,
+                                              self.archive('code-1', self.files))
+        full_size = self.deploy(manifest, target)
+
+        self.files['app/file7.php'] = 'changed'
+        manifest = codestore.archive_manifest(self.manager_store,
+                                              self.archive('code-2', self.files))
+        delta_size = self.deploy(manifest, target)
+        self.assertTrue(delta_size < full_size / 2)
+        self.assertEqual(open(os.path.join(target, 'app/file7.php')).read(), 'changed')
+        self.assertEqual(open(os.path.join(target, 'app/file8.php')).read(),
+                         self.files['app/file8.php'])
+
+    def test_05_incomplete_bundle(self):
+        manifest = codestore.archive_manifest(self.manager_store,
+                                              self.archive('code-1', self.files))
+        bundle = StringIO()
+        codestore.write_bundle(self.manager_store, manifest, [], bundle)
+        bundle.seek(0)
+        self.assertRaises(codestore.CodeStoreError, codestore.read_bundle,
+                          self.agent_store, bundle)
+
+    def test_06_prune_archives(self):
+        kept = self.archive('code-1', {'index.php': 'one', 'common.php': 'both'})
+        deleted = self.archive('code-2', {'index.php': 'two', 'common.php': 'both'})
+        kept_manifest = codestore.archive_manifest(self.manager_store, kept)
+        deleted_manifest = codestore.archive_manifest(self.manager_store, deleted)
+        manifests_dir = os.path.join(self.manager_store.directory, 'manifests')
+        self.assertEqual(len(os.listdir(manifests_dir)), 2)
+
+        os.remove(deleted)
+        codestore.prune_archives(self.manager_store, [ kept ])
+        self.assertEqual(self.manager_store.missing(codestore.manifest_hashes(kept_manifest)), [])
+        self.assertEqual(self.manager_store.missing(codestore.manifest_hashes(deleted_manifest)),
+                         [ deleted_manifest['files']['index.php'][0] ])
+        self.assertEqual(len(os.listdir(manifests_dir)), 1)
+
+        codestore.prune_archives(self.manager_store, [])
+        self.assertEqual(os.listdir(manifests_dir), [])
+        self.assertEqual(len(self.manager_store.missing(codestore.manifest_hashes(kept_manifest))), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import time
+import threading
+import unittest
+
+from conpaas.core import fanout
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_01_results(self):
+        outcome = fanout.call_nodes(lambda node: node * 2, [1, 2, 3])
+        self.assertEqual(outcome.results, {1: 2, 2: 4, 3: 6})
+        self.assertEqual(outcome.errors, {})
+        self.assertEqual(outcome.succeeded_nodes(), [1, 2, 3])
+        outcome.check()
+
+        outcome = fanout.call_nodes(lambda node: node, [])
+        self.assertEqual(outcome.results, {})
+        outcome.check()
+
+    def test_02_parallel(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def func(node):
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            time.sleep(0.1)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+
+        fanout.call_nodes(func, range(8), max_workers=4)
+        self.assertEqual(running[1], 4)
+
+    def test_03_errors(self):
+        def func(node):
+            if node % 2:
+                raise ValueError('odd node %s' % node)
+            return node
+
+        outcome = fanout.call_nodes(func, [1, 2, 3, 4])
+        self.assertEqual(outcome.results, {2: 2, 4: 4})
+        self.assertEqual(outcome.failed_nodes(), [1, 3])
+        self.assertTrue('odd node 1' in outcome.tracebacks[1])
+        self.assertRaises(ValueError, outcome.check, fanout.REQUIRE_ALL)
+        outcome.check(fanout.REQUIRE_ANY)
+        outcome.check(fanout.REQUIRE_NONE)
+
+        outcome = fanout.call_nodes(func, [1, 3])
+        self.assertRaises(ValueError, outcome.check, fanout.REQUIRE_ANY)
+        outcome.check(fanout.REQUIRE_NONE)
+
+    def test_04_timeout(self):
+        def func(node):
+            if node == 'slow':
+                time.sleep(1)
+            return node
+
+        start = time.time()
+        outcome = fanout.call_nodes(func, ['fast', 'slow'], timeout=0.2)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(outcome.results, {'fast': 'fast'})
+        self.assertTrue(isinstance(outcome.errors['slow'],
+                                   fanout.FanOutTimeout))
+        # a late answer does not change the outcome
+        time.sleep(1)
+        self.assertEqual(outcome.results, {'fast': 'fast'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import errno
+import socket
+import httplib
+import unittest
+
+from conpaas.core.https import client
+
+
+class FakeSSLConnection(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv(self, bufsize):
+        if not self.chunks:
+            return ''
+        return self.chunks.pop(0)
+
+
+class FakeHTTPSConnection(object):
+
+    def __init__(self):
+        self.sock = object()
+        self.ssl_session = None
+        self.closed = False
+
+    def close(self):
+        self.sock = None
+        self.closed = True
+
+
+class FakeResponse(object):
+
+    status = 200
+
+    def read(self):
+        return 'ok'
+
+
+class ScriptedConnection(object):
+    """Fails the request or the response with the given errors."""
+
+    def __init__(self, request_error=None, response_error=None):
+        self.request_error = request_error
+        self.response_error = response_error
+        self.requests = 0
+
+    def request(self, method, uri, body, headers):
+        self.requests += 1
+        if self.request_error:
+            raise self.request_error
+
+    def getresponse(self):
+        if self.response_error:
+            raise self.response_error
+        return FakeResponse()
+
+
+class ScriptedPool(object):
+    """Hands out reused connections first, then new ones."""
+
+    def __init__(self, reused, new):
+        self.reused = list(reused)
+        self.new = list(new)
+        self.discarded = []
+        self.put_back = []
+
+    def get(self, host, port, ssl_ctx):
+        if self.reused:
+            return self.reused.pop(0), True
+        return self.new.pop(0), False
+
+    def put(self, host, port, conn):
+        self.put_back.append(conn)
+
+    def discard(self, host, port, conn):
+        self.discarded.append(conn)
+
+
+class TestHTTPSClient(unittest.TestCase):
+
+    def _request(self, pool):
+        saved_pool = client._pool
+        client._pool = pool
+        try:
+            return client._https_request('host', 5555, 'POST', '/', 'body')
+        finally:
+            client._pool = saved_pool
+
+    def _wrapper(self, chunks):
+        wrapper = object.__new__(client.SSLConnectionWrapper)
+        wrapper._ssl_conn = FakeSSLConnection(chunks)
+        wrapper._rbuf = ''
+        wrapper._makefile_refs = 0
+        wrapper._close_pending = False
+        return wrapper
+
+    def test_01_makefile_reads_lazily(self):
+        wrapper = self._wrapper(['HTTP/1.1 200 OK\r\nContent-', 'Length: 2\r\n\r\nok',
+                                 'HTTP/1.1 200 OK\r\n'])
+        fp = wrapper.makefile('rb', 0)
+        self.assertEquals('HTTP/1.1 200 OK\r\n', fp.readline())
+        self.assertEquals('Content-Length: 2\r\n', fp.readline())
+        self.assertEquals('\r\n', fp.readline())
+        self.assertEquals('ok', fp.read(2))
+        fp.close()
+
+        # the next response is read from a new file object
+        fp = wrapper.makefile('rb', 0)
+        self.assertEquals('HTTP/1.1 200 OK\r\n', fp.readline(65537))
+        self.assertEquals('', fp.readline())
+
+    def test_02_readline_limit(self):
+        fp = self._wrapper(['abcdef\n']).makefile('rb', 0)
+        self.assertEquals('abc', fp.readline(3))
+        self.assertEquals('def\n', fp.read())
+
+    def test_03_pool_reuse(self):
+        pool = client.HTTPSConnectionPool(max_per_host=1, idle_timeout=30)
+        conn = FakeHTTPSConnection()
+        pool.put('host', 5555, conn)
+        self.assertEquals((conn, True), pool.get('host', 5555, None))
+
+        # only max_per_host idle connections are kept
+        other = FakeHTTPSConnection()
+        pool.put('host', 5555, conn)
+        pool.put('host', 5555, other)
+        self.assertTrue(other.closed)
+        self.assertFalse(conn.closed)
+
+    def test_04_pool_idle_eviction(self):
+        pool = client.HTTPSConnectionPool(idle_timeout=-1)
+        conn = FakeHTTPSConnection()
+        pool.put('host', 5555, conn)
+        pool.evict_idle()
+        self.assertTrue(conn.closed)
+        self.assertEquals({}, pool._idle)
+
+    def test_05_pool_closed_connections(self):
+        pool = client.HTTPSConnectionPool()
+        conn = FakeHTTPSConnection()
+        conn.ssl_session = 'session'
+        conn.close()
+        pool.put('host', 5555, conn)
+        self.assertEquals({}, pool._idle)
+        self.assertEquals('session', pool._sessions[('host', 5555)])
+    def test_06_check_batch_response(self):
+        body = '[{"id": 1, "error": "Method not found"}, ' \
+               '{"id": 0, "result": {"state": "RUNNING"}, "error": null}]'
+        results = client.check_batch_response((200, body))
+        self.assertEquals([{'state': 'RUNNING'}, {'error': 'Method not found'}], results)
+
+        self.assertRaises(Exception, client.check_batch_response,
+                          (200, '{"id": null, "error": "Empty batch"}'))
+        self.assertRaises(Exception, client.check_batch_response, (500, ''))
+
+    def test_07_retry_stale_connections(self):
+        # closed by the server before the status line, or reset while sending
+        for stale in [ ScriptedConnection(response_error=httplib.BadStatusLine('')),
+                       ScriptedConnection(request_error=socket.error(errno.ECONNRESET, 'reset')),
+                       ScriptedConnection(request_error=socket.error(errno.EPIPE, 'broken pipe')) ]:
+            fresh = ScriptedConnection()
+            pool = ScriptedPool([ stale ], [ fresh ])
+            self.assertEquals((200, 'ok'), self._request(pool))
+            self.assertEquals([ stale ], pool.discarded)
+            self.assertEquals([ fresh ], pool.put_back)
+
+    def test_08_no_retry_after_sending(self):
+        # the server may have processed the request
+        for error in [ socket.timeout('timed out'),
+                       httplib.BadStatusLine('garbage'),
+                       httplib.IncompleteRead('partial') ]:
+            conn = ScriptedConnection(response_error=error)
+            pool = ScriptedPool([ conn ], [ ScriptedConnection() ])
+            self.assertRaises(type(error), self._request, pool)
+            self.assertEquals(1, conn.requests)
+            self.assertEquals(1, len(pool.new))
+
+        # a new connection is not retried
+        conn = ScriptedConnection(request_error=socket.error(errno.ECONNRESET, 'reset'))
+        self.assertRaises(socket.error, self._request, ScriptedPool([], [ conn ]))
+
+if __name__ == "__main__":
+    unittest.main()
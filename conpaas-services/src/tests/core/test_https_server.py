@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import socket
+import httplib
+import threading
+import tempfile
+import unittest
+import mimetools
+from cStringIO import StringIO
+
+from conpaas.core import rpcstats
+from conpaas.core.https import server
+
+
+class FileResponseHandler(server.ConpaasRequestHandler):
+    """Request handler writing its response to a string."""
+
+    def __init__(self, headers=''):
+        self.wfile = StringIO()
+        self.headers = mimetools.Message(StringIO(headers + '\r\n'))
+        self.request_version = 'HTTP/1.1'
+        self.requestline = 'GET / HTTP/1.1'
+        self.command = 'GET'
+        self.client_address = ('127.0.0.1', 0)
+        self.close_connection = 0
+
+
+def parse_response(data):
+    head, body = data.split('\r\n\r\n', 1)
+    lines = head.split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict([ line.split(': ', 1) for line in lines[1:] ])
+    return status, headers, body
+
+
+class TestHTTPSServer(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        self.content = ''.join([ chr(i % 256)
+                                 for i in range(server.FILE_CHUNK_SIZE * 2 + 10) ])
+        os.write(fd, self.content)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def send(self, headers=''):
+        handler = FileResponseHandler(headers)
+        handler.send_file_response(httplib.OK, self.filename,
+                                   {'Content-disposition': 'attachement'})
+        return parse_response(handler.wfile.getvalue())
+
+    def test_01_whole_file(self):
+        status, headers, body = self.send()
+        self.assertEqual(status, httplib.OK)
+        self.assertEqual(body, self.content)
+        self.assertEqual(int(headers['Content-Length']), len(self.content))
+        self.assertEqual(headers['Content-disposition'], 'attachement')
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+
+    def test_02_ranges(self):
+        size = len(self.content)
+        for spec, first, last in [ ('100-199', 100, 199),
+                                   ('100-', 100, size - 1),
+                                   ('-50', size - 50, size - 1),
+                                   ('-%d' % (size * 2), 0, size - 1),
+                                   ('10-%d' % (size * 2), 10, size - 1) ]:
+            status, headers, body = self.send('Range: bytes=%s\r\n' % spec)
+            self.assertEqual(status, httplib.PARTIAL_CONTENT)
+            self.assertEqual(body, self.content[first:last + 1])
+            self.assertEqual(headers['Content-Range'],
+                             'bytes %d-%d/%d' % (first, last, size))
+
+    def test_03_ignored_ranges(self):
+        for spec in [ 'items=1-2', 'bytes=1-2,5-6', 'bytes=5-2', 'bytes=x-' ]:
+            status, headers, body = self.send('Range: %s\r\n' % spec)
+            self.assertEqual(status, httplib.OK)
+            self.assertEqual(body, self.content)
+
+    def test_04_unsatisfiable_range(self):
+        status, headers, body = self.send('Range: bytes=%d-\r\n'
+                                          % len(self.content))
+        self.assertEqual(status, httplib.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(headers['Content-Range'],
+                         'bytes */%d' % len(self.content))
+        self.assertEqual(body, '')
+
+
+class FakeServer(object):
+    """The dispatching state of a ConpaasSecureServer."""
+
+    def __init__(self, methods):
+        self.callback_dict = {'GET': {}, 'POST': {}, 'UPLOAD': {}}
+        self.dispatch_table = {}
+        self.serialized_methods = set()
+        self.service_locks = {}
+        self.rpc_stats = rpcstats.RPCStats()
+        for (http_method, service_id, func_name), callback in methods.items():
+            self.callback_dict[http_method].setdefault(service_id, {})
+            self.callback_dict[http_method][service_id][func_name] = callback
+            self.dispatch_table[(http_method, service_id, func_name)] = callback
+            if server._serialized(http_method, callback):
+                self.serialized_methods.add((http_method, service_id, func_name))
+            self.service_locks.setdefault(service_id, threading.RLock())
+
+
+class TestDispatch(unittest.TestCase):
+
+    def setUp(self):
+        def fail(params):
+            raise Exception('failed')
+        self.server = FakeServer({
+            ('GET', 0, 'echo'): lambda params: server.HttpJsonResponse(params),
+            ('POST', 1, 'refuse'): lambda params: server.HttpErrorResponse('no'),
+            ('POST', 1, 'fail'): fail })
+
+    def call(self, callback_type, params):
+        handler = FileResponseHandler()
+        handler.server = self.server
+        handler._dispatch(callback_type, params)
+        status, headers, body = parse_response(handler.wfile.getvalue())
+        return status, body
+
+    def test_01_dispatch(self):
+        status, body = self.call('GET', {'service_id': '0', 'method': 'echo',
+                                         'params': {'a': 1}, 'id': '1'})
+        self.assertEqual(json.loads(body)['result'], {'a': 1})
+        status, body = self.call('GET', {'service_id': 'x', 'method': 'echo'})
+        self.assertEqual(status, httplib.NOT_FOUND)
+        status, body = self.call('GET', {'service_id': 0, 'method': 'nope'})
+        self.assertEqual((status, body), (httplib.NOT_FOUND, 'Method not found'))
+        status, body = self.call('POST', {'service_id': 0, 'method': 'echo'})
+        self.assertEqual((status, body), (httplib.NOT_FOUND, 'Service not found'))
+
+    def test_02_stats(self):
+        for _ in range(3):
+            self.call('GET', {'service_id': 0, 'method': 'echo', 'id': 1})
+        self.call('POST', {'service_id': 1, 'method': 'refuse', 'id': 1})
+        self.call('POST', {'service_id': 1, 'method': 'fail', 'id': 1})
+        self.call('POST', {'service_id': 1, 'method': 'nope', 'id': 1})
+
+        stats = self.server.rpc_stats.summary()
+        self.assertEqual(sorted(stats.keys()), [0, 1])
+        self.assertEqual(stats[0]['echo']['calls'], 3)
+        self.assertEqual(stats[0]['echo']['errors'], 0)
+        self.assertEqual(stats[1]['refuse']['errors'], 1)
+        self.assertEqual(stats[1]['fail']['errors'], 1)
+        self.assertTrue('nope' not in stats[1])
+        self.assertEqual(self.server.rpc_stats.summary(1).keys(), [1])
+
+
+    def test_03_serialized(self):
+        changing = []
+        overlaps = []
+
+        def change(params):
+            if changing:
+                overlaps.append('change')
+            changing.append(1)
+            time.sleep(0.1)
+            changing.pop()
+            return server.HttpJsonResponse()
+
+        def poll(params):
+            if changing:
+                overlaps.append('poll')
+            return server.HttpJsonResponse()
+
+        self.server = FakeServer({ ('GET', 0, 'poll'): poll, ('POST', 0, 'change'): change })
+        threads = [ threading.Thread(target=self.call, args=(method, {
+                        'service_id': 0, 'method': name, 'id': 1 }))
+                    for method, name in [ ('POST', 'change'), ('POST', 'change'), ('GET', 'poll') ] ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        # the state changing methods ran one at a time, the poll alongside
+        self.assertEqual(overlaps, [ 'poll' ])
+        self.assertEqual(self.server.serialized_methods, set([ ('POST', 0, 'change') ]))
+
+
+class EchoLineHandler(object):
+    """Answers a line per request, and keeps the connection alive."""
+
+    def __init__(self, request, client_address, server):
+        line = request.recv(100)
+        self.close_connection = not line
+        if line:
+            request.sendall(line.upper())
+
+
+class IdleServer(server.HTTPSServer):
+
+    RequestHandlerClass = EchoLineHandler
+    keepalive_timeout = 0.5
+
+    def __init__(self, workers):
+        self._start_workers(workers, 4)
+
+    def shutdown_request(self, request):
+        request.close()
+
+
+class TestKeepAlive(unittest.TestCase):
+
+    def setUp(self):
+        self.server = IdleServer(1)
+        self.clients = []
+
+    def tearDown(self):
+        self.server._closing = True
+        os.write(self.server._wakeup_w, 'x')
+        for client in self.clients:
+            client.close()
+
+    def connect(self):
+        client, request = socket.socketpair()
+        client.settimeout(2)
+        self.clients.append(client)
+        self.server.process_request(request, ('127.0.0.1', 0))
+        return client
+
+    def test_01_idle_connections_release_workers(self):
+        first = self.connect()
+        first.sendall('a')
+        self.assertEqual(first.recv(100), 'A')
+        # the single worker serves another connection while the first is idle
+        second = self.connect()
+        second.sendall('b')
+        self.assertEqual(second.recv(100), 'B')
+        # and the next request of the first one
+        first.sendall('c')
+        self.assertEqual(first.recv(100), 'C')
+
+    def test_02_idle_timeout(self):
+        client = self.connect()
+        client.sendall('a')
+        self.assertEqual(client.recv(100), 'A')
+        time.sleep(1)
+        self.assertEqual(client.recv(100), '')
+        self.assertEqual(self.server._idle, {})
+
+
+class TestRPCStats(unittest.TestCase):
+
+    def test_01_percentiles(self):
+        stats = rpcstats.RPCStats()
+        for ms in range(1, 101):
+            stats.record(2, 'method', ms / 1000.0, error=(ms % 10 == 0))
+        summary = stats.summary()[2]['method']
+        self.assertEqual(summary['calls'], 100)
+        self.assertEqual(summary['errors'], 10)
+        self.assertAlmostEqual(summary['mean'], 0.0505)
+        self.assertEqual(summary['max'], 0.1)
+        for percent in (50, 95, 99):
+            exact = percent / 1000.0
+            estimate = summary['p%d' % percent]
+            self.assertTrue(exact <= estimate <= exact * 1.2,
+                            (percent, estimate))
+
+        stats.record(2, 'slow', 10000)
+        self.assertEqual(stats.summary()[2]['slow']['p99'], 10000)
+        stats.reset()
+        self.assertEqual(stats.summary(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
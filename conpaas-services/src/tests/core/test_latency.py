@@ -0,0 +1,88 @@
+import json
+import random
+import unittest
+
+from conpaas.core.latency import LatencyHistogram
+
+
+class TestLatency(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(0)
+        self.values = [ rnd.expovariate(1 / 200.0) for _ in range(20000) ]
+
+    def exact_percentile(self, values, p):
+        values = sorted(values)
+        return values[max(int(p / 100.0 * len(values) + 0.5) - 1, 0)]
+
+    def test_01_percentiles(self):
+        histogram = LatencyHistogram()
+        for value in self.values:
+            histogram.add(value)
+        histogram.add(0)
+
+        self.assertEqual(histogram.count, len(self.values) + 1)
+        self.assertAlmostEqual(histogram.mean(), sum(self.values) / (len(self.values) + 1))
+        for p in (50, 95, 99, 99.9):
+            exact = self.exact_percentile(self.values, p)
+            self.assertTrue(abs(histogram.percentile(p) - exact) <= 0.011 * exact,
+                            (p, histogram.percentile(p), exact))
+        self.assertEqual(histogram.percentile(0), 0)
+        # a few hundred buckets for four orders of magnitude
+        self.assertTrue(len(histogram.buckets) < 600)
+
+        self.assertEqual(LatencyHistogram().percentile(99), 0)
+        self.assertEqual(LatencyHistogram().mean(), 0)
+
+    def test_02_merge(self):
+        histograms = [ LatencyHistogram() for _ in range(4) ]
+        for i, value in enumerate(self.values):
+            histograms[i % 4].add(value)
+        merged = LatencyHistogram()
+        for histogram in histograms:
+            merged.merge(histogram)
+
+        whole = LatencyHistogram()
+        for value in self.values:
+            whole.add(value)
+        self.assertEqual(merged.count, whole.count)
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual(merged.percentile(95), whole.percentile(95))
+
+        self.assertRaises(ValueError, merged.merge, LatencyHistogram(0.05))
+
+    def test_03_difference(self):
+        earlier = LatencyHistogram()
+        for value in self.values[:5000]:
+            earlier.add(value)
+        later = earlier.copy()
+        interval = LatencyHistogram()
+        for value in self.values[5000:]:
+            later.add(value)
+            interval.add(value)
+
+        difference = later.difference(earlier)
+        self.assertEqual(difference.count, interval.count)
+        self.assertEqual(difference.buckets, interval.buckets)
+        self.assertAlmostEqual(difference.mean(), interval.mean())
+
+        # not the same series
+        self.assertEqual(interval.difference(later), None)
+        self.assertEqual(later.difference(later).count, 0)
+
+    def test_04_dict(self):
+        histogram = LatencyHistogram()
+        for value in self.values:
+            histogram.add(value, 2)
+        histogram.add(0)
+
+        data = json.loads(json.dumps(histogram.to_dict()))
+        restored = LatencyHistogram.from_dict(data)
+        self.assertEqual(restored.count, 2 * len(self.values) + 1)
+        self.assertEqual(restored.zeros, 1)
+        self.assertEqual(restored.buckets, histogram.buckets)
+        self.assertEqual(restored.percentile(99), histogram.percentile(99))
+
+
+if __name__ == "__main__":
+    unittest.main()
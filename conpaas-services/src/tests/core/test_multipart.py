@@ -0,0 +1,74 @@
+import unittest
+from cStringIO import StringIO
+
+from conpaas.core.https import multipart
+
+
+class TestMultipart(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = multipart.CHUNK_SIZE
+        self.spool_max_size = multipart.SPOOL_MAX_SIZE
+        # small chunks make delimiters straddle the reads
+        multipart.CHUNK_SIZE = 7
+        multipart.SPOOL_MAX_SIZE = 100
+
+    def tearDown(self):
+        multipart.CHUNK_SIZE = self.chunk_size
+        multipart.SPOOL_MAX_SIZE = self.spool_max_size
+
+    def roundtrip(self, params, files):
+        content_type, body = multipart.encode_multipart_formdata(params, files)
+        length = len(body)
+        data = body.read()
+        self.assertEqual(len(data), length)
+        return multipart.parse_multipart(StringIO(data), content_type, length)
+
+    def test_01_roundtrip(self):
+        content = ''.join([ chr(i % 256) for i in range(1000) ]) + '\r\n--'
+        parts = self.roundtrip({'method': 'upload_code_version'},
+                               [('code', 'code.tar.gz', StringIO(content)),
+                                ('key', u'id_rsa.pub', 'ssh-rsa AAAA')])
+        self.assertEqual([ part.name for part in parts ],
+                         ['method', 'code', 'key'])
+        self.assertEqual(parts[0].filename, None)
+        self.assertEqual(parts[0].value, 'upload_code_version')
+        self.assertEqual(parts[1].filename, 'code.tar.gz')
+        self.assertEqual(parts[1].file.read(), content)
+        self.assertEqual(parts[2].file.read(), 'ssh-rsa AAAA')
+
+    def test_02_rewind(self):
+        content_type, body = multipart.encode_multipart_formdata(
+            {'a': 1}, [('file', 'f', StringIO('x' * 50))])
+        first = body.read(20)
+        body.rewind()
+        self.assertEqual(body.read(20), first)
+        self.assertEqual(len(first + body.read()), len(body))
+
+    def test_03_empty_values(self):
+        parts = self.roundtrip({'description': ''},
+                               [('file', 'empty', StringIO(''))])
+        self.assertEqual(parts[0].value, '')
+        self.assertEqual(parts[1].file.read(), '')
+
+    def test_04_malformed(self):
+        content_type, body = multipart.encode_multipart_formdata({'a': 1}, [])
+        data = body.read()
+        # truncated body
+        self.assertRaises(multipart.MultipartError, multipart.parse_multipart,
+                          StringIO(data[:-10]), content_type, len(data) - 10)
+        # no boundary
+        self.assertRaises(multipart.MultipartError, multipart.parse_multipart,
+                          StringIO(data), 'multipart/form-data', len(data))
+
+    def test_05_epilogue_drained(self):
+        content_type, body = multipart.encode_multipart_formdata({'a': 1}, [])
+        data = body.read() + 'epilogue'
+        fp = StringIO(data + 'NEXT')
+        parts = multipart.parse_multipart(fp, content_type, len(data))
+        self.assertEqual(parts[0].value, '1')
+        self.assertEqual(fp.read(), 'NEXT')
+
+
+if __name__ == "__main__":
+    unittest.main()
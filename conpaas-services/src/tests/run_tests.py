@@ -8,6 +8,25 @@ from core import test_clouds
 from core import test_ipop
 from core import test_controller
 from core import test_misc
+from core import test_https_client
+from core import test_fanout
+from core import test_https_server
+from core import test_multipart
+from core import test_codestore
+from core import test_coderelay
+from core import test_latency
+
+from services import test_rrd
+from services import test_forecasting
+from services import test_autoscaling
+from services import test_simulator
+from services import test_htc_history
+from services import test_htc_submit
+from services import test_htc_configuration
+from services import test_mysql_metrics
+from services import test_xtreemfs_snapshot
+from services import test_scalaris_client
+from services import test_cds_map
 
 suites = [
     unittest.TestLoader().loadTestsFromTestCase(test_agent.TestAgent),
@@ -19,6 +38,30 @@ suites = [
     unittest.TestLoader().loadTestsFromTestCase(test_controller.TestController),
     unittest.TestLoader().loadTestsFromTestCase(test_controller.TestReservationTimer),
     unittest.TestLoader().loadTestsFromTestCase(test_misc.TestMisc),
+    unittest.TestLoader().loadTestsFromTestCase(test_https_client.TestHTTPSClient),
+    unittest.TestLoader().loadTestsFromTestCase(test_fanout.TestFanOut),
+    unittest.TestLoader().loadTestsFromTestCase(test_https_server.TestHTTPSServer),
+    unittest.TestLoader().loadTestsFromTestCase(test_https_server.TestDispatch),
+    unittest.TestLoader().loadTestsFromTestCase(test_https_server.TestRPCStats),
+    unittest.TestLoader().loadTestsFromTestCase(test_https_server.TestKeepAlive),
+    unittest.TestLoader().loadTestsFromTestCase(test_multipart.TestMultipart),
+    unittest.TestLoader().loadTestsFromTestCase(test_codestore.TestCodeStore),
+    unittest.TestLoader().loadTestsFromTestCase(test_coderelay.TestCodeRelay),
+    unittest.TestLoader().loadTestsFromTestCase(test_latency.TestLatency),
+    unittest.TestLoader().loadTestsFromTestCase(test_rrd.TestRRD),
+    unittest.TestLoader().loadTestsFromTestCase(test_forecasting.TestOnlineModels),
+    unittest.TestLoader().loadTestsFromTestCase(test_forecasting.TestForecastingModels),
+    unittest.TestLoader().loadTestsFromTestCase(test_autoscaling.TestProvisioningLoop),
+    unittest.TestLoader().loadTestsFromTestCase(test_autoscaling.TestResponseTimeHistograms),
+    unittest.TestLoader().loadTestsFromTestCase(test_autoscaling.TestTailDecisions),
+    unittest.TestLoader().loadTestsFromTestCase(test_simulator.TestSimulator),
+    unittest.TestLoader().loadTestsFromTestCase(test_htc_history.TestHistory),
+    unittest.TestLoader().loadTestsFromTestCase(test_htc_submit.TestSubmitBag),
+    unittest.TestLoader().loadTestsFromTestCase(test_htc_configuration.TestConfiguration),
+    unittest.TestLoader().loadTestsFromTestCase(test_mysql_metrics.TestMetricsCollector),
+    unittest.TestLoader().loadTestsFromTestCase(test_xtreemfs_snapshot.TestSnapshot),
+    unittest.TestLoader().loadTestsFromTestCase(test_scalaris_client.TestScalarisClient),
+    unittest.TestLoader().loadTestsFromTestCase(test_cds_map.TestGlobalMap),
 ]
 
 alltests = unittest.TestSuite(suites)
@@ -0,0 +1,505 @@
+import time
+import logging
+import unittest
+from threading import Event, Lock
+
+from conpaas.core.latency import LatencyHistogram
+from conpaas.services.webservers.manager.autoscaling import monitoring
+
+try:
+    from conpaas.services.webservers.manager.autoscaling import scaler
+    from conpaas.services.webservers.manager.autoscaling.performance import StatUtils
+except ImportError:
+    # the prediction models need numpy and statsmodels
+    scaler = None
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeNode(object):
+
+    def __init__(self, ip):
+        self.ip = ip
+
+
+class FakePerfInfo(object):
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getWebServiceNodes(self):
+        return [ FakeNode(ip) for ip in self.nodes['web'] ]
+
+    def getBackendServiceNodes(self):
+        return [ FakeNode(ip) for ip in self.nodes['backend'] ]
+
+    def getProxyServiceNodes(self):
+        return [ FakeNode(ip) for ip in self.nodes['proxy'] ]
+
+
+class FakeMonitoring(object):
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.data = { 'web': {}, 'backend': {}, 'proxy': {} }
+        self.histograms = {}
+
+    def _performance_info_get(self):
+        return FakePerfInfo(self.nodes)
+
+    def init_collect_monitoring_data(self):
+        pass
+
+    def collect_monitoring_data_web(self):
+        return self.data['web']
+
+    def collect_monitoring_data_backend(self):
+        return self.data['backend']
+
+    def collect_monitoring_data_proxy(self):
+        return self.data['proxy']
+
+    def collect_response_time_histograms(self):
+        return self.histograms
+
+
+class FakeManagerClient(object):
+
+    def __init__(self):
+        self.removed = []
+
+    def remove_nodes(self, host, port, web, backend, node_ip):
+        self.removed.append(node_ip)
+
+
+class FakeLoadBalancer(object):
+
+    def get_updated_backend_weights_id(self, ip):
+        # no weight was set for this backend
+        raise KeyError(ip)
+
+
+class FakeStrategyFinder(object):
+
+    def remove_vmes_type_candidate(self, backend_nodes, backend_monitoring_data, vm_type, num):
+        return [ node.ip for node in backend_nodes[:num] ]
+
+    def remove_backend_vm_candidate(self, backend_nodes, backend_monitoring_data):
+        return backend_nodes[-1].ip
+
+    def get_vm_inst_types(self):
+        return [ 'small' ]
+
+
+class FakeProfiler(object):
+
+    def store_instance_workload(self, backend_nodes, backend_monitoring_data):
+        pass
+
+
+class FakeCostController(object):
+
+    def print_vm_cost(self):
+        pass
+
+
+class FakeHistogramsClient(object):
+    """The histograms exported by the proxies, as get_response_time_histograms returns them."""
+
+    def __init__(self):
+        self.proxies = {}
+        self.error = None
+
+    def get_response_time_histograms(self, host, port):
+        if self.error is not None:
+            raise self.error
+        return { 'proxies': self.proxies }
+
+
+def histogram(*values):
+    result = LatencyHistogram()
+    for value in values:
+        result.add(value)
+    return result
+
+
+def export(started, web, php):
+    return { 'started': started,
+             'web_response_time_lb': web.to_dict(),
+             'php_response_time_lb': php.to_dict() }
+
+
+class HistogramsMonitoring(monitoring.Monitoring_Controller):
+    """
+    The collection of the response time histograms of the Monitoring_Controller, without
+    the configuration and the Ganglia data it needs for the other metrics.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.manager_host = 'manager'
+        self.manager_port = 443
+        self.proxy_histograms = {}
+
+
+class TestResponseTimeHistograms(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeHistogramsClient()
+        self.former_client = monitoring.client
+        monitoring.client = self.client
+        self.monitoring = HistogramsMonitoring()
+
+    def tearDown(self):
+        monitoring.client = self.former_client
+
+    def counts(self, merged):
+        return merged['web_response_time_lb'].count, merged['php_response_time_lb'].count
+
+    def test_01_intervals(self):
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 200), histogram(50)) }
+        # the first export only provides the reference
+        self.assertEqual(self.counts(self.monitoring.collect_response_time_histograms()), (0, 0))
+
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 200, 300, 400), histogram(50, 60)) }
+        merged = self.monitoring.collect_response_time_histograms()
+        self.assertEqual(self.counts(merged), (2, 1))
+        self.assertEqual(merged['web_response_time_lb'].total, 700)
+
+        # nothing new
+        self.assertEqual(self.counts(self.monitoring.collect_response_time_histograms()), (0, 0))
+
+    def test_02_proxies_merged(self):
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100), histogram(50)),
+                                '10.0.0.5': export(1000, histogram(), histogram()) }
+        self.monitoring.collect_response_time_histograms()
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 200), histogram(50)),
+                                '10.0.0.5': export(1000, histogram(300), histogram(60, 70)),
+                                # a proxy without histograms yet
+                                '10.0.0.6': {} }
+        merged = self.monitoring.collect_response_time_histograms()
+        self.assertEqual(self.counts(merged), (2, 2))
+        self.assertEqual(merged['web_response_time_lb'].total, 500)
+
+    def test_03_restarted_proxy(self):
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 200, 300), histogram(50)) }
+        self.monitoring.collect_response_time_histograms()
+        # the monitoring of the proxy restarted: the whole export is new
+        self.client.proxies = { '10.0.0.4': export(2000, histogram(400), histogram(60, 70)) }
+        merged = self.monitoring.collect_response_time_histograms()
+        self.assertEqual(self.counts(merged), (1, 2))
+        self.assertEqual(merged['web_response_time_lb'].total, 400)
+
+    def test_04_inconsistent_export(self):
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 200), histogram(50)) }
+        self.monitoring.collect_response_time_histograms()
+        # fewer web requests than before with the same start: only that histogram is skipped
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100), histogram(50, 60)) }
+        self.assertEqual(self.counts(self.monitoring.collect_response_time_histograms()), (0, 1))
+        # and the export is the reference of the next interval
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100, 300), histogram(50, 60)) }
+        self.assertEqual(self.counts(self.monitoring.collect_response_time_histograms()), (1, 0))
+
+    def test_05_removed_proxy(self):
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100), histogram(50)),
+                                '10.0.0.5': export(1000, histogram(100), histogram(50)) }
+        self.monitoring.collect_response_time_histograms()
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100), histogram(50)) }
+        self.monitoring.collect_response_time_histograms()
+        self.assertEqual(self.monitoring.proxy_histograms.keys(), [ '10.0.0.4' ])
+
+        # a proxy coming back is a new reference
+        self.client.proxies = { '10.0.0.4': export(1000, histogram(100), histogram(50)),
+                                '10.0.0.5': export(1000, histogram(100, 200), histogram(50)) }
+        self.assertEqual(self.counts(self.monitoring.collect_response_time_histograms()), (0, 0))
+
+    def test_06_unavailable(self):
+        self.client.error = Exception('manager unreachable')
+        self.assertEqual(self.monitoring.collect_response_time_histograms(), {})
+
+
+NO_ACTIONS = { 'add_backend_nodes': 0, 'remove_backend_nodes': 0,
+               'add_web_nodes': 0, 'remove_web_nodes': 0,
+               'vm_web_instance': 'small', 'node_ip_remove': '',
+               'vm_backend_instance': [] }
+
+
+if scaler is not None:
+
+    class LoopProvisioningManager(scaler.ProvisioningManager):
+        """
+        The decision loop of the ProvisioningManager, deciding the actions set by the tests.
+        """
+
+        def __init__(self, nodes):
+            self.client = FakeManagerClient()
+            self.clock = time
+            self.slo = 700
+            self.weight_slow_violation = scaler.WEIGHT_SLO_VIOLATION
+            self.stat_utils = StatUtils()
+            self.web_monitoring_data = {}
+            self.backend_monitoring_data = {}
+            self.proxy_monitoring_data = {}
+            self.pending_monitoring_data = None
+            self.response_time_histograms = {}
+            self.pending_histograms = {}
+            self.node_start_times = {}
+            self.monitoring_lock = Lock()
+            self.decision_event = Event()
+            self.stop_event = Event()
+            self.actions_thread = None
+            self.last_change_time = 0
+            self.time_between_changes = 600
+            self.trigger_weight_balancing = False
+            self.killed_backends = []
+            self.monitoring = FakeMonitoring(nodes)
+            self.dyc_load_balancer = FakeLoadBalancer()
+            self.optimal_scaling = FakeStrategyFinder()
+            self.actions = NO_ACTIONS
+            self.decisions = []
+            self.executed = Event()
+            self.release_actions = Event()
+            self.release_actions.set()
+
+        def log_monitoring_data(self):
+            pass
+
+        def decide_actions(self):
+            self.decisions.append((self.web_monitoring_data, self.backend_monitoring_data,
+                                   self.proxy_monitoring_data))
+            return self.actions
+
+        def execute_actions(self, actions):
+            self.executed.set()
+            self.release_actions.wait()
+
+        def start_weight_adjustment(self):
+            pass
+
+
+if scaler is not None:
+
+    class DecisionProvisioningManager(scaler.ProvisioningManager):
+        """
+        The decisions of the ProvisioningManager on fixed monitoring data, without the
+        prediction models.
+        """
+
+        def __init__(self, nodes):
+            self.clock = FakeClock(10000)
+            self.slo = 700
+            self.weight_slow_violation = scaler.WEIGHT_SLO_VIOLATION
+            self.stat_utils = StatUtils()
+            self.monitoring = FakeMonitoring(nodes)
+            self.profiler = FakeProfiler()
+            self.cost_controller = FakeCostController()
+            self.optimal_scaling = FakeStrategyFinder()
+            self.response_time_histograms = {}
+            self.last_change_time = 0
+            self.time_between_changes = 600
+            self.trigger_weight_balancing = False
+            self.trigger_prediction = 0
+            self.last_scaling_operation = 0
+            self.time_between_scaling_predictions = 3600
+            self.calculate_scaling_error = False
+
+        def obtain_prediciton_decision(self, add, threshold):
+            return False
+
+        def store_predictorScaler_workload(self, cpu_data, req_rate_data):
+            pass
+
+        def calculate_strategy(self, avg_cpu_user_backend, backend_nodes, req_rate, cpu_usage):
+            return [ ('add', ('small', 1)) ]
+
+
+def node_data(timestamps, **metrics):
+    data = dict((metric, [ value ] * len(timestamps)) for metric, value in metrics.iteritems())
+    data['timestamps'] = list(timestamps)
+    return data
+
+
+@unittest.skipIf(scaler is None, 'the autoscaling needs numpy and statsmodels')
+class TestProvisioningLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.pm = LoopProvisioningManager({ 'web': [ '10.0.0.1' ],
+                                            'backend': [ '10.0.0.2', '10.0.0.3' ],
+                                            'proxy': [ '10.0.0.4' ] })
+        self.data = self.pm.monitoring.data
+
+    def collect(self, timestamps, response_time=100, backends=('10.0.0.2', '10.0.0.3')):
+        self.data['web']['10.0.0.1'] = node_data(timestamps, cpu_user=20)
+        for ip in backends:
+            self.data['backend'][ip] = node_data(timestamps, cpu_user=20)
+        self.data['proxy']['10.0.0.4'] = node_data(timestamps, web_response_time_lb=response_time,
+                                                   php_response_time_lb=response_time)
+        return self.pm.collect_monitoring_data()
+
+    def test_01_no_data(self):
+        # a decision before the first collection
+        self.assertFalse(self.pm.provisioning_step(1))
+        self.assertEqual(self.pm.decisions, [])
+
+    def test_02_new_nodes(self):
+        self.assertTrue(self.collect([ 0, 15 ], backends=('10.0.0.2',)))
+        # 10.0.0.3 has no data yet
+        self.assertFalse(self.pm.provisioning_step(1))
+        self.assertEqual(self.pm.decisions, [])
+
+        self.assertTrue(self.collect([ 15, 30 ]))
+        self.assertTrue(self.pm.provisioning_step(1))
+        web, backend, proxy = self.pm.decisions[0]
+        self.assertEqual(backend['10.0.0.2']['timestamps'], [ 0, 15, 30 ])
+        self.assertEqual(backend['10.0.0.3']['timestamps'], [ 15, 30 ])
+        # the data is used by a single decision
+        self.assertFalse(self.pm.provisioning_step(2))
+        self.assertEqual(len(self.pm.decisions), 1)
+
+    def test_03_actions_running(self):
+        self.pm.actions = dict(NO_ACTIONS, add_web_nodes=1)
+        self.pm.release_actions.clear()
+        self.collect([ 0, 15 ])
+        self.assertTrue(self.pm.provisioning_step(1))
+        self.assertTrue(self.pm.executed.wait(5))
+
+        # no decision while the actions run, the data is kept for the next one
+        self.collect([ 30, 45 ])
+        self.assertFalse(self.pm.provisioning_step(2))
+        self.assertEqual(len(self.pm.decisions), 1)
+
+        self.pm.release_actions.set()
+        self.pm.actions_thread.join(5)
+        self.assertTrue(self.pm.provisioning_step(2))
+        web, backend, proxy = self.pm.decisions[1]
+        self.assertEqual(web['10.0.0.1']['timestamps'], [ 30, 45 ])
+
+    def test_04_slo_violation(self):
+        self.collect([ 0, 15 ])
+        self.assertFalse(self.pm.decision_event.is_set())
+        self.collect([ 30, 45 ], response_time=2000)
+        self.assertTrue(self.pm.decision_event.is_set())
+
+        # not during the cooldown time
+        self.pm.decision_event.clear()
+        self.pm.last_change_time = time.time()
+        self.collect([ 60, 75 ], response_time=2000)
+        self.assertFalse(self.pm.decision_event.is_set())
+
+    def test_05_missing_node(self):
+        self.pm.clock = clock = FakeClock(10000)
+        self.collect([ 0, 15 ], backends=('10.0.0.2',))
+        self.assertFalse(self.pm.provisioning_step(1))
+
+        # 10.0.0.3 has sent no data since it started
+        clock.now += scaler.NEW_NODE_GRACE_PERIOD - 1
+        self.collect([ 30, 45 ], backends=('10.0.0.2',))
+        self.assertFalse(self.pm.provisioning_step(1))
+
+        clock.now += 1
+        self.assertTrue(self.pm.provisioning_step(1))
+        web, backend, proxy = self.pm.decisions[0]
+        self.assertEqual(backend.keys(), [ '10.0.0.2' ])
+        backend_nodes = self.pm.monitoring._performance_info_get().getBackendServiceNodes()
+        self.assertEqual([ node.ip for node in self.pm.monitored_nodes(backend_nodes, backend) ],
+                         [ '10.0.0.2' ])
+
+        # the removed nodes are forgotten, a node starting later gets its own grace period
+        self.pm.monitoring.nodes['backend'] = [ '10.0.0.2', '10.0.0.5' ]
+        self.collect([ 60, 75 ], backends=('10.0.0.2',))
+        self.assertFalse(self.pm.provisioning_step(2))
+        self.assertEqual(sorted(self.pm.node_start_times),
+                         [ '10.0.0.1', '10.0.0.2', '10.0.0.4', '10.0.0.5' ])
+        self.assertEqual(self.pm.node_start_times['10.0.0.5'], clock.now)
+
+    def test_06_remove_backends(self):
+        self.collect([ 0, 15 ])
+        self.assertTrue(self.pm.take_monitoring_data())
+        scaler.ProvisioningManager.execute_actions(self.pm, dict(
+            NO_ACTIONS, add_backend_nodes=1,
+            vm_backend_instance=[ ('remove', ('small', 2)) ]))
+        # each backend is removed once, though it has no weight
+        self.assertEqual(self.pm.client.removed, [ '10.0.0.2', '10.0.0.3' ])
+
+
+@unittest.skipIf(scaler is None, 'the autoscaling needs numpy and statsmodels')
+class TestTailDecisions(unittest.TestCase):
+
+    def setUp(self):
+        self.pm = DecisionProvisioningManager({ 'web': [ '10.0.0.1' ],
+                                                'backend': [ '10.0.0.2', '10.0.0.3' ],
+                                                'proxy': [ '10.0.0.4' ] })
+        timestamps = [ 0, 15, 30 ]
+        # average response times between LOWER_THRS_SLO and UPPER_THRS_SLO of the SLO, and
+        # backends idle enough to remove one
+        self.pm.web_monitoring_data = { '10.0.0.1': node_data(timestamps, cpu_user=30) }
+        self.pm.backend_monitoring_data = dict((ip, node_data(timestamps, cpu_user=30, php_request_rate=1))
+                                               for ip in ('10.0.0.2', '10.0.0.3'))
+        self.pm.proxy_monitoring_data = { '10.0.0.4': node_data(timestamps,
+                                                                web_response_time_lb=300,
+                                                                php_response_time_lb=300,
+                                                                web_request_rate_lb=1,
+                                                                php_request_rate_lb=1) }
+
+    def decide(self, p95, p99, count=1000):
+        # count requests: 93% of 300 ms, 5% of p95 and 2% of p99
+        values = histogram()
+        values.add(300, count - count * 7 / 100)
+        values.add(p95, count * 5 / 100)
+        values.add(p99, count * 2 / 100)
+        self.pm.response_time_histograms = { 'web_response_time_lb': values,
+                                             'php_response_time_lb': values }
+        return self.pm.decide_actions()
+
+    def test_01_averages(self):
+        actions = self.decide(300, 300)
+        self.assertEqual((actions['add_web_nodes'], actions['add_backend_nodes']), (0, 0))
+        self.assertEqual(actions['remove_backend_nodes'], 1)
+        self.assertEqual(actions['node_ip_remove'], '10.0.0.3')
+
+    def test_02_tail_above_slo(self):
+        # p95 over UPPER_THRS_SLO * slo
+        actions = self.decide(600, 600)
+        self.assertEqual((actions['add_web_nodes'], actions['add_backend_nodes']), (1, 1))
+        self.assertEqual(actions['remove_backend_nodes'], 0)
+        self.assertEqual(actions['vm_backend_instance'], [ ('add', ('small', 1)) ])
+
+        # p99 over the SLO
+        self.pm.last_change_time = 0
+        actions = self.decide(300, 800)
+        self.assertEqual((actions['add_web_nodes'], actions['add_backend_nodes']), (1, 1))
+
+    def test_03_tail_near_slo(self):
+        # p99 over UPPER_THRS_SLO * slo, but under the SLO: no node added nor removed
+        actions = self.decide(300, 600)
+        self.assertEqual((actions['add_web_nodes'], actions['add_backend_nodes']), (0, 0))
+        self.assertEqual(actions['remove_backend_nodes'], 0)
+
+    def test_04_few_requests(self):
+        # too few requests for the percentiles: the averages decide
+        actions = self.decide(800, 800, count=scaler.MIN_TAIL_REQUESTS - 1)
+        self.assertEqual(self.pm.response_time_tail('php_response_time_lb'), None)
+        self.assertEqual((actions['add_web_nodes'], actions['add_backend_nodes']), (0, 0))
+        self.assertEqual(actions['remove_backend_nodes'], 1)
+
+    def test_05_early_decision(self):
+        data = (self.pm.proxy_monitoring_data, self.pm.backend_monitoring_data)
+        self.assertFalse(self.pm.slo_violated(*data))
+        tail = { 'php_response_time_lb': histogram(*([ 300 ] * 98 + [ 800 ] * 2)) }
+        self.assertTrue(self.pm.slo_violated(*data, histograms=tail))
+        tail = { 'php_response_time_lb': histogram(*([ 800 ] * 10)) }
+        self.assertFalse(self.pm.slo_violated(*data, histograms=tail))
+
+
+if __name__ == "__main__":
+    unittest.main()
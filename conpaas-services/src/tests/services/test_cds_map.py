@@ -0,0 +1,106 @@
+import os
+import random
+import unittest
+
+try:
+    from conpaas.services.cds.manager.map import GlobalMap
+    from conpaas.services.cds.manager.edge import EdgeLocation
+except ImportError:
+    # the map needs python-memcache
+    GlobalMap = None
+
+MAP_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'conpaas', 'services', 'cds',
+                            'manager', 'globalmap.txt')
+
+
+class FakeMemcache(object):
+
+    def __init__(self):
+        self.data = {}
+        self.writes = []
+
+    def set_multi(self, data, time):
+        self.data.update(data)
+        self.writes.append(sorted(data))
+        return []
+
+
+@unittest.skipIf(GlobalMap is None, 'the map needs python-memcache')
+class TestGlobalMap(unittest.TestCase):
+
+    def setUp(self):
+        self.edges = [ EdgeLocation('10.0.0.%d' % i, country, [])
+                       for i, country in enumerate(['US', 'US', 'UK', 'DE',
+                                                    'DE', 'AT', 'MX', 'FR']) ]
+
+    def new_map(self, weighting='hops'):
+        gmap = GlobalMap(MAP_FILENAME, weighting)
+        gmap.mc = FakeMemcache()
+        return gmap
+
+    def test_01_nearest(self):
+        gmap = self.new_map()
+        gmap.check_connectivity()
+        gmap.assign_edge_locations([ self.edges[2], self.edges[6] ])
+        self.assertEqual(gmap.edge_map['FR'].address, '10.0.0.2')
+        self.assertEqual(gmap.edge_map['MX'].address, '10.0.0.6')
+        # UK and MX are both 1 hop from US
+        self.assertEqual(gmap.edge_map['US'].address, '10.0.0.6')
+        self.assertEqual(gmap.dist['AT']['US'], 3)
+
+        gmap.assign_edge_locations([])
+        for edge in gmap.edge_map.itervalues():
+            self.assertEqual(edge.address, '')
+
+    def test_02_latency(self):
+        gmap = self.new_map('latency')
+        gmap.assign_edge_locations([ self.edges[2], self.edges[6] ])
+        # 40 ms from MX, 75 ms from UK
+        self.assertEqual(gmap.edge_map['US'].address, '10.0.0.6')
+        # 1 hop from US, but 12 ms from UK
+        self.assertEqual(gmap.edge_map['IE'].address, '10.0.0.2')
+        self.assertEqual(gmap.dist['IE']['AT'], 42)
+
+    def test_03_incremental(self):
+        gmap = self.new_map()
+        rnd = random.Random(0)
+        for _ in range(200):
+            edges = [ edge for edge in self.edges if rnd.random() < 0.5 ]
+            rnd.shuffle(edges)
+            gmap.assign_edge_locations(edges)
+            expected = self.new_map()
+            expected.assign_edge_locations(edges)
+            self.assertEqual(gmap.nearest, expected.nearest)
+            for country in gmap.map:
+                self.assertEqual(gmap.edge_map[country].address,
+                                 expected.edge_map[country].address)
+
+    def test_04_memcache(self):
+        gmap = self.new_map()
+        gmap.assign_edge_locations(self.edges[:3])
+        gmap.update_memcache()
+        self.assertEqual(gmap.mc.writes, [ sorted(gmap.map) ])
+        # US and MX are spread over the edge locations in US
+        self.assertEqual(gmap.mc.data['MX'], '10.0.0.0')
+        self.assertEqual(gmap.mc.data['US'], '10.0.0.1')
+
+        # a stable edge set writes nothing
+        gmap.assign_edge_locations(list(reversed(self.edges[:3])))
+        gmap.update_memcache()
+        self.assertEqual(len(gmap.mc.writes), 1)
+
+        # only the countries nearer to AT are written
+        gmap.assign_edge_locations(self.edges[:3] + [ self.edges[5] ])
+        gmap.update_memcache()
+        self.assertEqual(gmap.mc.writes[-1], [ 'AT', 'CH', 'DE' ])
+        self.assertEqual(gmap.mc.data['CH'], '10.0.0.5')
+
+        # all the keys are written again before they expire
+        gmap.memcache_time -= GlobalMap.MEMCACHE_REFRESH
+        gmap.update_memcache()
+        self.assertEqual(gmap.mc.writes[-1], sorted(gmap.map))
+
+
+if __name__ == "__main__":
+    unittest.main()
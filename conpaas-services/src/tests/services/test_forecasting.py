@@ -0,0 +1,96 @@
+import unittest
+
+try:
+    from conpaas.services.webservers.manager.autoscaling.prediction import forecasting
+except ImportError:
+    # the forecasting models need numpy
+    forecasting = None
+
+
+class RecordingModel(object):
+
+    def __init__(self):
+        self.fed = []
+
+    def update(self, values):
+        self.fed.extend(values)
+
+
+@unittest.skipIf(forecasting is None, 'the forecasting models need numpy')
+class TestOnlineModels(unittest.TestCase):
+
+    def setUp(self):
+        self.models = forecasting.OnlineModels()
+
+    def test_01_new_samples(self):
+        model = self.models.update('cpu', RecordingModel, [ 1, 2, 3 ])
+        self.assertEqual(model.fed, [ 1, 2, 3 ])
+        # every sample is new without a total
+        self.assertTrue(self.models.update('cpu', RecordingModel, [ 3, 4 ]) is model)
+        self.assertEqual(model.fed, [ 1, 2, 3, 3, 4 ])
+        # the keys have models of their own
+        self.assertEqual(self.models.update('req_rate', RecordingModel, [ 5 ]).fed, [ 5 ])
+
+    def test_02_sliding_window(self):
+        model = self.models.update('cpu', RecordingModel, [ 1, 1, 1, 1 ], 4)
+        # repeated values are told apart by the total
+        self.models.update('cpu', RecordingModel, [ 1, 1, 1, 1 ], 5)
+        self.assertEqual(model.fed, [ 1, 1, 1, 1, 1 ])
+        self.models.update('cpu', RecordingModel, [ 1, 1, 2, 2 ], 7)
+        self.assertEqual(model.fed, [ 1, 1, 1, 1, 1, 2, 2 ])
+        # nothing new
+        self.models.update('cpu', RecordingModel, [ 1, 2, 2 ], 7)
+        self.assertEqual(len(model.fed), 7)
+
+    def test_03_missed_samples(self):
+        model = self.models.update('cpu', RecordingModel, [ 1, 2 ], 2)
+        # the samples 3 to 5 left the window before being fed
+        self.models.update('cpu', RecordingModel, [ 6, 7 ], 7)
+        self.assertEqual(model.fed, [ 1, 2, 6, 7 ])
+
+    def test_04_restart(self):
+        model = self.models.update('cpu', RecordingModel, [ 1, 2, 3 ], 3)
+        restarted = self.models.update('cpu', RecordingModel, [ 4, 5 ], 2)
+        self.assertFalse(restarted is model)
+        self.assertEqual(restarted.fed, [ 4, 5 ])
+
+        self.models.reset('cpu')
+        self.assertEqual(self.models.update('cpu', RecordingModel, [ 6 ], 3).fed, [ 6 ])
+
+
+@unittest.skipIf(forecasting is None, 'the forecasting models need numpy')
+class TestForecastingModels(unittest.TestCase):
+
+    def setUp(self):
+        self.series = [ 10 + (i % 4) * 2 + i * 0.5 for i in range(24) ]
+
+    def test_01_holtwinters_pieces(self):
+        whole = forecasting.HoltWinters(0.2, 0.1, 0.05, 4)
+        whole.update(self.series)
+        pieces = forecasting.HoltWinters(0.2, 0.1, 0.05, 4)
+        self.assertRaises(ValueError, pieces.forecast)
+        for start in range(0, len(self.series), 5):
+            pieces.update(self.series[start:start + 5])
+        for expected, value in zip(whole.forecast(), pieces.forecast()):
+            self.assertAlmostEqual(expected, value)
+        self.assertEqual(len(pieces.forecast()), 4)
+
+    def test_02_recursive_least_squares(self):
+        # y[t] = 2 - 0.9 * y[t-1]
+        series = [ 10.0 ]
+        for _ in range(40):
+            series.append(2 - 0.9 * series[-1])
+        model = forecasting.RecursiveLeastSquares(order=1)
+        self.assertRaises(ValueError, model.forecast, 1)
+        model.update(series)
+        self.assertAlmostEqual(model.theta[0], 2, places=2)
+        self.assertAlmostEqual(model.theta[1], -0.9, places=2)
+        self.assertAlmostEqual(model.forecast(1)[0], 2 - 0.9 * series[-1], places=3)
+
+    def test_03_correlation(self):
+        self.assertAlmostEqual(forecasting.correlation([ 1, 2, 3 ], [ 2, 4, 6 ]), 1.0)
+        self.assertAlmostEqual(forecasting.correlation([ 1, 2, 3 ], [ 3, 2, 1 ]), -1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import random
+import itertools
+import unittest
+
+from conpaas.services.htc.manager.configuration import Configuration
+
+TYPES = [ 'small', 'medium', 'large' ]
+
+
+def brute_force(conf, target):
+    """The cost of the cheapest configuration with a throughput of at least
+    target, trying all of them, None if there is none."""
+    best = None
+    keys = sorted(conf.limits)
+    for counts in itertools.product(*[ range(conf.limits[k] + 1) for k in keys ]):
+        throughput = sum(count * conf.throughput.get(k, 0) for k, count in zip(keys, counts))
+        if throughput < target:
+            continue
+        cost = sum(count * conf.costs[k] for k, count in zip(keys, counts))
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+class TestConfiguration(unittest.TestCase):
+
+    def make_configuration(self, rnd):
+        conf = Configuration(TYPES, [ rnd.uniform(0.01, 1) for _ in TYPES ],
+                             [ rnd.randint(0, 5) for _ in TYPES ])
+        for t in TYPES:
+            conf.set_average(t, rnd.uniform(5, 120), 1)
+        conf.relevant_time_unit()
+        conf.dynamic_configuration()
+        return conf
+
+    def test_01_brute_force(self):
+        rnd = random.Random(0)
+        for case in range(200):
+            conf = self.make_configuration(rnd)
+            self.assertEqual(conf.tmax, conf.compute_tmax())
+            for target in range(-1, conf.tmax + 2):
+                expected = brute_force(conf, target)
+                if expected is None:
+                    self.assertEqual(conf.get_cost(target), None)
+                    self.assertEqual(conf.get_configuration(target), None)
+                    continue
+                self.assertAlmostEqual(conf.get_cost(target), expected)
+
+                machines = conf.get_configuration(target)
+                for k, count in machines.iteritems():
+                    self.assertTrue(0 <= count <= conf.limits[k])
+                self.assertTrue(sum(count * conf.throughput[k]
+                                    for k, count in machines.iteritems() if count) >= target)
+                self.assertAlmostEqual(sum(count * conf.costs[k]
+                                           for k, count in machines.iteritems()), expected)
+
+    def test_02_no_tasks(self):
+        # only the machine types with run times have a throughput
+        conf = Configuration(TYPES, [ 0.05, 0.18, 0.40 ], [ 2, 2, 2 ])
+        conf.set_average('medium', 60.0, 1)
+        conf.relevant_time_unit()
+        self.assertEqual(conf.dynamic_configuration(), 8)
+        self.assertEqual(conf.get_configuration(5), { 0: 0, 1: 2, 2: 0 })
+        self.assertEqual(conf.get_configuration(0), { 0: 0, 1: 0, 2: 0 })
+        self.assertEqual(conf.get_cost(9), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+try:
+    import xmltodict
+    from conpaas.services.htc.manager import get_run_time
+except ImportError:
+    # get_run_time needs xmltodict
+    get_run_time = None
+
+
+def classad(job, bag, task, run_time, machine_type, cluster, date):
+    return """<c>
+    <a n="HtcJob"><i>%d</i></a>
+    <a n="HtcBag"><i>%d</i></a>
+    <a n="HtcTask"><i>%d</i></a>
+    <a n="RemoteWallClockTime"><r>%s</r></a>
+    <a n="MATCH_EXP_MachineCloudMachineType"><s>%s</s></a>
+    <a n="ClusterId"><i>%d</i></a>
+    <a n="ProcId"><i>0</i></a>
+    <a n="CompletionDate"><i>%d</i></a>
+    <a n="Owner"><s>condor</s></a>
+</c>
+""" % (job, bag, task, run_time, machine_type, cluster, date)
+
+
+def history(*classads):
+    return ('<?xml version="1.0"?>\n'
+            '<!DOCTYPE classads SYSTEM "classads.dtd">\n'
+            '<classads>\n%s</classads>\n' % ''.join(classads))
+
+
+TASK_1 = classad(1, 2, 1, 10.0, 'small', 100, 1000)
+TASK_2 = classad(1, 2, 2, 30.0, 'small', 101, 1000)
+TASK_3 = classad(1, 2, 3, 5.0, 'large', 102, 1005)
+# task 1 run again
+TASK_1_AGAIN = classad(1, 2, 1, 20.0, 'large', 103, 1010)
+
+
+@unittest.skipIf(get_run_time is None, 'get_run_time needs xmltodict')
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_01_iter_history(self):
+        records = list(get_run_time.iter_history(StringIO(history(TASK_1, TASK_3))))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1], { 'HtcJob': 1, 'HtcBag': 2, 'HtcTask': 3,
+                                       'RemoteWallClockTime': 5.0,
+                                       'MATCH_EXP_MachineCloudMachineType': 'large',
+                                       'ClusterId': 102, 'ProcId': 0,
+                                       'CompletionDate': 1005 })
+
+        self.assertEqual(list(get_run_time.iter_history(StringIO(''))), [])
+        self.assertEqual(list(get_run_time.iter_history(StringIO(history()))), [])
+
+    def test_02_partial_output(self):
+        # the output of condor_history was cut in the middle of a ClassAd
+        xml = history(TASK_1, TASK_2)
+        xml = xml[:xml.index('<a n="RemoteWallClockTime"><r>30.0')]
+        records = list(get_run_time.iter_history(StringIO(xml)))
+        self.assertEqual([ record['HtcTask'] for record in records ], [ 1 ])
+
+    def test_03_bag_progress(self):
+        progress = get_run_time.BagProgress(1, 2)
+        xml = history(TASK_1, TASK_2, TASK_3, TASK_1_AGAIN)
+        for record in get_run_time.iter_history(StringIO(xml)):
+            progress.add(record)
+        self.assertEqual(progress.completed_tasks(), 4)
+        self.assertEqual(progress.completed_task_sets(), 3)
+        self.assertEqual(progress.average_run_times(), { 'small': 20.0, 'large': 12.5 })
+        # the same tasks as the former parsing of the whole output
+        self.assertEqual(progress.poll_dict(), get_run_time.get_poll_dict(xmltodict.parse(xml)))
+
+    def test_04_incremental_polls(self):
+        path = os.path.join(self.dir, 'history.xml')
+        tracker = get_run_time.HistoryTracker(1, 2)
+        self.assertTrue('CompletionDate >= 0' in tracker.command()[2])
+
+        self.assertEqual(tracker.consume(get_run_time.iter_history(StringIO(history(TASK_1)))), 1)
+        self.assertEqual(tracker.cursor, 1000)
+        self.assertTrue('HtcJob == 1 && HtcBag == 2 && CompletionDate >= 1000' in tracker.command()[2])
+
+        # the ClassAds completed at the cursor date are listed again
+        tracker.command = lambda: [ 'cat', path ]
+        open(path, 'w').write(history(TASK_3, TASK_2, TASK_1))
+        self.assertEqual(tracker.poll(), 2)
+        self.assertEqual(tracker.cursor, 1005)
+        self.assertEqual(tracker.poll(), 0)
+
+        open(path, 'w').write(history(TASK_1_AGAIN, TASK_3))
+        self.assertEqual(tracker.poll(), 1)
+        self.assertEqual(tracker.progress.completed_tasks(), 4)
+        self.assertEqual(tracker.progress.completed_task_sets(), 3)
+
+        tracker.command = lambda: [ 'false' ]
+        self.assertEqual(tracker.poll(), None)
+        self.assertEqual(tracker.progress.completed_tasks(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
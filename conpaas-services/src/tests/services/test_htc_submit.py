@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from conpaas.services.htc.manager import submit_a_task
+
+
+class TestSubmitBag(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        self.farm_dir = submit_a_task.FARM_DIR
+        self.condor_submit = submit_a_task._condor_submit
+        self.submitted = []
+        submit_a_task.FARM_DIR = self.dir
+        submit_a_task._condor_submit = self.submitted.append
+
+    def tearDown(self):
+        submit_a_task.FARM_DIR = self.farm_dir
+        submit_a_task._condor_submit = self.condor_submit
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def classad(self):
+        self.assertEqual(self.submitted, [ 'htc-j-1-b-2.classad' ])
+        return open(os.path.join(self.dir, self.submitted[0])).read().split('\n')
+
+    def test_01_queue_order(self):
+        submit_a_task.submit_a_bag(1, 2, [ (1, '/bin/true 1', [ 'small', 'large' ]),
+                                          (2, '/bin/true 2', []),
+                                          (3, '/bin/true 3', [ 'medium' ]),
+                                          (4, '/bin/true 4', []) ])
+        lines = self.classad()
+        self.assertTrue('+HtcJob = 1' in lines and '+HtcBag = 2' in lines)
+
+        # the task and requirements of every queue statement, in order
+        queued = []
+        task = requirements = None
+        for line in lines:
+            if line.startswith('+HtcTask = '):
+                task = int(line.split(' = ')[1])
+            elif line.startswith('Requirements = '):
+                requirements = line.split('==')[1].strip().strip('"')
+            elif line == 'queue 1':
+                queued.append((task, requirements))
+        # the plain tasks go before the first Requirements line, and every
+        # worker type of the replicated tasks sets its own
+        self.assertEqual(queued, [ (2, None), (4, None),
+                                   (1, 'small'), (1, 'large'), (3, 'medium') ])
+
+        for tasknr in range(1, 5):
+            script = os.path.join(self.dir, 'htc-j-1-b-2-t-%d.thetask' % tasknr)
+            self.assertEqual(open(script).read(), '#!/bin/bash\n/bin/true %d\n' % tasknr)
+            self.assertTrue(os.access(script, os.X_OK))
+            self.assertTrue('Cmd = htc-j-1-b-2-t-%d.thetask' % tasknr in lines)
+
+    def test_02_task_count(self):
+        tasks = [ (n, '/bin/true', [ 'small', 'medium', 'large' ] if n % 10 == 0 else [])
+                  for n in range(1, 1001) ]
+        submit_a_task.submit_a_bag(1, 2, tasks)
+        lines = self.classad()
+        # a single submit description, with a queue statement per task and worker type
+        self.assertEqual(lines.count('queue 1'), 900 + 100 * 3)
+        self.assertEqual(len([ line for line in lines if line.startswith('Requirements') ]), 300)
+        self.assertEqual(len([ line for line in lines if line.startswith('+HtcTask') ]), 1000)
+
+    def test_03_empty_bag(self):
+        submit_a_task.submit_a_bag(1, 2, [])
+        self.assertEqual(self.submitted, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
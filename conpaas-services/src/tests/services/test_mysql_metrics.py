@@ -0,0 +1,167 @@
+import logging
+import unittest
+
+try:
+    import MySQLdb
+    from conpaas.services.mysql.manager import metrics
+except ImportError:
+    # the collector needs MySQLdb
+    metrics = None
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query):
+        self.conn.queries += 1
+        if self.conn.error is not None:
+            raise self.conn.error
+
+    def fetchall(self):
+        return self.conn.server.rows(self.conn.ip)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, server, ip):
+        self.server = server
+        self.ip = ip
+        self.queries = 0
+        self.error = None
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServers(object):
+    """The status variables of the nodes, and the connections opened to them."""
+
+    def __init__(self):
+        self.status = {}
+        self.connections = []
+        self.down = set()
+        self.timeouts = []
+
+    def connect(self, ip, user, password, connect_timeout=None):
+        self.timeouts.append(connect_timeout)
+        if ip in self.down:
+            raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server on '%s'" % ip)
+        conn = FakeConnection(self, ip)
+        self.connections.append(conn)
+        return conn
+
+    def rows(self, ip):
+        load, counters = self.status[ip]
+        rows = [('wsrep_local_recv_queue_avg', load)]
+        for (name, _), value in zip(metrics.COUNTERS, counters):
+            rows.append((name, value))
+        return rows
+
+
+@unittest.skipIf(metrics is None, 'the collector needs MySQLdb')
+class TestMetricsCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = FakeServers()
+        self.clock = FakeClock(1000.0)
+        self.collector = metrics.MetricsCollector(logging.getLogger(__name__), ttl=1.0,
+                                                  connect=self.servers.connect, clock=self.clock)
+        self.servers.status = {'10.0.0.1': ('0.5', ['100', '10', '0', '20']),
+                               '10.0.0.2': ('1.5', ['300', '30', '0', '40'])}
+
+    def collect(self, ips=('10.0.0.1', '10.0.0.2')):
+        return self.collector.collect(list(ips), 'root', 'secret')
+
+    def test_01_rates(self):
+        result = self.collect()
+        self.assertEqual(result['loads'], ['0.5', '1.5'])
+        self.assertEqual(result['meanLoad'], 1.0)
+        self.assertEqual(result['meanSelect'], 200.0)
+        self.assertEqual(result['selectRates'], [None, None])
+        self.assertEqual(result['meanSelectRate'], None)
+
+        self.clock.now += 10
+        self.servers.status['10.0.0.1'] = ('0.5', ['150', '10', '0', '20'])
+        # the counters of 10.0.0.2 were reset
+        self.servers.status['10.0.0.2'] = ('1.5', ['100', '30', '0', '40'])
+        result = self.collect()
+        self.assertEqual(result['selectRates'], [5.0, 0.0])
+        self.assertEqual(result['meanSelectRate'], 2.5)
+        self.assertEqual(result['insertRates'], [0.0, 0.0])
+        # a single connection per node
+        self.assertEqual(len(self.servers.connections), 2)
+
+    def test_02_cache(self):
+        first = self.collect()
+        conn1, conn2 = self.collector.connections['10.0.0.1'], self.collector.connections['10.0.0.2']
+        self.clock.now += 0.5
+        self.assertTrue(self.collect() is first)
+        self.assertEqual((conn1.queries, conn2.queries), (1, 1))
+
+        # other nodes, or results too old
+        self.collect(['10.0.0.1'])
+        self.clock.now += 1
+        self.collect(['10.0.0.1'])
+        self.assertEqual((conn1.queries, conn2.queries), (3, 1))
+        # the connection of a node leaving the service is closed
+        self.assertTrue(conn2.closed)
+        self.assertEqual(self.collector.connections.keys(), ['10.0.0.1'])
+
+    def test_03_lost_connection(self):
+        for error in (MySQLdb.OperationalError(2006, 'MySQL server has gone away'),
+                      MySQLdb.InterfaceError(0, '')):
+            self.collect()
+            conn = self.collector.connections['10.0.0.1']
+            conn.error = error
+            self.clock.now += 10
+            count = len(self.servers.connections)
+            selects = int(self.servers.status['10.0.0.1'][1][0])
+            self.servers.status['10.0.0.1'] = ('0.5', [str(selects + 50), '10', '0', '20'])
+
+            # retried on a new connection, keeping the previous sample
+            result = self.collect()
+            self.assertTrue(conn.closed)
+            self.assertEqual(len(self.servers.connections), count + 1)
+            self.assertTrue(self.collector.connections['10.0.0.1'] is self.servers.connections[-1])
+            self.assertEqual(result['selectRates'][0], 5.0)
+            self.collector.close()
+        self.assertEqual(set(self.servers.timeouts), set([metrics.CONNECT_TIMEOUT]))
+
+    def test_04_node_down(self):
+        self.collect()
+        conn = self.collector.connections['10.0.0.1']
+        conn.error = MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+        self.servers.down.add('10.0.0.1')
+        self.clock.now += 1
+        self.assertRaises(MySQLdb.OperationalError, self.collect)
+        self.assertTrue(conn.closed)
+        self.assertFalse('10.0.0.1' in self.collector.connections)
+
+        # the next call opens a new connection
+        self.servers.down.clear()
+        self.clock.now += 1
+        self.servers.status['10.0.0.1'] = ('0.5', ['120', '10', '0', '20'])
+        result = self.collect()
+        self.assertEqual(result['selectRates'][0], 10.0)
+        self.assertEqual(len(self.collector.connections), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from conpaas.services.webservers.manager.autoscaling import rrd
+
+NAN = float('nan')
+
+
+def write_rrd(filename, pdp_step, last_up, ds_names, rras):
+    """
+    Write an RRD file in the layout of rrdtool on 64-bit little endian
+    platforms. 'rras' is a list of (cf, pdp_cnt, cur_row, rows), where
+    every row is a list holding one value per data source.
+    """
+    par = '\0' * 80
+    data = ['RRD\0', '0003\0', '\0' * 7, struct.pack('<d', rrd.FLOAT_COOKIE),
+            struct.pack('<QQQ', len(ds_names), len(rras), pdp_step), par]
+    for name in ds_names:
+        data.append(name.ljust(20, '\0') + 'GAUGE'.ljust(20, '\0') + par)
+    for cf, pdp_cnt, cur_row, rows in rras:
+        data.append(cf.ljust(24, '\0') + struct.pack('<QQ', len(rows), pdp_cnt) + par)
+    data.append(struct.pack('<QQ', last_up, 0))
+    data.append(('\0' * 32 + par) * len(ds_names))
+    data.append(par * len(ds_names) * len(rras))
+    for cf, pdp_cnt, cur_row, rows in rras:
+        data.append(struct.pack('<Q', cur_row))
+    for cf, pdp_cnt, cur_row, rows in rras:
+        for row in rows:
+            data.append(struct.pack('<%dd' % len(row), *row))
+    fd = open(filename, 'wb')
+    fd.write(''.join(data))
+    fd.close()
+
+
+class TestRRD(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.rrd')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_01_fetch(self):
+        # 5 rows of 15s ending at 1000 * 15 = 15000, oldest row first
+        write_rrd(self.filename, 15, 15007, ['sum'],
+                  [('AVERAGE', 1, 4, [[1.0], [2.0], [3.0], [NAN], [5.0]])])
+        timestamps, values = rrd.fetch(self.filename, start=14940, end=15000)
+        self.assertEqual(list(timestamps), [14955, 14970, 14985, 15000])
+        self.assertEqual(values[:2].tolist(), [2.0, 3.0])
+        self.assertTrue(values[2] != values[2])
+        self.assertEqual(values[3], 5.0)
+
+    def test_02_wraparound_and_missing(self):
+        # the current row is the second one: the oldest is the third
+        write_rrd(self.filename, 15, 15000, ['a', 'b'],
+                  [('AVERAGE', 1, 1, [[4.0, 40.0], [5.0, 50.0], [1.0, 10.0],
+                                      [2.0, 20.0], [NAN, 30.0]])])
+        timestamps, values = rrd.fetch(self.filename, start=14910, end=15030,
+                                       ds='b', missing=-1)
+        self.assertEqual(list(timestamps), range(14925, 15031, 15))
+        self.assertEqual(values.tolist(),
+                         [-1, 10.0, 20.0, 30.0, 40.0, 50.0, -1, -1])
+        timestamps, values = rrd.fetch(self.filename, start=14910, end=15030,
+                                       missing=-1)
+        self.assertEqual(values.tolist(),
+                         [-1, 1.0, 2.0, -1, 4.0, 5.0, -1, -1])
+        self.assertRaises(rrd.RRDError, rrd.fetch, self.filename, ds='c')
+
+    def test_03_choose_rra(self):
+        write_rrd(self.filename, 15, 15000, ['sum'],
+                  [('AVERAGE', 1, 0, [[1.0]] * 10),
+                   ('AVERAGE', 4, 0, [[2.0]] * 10),
+                   ('MAX', 1, 0, [[3.0]] * 10)])
+        # the base archive covers the last 150s only
+        timestamps, values = rrd.fetch(self.filename, start=14900, end=15000,
+                                       resolution=15)
+        self.assertEqual(timestamps[1] - timestamps[0], 15)
+        self.assertEqual(set(values), set([1.0]))
+        timestamps, values = rrd.fetch(self.filename, start=14400, end=15000,
+                                       resolution=15)
+        self.assertEqual(timestamps[1] - timestamps[0], 60)
+        self.assertEqual(set(values), set([2.0]))
+        timestamps, values = rrd.fetch(self.filename, 'MAX', start=14900,
+                                       end=15000)
+        self.assertEqual(set(values), set([3.0]))
+
+    def test_04_not_rrd(self):
+        fd = open(self.filename, 'wb')
+        fd.write('timestamp value\n')
+        fd.close()
+        self.assertRaises(rrd.RRDError, rrd.fetch, self.filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
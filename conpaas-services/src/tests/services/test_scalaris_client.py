@@ -0,0 +1,152 @@
+import json
+import time
+import threading
+import unittest
+
+from conpaas.services.scalaris.agent import scalaris
+
+
+def yaws_url_decode(body):
+    """Decode a request body as yaws does: '%XX' and '+' are decoded up to
+    the first '?', the rest is left as is."""
+    decoded = []
+    i = 0
+    while i < len(body):
+        if body[i] == '%':
+            decoded.append(chr(int(body[i + 1:i + 3], 16)))
+            i += 3
+        elif body[i] == '+':
+            decoded.append(' ')
+            i += 1
+        elif body[i] == '?':
+            decoded.append(body[i:])
+            break
+        else:
+            decoded.append(body[i])
+            i += 1
+    return ''.join(decoded)
+
+
+class FakeConnection(object):
+
+    def __init__(self, node):
+        self.node = node
+        self.url = node.url
+
+    def callp(self, path, function, params):
+        return self.node.call(path, function, params)
+
+    def process_result_req_list_tso(self, result):
+        return scalaris.JSONConnection.process_result_req_list_tso(result)
+
+    def close(self):
+        pass
+
+
+class FakeNode(object):
+
+    def __init__(self, url, store, delay=0.02):
+        self.url = url
+        self.store = store
+        self.delay = delay
+        self.calls = []
+        self.broken = False
+
+    def call(self, path, function, params):
+        if self.broken:
+            raise scalaris.ConnectionError(None, error='broken node')
+        self.calls.append(len(params[0]))
+        time.sleep(self.delay)
+        result = []
+        for request in params[0]:
+            if 'read' in request:
+                if request['read'] in self.store:
+                    result.append({'status': 'ok', 'value': self.store[request['read']]})
+                else:
+                    result.append({'status': 'fail', 'reason': 'not_found'})
+            else:
+                self.store.update(request['write'])
+                result.append({'status': 'ok'})
+        return result
+
+
+class FakeConnectionPool(scalaris.ConnectionPool):
+
+    def __init__(self, node):
+        scalaris.ConnectionPool.__init__(self, 0, node.url)
+        self.node = node
+
+    def _new_connection(self):
+        return FakeConnection(self.node)
+
+
+class TestScalarisClient(unittest.TestCase):
+
+    def setUp(self):
+        self.store = {}
+        self.nodes = [ FakeNode('http://node%d:8000' % i, self.store) for i in range(3) ]
+        self.pool = scalaris.ClusterConnectionPool([ node.url for node in self.nodes ])
+        self.pool._pools = dict((node.url, FakeConnectionPool(node)) for node in self.nodes)
+
+    def test_01_escape_body(self):
+        body = json.dumps({'write': {'k': 'a%20b+c d\xc3\xa9'}, 'n': 1e+20},
+                          separators=(',', ':'))
+        self.assertEqual(yaws_url_decode(scalaris._escape_body(body)), body)
+        self.assertEqual(scalaris._escape_body('{"a":1}'), '{"a":1}')
+        # nothing after a '?' is decoded, so it is escaped as well
+        body = json.dumps({'v': 'a?b%c+d'}, separators=(',', ':'))
+        self.assertNotEqual(yaws_url_decode(body.replace('%', '%25')), body)
+        self.assertEqual(yaws_url_decode(scalaris._escape_body(body)), body)
+
+    def test_02_read_write(self):
+        client = scalaris.BatchingClient(self.pool)
+        client.write('session1', 'data')
+        self.assertEqual(client.read('session1'), 'data')
+        self.assertRaises(scalaris.NotFoundError, client.read, 'session2')
+
+        client.write_many({'a': 1, 'b': bytearray('\x00\x01')})
+        self.assertEqual(client.read_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': bytearray('\x00\x01')})
+
+    def test_03_batching(self):
+        client = scalaris.BatchingClient(self.pool, max_batch=50, max_in_flight=2)
+        errors = []
+
+        def session(i):
+            try:
+                client.write('session%d' % i, i)
+                if client.read('session%d' % i) != i:
+                    errors.append(i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [ threading.Thread(target=session, args=(i,)) for i in range(100) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        calls = sum([ node.calls for node in self.nodes ], [])
+        self.assertEqual(sum(calls), 200)
+        # operations issued at the same time share calls
+        self.assertTrue(len(calls) < 50, calls)
+        self.assertTrue(max(calls) <= 50)
+        # calls are spread across the nodes
+        self.assertTrue(len([ node for node in self.nodes if node.calls ]) > 1)
+
+    def test_04_failed_node(self):
+        self.nodes[0].broken = True
+        client = scalaris.BatchingClient(self.pool)
+        for i in range(6):
+            client.write('key%d' % i, i)
+        self.assertEqual(self.nodes[0].calls, [])
+        self.assertEqual(len(self.store), 6)
+
+        for node in self.nodes:
+            node.broken = True
+        self.assertRaises(scalaris.ConnectionError, client.read, 'key0')
+
+
+if __name__ == "__main__":
+    unittest.main()
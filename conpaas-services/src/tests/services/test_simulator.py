@@ -0,0 +1,91 @@
+import logging
+import unittest
+
+try:
+    from conpaas.services.webservers.manager.autoscaling import simulator
+except ImportError:
+    # the prediction models need numpy and statsmodels
+    simulator = None
+
+
+class FakeCostController(object):
+
+    def __init__(self):
+        self.usage = {}
+
+    def update_vm_usage(self, ip, boottime, inst_type):
+        self.usage[ip] = inst_type
+
+    def instance_type_detector(self, cpu_num, mem_total):
+        return 'small'
+
+
+@unittest.skipIf(simulator is None, 'the autoscaling needs numpy and statsmodels')
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        # the samples are taken every SAMPLE_STEP seconds from the epoch
+        self.start = simulator.SIMULATION_START - simulator.SIMULATION_START % simulator.SAMPLE_STEP
+        self.clock = simulator.SimulatedClock(self.start)
+        self.cloud = simulator.SimulatedCloud(self.clock, boot_time=120)
+
+    def test_01_nodes(self):
+        self.cloud.start_node('proxy', 'small', booted=True)
+        self.cloud.add_nodes(None, None, web=0, backend=2, vm_backend_instance='small')
+        self.assertEqual(self.cloud.running_nodes('backend'), [])
+
+        self.clock.sleep(120)
+        backends = self.cloud.running_nodes('backend')
+        self.assertEqual(len(backends), 2)
+        self.assertEqual(len(self.cloud.list_nodes(None, None)['backend']), 2)
+
+        self.cloud.remove_nodes(None, None, backend=1, node_ip=backends[0].ip)
+        self.assertEqual(self.cloud.running_nodes('backend'), [ backends[1] ])
+        self.assertRaises(Exception, self.cloud.remove_nodes, None, None, backend=1,
+                          node_ip=backends[0].ip)
+        self.assertEqual((self.cloud.nodes_added, self.cloud.nodes_removed), (2, 1))
+
+    def test_02_slo_accounting(self):
+        for role in ('proxy', 'web', 'backend'):
+            self.cloud.start_node(role, 'small', booted=True)
+        # a small backend serves 5 requests/s: 166 ms at 2 requests/s, 250 ms at 3 and
+        # 1000 ms at 4.5, and a p95 of three times as much
+        trace = simulator.synthetic_trace(lambda t: 2 if t < 45 else 3 if t < 90 else 4.5, 120,
+                                          start=self.start)
+        monitoring = simulator.TraceMonitoring(logging.getLogger(__name__), FakeCostController(),
+                                               self.cloud, trace, 700, lambda inst_type: 1.0,
+                                               simulator.INSTANCE_HARDWARE['OPENNEBULA'])
+        self.clock.sleep(120)
+        monitoring.nodes_info_update([])
+        monitoring.init_collect_monitoring_data()
+
+        self.assertEqual(monitoring.samples, 8)
+        self.assertEqual(monitoring.slo_violations, 3)
+        self.assertEqual(monitoring.tail_slo_violations, 6)
+        self.assertEqual(monitoring.max_backends, 1)
+        backend = monitoring.collect_monitoring_data_backend().values()[0]
+        self.assertEqual(len(backend['timestamps']), 8)
+        self.assertEqual(monitoring.collect_response_time_histograms()['php_response_time_lb'].count,
+                         8 * simulator.HISTOGRAM_REQUESTS_PER_SAMPLE)
+
+        report = simulator.Report(120, monitoring.samples, monitoring.slo_violations,
+                                  monitoring.tail_slo_violations, 0.1, 0.01, [ 0.1, 0.3 ], 0, 0, 1)
+        self.assertEqual(report.slo_violation_rate, 0.375)
+        self.assertEqual(report.tail_slo_violation_rate, 0.75)
+        self.assertAlmostEqual(report.decision_latency_avg, 0.2)
+        self.assertEqual(simulator.Report(0, 0, 0, 0, 0, 0, [], 0, 0, 0).slo_violation_rate, 0.0)
+
+    def test_03_run(self):
+        sim = simulator.Simulator(seed=0)
+        # a single backend serves a third of 15 requests/s
+        report = sim.run(simulator.synthetic_trace(lambda t: 15, 2 * 3600))
+        self.assertEqual(report.samples, 2 * 3600 / simulator.SAMPLE_STEP)
+        self.assertTrue(report.nodes_added >= 2)
+        self.assertTrue(report.max_backends >= 3)
+        # the violations stop once enough backends run
+        self.assertTrue(0 < report.slo_violations < report.samples / 2)
+        self.assertTrue(report.decisions > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from conpaas.services.xtreemfs import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'in'))
+        os.mkdir(os.path.join(self.dir, 'out'))
+        # small chunks, so that the parts span several of them
+        self.chunk_size = snapshot.CHUNK_SIZE
+        snapshot.CHUNK_SIZE = 1000
+
+    def tearDown(self):
+        snapshot.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.dir)
+
+    def spool(self, name, data):
+        path = os.path.join(self.dir, 'in', name)
+        writer = snapshot.PartWriter(name, path)
+        # written in pieces not aligned on the chunks
+        for start in range(0, len(data), 300):
+            writer.write(data[start:start + 300])
+        return writer, path
+
+    def gzipped(self, data):
+        buf = StringIO()
+        archive = gzip.GzipFile(fileobj=buf, mode='wb')
+        archive.write(data)
+        archive.close()
+        return buf.getvalue()
+
+    def write(self):
+        self.data = { 'node0': self.gzipped(os.urandom(2500)),
+                      'manager': 'x' * 2000,
+                      'node1': '' }
+        parts = []
+        paths = {}
+        for name in ('node0', 'node1', 'manager'):
+            writer, paths[name] = self.spool(name, self.data[name])
+            self.assertEqual(writer.is_gzip(), name == 'node0')
+            parts.append(writer.close())
+        index = { 'id': 'a' * 32, 'base': None, 'created': 1000,
+                  'nodes': [], 'parts': parts }
+        output = StringIO()
+        snapshot.write_snapshot(output, index, paths)
+        return output.getvalue()
+
+    def read(self, data):
+        return snapshot.read_snapshot(StringIO(data),
+                                      os.path.join(self.dir, 'out'))
+
+    def test_01_round_trip(self):
+        index, paths = self.read(self.write())
+        self.assertEqual(index['version'], snapshot.FORMAT_VERSION)
+        self.assertEqual(index['id'], 'a' * 32)
+        self.assertEqual([ part['name'] for part in index['parts'] ],
+                         [ 'node0', 'node1', 'manager' ])
+        self.assertEqual([ len(part['chunks']) for part in index['parts'] ],
+                         [ 3, 0, 2 ])
+        for part in index['parts']:
+            data = open(paths[part['name']], 'rb').read()
+            self.assertEqual(data, self.data[part['name']])
+            self.assertEqual(part['size'], len(data))
+            self.assertEqual(snapshot.file_digest(StringIO(data)), part['sha1'])
+
+    def test_02_truncated(self):
+        data = self.write()
+        last = data.rindex('x' * 1000)
+        # cut in the middle of the last chunk
+        self.assertRaises(tarfile.ReadError, self.read, data[:last + 500])
+        # cut right before the last chunk
+        self.assertRaises(snapshot.SnapshotError, self.read, data[:last - 512])
+
+    def test_03_corrupted(self):
+        data = self.write()
+        last = data.rindex('x' * 1000)
+        data = data[:last] + 'y' + data[last + 1:]
+        self.assertRaises(snapshot.SnapshotError, self.read, data)
+
+    def test_04_not_a_snapshot(self):
+        output = StringIO()
+        arch = tarfile.open(fileobj=output, mode='w|')
+        info = tarfile.TarInfo('other.txt')
+        info.size = 4
+        arch.addfile(info, StringIO('data'))
+        arch.close()
+        self.assertRaises(snapshot.SnapshotError, self.read, output.getvalue())
+        self.assertRaises(snapshot.SnapshotError, snapshot.check_part_name, '../etc')
+
+
+if __name__ == "__main__":
+    unittest.main()